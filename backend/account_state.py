@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""
+账户 / 持仓状态缓存
+服务端只维护一份账户余额和交易所持仓：用户数据流的 ACCOUNT_UPDATE 实时更新，
+另有一个共享的轮询线程（一次 account 请求）定期校准（用户数据流未连接时缩短间隔），
+打开多少个页面都只占用一份上游请求。
+
+每次变化生成一个版本号递增的增量 {version, prev_version, account: {变化的字段}, positions: {键: 持仓或 None}}，
+（数量有变化的持仓键列在 resized 中）通过 socket 事件 account_state 推送给订阅的客户端；客户端带上已有的版本号重新同步，
+版本过旧（超出保留的增量记录）时返回完整快照
+"""
+import logging
+import threading
+import time
+from collections import deque
+
+from client_registry import ClientRegistry
+
+logger = logging.getLogger(__name__)
+
+# 轮询间隔（秒）：用户数据流已连接时只用于校准未实现盈亏和可用余额
+DEFAULT_POLL_INTERVAL = 30
+DEFAULT_FALLBACK_POLL_INTERVAL = 10
+
+# 没有订阅者且超过该时间（秒）无人读取时暂停轮询
+DEFAULT_IDLE_TIMEOUT = 300
+
+# 保留的增量条数
+DEFAULT_JOURNAL_SIZE = 500
+
+# ACCOUNT_UPDATE 只带钱包余额，收到后延迟该时间（秒）轮询一次补齐可用余额（合并连续的推送）
+STREAM_REFRESH_DELAY = 1
+
+# 金额保留的小数位，避免浮点误差产生无意义的增量
+PRECISION = 6
+
+
+def position_key(symbol, position_side):
+    return f"{symbol}:{position_side or 'BOTH'}"
+
+
+def _position(symbol, position_side, amount, entry_price, unrealized_pnl):
+    return {
+        'symbol': symbol,
+        'positionSide': position_side or 'BOTH',
+        'positionAmt': amount,
+        'entryPrice': entry_price,
+        'unrealizedProfit': round(unrealized_pnl, PRECISION),
+    }
+
+
+def parse_rest_account(data):
+    """解析 REST account 返回的账户信息，返回 (账户字段, {键: 持仓})，只保留数量不为 0 的持仓"""
+    account = {
+        'total_balance': round(float(data.get('totalWalletBalance', 0) or 0), PRECISION),
+        'available_balance': round(float(data.get('availableBalance', 0) or 0), PRECISION),
+        'margin_balance': round(float(data.get('totalMarginBalance', 0) or 0), PRECISION),
+        'total_unrealized_pnl': round(float(data.get('totalUnrealizedProfit', 0) or 0), PRECISION),
+    }
+    positions = {}
+    for p in data.get('positions', []):
+        amount = float(p.get('positionAmt', 0) or 0)
+        if amount == 0:
+            continue
+        item = _position(p['symbol'], p.get('positionSide'), amount, float(p.get('entryPrice', 0) or 0),
+                         float(p.get('unrealizedProfit', 0) or 0))
+        positions[position_key(item['symbol'], item['positionSide'])] = item
+    return account, positions
+
+
+class AccountState:
+    """版本化的账户 / 持仓状态缓存（线程安全）"""
+
+    def __init__(self, client, poll_interval=DEFAULT_POLL_INTERVAL,
+                 fallback_poll_interval=DEFAULT_FALLBACK_POLL_INTERVAL, idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 journal_size=DEFAULT_JOURNAL_SIZE, tracker=None):
+        self.client = client
+        self.poll_interval = poll_interval
+        self.fallback_poll_interval = fallback_poll_interval
+        self.idle_timeout = idle_timeout
+        self.tracker = tracker
+        self.version = 0
+        self.account = {}
+        self.positions = {}
+        self.updated_at = 0
+        self.subscribers = 0
+        self.stats = {'polls': 0, 'stream_updates': 0, 'deltas': 0, 'errors': 0}
+        self._journal = deque(maxlen=journal_size)   # [(版本号, 增量)]
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._last_access = time.time()
+        self._wakeup = threading.Event()
+        self._refresh_at = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_listener(self, callback):
+        """注册增量回调 callback(delta)"""
+        self._listeners.append(callback)
+
+    # ==================== 启停 ====================
+
+    def start(self):
+        if self._thread is not None:
+            return
+        if self.tracker is not None:
+            self.tracker.add_listener(self._on_stream_event)
+        self._thread = threading.Thread(target=self._run, name='account-state', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    @property
+    def stream_connected(self):
+        return self.tracker is not None and self.tracker.connected
+
+    def _run(self):
+        while not self._stop.is_set():
+            now = time.time()
+            interval = self.poll_interval if self.stream_connected else self.fallback_poll_interval
+            next_at = self.updated_at + interval
+            if self._refresh_at is not None:
+                next_at = min(next_at, self._refresh_at)
+            if next_at > now:
+                self._wakeup.wait(next_at - now)
+                self._wakeup.clear()
+                continue
+            requested = self._refresh_at is not None
+            self._refresh_at = None
+            if not requested and self.subscribers == 0 and now - self._last_access > self.idle_timeout:
+                # 无人查看时不轮询，下次读取时再刷新
+                self._wakeup.wait(interval)
+                self._wakeup.clear()
+                continue
+            try:
+                self.refresh()
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.warning(f"刷新账户状态失败: {e}")
+                self._stop.wait(self.fallback_poll_interval)
+
+    # ==================== 数据来源 ====================
+
+    def refresh(self, max_age=0):
+        """
+        请求一次账户信息并合并到缓存
+
+        max_age 大于 0 时，缓存不足 max_age 秒（或等待期间已被其他线程刷新）则不再请求
+        """
+        with self._refresh_lock:
+            if max_age and time.time() - self.updated_at < max_age:
+                return
+            data = self.client.client.account()
+            self.stats['polls'] += 1
+            account, positions = parse_rest_account(data)
+            self._apply(account, positions, replace=True)
+
+    def _on_stream_event(self, event, data):
+        if event != 'ACCOUNT_UPDATE':
+            return
+        self.stats['stream_updates'] += 1
+        update = data.get('a', {})
+        account = {}
+        for b in update.get('B', []):
+            if b.get('a') == 'USDT':
+                account['total_balance'] = round(float(b.get('wb', 0) or 0), PRECISION)
+        positions = {}
+        for p in update.get('P', []):
+            amount = float(p.get('pa', 0) or 0)
+            key = position_key(p['s'], p.get('ps'))
+            positions[key] = None if amount == 0 else _position(
+                p['s'], p.get('ps'), amount, float(p.get('ep', 0) or 0), float(p.get('up', 0) or 0))
+        self._apply(account, positions, replace=False)
+        # 可用余额等字段不在推送中，稍后轮询一次补齐
+        if self._refresh_at is None:
+            self._refresh_at = time.time() + STREAM_REFRESH_DELAY
+            self._wakeup.set()
+
+    def _apply(self, account, positions, replace):
+        """合并新数据，有变化时生成增量；replace 为 True 时 positions 为完整持仓（缺少的视为已平仓）"""
+        with self._lock:
+            account_changes = {k: v for k, v in account.items() if self.account.get(k) != v}
+            position_changes = {k: v for k, v in positions.items() if self.positions.get(k) != v}
+            if replace:
+                position_changes.update({k: None for k in self.positions if k not in positions})
+            if not replace and position_changes:
+                # 推送只包含变化的持仓，总未实现盈亏按缓存中的持仓重新汇总
+                merged = dict(self.positions)
+                merged.update(position_changes)
+                total = round(sum(p['unrealizedProfit'] for p in merged.values() if p), PRECISION)
+                if self.account.get('total_unrealized_pnl') != total:
+                    account_changes['total_unrealized_pnl'] = total
+            self.updated_at = time.time()
+            if not account_changes and not position_changes:
+                return None
+            # 数量有变化的持仓（开仓、平仓、加减仓），只有未实现盈亏变化的不在其中
+            resized = sorted(k for k, v in position_changes.items()
+                             if (v or {}).get('positionAmt') != (self.positions.get(k) or {}).get('positionAmt'))
+            self.account.update(account_changes)
+            for key, value in position_changes.items():
+                if value is None:
+                    self.positions.pop(key, None)
+                else:
+                    self.positions[key] = value
+            delta = {'version': self.version + 1, 'prev_version': self.version}
+            if account_changes:
+                delta['account'] = account_changes
+            if position_changes:
+                delta['positions'] = position_changes
+            if resized:
+                delta['resized'] = resized
+            self.version += 1
+            self._journal.append((self.version, delta))
+            self.stats['deltas'] += 1
+        for callback in self._listeners:
+            try:
+                callback(delta)
+            except Exception as e:
+                logger.error(f"账户状态增量回调出错: {e}")
+        return delta
+
+    # ==================== 读取 ====================
+
+    def touch(self, max_age=None):
+        """记录一次读取；缓存过旧（轮询暂停期间）时先同步刷新一次"""
+        self._last_access = time.time()
+        max_age = self.fallback_poll_interval if max_age is None else max_age
+        if time.time() - self.updated_at > max_age:
+            try:
+                self.refresh(max_age=max_age)
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.warning(f"刷新账户状态失败，返回缓存数据: {e}")
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'version': self.version,
+                'account': dict(self.account),
+                'positions': list(self.positions.values()),
+                'updated_at': self.updated_at,
+            }
+
+    def changes_since(self, version):
+        """
+        返回 version 之后的合并增量；版本号无效或已超出保留的增量记录时返回 None（需要完整快照）
+        """
+        with self._lock:
+            if version == self.version:
+                return {'version': self.version, 'prev_version': version, 'account': {}, 'positions': {}, 'resized': []}
+            if version > self.version or not self._journal or self._journal[0][1]['prev_version'] > version:
+                return None
+            merged = {'version': self.version, 'prev_version': version, 'account': {}, 'positions': {}}
+            resized = set()
+            for v, delta in self._journal:
+                if v <= version:
+                    continue
+                merged['account'].update(delta.get('account', {}))
+                merged['positions'].update(delta.get('positions', {}))
+                resized.update(delta.get('resized', []))
+            merged['resized'] = sorted(resized)
+            return merged
+
+    def sync(self, since=None):
+        """客户端重新同步：since 有效时返回增量，否则返回完整快照（full 为 True）"""
+        if since is not None:
+            delta = self.changes_since(since)
+            if delta is not None:
+                return dict(delta, full=False)
+        return dict(self.snapshot(), full=True)
+
+    def unrealized_pnl(self, symbol, position_side, quantity=None):
+        """某个持仓的未实现盈亏；quantity 为本地仓位数量时按数量占交易所持仓的比例分摊"""
+        with self._lock:
+            p = self.positions.get(position_key(symbol, position_side))
+        if not p:
+            return 0
+        if quantity is None or not p['positionAmt']:
+            return p['unrealizedProfit']
+        return round(p['unrealizedProfit'] * min(1, abs(float(quantity)) / abs(p['positionAmt'])), 4)
+
+
+_states = ClientRegistry('账户状态缓存')
+
+
+def get_account_state(client, stream=True, **kwargs):
+    """获取（必要时创建并启动）与 client 绑定的账户状态缓存；stream 为 True 时订阅该客户端的用户数据流"""
+    def create():
+        tracker = None
+        if stream:
+            from order_tracker import get_order_tracker
+            tracker = get_order_tracker(client)
+        state = AccountState(client, tracker=tracker, **kwargs)
+        state.start()
+        return state
+
+    return _states.get(client, create)
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+AI 筛选
+ai_filter 模块对每个候选标的渲染提示词并调用 OpenAI 兼容接口。这里用 asyncio 并发发送请求（可配置并发数），
+相同提示词（按渲染结果哈希）在有效期内直接使用缓存的回复，同一轮中重复的提示词只请求一次；
+每轮设置截止时间，超时未返回的标的按 HOLD 处理，保证在收盘前的触发窗口内完成。每次调用记录延迟和 token 用量。
+占位符默认按紧凑 CSV 展开（见 prompt_serializer），模块配置 prompt_serializer 可调整字段、精度、条数和降采样。
+
+用法（生成的策略代码中）:
+    ai = get_ai_filter()
+    results = ai.filter([{'symbol': s, 'direction': d, 'klines': {'BTCUSDT_5m': ..., '5m': ...},
+                          'indicators': {'ema_5m': ...}} for ...], module_config)
+    passed = [r for r in results if r['passed']]
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+
+from openai import AsyncOpenAI
+
+from prompt_serializer import estimate_tokens, make_serializer
+
+logger = logging.getLogger(__name__)
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'config.json')
+
+# 默认并发数
+DEFAULT_CONCURRENCY = 8
+
+# 每轮默认截止时间（秒），需小于定时启动的提前量
+DEFAULT_DEADLINE = 4
+
+# 回复缓存有效期（秒）和条数
+DEFAULT_CACHE_TTL = 300
+DEFAULT_CACHE_SIZE = 1024
+
+_PLACEHOLDER = re.compile(r'\{(k_lines|indicators)\.([A-Za-z0-9_]+)\}')
+_JSON_OBJECT = re.compile(r'\{.*\}', re.S)
+
+
+def render_prompt(template, klines, indicators, serializer=None):
+    """替换提示词中的 {k_lines.X} / {indicators.Y} 占位符（其余花括号原样保留）"""
+    serializer = serializer or make_serializer()
+
+    def replace(match):
+        source = klines if match.group(1) == 'k_lines' else indicators
+        value = source.get(match.group(2))
+        return '' if value is None else serializer(value)
+    return _PLACEHOLDER.sub(replace, template)
+
+
+def prompt_size(prompt):
+    """提示词大小 {'prompt_chars', 'prompt_tokens_est'}"""
+    return {'prompt_chars': len(prompt), 'prompt_tokens_est': estimate_tokens(prompt)}
+
+
+def parse_reply(content):
+    """解析回复中的 JSON（signal / confidence / reason），解析失败时按 HOLD 处理"""
+    match = _JSON_OBJECT.search(content or '')
+    if match:
+        try:
+            data = json.loads(match.group(0))
+            return {
+                'signal': str(data.get('signal', 'HOLD')).upper(),
+                'confidence': str(data.get('confidence', 'LOW')).upper(),
+                'reason': data.get('reason', ''),
+            }
+        except ValueError:
+            pass
+    return {'signal': 'HOLD', 'confidence': 'LOW', 'reason': f'无法解析回复: {(content or "")[:100]}'}
+
+
+def is_passed(direction, reply, config):
+    """按方向检查信号和置信度要求（要求列表为空时不限制）"""
+    prefix = 'long' if direction == 'LONG' else 'short'
+    signals = config.get(f'{prefix}_required_signal') or []
+    confidences = config.get(f'{prefix}_required_confidence') or []
+    return (not signals or reply['signal'] in signals) and (not confidences or reply['confidence'] in confidences)
+
+
+def load_ai_settings(config_file=CONFIG_FILE):
+    """从 data/config.json 读取 ai_base_url / ai_api_key / ai_model"""
+    try:
+        with open(config_file, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    except Exception as e:
+        logger.error(f"读取 AI 配置失败: {e}")
+        config = {}
+    return {'base_url': config.get('ai_base_url'), 'api_key': config.get('ai_api_key'), 'model': config.get('ai_model')}
+
+
+class AIFilter:
+    """并发、带缓存的 AI 筛选"""
+
+    def __init__(self, base_url, api_key, model, concurrency=DEFAULT_CONCURRENCY, deadline=DEFAULT_DEADLINE,
+                 cache_ttl=DEFAULT_CACHE_TTL, cache_size=DEFAULT_CACHE_SIZE, serializer=None):
+        self.base_url = base_url
+        self.api_key = api_key or 'EMPTY'
+        self.model = model
+        self.concurrency = concurrency
+        self.deadline = deadline
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.serializer = serializer   # 为 None 时按模块配置 prompt_serializer 创建
+        self.calls = deque(maxlen=500)   # 最近的调用记录
+        self.stats = {'calls': 0, 'cache_hits': 0, 'timeouts': 0, 'errors': 0,
+                      'prompt_tokens': 0, 'completion_tokens': 0, 'total_latency': 0.0,
+                      'renders': 0, 'prompt_chars': 0, 'prompt_tokens_est': 0}
+        self._cache = OrderedDict()   # {哈希: (回复, 时间)}
+        self._lock = threading.Lock()
+
+    # ==================== 缓存 ====================
+
+    def _cache_get(self, key):
+        with self._lock:
+            item = self._cache.get(key)
+            if item is None or time.time() - item[1] > self.cache_ttl:
+                return None
+            self._cache.move_to_end(key)
+            return item[0]
+
+    def _cache_put(self, key, reply):
+        with self._lock:
+            self._cache[key] = (reply, time.time())
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    # ==================== 请求 ====================
+
+    async def _request(self, client, semaphore, system_prompt, prompt):
+        """发送一次请求，返回 (回复, 调用记录)"""
+        async with semaphore:
+            start = time.time()
+            messages = [{'role': 'user', 'content': prompt}]
+            if system_prompt:
+                messages.insert(0, {'role': 'system', 'content': system_prompt})
+            response = await client.chat.completions.create(model=self.model, messages=messages)
+            latency = time.time() - start
+        usage = response.usage
+        record = {
+            'latency': round(latency, 3),
+            'prompt_tokens': getattr(usage, 'prompt_tokens', 0) if usage else 0,
+            'completion_tokens': getattr(usage, 'completion_tokens', 0) if usage else 0,
+        }
+        with self._lock:
+            self.stats['calls'] += 1
+            self.stats['prompt_tokens'] += record['prompt_tokens']
+            self.stats['completion_tokens'] += record['completion_tokens']
+            self.stats['total_latency'] += latency
+        return parse_reply(response.choices[0].message.content), record
+
+    async def afilter(self, items, config, deadline=None):
+        """
+        并发筛选，items 为 [{'symbol', 'direction', 'klines': {名称: K线}, 'indicators': {名称: 序列}}]
+
+        模块配置中的 concurrency / deadline_seconds 可覆盖默认的并发数和截止时间，prompt_serializer 设置占位符格式；
+        返回与 items 对应的结果列表，每项包含 signal / confidence / reason / passed / cached / timed_out / latency
+        以及提示词大小 prompt_chars / prompt_tokens_est
+        """
+        if deadline is None:
+            deadline = float(config.get('deadline_seconds', self.deadline))
+        concurrency = int(config.get('concurrency', self.concurrency))
+        start = time.time()
+        template, system_prompt = config.get('prompt', ''), config.get('system_prompt', '')
+        serializer = self.serializer or make_serializer(config.get('prompt_serializer'))
+        results = [None] * len(items)
+        sizes = [None] * len(items)
+        pending = {}   # {哈希: task}，同一轮中相同提示词只请求一次
+        waiting = []   # [(下标, 哈希)]
+        async with AsyncOpenAI(base_url=self.base_url, api_key=self.api_key, max_retries=0,
+                               timeout=deadline) as client:
+            semaphore = asyncio.Semaphore(concurrency)
+            for i, item in enumerate(items):
+                prompt = render_prompt(template, item.get('klines', {}), item.get('indicators', {}), serializer)
+                sizes[i] = prompt_size(prompt)
+                with self._lock:
+                    self.stats['renders'] += 1
+                    self.stats['prompt_chars'] += sizes[i]['prompt_chars']
+                    self.stats['prompt_tokens_est'] += sizes[i]['prompt_tokens_est']
+                key = hashlib.sha256(f'{self.model}\n{system_prompt}\n{prompt}'.encode('utf-8')).hexdigest()
+                cached = self._cache_get(key)
+                if cached is not None:
+                    results[i] = dict(cached, cached=True, timed_out=False, latency=0)
+                    with self._lock:
+                        self.stats['cache_hits'] += 1
+                    continue
+                if key not in pending:
+                    pending[key] = asyncio.ensure_future(self._request(client, semaphore, system_prompt, prompt))
+                waiting.append((i, key))
+            if pending:
+                await asyncio.wait(pending.values(), timeout=max(0, deadline - (time.time() - start)))
+            for task in pending.values():
+                if not task.done():
+                    task.cancel()
+            for i, key in waiting:
+                task = pending[key]
+                if task.cancelled() or not task.done():
+                    results[i] = {'signal': 'HOLD', 'confidence': 'LOW', 'reason': f'超过截止时间 {deadline}s',
+                                  'cached': False, 'timed_out': True, 'latency': deadline}
+                    with self._lock:
+                        self.stats['timeouts'] += 1
+                elif task.exception() is not None:
+                    results[i] = {'signal': 'HOLD', 'confidence': 'LOW', 'reason': f'请求失败: {task.exception()}',
+                                  'cached': False, 'timed_out': False, 'latency': round(time.time() - start, 3)}
+                    with self._lock:
+                        self.stats['errors'] += 1
+                else:
+                    reply, record = task.result()
+                    self._cache_put(key, reply)
+                    results[i] = dict(reply, cached=False, timed_out=False, **record)
+            await asyncio.gather(*pending.values(), return_exceptions=True)
+        for item, result, size in zip(items, results, sizes):
+            result.update(size)
+            result['symbol'] = item.get('symbol')
+            result['direction'] = item.get('direction')
+            result['passed'] = not result['timed_out'] and is_passed(item.get('direction'), result, config)
+            self.calls.append(result)
+        logger.info(f"AI 筛选: {len(items)} 个标的, 请求 {len(pending)} 次, "
+                    f"缓存命中 {sum(1 for r in results if r['cached'])} 个, "
+                    f"超时 {sum(1 for r in results if r['timed_out'])} 个, "
+                    f"通过 {sum(1 for r in results if r['passed'])} 个, 耗时 {time.time() - start:.2f}s, "
+                    f"提示词平均 {sum(s['prompt_chars'] for s in sizes) // max(1, len(sizes))} 字符 / "
+                    f"约 {sum(s['prompt_tokens_est'] for s in sizes) // max(1, len(sizes))} tokens")
+        return results
+
+    def filter(self, items, config, deadline=None):
+        """同步调用（在策略线程中使用独立的事件循环）"""
+        if not items:
+            return []
+        return asyncio.run(self.afilter(items, config, deadline))
+
+
+_filter = None
+_filter_lock = threading.Lock()
+
+
+def get_ai_filter(**kwargs):
+    """全局 AI 筛选实例（使用 data/config.json 中的 AI 配置）"""
+    global _filter
+    with _filter_lock:
+        if _filter is None:
+            settings = load_ai_settings()
+            settings.update(kwargs)
+            _filter = AIFilter(**settings)
+        return _filter
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+接口扩展
+在 app 创建之后注册新增接口；对已有路径的接口按 HTTP 方法替换处理函数，其余方法仍由原处理函数处理
+"""
+import functools
+import logging
+
+from flask import jsonify, request
+
+logger = logging.getLogger(__name__)
+
+# 原应用的登录状态接口（返回 {'authenticated': bool, 'user': ...}）
+AUTH_STATUS_RULE = '/api/auth/status'
+
+
+def override_route(app, rule, methods, view_func):
+    """
+    为 rule 的指定 methods 设置处理函数
+
+    已存在同路径且方法重叠的路由时替换其处理函数（不在 methods 中的方法仍交给原函数），
+    没有路由覆盖的方法新增路由
+    """
+    methods = set(m.upper() for m in methods)
+    covered = set()
+    for r in list(app.url_map.iter_rules()):
+        if r.rule != rule or not (r.methods & methods):
+            continue
+        original = app.view_functions[r.endpoint]
+
+        def wrapper(*args, _original=original, **kwargs):
+            if request.method in methods:
+                return view_func(*args, **kwargs)
+            return _original(*args, **kwargs)
+
+        app.view_functions[r.endpoint] = wrapper
+        covered |= r.methods & methods
+    remaining = methods - covered
+    if remaining:
+        endpoint = f"ext_{view_func.__name__}_{'_'.join(sorted(remaining)).lower()}"
+        app.add_url_rule(rule, endpoint=endpoint, view_func=view_func, methods=sorted(remaining))
+
+
+def guard_route(app, rule, methods, check):
+    """
+    在已有接口之前执行 check()：返回响应时直接返回（如校验失败），返回 None 时继续交给原处理函数
+    """
+    methods = set(m.upper() for m in methods)
+    for r in list(app.url_map.iter_rules()):
+        if r.rule != rule or not (r.methods & methods):
+            continue
+        original = app.view_functions[r.endpoint]
+
+        def wrapper(*args, _original=original, **kwargs):
+            if request.method in methods:
+                response = check()
+                if response is not None:
+                    return response
+            return _original(*args, **kwargs)
+
+        app.view_functions[r.endpoint] = wrapper
+
+
+def login_checker(app):
+    """
+    返回函数：按原应用的登录状态（GET /api/auth/status 的处理函数）判断当前请求是否已登录
+
+    也可在 socket 事件处理函数中调用；原应用没有登录状态接口时始终返回 False
+    """
+    endpoint = next((r.endpoint for r in app.url_map.iter_rules()
+                     if r.rule == AUTH_STATUS_RULE and 'GET' in r.methods), None)
+    if endpoint is None:
+        logger.error(f"未找到登录状态接口 {AUTH_STATUS_RULE}，需要登录的扩展接口将拒绝所有请求")
+
+    def authenticated():
+        if endpoint is None:
+            return False
+        try:
+            response = app.make_response(app.view_functions[endpoint]())
+        except Exception as e:
+            logger.error(f"检查登录状态失败: {e}")
+            return False
+        return bool((response.get_json(silent=True) or {}).get('authenticated'))
+    return authenticated
+
+
+def login_required(app):
+    """
+    返回装饰器：处理请求前校验登录状态（见 login_checker），未登录时返回 401
+
+    用于 add_url_rule / override_route 新增或替换的接口，使其与原接口使用同一套登录校验；
+    也可用于 guard_route 的 check，未登录时在执行 check 之前返回 401
+    """
+    authenticated = login_checker(app)
+
+    def decorator(view_func):
+        @functools.wraps(view_func)
+        def wrapper(*args, **kwargs):
+            if not authenticated():
+                return jsonify({'success': False, 'error': '未登录'}), 401
+            return view_func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def register_extensions(app, socketio=None):
+    """注册所有扩展接口"""
+    from log_api import register_log_routes
+    from position_api import register_position_routes
+    from optimizer_api import register_optimizer_routes
+    from strategy_api import register_strategy_routes
+
+    register_log_routes(app, socketio)
+    register_position_routes(app, socketio)
+    register_optimizer_routes(app, socketio)
+    register_strategy_routes(app, socketio)
+    logger.info("扩展接口已注册")
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+策略异步运行时
+进程内只有一个事件循环（独立线程），异步模式的策略（EXECUTION_MODE = 'async'，提供 run_async）
+在同一个循环上运行：多个策略、多个标的的取数、AI 请求和下单以协程交错执行，不再各自占用线程。
+按K线触发这些策略的定时器（StrategyTimer、多策略运行时的共用定时器）也作为任务运行在这个循环上。
+
+交易所接口仍经过 BinanceClient（共享连接池、请求限流、相同请求合并都保持有效），
+AsyncClient 把这些同步调用放到有界线程池中执行并返回可 await 的结果（依赖中没有异步 HTTP 客户端，
+直接请求会绕过 BinanceClient 的限流和签名）；
+AI 筛选直接使用 ai_filter 的协程接口 afilter
+
+用法（生成的策略代码中）:
+    async def run_async(self):
+        client = AsyncClient(self.client)
+        klines, gainers = await asyncio.gather(
+            to_thread(self.kline_cache.get_klines, 'BTCUSDT', '5m', 60),
+            client.get_top_gainers(limit=1000))
+        klines_map = await fetch_klines_async(self.kline_cache, symbols, '5m', 60)
+"""
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# 执行模式（生成策略中的 EXECUTION_MODE）
+SYNC_MODE = 'sync'
+ASYNC_MODE = 'async'
+
+# 执行同步调用（交易所请求、指标计算等）的线程数
+DEFAULT_MAX_BLOCKING = 32
+
+
+class AsyncRuntime:
+    """运行在独立线程中的共享事件循环"""
+
+    def __init__(self, max_blocking=DEFAULT_MAX_BLOCKING):
+        self.max_blocking = max_blocking
+        self.executor = ThreadPoolExecutor(max_workers=max_blocking, thread_name_prefix='async-blocking')
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_default_executor(self.executor)
+        self._thread = threading.Thread(target=self._run, name='strategy-loop', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    @property
+    def in_loop(self):
+        return threading.current_thread() is self._thread
+
+    def submit(self, coro):
+        """提交协程，返回 concurrent.futures.Future（可在其他线程中等待）"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """在共享循环上运行协程并等待结果（不能在循环线程内调用）"""
+        if self.in_loop:
+            raise RuntimeError("不能在事件循环线程中同步等待协程")
+        return self.submit(coro).result(timeout)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=5)
+        self.executor.shutdown(wait=False)
+
+
+async def to_thread(func, *args, **kwargs):
+    """在运行时的线程池中执行同步函数"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+
+async def map_limited(func, items, concurrency=8):
+    """
+    并发执行 func(item)（协程函数），最多同时 concurrency 个
+
+    返回与 items 顺序一致的结果列表，出错的项为对应的异常对象（与 gather(return_exceptions=True) 一致）
+    """
+    semaphore = asyncio.Semaphore(max(1, int(concurrency)))
+
+    async def run(item):
+        async with semaphore:
+            return await func(item)
+
+    return await asyncio.gather(*(run(item) for item in items), return_exceptions=True)
+
+
+class AsyncClient:
+    """
+    BinanceClient 的异步包装：方法调用在线程池中执行并返回协程，.client（合约连接器）同样包装
+
+    其余非方法属性直接返回原值
+    """
+
+    def __init__(self, client):
+        self._target = client
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name == 'client':
+            return AsyncClient(attr)
+        if not callable(attr):
+            return attr
+
+        async def call(*args, **kwargs):
+            return await to_thread(attr, *args, **kwargs)
+
+        call.__name__ = name
+        return call
+
+
+def execution_mode(module):
+    """策略模块的执行模式（未声明或没有 run_async 时为同步）"""
+    mode = getattr(module, 'EXECUTION_MODE', SYNC_MODE)
+    if mode == ASYNC_MODE and not hasattr(getattr(module, 'Strategy', None), 'run_async'):
+        logger.warning("策略声明了异步执行但没有 run_async，按同步执行")
+        return SYNC_MODE
+    return mode
+
+
+_runtime = None
+_runtime_lock = threading.Lock()
+
+
+def get_async_runtime(**kwargs):
+    """进程内共享的异步运行时（首次调用时启动事件循环线程）"""
+    global _runtime
+    with _runtime_lock:
+        if _runtime is None:
+            _runtime = AsyncRuntime(**kwargs)
+        return _runtime
@@ -0,0 +1,520 @@
+# -*- coding: utf-8 -*-
+"""
+离线回测引擎
+按 current_strategy.json 的模块流程（获取行情 -> 自定义策略 -> 标的选择 -> 获取行情 -> 技术指标 -> 自定义策略 -> 交易执行 -> 定时启动）
+在历史K线上逐根K线回放，由模拟撮合按 OHLC 成交开仓单、止盈止损单和到期平仓，输出盈亏、回撤和成交明细。
+
+为保证一年 5m 数据、上百个标的能在几分钟内完成：
+- 指标在每个标的的完整序列上一次性批量计算（与实盘用最近 limit 根K线计算相比，仅预热段存在差异）
+- 涨幅榜（24h 涨跌幅、24h 成交额）预先计算为 [标的 x 时间] 矩阵，每根K线只做一次排序
+- 传给自定义策略的 klines / indicators 为共享内存的视图，不复制数据
+
+ai_filter 模块无法离线回放，回测时跳过
+"""
+import logging
+import time
+from datetime import datetime
+
+import numpy as np
+
+from indicator_batch import compute_batch, unstack
+from kline_array import as_kline_array
+from kline_cache import INTERVAL_MS
+from kline_warehouse import get_kline_warehouse
+from strategy_code_cache import compile_custom_strategy
+from vector_strategy import ROW_MODE, VECTOR_MODE, evaluate_vector
+
+logger = logging.getLogger(__name__)
+
+# 默认手续费率（单边，按吃单计）
+DEFAULT_FEE_RATE = 0.0005
+
+# 开仓限价单价差（与生成的策略代码一致）
+DEFAULT_LIMIT_SPREAD = 0.03
+
+def load_history(client, symbols, interval, start_time, end_time):
+    """
+    从本地K线仓库读取历史K线（只下载仓库中缺失的区间），返回 {symbol: KlineArray}
+
+    start_time / end_time 为毫秒时间戳
+    """
+    warehouse = get_kline_warehouse(client)
+    history = {}
+    for symbol in symbols:
+        klines = warehouse.load(symbol, interval, start_time, end_time)
+        if klines is not None:
+            history[symbol] = klines
+        logger.info(f"加载历史K线: {symbol} {interval} {len(klines) if klines is not None else 0} 根")
+    return history
+
+
+def history_requirements(modules):
+    """回测所需的历史K线：返回 (定时周期, [(自定义标的, 周期)])，候选标的使用定时周期的K线"""
+    base_interval, symbol_interval, custom = None, None, []
+    for module in modules:
+        config = module.get('config', {})
+        if module.get('type') == 'timer':
+            base_interval = config.get('interval')
+        elif module.get('type') == 'kline':
+            interval = config.get('interval', '5m')
+            if config.get('source_type') == 'custom_symbol' and config.get('custom_symbol'):
+                custom.append((config['custom_symbol'], interval))
+            elif symbol_interval is None:
+                symbol_interval = interval
+    return base_interval or symbol_interval or '5m', custom
+
+
+class _Series:
+    """一个 (symbol, interval) 的历史K线及其在回测时间轴上的索引"""
+
+    __slots__ = ('klines', 'index', 'indicators')
+
+    def __init__(self, klines, interval, decision_times):
+        self.klines = klines
+        close_times = klines.open_time + INTERVAL_MS[interval]
+        # 每个决策时刻已收盘的最后一根K线，-1 表示尚无数据
+        self.index = np.searchsorted(close_times, decision_times, side='right') - 1
+        self.indicators = {}
+
+
+class BacktestEngine:
+    """
+    模块流程回测引擎
+
+    history 为 {interval: {symbol: K线}}，需包含定时周期下所有候选标的的K线，以及自定义标的（如 BTCUSDT）的K线
+    """
+
+    def __init__(self, modules, history, initial_balance=1000.0, fee_rate=DEFAULT_FEE_RATE,
+                 limit_spread=DEFAULT_LIMIT_SPREAD, start_time=None, end_time=None):
+        self.modules = modules
+        self.initial_balance = float(initial_balance)
+        self.fee_rate = fee_rate
+        self.limit_spread = limit_spread
+        self.skipped_modules = []
+        self.history = {interval: {s: as_kline_array(k) for s, k in items.items() if k is not None and len(k)}
+                        for interval, items in history.items()}
+        self._parse_modules()
+        self._build_timeline(start_time, end_time)
+        self._prepare_series()
+        self._prepare_indicators()
+        self._prepare_ranking()
+
+    # ==================== 解析模块流程 ====================
+
+    def _parse_modules(self):
+        self.global_klines = []     # [(参数名, symbol, interval, limit)]
+        self.symbol_klines = []     # [(参数名, interval, limit)]
+        self.global_strategies = []
+        self.symbol_strategies = []
+        self.indicator_modules = []  # [(config, 数据源参数名, 是否全局)]
+        self.symbol_config = None
+        self.trade_config = {}
+        self.base_interval = None
+        for index, module in enumerate(self.modules):
+            module_type, config = module.get('type'), module.get('config', {})
+            per_symbol = self.symbol_config is not None
+            if module_type == 'kline':
+                interval, limit = config.get('interval', '5m'), int(config.get('limit', 100))
+                if config.get('source_type') == 'custom_symbol' and config.get('custom_symbol'):
+                    symbol = config['custom_symbol']
+                    self.global_klines.append((f'klines_{symbol}_{interval}', symbol, interval, limit))
+                else:
+                    self.symbol_klines.append((f'klines_{interval}', interval, limit))
+            elif module_type == 'symbol':
+                self.symbol_config = config
+            elif module_type == 'indicator':
+                self.indicator_modules.append((config, config.get('data_source', ''), not per_symbol))
+            elif module_type == 'custom_strategy':
+                params = [k[0] for k in self.global_klines]
+                if per_symbol:
+                    params += [k[0] for k in self.symbol_klines]
+                func = compile_custom_strategy(config.get('code', ''), params + ['indicators'],
+                                               name=f'custom_strategy_{index}')
+                if per_symbol:
+                    self.symbol_strategies.append((func, config.get('mode', ROW_MODE)))
+                else:
+                    self.global_strategies.append(func)
+            elif module_type == 'trade':
+                self.trade_config = config
+            elif module_type == 'timer':
+                self.base_interval = config.get('interval')
+            else:
+                self.skipped_modules.append(module_type)
+        if self.symbol_config is None or not self.symbol_klines:
+            raise ValueError("回测需要 标的选择 和 按标的获取行情 模块")
+        if self.base_interval is None:
+            self.base_interval = self.symbol_klines[0][1]
+        if self.skipped_modules:
+            logger.warning(f"回测跳过不支持的模块: {self.skipped_modules}")
+
+    # ==================== 预计算 ====================
+
+    def _build_timeline(self, start_time, end_time):
+        """以定时周期的K线收盘时刻作为决策时间轴"""
+        base = self.history.get(self.base_interval, {})
+        if not base:
+            raise ValueError(f"缺少 {self.base_interval} 周期的历史K线")
+        self.symbols = sorted(base)
+        open_times = np.unique(np.concatenate([k.open_time for k in base.values()]))
+        if start_time is not None:
+            open_times = open_times[open_times >= start_time]
+        if end_time is not None:
+            open_times = open_times[open_times < end_time]
+        self.open_times = open_times
+        self.decision_times = open_times + INTERVAL_MS[self.base_interval]
+
+    def _series(self, symbol, interval):
+        key = (symbol, interval)
+        series = self._series_map.get(key)
+        if series is None:
+            klines = self.history.get(interval, {}).get(symbol)
+            if klines is None:
+                return None
+            series = _Series(klines, interval, self.decision_times)
+            self._series_map[key] = series
+        return series
+
+    def _prepare_series(self):
+        self._series_map = {}
+        for _, symbol, interval, _ in self.global_klines:
+            if self._series(symbol, interval) is None:
+                raise ValueError(f"缺少 {symbol} {interval} 的历史K线")
+        # 撮合使用定时周期的K线
+        self.trade_series = {s: self._series(s, self.base_interval) for s in self.symbols}
+
+    def _prepare_indicators(self):
+        """每个指标模块在所有相关序列的完整历史上批量计算一次"""
+        for config, data_source, is_global in self.indicator_modules:
+            suffix = data_source[len('klines_'):] if data_source.startswith('klines_') else data_source
+            if is_global:
+                targets = [self._series(s, i) for name, s, i, _ in self.global_klines if name == data_source]
+            else:
+                interval = next((i for name, i, _ in self.symbol_klines if name == data_source), None)
+                targets = [self._series(s, interval) for s in self.symbols] if interval else []
+            targets = [t for t in targets if t is not None]
+            if not targets:
+                continue
+            indicator_type = config.get('indicator_type', 'EMA')
+            params = {k: v for k, v in config.items() if k not in ('indicator_type', 'data_source', 'compute_mode')}
+            lengths = [len(t.klines) for t in targets]
+            start = time.time()
+            for output, values in compute_batch([t.klines for t in targets], indicator_type, **params).items():
+                for series, row in zip(targets, unstack(values, lengths)):
+                    series.indicators[f'{output}_{suffix}'] = row
+            logger.info(f"回测指标计算: {indicator_type} {len(targets)} 个序列, 耗时 {time.time() - start:.2f}s")
+
+    def _prepare_ranking(self):
+        """预先计算每个决策时刻各标的的 24h 涨跌幅和 24h 成交额"""
+        config = self.symbol_config
+        self.selection_mode = config.get('mode', 'top_gainers')
+        blacklist = set(config.get('blacklist') or [])
+        if self.selection_mode != 'top_gainers':
+            fixed = [s for s in config.get('symbols', []) if s in self.trade_series and s not in blacklist]
+            self.fixed_symbols = fixed
+            return
+        window = max(1, 86400000 // INTERVAL_MS[self.base_interval])
+        count, steps = len(self.symbols), len(self.decision_times)
+        self.change = np.full((count, steps), -np.inf, dtype=np.float32)
+        self.quote_volume = np.zeros((count, steps), dtype=np.float32)
+        for row, symbol in enumerate(self.symbols):
+            if symbol in blacklist:
+                continue
+            series = self.trade_series[symbol]
+            klines = series.klines
+            close = klines.close
+            qv = klines.columns.get('quote_volume')
+            qv = qv if qv is not None else klines.volume * close
+            cum = np.concatenate(([0.0], np.cumsum(qv)))
+            idx = np.arange(len(close))
+            lo = np.maximum(idx - window + 1, 0)
+            rolling_qv = cum[idx + 1] - cum[lo]
+            base_close = close[np.maximum(idx - window, 0)]
+            change = close / base_close - 1
+            valid = series.index >= 0
+            self.change[row, valid] = change[series.index[valid]]
+            self.quote_volume[row, valid] = rolling_qv[series.index[valid]]
+        self.change[self.quote_volume < float(config.get('min_volume', 0))] = -np.inf
+
+    def _select_symbols(self, step):
+        top_n = int(self.symbol_config.get('top_n', 10))
+        if self.selection_mode != 'top_gainers':
+            return self.fixed_symbols[:top_n]
+        column = self.change[:, step]
+        order = np.argsort(-column)[:top_n]
+        return [self.symbols[i] for i in order if column[i] != -np.inf]
+
+    # ==================== 回放 ====================
+
+    def _window(self, series, step, limit):
+        end = series.index[step] + 1
+        if end <= 0:
+            return None, None
+        start = max(0, end - limit)
+        klines = series.klines[start:end]
+        indicators = {name: values[start:end] for name, values in series.indicators.items()}
+        return klines, indicators
+
+    def _call_strategy(self, func, args):
+        try:
+            return func(*args)
+        except Exception as e:
+            self.stats['strategy_errors'] += 1
+            if self.stats['strategy_errors'] <= 10:
+                logger.error(f"{func.__name__} 执行出错: {e}")
+            return None
+
+    def _call_vector(self, func, global_args, global_indicators, candidates):
+        try:
+            return evaluate_vector(func, global_args, [[c[2][j] for c in candidates] for j in range(len(self.symbol_klines))],
+                                   [c[3] for c in candidates], [c[0] for c in candidates], global_indicators)
+        except Exception as e:
+            self.stats['strategy_errors'] += 1
+            if self.stats['strategy_errors'] <= 10:
+                logger.error(f"{func.__name__} 执行出错: {e}")
+            return [None] * len(candidates)
+
+    def run(self):
+        """逐根K线回放，返回回测结果"""
+        trade = self.trade_config
+        max_positions = int(trade.get('max_positions', 1))
+        max_hold_bars = int(trade.get('hold_bars', 1))
+        position_size = float(trade.get('position_size', 10))
+        take_profit_ratio = float(trade.get('take_profit_ratio', 0) or 0)
+        stop_loss_ratio = float(trade.get('stop_loss_ratio', 0) or 0)
+        cooldown_ms = float(trade.get('cooldown_minutes', 0) or 0) * 60000
+
+        self.stats = {'strategy_errors': 0, 'orders': 0, 'unfilled': 0}
+        positions = []   # 当前持仓（含待成交的开仓单）
+        trades = []
+        last_buy = {}
+        realized = 0.0
+        equity = np.empty(len(self.decision_times))
+        start = time.time()
+
+        for step, decision_time in enumerate(self.decision_times):
+            # 1. 撮合本根K线：待成交的开仓单，以及持仓的止盈止损
+            for position in positions[:]:
+                series = self.trade_series[position['symbol']]
+                i = series.index[step]
+                if i < 0 or series.klines.open_time[i] != self.open_times[step]:
+                    continue
+                k = series.klines
+                if position['status'] == 'PENDING':
+                    fill = self._fill_entry(position, k.open[i], k.high[i], k.low[i])
+                    if fill is None:
+                        positions.remove(position)
+                        self.stats['unfilled'] += 1
+                        continue
+                    self._open(position, fill, self.open_times[step], take_profit_ratio, stop_loss_ratio)
+                exit_price, reason = self._check_exit(position, k.high[i], k.low[i])
+                if exit_price is not None:
+                    realized += self._close(position, exit_price, reason, decision_time, trades)
+                    positions.remove(position)
+
+            # 2. 到期平仓（按收盘价），其余持仓K线数 +1
+            for position in positions[:]:
+                if position['hold_bars'] >= max_hold_bars:
+                    series = self.trade_series[position['symbol']]
+                    price = series.klines.close[series.index[step]]
+                    realized += self._close(position, price, '到期', decision_time, trades)
+                    positions.remove(position)
+                else:
+                    position['hold_bars'] += 1
+
+            equity[step] = self.initial_balance + realized + self._unrealized(positions, step)
+
+            if len(positions) >= max_positions:
+                continue
+
+            # 3. 全局自定义策略
+            global_args, global_indicators, ready = [], {}, True
+            for _, symbol, interval, limit in self.global_klines:
+                klines, indicators = self._window(self._series(symbol, interval), step, limit)
+                if klines is None:
+                    ready = False
+                    break
+                global_args.append(klines)
+                global_indicators.update(indicators)
+            if not ready:
+                continue
+            direction = None
+            for func in self.global_strategies:
+                signal = self._call_strategy(func, global_args + [global_indicators])
+                if signal not in ('LONG', 'SHORT'):
+                    direction = False
+                    break
+                direction = signal
+            if direction is False:
+                continue
+
+            # 4. 标的选择 + 按标的自定义策略
+            held = {p['symbol'] for p in positions}
+            candidates = []   # [(symbol, 方向, 按标的K线参数, 按标的指标)]
+            for symbol in self._select_symbols(step):
+                if symbol in held or decision_time - last_buy.get(symbol, -cooldown_ms) < cooldown_ms:
+                    continue
+                args, indicators, ready = [], {}, True
+                for _, interval, limit in self.symbol_klines:
+                    klines, symbol_indicators = self._window(self._series(symbol, interval), step, limit)
+                    if klines is None:
+                        ready = False
+                        break
+                    args.append(klines)
+                    indicators.update(symbol_indicators)
+                if ready:
+                    candidates.append((symbol, direction, args, indicators))
+            for func, mode in self.symbol_strategies:
+                if not candidates:
+                    break
+                if mode == VECTOR_MODE:
+                    signals = self._call_vector(func, global_args, global_indicators, candidates)
+                else:
+                    signals = [self._call_strategy(func, global_args + c[2] + [{**global_indicators, **c[3]}])
+                               for c in candidates]
+                candidates = [(c[0], signal, c[2], c[3]) for c, signal in zip(candidates, signals)
+                              if signal in ('LONG', 'SHORT') and (not c[1] or signal == c[1])]
+
+            # 5. 下开仓限价单（下一根K线撮合）
+            for symbol, side, _, _ in candidates[:max_positions - len(positions)]:
+                side = side or 'LONG'
+                series = self.trade_series[symbol]
+                price = series.klines.close[series.index[step]]
+                spread = self.limit_spread if side == 'LONG' else -self.limit_spread
+                positions.append({
+                    'symbol': symbol,
+                    'positionSide': side,
+                    'status': 'PENDING',
+                    'limit_price': price * (1 + spread),
+                    'quantity': position_size / price,
+                    'hold_bars': 1,
+                    'signal_time': int(decision_time),
+                })
+                last_buy[symbol] = decision_time
+                self.stats['orders'] += 1
+
+        elapsed = time.time() - start
+        result = self._report(trades, equity, elapsed)
+        logger.info(f"回测完成: {len(self.decision_times)} 根K线, {len(self.symbols)} 个标的, "
+                    f"{len(trades)} 笔交易, 盈亏 {result['summary']['pnl']:.4f}, 耗时 {elapsed:.1f}s")
+        return result
+
+    # ==================== 模拟撮合 ====================
+
+    @staticmethod
+    def _fill_entry(position, open_price, high, low):
+        """开仓限价单：开盘价优于限价时按开盘价成交，否则K线触及限价时按限价成交"""
+        limit = position['limit_price']
+        if position['positionSide'] == 'LONG':
+            if open_price <= limit:
+                return open_price
+            return limit if low <= limit else None
+        if open_price >= limit:
+            return open_price
+        return limit if high >= limit else None
+
+    @staticmethod
+    def _open(position, price, fill_time, take_profit_ratio, stop_loss_ratio):
+        sign = 1 if position['positionSide'] == 'LONG' else -1
+        position['status'] = 'OPEN'
+        position['entry_price'] = float(price)
+        position['entry_time'] = int(fill_time)
+        position['take_profit_price'] = price * (1 + sign * take_profit_ratio / 100) if take_profit_ratio > 0 else None
+        position['stop_loss_price'] = price * (1 - sign * stop_loss_ratio / 100) if stop_loss_ratio > 0 else None
+
+    @staticmethod
+    def _check_exit(position, high, low):
+        """止盈止损：同一根K线同时触及时按止损处理（保守）"""
+        sl, tp = position['stop_loss_price'], position['take_profit_price']
+        if position['positionSide'] == 'LONG':
+            if sl is not None and low <= sl:
+                return sl, '止损'
+            if tp is not None and high >= tp:
+                return tp, '止盈'
+        else:
+            if sl is not None and high >= sl:
+                return sl, '止损'
+            if tp is not None and low <= tp:
+                return tp, '止盈'
+        return None, None
+
+    def _close(self, position, price, reason, decision_time, trades):
+        sign = 1 if position['positionSide'] == 'LONG' else -1
+        quantity = float(position['quantity'])
+        entry, price = position['entry_price'], float(price)
+        fee = (entry + price) * quantity * self.fee_rate
+        pnl = sign * (price - entry) * quantity - fee
+        trades.append({
+            'symbol': position['symbol'],
+            'positionSide': position['positionSide'],
+            'entry_time': _iso(position['entry_time']),
+            'entry_price': entry,
+            'exit_time': _iso(decision_time),
+            'exit_price': price,
+            'quantity': quantity,
+            'exit_reason': reason,
+            'fee': fee,
+            'pnl': pnl,
+            'pnl_percent': pnl / (entry * quantity) * 100,
+        })
+        return pnl
+
+    def _unrealized(self, positions, step):
+        total = 0.0
+        for p in positions:
+            if p['status'] != 'OPEN':
+                continue
+            series = self.trade_series[p['symbol']]
+            price = series.klines.close[series.index[step]]
+            total += (price - p['entry_price']) * p['quantity'] * (1 if p['positionSide'] == 'LONG' else -1)
+        return total
+
+    # ==================== 报告 ====================
+
+    def _report(self, trades, equity, elapsed):
+        pnls = np.array([t['pnl'] for t in trades]) if trades else np.zeros(0)
+        peak = np.maximum.accumulate(equity) if len(equity) else equity
+        drawdown = peak - equity if len(equity) else equity
+        max_dd_index = int(np.argmax(drawdown)) if len(drawdown) else 0
+        wins = int((pnls > 0).sum())
+        # 按K线收益率计算的年化夏普比率
+        sharpe = 0.0
+        if len(equity) > 1:
+            returns = np.diff(equity) / equity[:-1]
+            std = returns.std()
+            if std > 0:
+                sharpe = float(returns.mean() / std * np.sqrt(365 * 86400000 / INTERVAL_MS[self.base_interval]))
+        summary = {
+            'bars': len(self.decision_times),
+            'symbols': len(self.symbols),
+            'start': _iso(self.open_times[0]) if len(self.open_times) else None,
+            'end': _iso(self.decision_times[-1]) if len(self.decision_times) else None,
+            'trades': len(trades),
+            'wins': wins,
+            'win_rate': round(wins / len(trades), 4) if trades else 0,
+            'pnl': float(pnls.sum()),
+            'fees': float(sum(t['fee'] for t in trades)),
+            'avg_pnl': float(pnls.mean()) if trades else 0,
+            'final_equity': float(equity[-1]) if len(equity) else self.initial_balance,
+            'max_drawdown': float(drawdown[max_dd_index]) if len(drawdown) else 0,
+            'max_drawdown_percent': float(drawdown[max_dd_index] / peak[max_dd_index] * 100) if len(drawdown) else 0,
+            'sharpe': round(sharpe, 4),
+            'orders': self.stats['orders'],
+            'unfilled_orders': self.stats['unfilled'],
+            'strategy_errors': self.stats['strategy_errors'],
+            'skipped_modules': self.skipped_modules,
+            'elapsed_seconds': round(elapsed, 2),
+        }
+        return {
+            'summary': summary,
+            'trades': trades,
+            'equity': {'time': self.decision_times.tolist(), 'equity': equity.tolist()},
+        }
+
+
+def _iso(ms):
+    return datetime.fromtimestamp(int(ms) / 1000).isoformat()
+
+
+def run_backtest(modules, history, **kwargs):
+    """按模块流程回测，modules 为 current_strategy.json 中的 modules 列表"""
+    return BacktestEngine(modules, history, **kwargs).run()
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+按客户端共享的服务注册表
+K线缓存、行情快照、订单跟踪等服务与交易客户端一一对应，同一客户端的多个使用者共用一份。
+服务本身持有客户端（后台线程也会引用它），用弱引用字典保存时条目永远不会被回收，
+因此改为显式注册表：客户端不再使用时调用 close_client(client) 停止并释放它的所有服务
+"""
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+_registries = []
+
+
+class ClientRegistry:
+    """{客户端: 服务} 注册表（按对象身份区分客户端，线程安全）"""
+
+    def __init__(self, name):
+        self.name = name
+        self._items = {}   # {id(client): (client, 服务)}
+        self._lock = threading.Lock()
+        _registries.append(self)
+
+    def get(self, client, factory):
+        """返回 client 对应的服务，不存在时调用 factory() 创建（创建过程在锁内，只执行一次）"""
+        with self._lock:
+            item = self._items.get(id(client))
+            if item is None:
+                item = (client, factory())
+                self._items[id(client)] = item
+            return item[1]
+
+    def peek(self, client):
+        with self._lock:
+            item = self._items.get(id(client))
+            return item[1] if item else None
+
+    def close(self, client):
+        """移除并停止 client 对应的服务（服务有 stop 方法时调用）"""
+        with self._lock:
+            item = self._items.pop(id(client), None)
+        if item is None:
+            return False
+        stop = getattr(item[1], 'stop', None)
+        if callable(stop):
+            try:
+                stop()
+            except Exception as e:
+                logger.error(f"停止{self.name}失败: {e}")
+        return True
+
+    def __len__(self):
+        return len(self._items)
+
+
+def close_client(client):
+    """停止并释放 client 的所有共享服务，返回已释放的服务名称"""
+    closed = [r.name for r in _registries if r.close(client)]
+    if closed:
+        logger.info(f"已释放客户端的共享服务: {', '.join(closed)}")
+    return closed
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+本地模拟 OpenAI 兼容接口
+实现最小化的 /v1/chat/completions（仅标准库），可设置响应延迟和回复内容，用于离线调试 AI 筛选
+
+用法:
+    server = FakeOpenAIServer(delay=0.5).start()
+    ai = AIFilter(base_url=server.url, api_key='test', model='stub')
+    server.stop()
+"""
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REPLY = {'signal': 'BUY', 'reason': '模拟回复', 'confidence': 'HIGH'}
+
+
+def _count_tokens(text):
+    """粗略估算 token 数（约 4 个字符一个 token）"""
+    return max(1, len(text) // 4)
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server.owner
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self.send_error(404)
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        server.requests.append(body)
+        messages = body.get('messages', [])
+        prompt = '\n'.join(m.get('content', '') for m in messages)
+        delay = server.delay(prompt) if callable(server.delay) else server.delay
+        if delay:
+            time.sleep(delay)
+        reply = server.reply(prompt) if callable(server.reply) else server.reply
+        content = reply if isinstance(reply, str) else json.dumps(reply, ensure_ascii=False)
+        prompt_tokens, completion_tokens = _count_tokens(prompt), _count_tokens(content)
+        data = json.dumps({
+            'id': f'chatcmpl-{len(server.requests)}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'stub'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                      'total_tokens': prompt_tokens + completion_tokens},
+        }).encode('utf-8')
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        except OSError:
+            # 客户端已超时断开
+            pass
+
+
+class FakeOpenAIServer:
+    """
+    模拟 OpenAI 兼容服务
+
+    delay 为响应延迟（秒），reply 为回复内容（字典 / 字符串），两者都可以是以 prompt 为参数的函数
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, delay=0, reply=None):
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.owner = self
+        self._thread = None
+        self.delay = delay
+        self.reply = reply if reply is not None else DEFAULT_REPLY
+        self.requests = []
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-openai-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+本地模拟币安合约 REST 接口
+实现最小化的 HTTP 服务（仅标准库），默认提供 /fapi/v1/ping 和 /fapi/v1/time（可设置与本地时钟的偏差和响应延迟），
+其余接口通过 add_handler 注册，用于离线调试服务器时间同步、请求限流等模块。
+
+每个响应带 X-MBX-USED-WEIGHT-1M（按 add_handler 时指定的权重按分钟累计）和 X-MBX-ORDER-COUNT-1M（POST 请求数）；
+设置 weight_limit 后超出时返回 429 和 Retry-After（到下一分钟的秒数）
+
+用法:
+    server = FakeRestServer(skew_ms=1500).start()
+    client = UMFutures(base_url=server.url)
+    client.time()   # {'serverTime': 本地时间 + 1500}
+    server.stop()
+"""
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+logger = logging.getLogger(__name__)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # 保持连接（与交易所一致），用于调试连接复用
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _handle(self, method):
+        server = self.server.owner
+        url = urlparse(self.path)
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        length = int(self.headers.get('Content-Length', 0) or 0)
+        if length:
+            params.update({k: v[-1] for k, v in parse_qs(self.rfile.read(length).decode('utf-8')).items()})
+        server.requests.append((method, url.path, params))
+        handler = server.handlers.get(url.path)
+        limited, limit_headers = server.account(method, url.path, params)
+        if limited:
+            status, body, headers = 429, {'code': -1003, 'msg': 'Too many requests'}, {}
+        elif handler is None:
+            status, body, headers = 404, {'code': -1, 'msg': 'Not found'}, {}
+        else:
+            if server.delay:
+                time.sleep(server.delay)
+            result = handler(params)
+            status, body, headers = result if isinstance(result, tuple) else (200, result, {})
+        headers = dict(limit_headers, **headers)
+        data = json.dumps(body).encode('utf-8')
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            for name, value in headers.items():
+                self.send_header(name, str(value))
+            self.end_headers()
+            self.wfile.write(data)
+        except OSError:
+            pass
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+
+class FakeRestServer:
+    """
+    模拟币安合约 REST 服务
+
+    skew_ms 为服务器时间相对本地时钟的偏差（毫秒），delay 为每个请求的响应延迟（秒）；
+    handlers 为 {路径: 函数(params) -> 响应体 或 (状态码, 响应体, 响应头)}，weights 为 {路径: 权重或函数(params)}；
+    weight_limit 为每分钟权重上限（为 None 时不限制）
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, skew_ms=0, delay=0, weight_limit=None):
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.owner = self
+        self._thread = None
+        self.skew_ms = skew_ms
+        self.delay = delay
+        self.requests = []   # [(方法, 路径, 参数)]
+        self.weight_limit = weight_limit
+        self.weights = {}
+        self.used_weight = 0
+        self.order_count = 0
+        self.rejected = 0
+        self._window = None
+        self._lock = threading.Lock()
+        self.handlers = {
+            '/fapi/v1/ping': lambda params: {},
+            '/fapi/v1/time': lambda params: {'serverTime': self.server_time()},
+        }
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def server_time(self):
+        """模拟的服务器时间（毫秒）"""
+        return int(time.time() * 1000) + self.skew_ms
+
+    def add_handler(self, path, handler, weight=1):
+        self.handlers[path] = handler
+        self.weights[path] = weight
+
+    def account(self, method, path, params):
+        """按分钟累计权重和下单次数，返回 (是否超出限制, 限流响应头)"""
+        with self._lock:
+            window = int(self.server_time() // 60000)
+            if window != self._window:
+                self._window = window
+                self.used_weight = 0
+                self.order_count = 0
+            weight = self.weights.get(path, 1)
+            self.used_weight += weight(params) if callable(weight) else weight
+            if method == 'POST':
+                self.order_count += 1
+            headers = {'X-MBX-USED-WEIGHT-1M': self.used_weight, 'X-MBX-ORDER-COUNT-1M': self.order_count}
+            if self.weight_limit is not None and self.used_weight > self.weight_limit:
+                self.rejected += 1
+                headers['Retry-After'] = max(1, int(60 - self.server_time() / 1000 % 60))
+                return True, headers
+            return False, headers
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-rest-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""
+本地模拟行情推送服务
+实现最小化的 WebSocket 服务端（仅标准库），模拟币安合约推送接口，用于离线调试 K线缓存、用户数据流等模块
+
+用法:
+    server = FakeStreamServer()
+    server.start()
+    conn = StreamConnection(base_url=server.url, ...)
+    server.publish('btcusdt@kline_5m', kline_event('BTCUSDT', '5m', open_time, 1, 2, 0.5, 1.5, 100))
+    server.publish(listen_key, order_trade_update('BTCUSDT', 1, 'FILLED', avg_price=100))
+"""
+import base64
+import hashlib
+import json
+import logging
+import socket
+import socketserver
+import struct
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+
+logger = logging.getLogger(__name__)
+
+_WS_MAGIC = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+def kline_event(symbol, interval, open_time, open_price, high, low, close, volume, closed=False,
+                interval_ms=None, continuous=False):
+    """构造一条 kline / continuous_kline 推送消息"""
+    interval_ms = interval_ms or 60000
+    k = {
+        't': open_time,
+        'T': open_time + interval_ms - 1,
+        'i': interval,
+        'o': str(open_price),
+        'h': str(high),
+        'l': str(low),
+        'c': str(close),
+        'v': str(volume),
+        'q': str(volume * close),
+        'n': 1,
+        'x': closed,
+    }
+    if continuous:
+        return {'e': 'continuous_kline', 'E': int(time.time() * 1000), 'ps': symbol, 'ct': 'PERPETUAL', 'k': k}
+    k['s'] = symbol
+    return {'e': 'kline', 'E': int(time.time() * 1000), 's': symbol, 'k': k}
+
+
+def order_trade_update(symbol, order_id, status, avg_price=0, filled_qty=0, orig_qty=0, client_order_id='',
+                       side='BUY', position_side='LONG', order_type='LIMIT'):
+    """构造一条用户数据流 ORDER_TRADE_UPDATE 消息"""
+    now = int(time.time() * 1000)
+    return {
+        'e': 'ORDER_TRADE_UPDATE', 'E': now, 'T': now,
+        'o': {
+            's': symbol, 'c': client_order_id, 'S': side, 'o': order_type, 'q': str(orig_qty),
+            'ap': str(avg_price), 'X': status, 'i': order_id, 'z': str(filled_qty), 'ps': position_side,
+        },
+    }
+
+
+def account_update(positions, reason='ORDER', balances=None, unrealized=None):
+    """
+    构造一条用户数据流 ACCOUNT_UPDATE 消息，positions 为 [(symbol, position_side, amount, entry_price)]，
+    balances 为 [(asset, wallet_balance)]，unrealized 为 {symbol: 未实现盈亏}
+    """
+    unrealized = unrealized or {}
+    now = int(time.time() * 1000)
+    return {
+        'e': 'ACCOUNT_UPDATE', 'E': now, 'T': now,
+        'a': {
+            'm': reason,
+            'B': [{'a': asset, 'wb': str(wb), 'cw': str(wb)} for asset, wb in balances or []],
+            'P': [{'s': s, 'ps': ps, 'pa': str(amount), 'ep': str(entry_price), 'up': str(unrealized.get(s, 0))}
+                  for s, ps, amount, entry_price in positions],
+        },
+    }
+
+
+class _Client:
+    """一个已建立的 WebSocket 连接"""
+
+    def __init__(self, sock, path):
+        self.sock = sock
+        self.path = path
+        self.streams = set()
+        self.send_lock = threading.Lock()
+        parsed = urlparse(path)
+        # /ws/<name> 为原始流连接
+        self.raw_name = parsed.path[4:] if parsed.path.startswith('/ws/') else None
+        for name in parse_qs(parsed.query).get('streams', [''])[0].split('/'):
+            if name:
+                self.streams.add(name)
+
+    def send_text(self, text):
+        payload = text.encode('utf-8')
+        length = len(payload)
+        if length < 126:
+            header = struct.pack('!BB', 0x81, length)
+        elif length < 65536:
+            header = struct.pack('!BBH', 0x81, 126, length)
+        else:
+            header = struct.pack('!BBQ', 0x81, 127, length)
+        with self.send_lock:
+            self.sock.sendall(header + payload)
+
+    def send_frame(self, opcode, payload=b''):
+        with self.send_lock:
+            self.sock.sendall(struct.pack('!BB', 0x80 | opcode, len(payload)) + payload)
+
+
+class _Handler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        server = self.server.owner
+        client = self._handshake()
+        if client is None:
+            return
+        server._add_client(client)
+        try:
+            while True:
+                frame = self._read_frame()
+                if frame is None:
+                    break
+                opcode, payload = frame
+                if opcode == 0x8:
+                    break
+                if opcode == 0x9:
+                    client.send_frame(0xA, payload)
+                elif opcode == 0x1:
+                    server._handle_request(client, payload.decode('utf-8'))
+        except (OSError, ValueError):
+            pass
+        finally:
+            server._remove_client(client)
+
+    def _recv_exact(self, n):
+        data = b''
+        while len(data) < n:
+            chunk = self.request.recv(n - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    def _handshake(self):
+        data = b''
+        while b'\r\n\r\n' not in data:
+            chunk = self.request.recv(4096)
+            if not chunk:
+                return None
+            data += chunk
+        lines = data.decode('latin-1').split('\r\n')
+        path = lines[0].split(' ')[1]
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                key, value = line.split(':', 1)
+                headers[key.strip().lower()] = value.strip()
+        accept = base64.b64encode(hashlib.sha1((headers.get('sec-websocket-key', '') + _WS_MAGIC).encode()).digest())
+        self.request.sendall(
+            b'HTTP/1.1 101 Switching Protocols\r\n'
+            b'Upgrade: websocket\r\n'
+            b'Connection: Upgrade\r\n'
+            b'Sec-WebSocket-Accept: ' + accept + b'\r\n\r\n'
+        )
+        return _Client(self.request, path)
+
+    def _read_frame(self):
+        header = self._recv_exact(2)
+        if header is None:
+            return None
+        opcode = header[0] & 0x0F
+        masked = header[1] & 0x80
+        length = header[1] & 0x7F
+        if length == 126:
+            length = struct.unpack('!H', self._recv_exact(2))[0]
+        elif length == 127:
+            length = struct.unpack('!Q', self._recv_exact(8))[0]
+        mask = self._recv_exact(4) if masked else b'\x00\x00\x00\x00'
+        payload = self._recv_exact(length) if length else b''
+        if payload is None:
+            return None
+        if masked:
+            payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        return opcode, payload
+
+
+class _ThreadingServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeStreamServer:
+    """模拟币安合约 WebSocket 推送服务"""
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self._server = _ThreadingServer((host, port), _Handler)
+        self._server.owner = self
+        self._thread = None
+        self._clients = []
+        self._lock = threading.Lock()
+        self.requests = []  # 收到的订阅请求，便于调试
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'ws://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-stream-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.drop_clients()
+        self._server.shutdown()
+        self._server.server_close()
+
+    def publish(self, stream, data):
+        """向订阅了 stream 的连接推送消息，返回送达的连接数"""
+        sent = 0
+        for client in self._snapshot():
+            try:
+                if client.raw_name is not None:
+                    if client.raw_name == stream or stream in client.streams:
+                        client.send_text(json.dumps(data))
+                        sent += 1
+                elif stream in client.streams:
+                    client.send_text(json.dumps({'stream': stream, 'data': data}))
+                    sent += 1
+            except OSError:
+                self._remove_client(client)
+        return sent
+
+    def drop_clients(self):
+        """断开所有连接（模拟网络中断）"""
+        for client in self._snapshot():
+            try:
+                client.sock.shutdown(socket.SHUT_RDWR)
+                client.sock.close()
+            except OSError:
+                pass
+            self._remove_client(client)
+
+    def wait_for_subscription(self, stream, timeout=5):
+        """等待某个流被订阅"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if any(stream in c.streams or c.raw_name == stream for c in self._snapshot()):
+                return True
+            time.sleep(0.02)
+        return False
+
+    def _snapshot(self):
+        with self._lock:
+            return list(self._clients)
+
+    def _add_client(self, client):
+        with self._lock:
+            self._clients.append(client)
+
+    def _remove_client(self, client):
+        with self._lock:
+            if client in self._clients:
+                self._clients.remove(client)
+
+    def _handle_request(self, client, text):
+        try:
+            request = json.loads(text)
+        except ValueError:
+            return
+        self.requests.append(request)
+        method = request.get('method')
+        params = request.get('params', [])
+        if method == 'SUBSCRIBE':
+            client.streams.update(params)
+        elif method == 'UNSUBSCRIBE':
+            client.streams.difference_update(params)
+        client.send_text(json.dumps({'result': None, 'id': request.get('id')}))
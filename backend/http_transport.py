@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+共享 HTTP 传输层
+BinanceClient 内部的各个连接器（binance-futures-connector、binance-connector、python-binance）各自持有
+requests 会话，默认每个主机只保留 10 个连接，并行拉取K线时排队或反复新建 TLS 连接。
+这里用一个共享的 HTTPAdapter 挂到所有会话上（API Key 等请求头仍由各自的会话设置）:
+- 连接池按主机共享，大小可配置（默认 64，与并行拉取的线程数匹配），池满时等待空闲连接而不是新建后丢弃
+- 开启 TCP keep-alive，空闲连接不被中间设备断开
+- warm_up 在触发前并发发送轻量请求，预先建立好连接，每根K线的第一笔下单不再等待 TLS 握手
+- 按接口记录延迟直方图和新建连接数，可通过 GET /api/strategy/transport 查看
+
+requests / urllib3 只支持 HTTP/1.1，这里不提供 HTTP/2；连接复用后握手开销同样只在建连时产生一次
+"""
+import logging
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+
+logger = logging.getLogger(__name__)
+
+# 每个主机的连接数和缓存的主机数
+DEFAULT_POOL_SIZE = 64
+DEFAULT_POOL_HOSTS = 10
+
+# TCP keep-alive：空闲 30s 后开始探测，间隔 10s，3 次无响应断开
+KEEPALIVE_IDLE = 30
+KEEPALIVE_INTERVAL = 10
+KEEPALIVE_COUNT = 3
+
+# 预热时建立的连接数，以及在触发前多少秒预热
+DEFAULT_WARMUP_CONNECTIONS = 4
+DEFAULT_WARMUP_SECONDS = 3
+
+# 合约 REST 地址和预热使用的接口（权重 1）
+FUTURES_BASE_URL = 'https://fapi.binance.com'
+WARMUP_PATH = '/fapi/v1/ping'
+
+# 延迟直方图的分桶上界（毫秒）
+LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+def _socket_options():
+    options = list(HTTPConnection.default_socket_options) + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+    # 各平台支持的选项不同（Windows / macOS 没有 TCP_KEEPIDLE）
+    for name, value in (('TCP_KEEPIDLE', KEEPALIVE_IDLE), ('TCP_KEEPINTVL', KEEPALIVE_INTERVAL),
+                        ('TCP_KEEPCNT', KEEPALIVE_COUNT)):
+        if hasattr(socket, name):
+            options.append((socket.IPPROTO_TCP, getattr(socket, name), value))
+    return options
+
+
+class LatencyHistogram:
+    """单个接口的延迟分布（毫秒）"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.errors = 0
+
+    def add(self, ms):
+        i = 0
+        while i < len(self.buckets) and ms > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def percentile(self, q):
+        """按分桶估算的分位数（返回所在桶的上界）"""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= target:
+                return self.buckets[i] if i < len(self.buckets) else round(self.max, 1)
+        return round(self.max, 1)
+
+    def to_dict(self):
+        labels = [f'<={b}' for b in self.buckets] + [f'>{self.buckets[-1]}']
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'avg_ms': round(self.total / self.count, 1) if self.count else None,
+            'max_ms': round(self.max, 1),
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'p99_ms': self.percentile(0.99),
+            'buckets': {label: c for label, c in zip(labels, self.counts) if c},
+        }
+
+
+class SharedAdapter(HTTPAdapter):
+    """共享连接池的 HTTPAdapter，记录每个接口的延迟"""
+
+    def __init__(self, transport, pool_size, pool_hosts):
+        self.transport = transport
+        super().__init__(pool_connections=pool_hosts, pool_maxsize=pool_size, max_retries=0, pool_block=True)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        pool_kwargs.setdefault('socket_options', _socket_options())
+        super().init_poolmanager(connections, maxsize, block=block, **pool_kwargs)
+
+    def send(self, request, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = super().send(request, **kwargs)
+        except Exception:
+            self.transport.record(request.method, request.url, None)
+            raise
+        self.transport.record(request.method, request.url, (time.perf_counter() - start) * 1000)
+        return response
+
+
+class HttpTransport:
+    """进程内共享的 HTTP 传输层"""
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, pool_hosts=DEFAULT_POOL_HOSTS,
+                 warmup_connections=DEFAULT_WARMUP_CONNECTIONS):
+        self.pool_size = pool_size
+        self.warmup_connections = warmup_connections
+        self.adapter = SharedAdapter(self, pool_size, pool_hosts)
+        self.histograms = {}   # {(方法, 路径): LatencyHistogram}
+        self.stats = {'warmups': 0, 'warmup_ms': None, 'sessions': 0}
+        self._lock = threading.Lock()
+        self._session = None
+
+    def mount(self, session):
+        """把共享连接池挂到会话上（同一个会话重复调用无影响）"""
+        if session.get_adapter('https://') is self.adapter:
+            return session
+        session.mount('https://', self.adapter)
+        session.mount('http://', self.adapter)
+        self.stats['sessions'] += 1
+        return session
+
+    @property
+    def session(self):
+        """不带 API Key 的共享会话（如 Webhook 通知）"""
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self.mount(requests.Session())
+        return self._session
+
+    def record(self, method, url, ms):
+        key = (method, urlparse(url).path)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = LatencyHistogram()
+            if ms is None:
+                histogram.errors += 1
+            else:
+                histogram.add(ms)
+
+    def warm_up(self, base_url=FUTURES_BASE_URL, connections=None, path=WARMUP_PATH):
+        """并发请求 connections 次轻量接口，让连接池中保持足够的已建立连接"""
+        connections = connections or self.warmup_connections
+        url = base_url.rstrip('/') + path
+        start = time.perf_counter()
+
+        def ping():
+            try:
+                self.session.get(url, timeout=5).close()
+                return True
+            except requests.RequestException as e:
+                logger.debug(f"连接预热失败: {e}")
+                return False
+
+        with ThreadPoolExecutor(max_workers=connections) as executor:
+            ok = sum(executor.map(lambda _: ping(), range(connections)))
+        elapsed = (time.perf_counter() - start) * 1000
+        self.stats['warmups'] += 1
+        self.stats['warmup_ms'] = round(elapsed, 1)
+        if ok < connections:
+            logger.warning(f"连接预热: {ok}/{connections} 个成功")
+        return ok
+
+    def pools(self):
+        """各主机连接池的状态（累计新建连接数 / 请求数）"""
+        result = {}
+        manager = self.adapter.poolmanager
+        for key in list(manager.pools.keys()):
+            pool = manager.pools.get(key)
+            if pool is None:
+                continue
+            result[f'{pool.scheme}://{pool.host}:{pool.port}'] = {
+                'connections_opened': pool.num_connections,
+                'requests': pool.num_requests,
+                # 队列中未建立的连接位置为 None
+                'idle': sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool is not None else 0,
+                'maxsize': pool.pool.maxsize if pool.pool is not None else self.pool_size,
+            }
+        return result
+
+    def status(self):
+        with self._lock:
+            latency = {f'{method} {path}': h.to_dict() for (method, path), h in sorted(self.histograms.items())}
+        return {'pool_size': self.pool_size, 'pools': self.pools(), 'latency': latency, 'stats': dict(self.stats)}
+
+
+def _sessions(client):
+    """找出客户端（及其内部连接器）持有的 requests 会话"""
+    found = []
+    # .client 为合约连接器（SharedMarketClient 等代理也会转发该属性）
+    candidates = [client, getattr(client, 'client', None)]
+    if hasattr(client, '__dict__'):
+        candidates.extend(vars(client).values())
+    for item in candidates:
+        if isinstance(item, requests.Session):
+            found.append(item)
+        elif isinstance(getattr(item, 'session', None), requests.Session):
+            found.append(item.session)
+    return list({id(session): session for session in found}.values())
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_http_transport(**kwargs):
+    """进程内共享的 HTTP 传输层"""
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = HttpTransport(**kwargs)
+        return _transport
+
+
+def get_http_session():
+    """使用共享连接池的通用会话（代替 requests.post 等模块级函数）"""
+    return get_http_transport().session
+
+
+def install_transport(client):
+    """把 BinanceClient 内部所有连接器的会话挂到共享连接池，返回传输层"""
+    transport = get_http_transport()
+    for session in _sessions(client):
+        transport.mount(session)
+    return transport
+
+
+def warm_up(client=None, connections=None):
+    """预热客户端所用 REST 地址的连接（client 为空时使用合约默认地址）"""
+    api = getattr(client, 'client', client)
+    base_url = getattr(api, 'base_url', None) or FUTURES_BASE_URL
+    return get_http_transport().warm_up(base_url, connections)
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+跨标的向量化指标计算
+把所有标的的K线按右对齐堆叠成 (标的数 × K线数) 的二维数组，EMA / RSI / MACD / BOLL 一次性对整个标的池计算。
+各标的K线数量不同时左侧以 NaN 填充并通过掩码跳过，结果与逐个标的调用 TA-Lib 一致
+"""
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from kline_array import as_kline_array
+from indicator_engine import INDICATOR_OUTPUTS
+
+# 布林带分块计算时每块滑动窗口的最大元素数（标的数 × 列数 × 周期）
+BOLL_CHUNK_ELEMENTS = 1 << 22
+
+
+def stack_columns(klines_list, field='close', length=None):
+    """
+    按右对齐堆叠多个标的的同一字段
+
+    返回 (values, mask)：values 为 float64 二维数组，mask 标记有效数据位置
+    """
+    arrays = [getattr(as_kline_array(k), field) for k in klines_list]
+    if length is None:
+        length = max((len(a) for a in arrays), default=0)
+    values = np.full((len(arrays), length), np.nan)
+    for i, a in enumerate(arrays):
+        n = min(len(a), length)
+        if n:
+            values[i, length - n:] = a[len(a) - n:]
+    return values, ~np.isnan(values)
+
+
+def unstack(values, lengths):
+    """把二维结果按各标的原始长度拆回列表（去掉左侧填充）"""
+    width = values.shape[1]
+    return [values[i, width - min(n, width):].tolist() for i, n in enumerate(lengths)]
+
+
+def batch_ema(values, period, mask=None):
+    """按行计算 EMA：每行前 period 个有效值取均值作为初值"""
+    if mask is None:
+        mask = ~np.isnan(values)
+    rows, cols = values.shape
+    out = np.full((rows, cols), np.nan)
+    k = 2.0 / (period + 1)
+    count = np.zeros(rows, dtype=np.int64)
+    total = np.zeros(rows)
+    prev = np.full(rows, np.nan)
+    for t in range(cols):
+        valid = mask[:, t]
+        x = np.where(valid, values[:, t], 0.0)
+        count += valid
+        total += np.where(valid & (count <= period), x, 0.0)
+        prev = np.where(valid & (count == period), total / period, prev)
+        prev = np.where(valid & (count > period), prev + k * (x - prev), prev)
+        out[:, t] = np.where(valid & (count >= period), prev, np.nan)
+    return out
+
+
+def batch_rsi(values, period, mask=None):
+    """按行计算 RSI（Wilder 平滑）"""
+    if mask is None:
+        mask = ~np.isnan(values)
+    rows, cols = values.shape
+    out = np.full((rows, cols), np.nan)
+    count = np.zeros(rows, dtype=np.int64)
+    gain = np.zeros(rows)
+    loss = np.zeros(rows)
+    for t in range(1, cols):
+        valid = mask[:, t] & mask[:, t - 1]
+        diff = np.where(valid, values[:, t] - values[:, t - 1], 0.0)
+        up = np.where(diff > 0, diff, 0.0)
+        down = np.where(diff < 0, -diff, 0.0)
+        count += valid
+        warm = valid & (count < period)
+        gain = np.where(warm, gain + up, gain)
+        loss = np.where(warm, loss + down, loss)
+        seed = valid & (count == period)
+        gain = np.where(seed, (gain + up) / period, gain)
+        loss = np.where(seed, (loss + down) / period, loss)
+        smooth = valid & (count > period)
+        gain = np.where(smooth, (gain * (period - 1) + up) / period, gain)
+        loss = np.where(smooth, (loss * (period - 1) + down) / period, loss)
+        total = gain + loss
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rsi = np.where(total != 0, 100.0 * gain / total, 0.0)
+        out[:, t] = np.where(valid & (count >= period), rsi, np.nan)
+    return out
+
+
+def batch_macd(values, fast_period, slow_period, signal_period, mask=None):
+    """按行计算 MACD，返回 (macd, signal, hist)"""
+    if mask is None:
+        mask = ~np.isnan(values)
+    if fast_period > slow_period:
+        fast_period, slow_period = slow_period, fast_period
+    slow = batch_ema(values, slow_period, mask)
+    # 与 TA-Lib 一致：快线与慢线同一根开始，跳过每行最前面 slow - fast 个有效值
+    fast_mask = mask & (np.cumsum(mask, axis=1) > slow_period - fast_period)
+    fast = batch_ema(values, fast_period, fast_mask)
+    macd = fast - slow
+    signal = batch_ema(macd, signal_period, ~np.isnan(macd))
+    macd = np.where(np.isnan(signal), np.nan, macd)
+    return macd, signal, macd - signal
+
+
+def batch_boll(values, period, std_dev, mask=None):
+    """
+    按行计算布林带，返回 (upper, middle, lower)
+
+    每个窗口用两遍法计算（先求均值，再求离差平方的均值），不使用整段累加和相减，
+    在回测的长历史上不会积累误差；按列分块计算以限制滑动窗口占用的内存
+    """
+    if mask is None:
+        mask = ~np.isnan(values)
+    rows, cols = values.shape
+    mean = np.full((rows, cols), np.nan)
+    std = np.full((rows, cols), np.nan)
+    if rows and cols >= period:
+        # 第 j 个窗口对应结果的第 j + period - 1 列
+        windows = sliding_window_view(np.where(mask, values, np.nan), period, axis=1)
+        chunk = max(1, BOLL_CHUNK_ELEMENTS // (rows * period))
+        for start in range(0, windows.shape[1], chunk):
+            w = windows[:, start:start + chunk]
+            m = w.mean(axis=2)
+            columns = slice(start + period - 1, start + period - 1 + w.shape[1])
+            mean[:, columns] = m
+            std[:, columns] = np.sqrt(((w - m[..., None]) ** 2).mean(axis=2))
+    ready = mask & (np.cumsum(mask, axis=1) >= period)
+    mean = np.where(ready, mean, np.nan)
+    std = np.where(ready, std, np.nan)
+    return mean + std_dev * std, mean, mean - std_dev * std
+
+
+def compute_batch(klines_list, indicator_type, **params):
+    """
+    对多个标的批量计算指标，返回 {输出名: 二维数组}（行与 klines_list 一一对应，右对齐）
+
+    参数与 indicator 模块配置一致
+    """
+    indicator_type = indicator_type.upper()
+    values, mask = stack_columns(klines_list)
+    if indicator_type == 'EMA':
+        outputs = (batch_ema(values, int(params.get('period', 20)), mask),)
+    elif indicator_type == 'RSI':
+        outputs = (batch_rsi(values, int(params.get('period', 14)), mask),)
+    elif indicator_type == 'MACD':
+        outputs = batch_macd(values, int(params.get('fast_period', 12)), int(params.get('slow_period', 26)),
+                             int(params.get('signal_period', 9)), mask)
+    elif indicator_type == 'BOLL':
+        outputs = batch_boll(values, int(params.get('period', 20)), float(params.get('std_dev', 2)), mask)
+    else:
+        raise ValueError(f"不支持的指标类型: {indicator_type}")
+    return dict(zip(INDICATOR_OUTPUTS[indicator_type], outputs))
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""
+增量技术指标引擎
+按 (symbol, interval, 指标) 保存计算状态，每根新K线收盘时 O(1) 更新，结果在预热期之后与 TA-Lib 全量计算一致。
+支持 EMA / RSI / MACD / BOLL，参数与 indicator 模块配置一致（period, fast_period, slow_period, signal_period, std_dev）
+"""
+import math
+import threading
+from collections import deque
+from itertools import islice
+
+import numpy as np
+
+from kline_array import as_kline_array
+
+NAN = float('nan')
+
+# 各指标输出的字段名（生成代码中再加上周期后缀，如 ema_5m）
+INDICATOR_OUTPUTS = {
+    'EMA': ('ema',),
+    'RSI': ('rsi',),
+    'MACD': ('macd', 'macd_signal', 'macd_hist'),
+    'BOLL': ('boll_upper', 'boll_middle', 'boll_lower'),
+}
+
+
+class EMAState:
+    """EMA：前 period 根取简单均值作为初值，与 talib.EMA 一致"""
+
+    def __init__(self, period):
+        self.period = period
+        self.k = 2.0 / (period + 1)
+        self.count = 0
+        self.total = 0.0
+        self.value = NAN
+
+    def update(self, x):
+        self.value = self.peek(x)
+        self.count += 1
+        if self.count <= self.period:
+            self.total += x
+        return self.value
+
+    def peek(self, x):
+        if self.count + 1 < self.period:
+            return NAN
+        if self.count + 1 == self.period:
+            return (self.total + x) / self.period
+        return self.value + self.k * (x - self.value)
+
+
+class RSIState:
+    """RSI：Wilder 平滑，与 talib.RSI 一致"""
+
+    def __init__(self, period):
+        self.period = period
+        self.count = 0
+        self.prev = NAN
+        self.gain = 0.0
+        self.loss = 0.0
+
+    def _next(self, x):
+        if self.count == 0:
+            return 0.0, 0.0, NAN
+        diff = x - self.prev
+        up, down = (diff, 0.0) if diff > 0 else (0.0, -diff)
+        p = self.period
+        if self.count < p:
+            return self.gain + up, self.loss + down, NAN
+        if self.count == p:
+            gain, loss = (self.gain + up) / p, (self.loss + down) / p
+        else:
+            gain, loss = (self.gain * (p - 1) + up) / p, (self.loss * (p - 1) + down) / p
+        total = gain + loss
+        return gain, loss, (100.0 * gain / total if total != 0 else 0.0)
+
+    def update(self, x):
+        self.gain, self.loss, value = self._next(x)
+        self.prev = x
+        self.count += 1
+        return value
+
+    def peek(self, x):
+        return self._next(x)[2]
+
+
+class MACDState:
+    """
+    MACD：与 talib.MACD 一致，快慢线在第 slow_period 根同时开始，
+    快线初值取这 slow_period 根中最后 fast_period 根的均值
+    """
+
+    def __init__(self, fast_period, slow_period, signal_period):
+        if fast_period > slow_period:
+            fast_period, slow_period = slow_period, fast_period
+        self.fast_period = fast_period
+        self.slow_period = slow_period
+        self.fast_k = 2.0 / (fast_period + 1)
+        self.slow_k = 2.0 / (slow_period + 1)
+        self.warmup = deque(maxlen=slow_period)
+        self.fast = NAN
+        self.slow = NAN
+        self.signal = EMAState(signal_period)
+
+    def _lines(self, x):
+        if len(self.warmup) < self.slow_period - 1:
+            return NAN, NAN
+        if math.isnan(self.slow):
+            window = list(self.warmup) + [x]
+            return sum(window[-self.fast_period:]) / self.fast_period, sum(window) / self.slow_period
+        return self.fast + self.fast_k * (x - self.fast), self.slow + self.slow_k * (x - self.slow)
+
+    def update(self, x):
+        self.fast, self.slow = self._lines(x)
+        if math.isnan(self.slow):
+            self.warmup.append(x)
+            return NAN, NAN, NAN
+        macd = self.fast - self.slow
+        signal = self.signal.update(macd)
+        if math.isnan(signal):
+            return NAN, NAN, NAN
+        return macd, signal, macd - signal
+
+    def peek(self, x):
+        fast, slow = self._lines(x)
+        if math.isnan(slow):
+            return NAN, NAN, NAN
+        macd = fast - slow
+        signal = self.signal.peek(macd)
+        if math.isnan(signal):
+            return NAN, NAN, NAN
+        return macd, signal, macd - signal
+
+
+class BollState:
+    """布林带：简单均值 ± std_dev 倍总体标准差，与 talib.BBANDS(matype=0) 一致"""
+
+    def __init__(self, period, std_dev):
+        self.period = period
+        self.std_dev = std_dev
+        self.window = deque()
+        self.total = 0.0
+        self.total_sq = 0.0
+
+    def _bands(self, total, total_sq):
+        mean = total / self.period
+        std = math.sqrt(max(total_sq / self.period - mean * mean, 0.0))
+        return mean + self.std_dev * std, mean, mean - self.std_dev * std
+
+    def _next_sums(self, x):
+        total, total_sq = self.total + x, self.total_sq + x * x
+        if len(self.window) == self.period:
+            old = self.window[0]
+            total, total_sq = total - old, total_sq - old * old
+        return total, total_sq
+
+    def update(self, x):
+        self.total, self.total_sq = self._next_sums(x)
+        if len(self.window) == self.period:
+            self.window.popleft()
+        self.window.append(x)
+        if len(self.window) < self.period:
+            return NAN, NAN, NAN
+        return self._bands(self.total, self.total_sq)
+
+    def peek(self, x):
+        if len(self.window) + 1 < self.period:
+            return NAN, NAN, NAN
+        return self._bands(*self._next_sums(x))
+
+
+def create_state(indicator_type, params):
+    """按 indicator 模块配置创建指标状态"""
+    indicator_type = indicator_type.upper()
+    if indicator_type == 'EMA':
+        return EMAState(int(params.get('period', 20)))
+    if indicator_type == 'RSI':
+        return RSIState(int(params.get('period', 14)))
+    if indicator_type == 'MACD':
+        return MACDState(int(params.get('fast_period', 12)), int(params.get('slow_period', 26)),
+                         int(params.get('signal_period', 9)))
+    if indicator_type == 'BOLL':
+        return BollState(int(params.get('period', 20)), float(params.get('std_dev', 2)))
+    raise ValueError(f"不支持的指标类型: {indicator_type}")
+
+
+class _Series:
+    """单个 (symbol, interval, 指标) 的状态与已收盘K线的指标历史"""
+
+    def __init__(self, indicator_type, params, history):
+        self.state = create_state(indicator_type, params)
+        self.last_open_time = None
+        self.outputs = deque(maxlen=history)
+
+
+class IndicatorEngine:
+    """
+    增量指标引擎
+
+    compute() 传入最近的K线窗口：最后一根视为未收盘K线，只试算不写入状态；
+    其余K线中比上次已处理更新的部分依次写入状态。窗口与已处理数据不连续时（如策略停运过）自动重建。
+    """
+
+    def __init__(self, history=1000):
+        self.history = history
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def reset(self, symbol=None):
+        with self._lock:
+            if symbol is None:
+                self._series.clear()
+            else:
+                for key in [k for k in self._series if k[0] == symbol]:
+                    del self._series[key]
+
+    def compute(self, symbol, interval, klines, indicator_type, **params):
+        """
+        计算指标，返回 {输出名: ndarray}，数组与 klines 等长对齐（预热期为 NaN）
+
+        symbol 为 None 时不保存状态，等同于对窗口全量计算
+        """
+        klines = as_kline_array(klines)
+        indicator_type = indicator_type.upper()
+        key = (symbol, interval, indicator_type, tuple(sorted(params.items())))
+        with self._lock:
+            series = self._series.get(key) if symbol is not None else None
+            closes = klines.close
+            times = klines.open_time
+            n = len(closes)
+            if series is None or series.last_open_time is None or n == 0 or times[0] > series.last_open_time:
+                series = _Series(indicator_type, params, self.history)
+                if symbol is not None:
+                    self._series[key] = series
+            # 写入已收盘K线（除最后一根外、比上次处理更新的部分）
+            start = 0 if series.last_open_time is None else int(np.searchsorted(times, series.last_open_time, 'right'))
+            for i in range(start, n - 1):
+                series.outputs.append(series.state.update(float(closes[i])))
+                series.last_open_time = int(times[i])
+            current = series.state.peek(float(closes[-1])) if n else None
+            values = list(islice(reversed(series.outputs), n - 1))[::-1] if n > 1 else []
+            values = [None] * (n - 1 - len(values)) + values + ([current] if n else [])
+
+        names = INDICATOR_OUTPUTS[indicator_type]
+        result = {}
+        for idx, name in enumerate(names):
+            column = []
+            for v in values:
+                if v is None:
+                    column.append(NAN)
+                elif len(names) == 1:
+                    column.append(v)
+                else:
+                    column.append(v[idx])
+            result[name] = np.array(column, dtype=np.float64)
+        return result
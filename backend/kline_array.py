@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+列式K线容器
+以连续的 float64 / int64 NumPy 数组保存K线，字段数组可直接传给 TA-Lib，无需再构建 DataFrame 和逐列类型转换；
+同时兼容原有的字典行写法 klines[-1]['close']、len(klines)、for k in klines
+"""
+import numpy as np
+
+# 价格/成交量字段（float64）
+PRICE_FIELDS = ('open', 'high', 'low', 'close', 'volume')
+# 可选的附加字段
+EXTRA_FLOAT_FIELDS = ('quote_volume',)
+EXTRA_INT_FIELDS = ('close_time', 'trades')
+
+
+def _row_time(row):
+    for key in ('open_time', 'timestamp', 'time'):
+        value = row.get(key)
+        if value is not None:
+            try:
+                return int(value)
+            except (TypeError, ValueError):
+                return 0
+    return 0
+
+
+class KlineArray:
+    """
+    K线列式容器
+
+    klines.close 等属性为连续的 float64 数组，klines.open_time 为 int64 数组；
+    klines[i] 返回该根K线的字典，klines[a:b] 返回共享内存的子容器
+    """
+
+    __slots__ = ('columns',)
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    @classmethod
+    def from_columns(cls, columns):
+        """由 {字段: 数组} 构建（数组按需转换为连续的 float64 / int64）"""
+        cols = {}
+        for name, values in columns.items():
+            dtype = np.int64 if name == 'open_time' or name in EXTRA_INT_FIELDS else np.float64
+            cols[name] = np.ascontiguousarray(values, dtype=dtype)
+        return cls(cols)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """由字典列表构建（兼容 get_klines 原有返回格式，字符串数值会被转换）"""
+        if isinstance(rows, KlineArray):
+            return rows
+        count = len(rows)
+        cols = {'open_time': np.fromiter((_row_time(r) for r in rows), dtype=np.int64, count=count)}
+        for name in PRICE_FIELDS:
+            cols[name] = np.fromiter((float(r[name]) for r in rows), dtype=np.float64, count=count)
+        first = rows[0] if count else {}
+        for name in EXTRA_FLOAT_FIELDS:
+            if name in first:
+                cols[name] = np.fromiter((float(r[name]) for r in rows), dtype=np.float64, count=count)
+        for name in EXTRA_INT_FIELDS:
+            if name in first:
+                cols[name] = np.fromiter((int(r[name]) for r in rows), dtype=np.int64, count=count)
+        return cls(cols)
+
+    def __getattr__(self, name):
+        # copy / pickle 在设置 columns 之前会查找 __setstate__ 等属性，此时不能再读取 self.columns（否则无限递归）
+        if name == 'columns' or name.startswith('__'):
+            raise AttributeError(name)
+        try:
+            return self.columns[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __len__(self):
+        return len(self.columns['open_time'])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return KlineArray({name: values[index] for name, values in self.columns.items()})
+        if isinstance(index, str):
+            return self.columns[index]
+        return {name: values[index].item() for name, values in self.columns.items()}
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __repr__(self):
+        return f"KlineArray(len={len(self)}, fields={list(self.columns)})"
+
+    def __getstate__(self):
+        return self.columns
+
+    def __setstate__(self, state):
+        self.columns = state
+
+    def copy(self):
+        return KlineArray({name: values.copy() for name, values in self.columns.items()})
+
+    def to_rows(self):
+        """转换为字典列表"""
+        names = list(self.columns)
+        lists = [self.columns[n].tolist() for n in names]
+        return [dict(zip(names, values)) for values in zip(*lists)]
+
+    def to_dataframe(self):
+        import pandas as pd
+        return pd.DataFrame(self.columns)
+
+
+def as_kline_array(klines):
+    """统一转换为 KlineArray（已是 KlineArray 时原样返回）"""
+    if klines is None or isinstance(klines, KlineArray):
+        return klines
+    return KlineArray.from_rows(klines)
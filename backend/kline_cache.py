@@ -0,0 +1,409 @@
+# -*- coding: utf-8 -*-
+"""
+K线内存缓存
+每个 (symbol, interval) 一个环形缓冲区：首次通过 REST 初始化，之后由合约 kline / continuousKline 推送实时更新，
+get_klines 直接从内存返回。检测到K线缺口或断线重连时通过 REST 补齐。
+收到K线收盘推送（x 为 true）时通知 add_close_listener 注册的回调，供按收盘触发的定时器使用。
+"""
+import logging
+import threading
+import time
+
+import numpy as np
+
+from client_registry import ClientRegistry
+from kline_array import KlineArray
+from ws_stream import StreamConnection, FUTURES_STREAM_URL
+
+logger = logging.getLogger(__name__)
+
+# 周期对应的毫秒数
+INTERVAL_MS = {
+    '1m': 60000, '3m': 180000, '5m': 300000, '15m': 900000, '30m': 1800000,
+    '1h': 3600000, '2h': 7200000, '4h': 14400000, '6h': 21600000, '8h': 28800000,
+    '12h': 43200000, '1d': 86400000, '3d': 259200000, '1w': 604800000,
+}
+
+# 缓冲区字段
+FLOAT_FIELDS = ('open', 'high', 'low', 'close', 'volume', 'quote_volume')
+INT_FIELDS = ('open_time', 'close_time', 'trades')
+
+# 单次 REST 请求最多返回的K线数量（get_klines 的 limit 上限）
+REST_MAX_LIMIT = 1500
+
+# 超过该时间（秒）没有被读取的标的取消推送订阅并释放缓冲区（如已跌出涨幅榜的交易对），每分钟检查一次
+DEFAULT_IDLE_SECONDS = 1800
+IDLE_SWEEP_INTERVAL = 60
+
+
+def parse_rest_kline(row):
+    """将 /fapi/v1/klines 返回的数组转换为K线字典"""
+    return {
+        'open_time': int(row[0]),
+        'open': float(row[1]),
+        'high': float(row[2]),
+        'low': float(row[3]),
+        'close': float(row[4]),
+        'volume': float(row[5]),
+        'close_time': int(row[6]),
+        'quote_volume': float(row[7]),
+        'trades': int(row[8]),
+    }
+
+
+def parse_stream_kline(k):
+    """将推送消息中的 k 字段转换为K线字典"""
+    return {
+        'open_time': int(k['t']),
+        'open': float(k['o']),
+        'high': float(k['h']),
+        'low': float(k['l']),
+        'close': float(k['c']),
+        'volume': float(k['v']),
+        'close_time': int(k['T']),
+        'quote_volume': float(k.get('q', 0)),
+        'trades': int(k.get('n', 0)),
+    }
+
+
+class KlineRingBuffer:
+    """
+    定长K线缓冲区
+
+    底层数组长度为容量的两倍，写满后把最近的数据整体前移，追加为均摊 O(1)，
+    且最近 N 根K线在内存中始终连续
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._arrays = {f: np.zeros(capacity * 2, dtype=np.float64) for f in FLOAT_FIELDS}
+        self._arrays.update({f: np.zeros(capacity * 2, dtype=np.int64) for f in INT_FIELDS})
+        self._start = 0
+        self._end = 0
+
+    def __len__(self):
+        return self._end - self._start
+
+    @property
+    def last_open_time(self):
+        if self._end == self._start:
+            return None
+        return int(self._arrays['open_time'][self._end - 1])
+
+    def clear(self):
+        self._start = self._end = 0
+
+    def update(self, bar):
+        """
+        写入一根K线：与最后一根同一开盘时间则覆盖，更新的追加到末尾，
+        更早的若已存在则覆盖，否则丢弃。返回是否写入
+        """
+        open_time = bar['open_time']
+        last = self.last_open_time
+        if last is None or open_time > last:
+            if self._end == len(self._arrays['open_time']):
+                self._compact()
+            self._write(self._end, bar)
+            self._end += 1
+            if self._end - self._start > self.capacity:
+                self._start = self._end - self.capacity
+            return True
+        if open_time == last:
+            self._write(self._end - 1, bar)
+            return True
+        times = self._arrays['open_time'][self._start:self._end]
+        idx = int(np.searchsorted(times, open_time))
+        if idx < len(times) and times[idx] == open_time:
+            self._write(self._start + idx, bar)
+            return True
+        return False
+
+    def extend(self, bars):
+        for bar in bars:
+            self.update(bar)
+
+    def tail(self, n):
+        """最近 n 根K线各字段的数组视图 {field: ndarray}"""
+        n = min(n, len(self))
+        return {f: a[self._end - n:self._end] for f, a in self._arrays.items()}
+
+    def snapshot(self, n):
+        """最近 n 根K线的副本（KlineArray），不受后续推送写入影响"""
+        return KlineArray({f: a.copy() for f, a in self.tail(n).items()})
+
+    def _write(self, pos, bar):
+        for f, a in self._arrays.items():
+            a[pos] = bar[f]
+
+    def _compact(self):
+        size = self._end - self._start
+        for a in self._arrays.values():
+            a[:size] = a[self._start:self._end]
+        self._start, self._end = 0, size
+
+
+class KlineCache:
+    """
+    基于 WebSocket 推送的K线缓存
+
+    get_klines(symbol, interval, limit) 与 BinanceClient.get_klines 签名一致，可直接替换使用，返回 KlineArray；
+    idle_seconds 内没有被读取的标的自动取消订阅（subscribe 订阅的标的除外，直到 release）
+    """
+
+    def __init__(self, client, capacity=1000, stream_url=FUTURES_STREAM_URL, continuous=False,
+                 stale_seconds=None, warehouse=None, idle_seconds=DEFAULT_IDLE_SECONDS):
+        self.client = client
+        self.capacity = capacity
+        # 本地K线仓库：初始化时已收盘的K线从仓库读取，REST 只请求最新的两根
+        self.warehouse = warehouse
+        self.continuous = continuous
+        # 超过该时间没有收到推送则认为缓存不可信，回退到 REST（默认两个周期）
+        self.stale_seconds = stale_seconds
+        self.idle_seconds = idle_seconds
+        self.stats = {'hits': 0, 'rest_seeds': 0, 'backfills': 0, 'stream_updates': 0, 'evictions': 0}
+        self._close_listeners = []   # [callback(symbol, interval, bar)]
+
+        self._buffers = {}      # {(symbol, interval): KlineRingBuffer}
+        self._updated_at = {}   # {(symbol, interval): 最近一次推送时间}
+        self._streams = {}      # {stream_name: (symbol, interval)}
+        self._seed_locks = {}   # {(symbol, interval): Lock}，多个策略同时请求同一标的时只初始化一次
+        self._accessed_at = {}  # {(symbol, interval): 最近一次读取时间}
+        self._pinned = {}       # {(symbol, interval): subscribe 次数}，不会因空闲被取消订阅
+        self._complete = set()  # 上线时间短、REST 返回的K线少于请求数量的标的（已有全部历史）
+        self._last_sweep = time.time()
+        self._lock = threading.RLock()
+        self._connection = StreamConnection(stream_url, on_message=self._on_message,
+                                            on_open=self._on_open, name='kline')
+
+    def start(self):
+        self._connection.start()
+
+    def stop(self):
+        self._connection.stop()
+
+    def add_close_listener(self, callback):
+        """注册K线收盘回调 callback(symbol, interval, bar)，在推送线程中调用"""
+        with self._lock:
+            self._close_listeners.append(callback)
+
+    def remove_close_listener(self, callback):
+        with self._lock:
+            if callback in self._close_listeners:
+                self._close_listeners.remove(callback)
+
+    def subscribe(self, symbol, interval):
+        """确保 (symbol, interval) 已初始化并订阅推送（用于只需要收盘事件的场景），release 之前不会因空闲被取消"""
+        with self._lock:
+            self._pinned[(symbol, interval)] = self._pinned.get((symbol, interval), 0) + 1
+        if not self.has_klines(symbol, interval, 1):
+            self.get_klines(symbol, interval, 2)
+
+    def release(self, symbol, interval):
+        """撤销一次 subscribe，之后按空闲时间正常回收"""
+        key = (symbol, interval)
+        with self._lock:
+            count = self._pinned.get(key, 0) - 1
+            if count > 0:
+                self._pinned[key] = count
+            else:
+                self._pinned.pop(key, None)
+                self._accessed_at[key] = time.time()
+
+    def has_klines(self, symbol, interval, limit):
+        """内存中是否已有足够且未过期的K线（即 get_klines 不会发起 REST 请求）"""
+        key = (symbol, interval)
+        with self._lock:
+            buffer = self._buffers.get(key)
+            if buffer is None or self._is_stale(key):
+                return False
+            return len(buffer) >= min(limit, REST_MAX_LIMIT) or (key in self._complete and len(buffer) > 0)
+
+    def get_klines(self, symbol, interval, limit=500, end_time=None):
+        """
+        从内存返回最近 limit 根K线，未缓存时通过 REST 初始化并订阅推送
+
+        end_time（毫秒）不为空时只返回开盘时间早于 end_time 的K线，
+        按收盘触发时传入刚收盘K线的收盘边界，可排除已开始推送的下一根K线；
+        limit 最大为 REST_MAX_LIMIT，超过缓存容量时该标的的缓冲区按 limit 扩容
+        """
+        key = (symbol, interval)
+        limit = min(limit, REST_MAX_LIMIT)
+        with self._lock:
+            self._accessed_at[key] = time.time()
+            if self.has_klines(symbol, interval, limit):
+                self.stats['hits'] += 1
+                return self._snapshot(key, limit, end_time)
+            seed_lock = self._seed_locks.setdefault(key, threading.Lock())
+        with seed_lock:
+            # 等待期间已由其他线程初始化
+            if not self.has_klines(symbol, interval, limit):
+                self._seed(symbol, interval, max(limit, min(self.capacity, 200)))
+                self._subscribe(symbol, interval)
+        with self._lock:
+            return self._snapshot(key, limit, end_time)
+
+    def _snapshot(self, key, limit, end_time):
+        buffer = self._buffers[key]
+        if end_time is None:
+            return buffer.snapshot(limit)
+        klines = buffer.snapshot(limit + 1)
+        count = int(np.searchsorted(klines.open_time, end_time))
+        return klines[max(0, count - limit):count]
+
+    def _is_stale(self, key):
+        if not self._connection.connected:
+            return True
+        stale_seconds = self.stale_seconds or INTERVAL_MS.get(key[1], 60000) * 2 / 1000
+        return time.time() - self._updated_at.get(key, 0) > stale_seconds
+
+    def _stream_name(self, symbol, interval):
+        if self.continuous:
+            return f'{symbol.lower()}_perpetual@continuousKline_{interval}'
+        return f'{symbol.lower()}@kline_{interval}'
+
+    def _subscribe(self, symbol, interval):
+        name = self._stream_name(symbol, interval)
+        with self._lock:
+            if name in self._streams:
+                return
+            self._streams[name] = (symbol, interval)
+        self._connection.subscribe([name])
+
+    def _fetch_rest(self, symbol, interval, limit, start_time=None):
+        params = {'limit': min(limit, REST_MAX_LIMIT)}
+        if start_time is not None:
+            params['startTime'] = start_time
+        rows = self.client.client.klines(symbol, interval, **params)
+        return [parse_rest_kline(r) for r in rows]
+
+    def _seed(self, symbol, interval, limit):
+        """初始化缓冲区（有本地K线仓库时只通过 REST 获取最新两根K线，其余从仓库读取），容量不足 limit 时扩容"""
+        bars = None
+        if self.warehouse is not None:
+            try:
+                history = self.warehouse.get_klines(symbol, interval, limit)
+                recent = self._fetch_rest(symbol, interval, 2)
+                if recent:
+                    bars = history.to_rows() if history is not None else []
+                    bars = [b for b in bars if b['open_time'] < recent[0]['open_time']] + recent
+                    bars = bars[-limit:]
+            except Exception as e:
+                logger.warning(f"从K线仓库初始化 {symbol} {interval} 失败，改用 REST: {e}")
+                bars = None
+        if bars is None:
+            bars = self._fetch_rest(symbol, interval, limit)
+        key = (symbol, interval)
+        with self._lock:
+            buffer = self._buffers.get(key)
+            if buffer is None or buffer.capacity < limit:
+                buffer = KlineRingBuffer(max(self.capacity, limit))
+                self._buffers[key] = buffer
+            buffer.clear()
+            buffer.extend(bars)
+            if len(bars) < limit:
+                self._complete.add(key)
+            else:
+                self._complete.discard(key)
+            self._updated_at[key] = time.time()
+            self.stats['rest_seeds'] += 1
+        logger.info(f"K线缓存初始化: {symbol} {interval} {len(bars)} 根")
+
+    def _backfill(self, symbol, interval, start_time):
+        """从 start_time 开始补齐缺失的K线"""
+        bars = self._fetch_rest(symbol, interval, REST_MAX_LIMIT, start_time=start_time)
+        with self._lock:
+            buffer = self._buffers.get((symbol, interval))
+            if buffer is None:
+                return
+            buffer.extend(bars)
+            self.stats['backfills'] += 1
+        logger.info(f"K线缓存补齐: {symbol} {interval} 从 {start_time} 起 {len(bars)} 根")
+
+    def _on_open(self, reconnected):
+        """断线重连后，断开期间的K线全部通过 REST 补齐"""
+        if not reconnected:
+            return
+        with self._lock:
+            pending = [(k, b.last_open_time) for k, b in self._buffers.items() if b.last_open_time is not None]
+        for (symbol, interval), last_open_time in pending:
+            try:
+                self._backfill(symbol, interval, last_open_time)
+                with self._lock:
+                    self._updated_at[(symbol, interval)] = time.time()
+            except Exception as e:
+                logger.error(f"重连后补齐 {symbol} {interval} K线失败: {e}")
+
+    def _evict_idle(self):
+        """取消订阅并释放长时间未被读取的标的"""
+        now = time.time()
+        if not self.idle_seconds or now - self._last_sweep < IDLE_SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        with self._lock:
+            idle = {name: key for name, key in self._streams.items()
+                    if key not in self._pinned and now - self._accessed_at.get(key, now) > self.idle_seconds}
+            for name, key in idle.items():
+                del self._streams[name]
+                for items in (self._buffers, self._updated_at, self._accessed_at, self._seed_locks):
+                    items.pop(key, None)
+                self._complete.discard(key)
+            self.stats['evictions'] += len(idle)
+        if idle:
+            self._connection.unsubscribe(list(idle))
+            logger.info(f"K线缓存取消空闲订阅: {len(idle)} 个 ({', '.join(sorted(n for n in idle)[:10])})")
+
+    def _on_message(self, stream, data):
+        self._evict_idle()
+        if not isinstance(data, dict) or data.get('e') not in ('kline', 'continuous_kline'):
+            return
+        key = self._streams.get(stream)
+        if key is None:
+            return
+        bar = parse_stream_kline(data['k'])
+        symbol, interval = key
+        with self._lock:
+            buffer = self._buffers.get(key)
+            if buffer is None:
+                return
+            last = buffer.last_open_time
+        # 新K线与缓存最后一根之间相隔超过一个周期，说明漏掉了推送，先补齐再写入
+        step = INTERVAL_MS.get(interval)
+        if last is not None and step and bar['open_time'] - last > step:
+            logger.warning(f"检测到K线缺口: {symbol} {interval} {last} -> {bar['open_time']}，开始补齐")
+            try:
+                self._backfill(symbol, interval, last)
+            except Exception as e:
+                logger.error(f"补齐 {symbol} {interval} K线失败: {e}")
+        with self._lock:
+            buffer.update(bar)
+            self._updated_at[key] = time.time()
+            self.stats['stream_updates'] += 1
+            listeners = list(self._close_listeners) if data['k'].get('x') else []
+        for callback in listeners:
+            try:
+                callback(symbol, interval, bar)
+            except Exception as e:
+                logger.error(f"K线收盘回调出错: {e}")
+
+
+_caches = ClientRegistry('K线缓存')
+
+
+def create_kline_cache(client, **kwargs):
+    """创建并启动K线缓存（不注册到 client，未指定 warehouse 时使用与 client 绑定的本地K线仓库）"""
+    if 'warehouse' not in kwargs:
+        # kline_warehouse 依赖本模块的常量，这里延迟导入
+        from kline_warehouse import get_kline_warehouse
+        kwargs['warehouse'] = get_kline_warehouse(client)
+    cache = KlineCache(client, **kwargs)
+    cache.start()
+    return cache
+
+
+def get_kline_cache(client, factory=None, **kwargs):
+    """
+    获取（必要时创建并启动）与 client 绑定的K线缓存，客户端不再使用时由 close_client 停止
+
+    factory 不为空时由 factory() 创建（如多策略运行时的共享代理），之后同一 client 的调用都返回该对象
+    """
+    return _caches.get(client, factory or (lambda: create_kline_cache(client, **kwargs)))
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+K线并发获取
+供生成的策略在 source_type 为 symbol_array 的 kline 模块中使用：
+按标的并发拉取K线，限制并发数，单个标的出错不影响其他标的（请求权重由共享的 rate_limiter 控制）；
+异步模式的策略使用 fetch_klines_async（在共享事件循环上并发，见 async_runtime）
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from async_runtime import map_limited, to_thread
+from kline_array import as_kline_array
+
+logger = logging.getLogger(__name__)
+
+# kline 模块未配置 max_concurrency 时的默认并发数
+DEFAULT_MAX_CONCURRENCY = 5
+
+
+def _fetcher(client, symbols, interval, limit, max_concurrency, end_time):
+    """
+    返回 (并发数, 获取单个标的K线的函数)
+
+    请求权重由客户端上安装的共享限流器统一控制（见 rate_limiter），这里只限制并发数
+    """
+    workers = max(1, min(int(max_concurrency or DEFAULT_MAX_CONCURRENCY), len(symbols)))
+
+    def fetch(symbol):
+        if end_time is not None:
+            return client.get_klines(symbol, interval, limit, end_time=end_time)
+        return client.get_klines(symbol, interval, limit)
+
+    return workers, fetch
+
+
+def fetch_klines_parallel(client, symbols, interval, limit, max_concurrency=DEFAULT_MAX_CONCURRENCY, end_time=None):
+    """
+    并发获取多个标的的K线
+
+    end_time 不为空时传给K线缓存，只取开盘时间早于 end_time 的K线；
+    返回 {symbol: KlineArray}，获取失败或无数据的标的值为 None
+    """
+    results = {symbol: None for symbol in symbols}
+    if not symbols:
+        return results
+
+    workers, fetch = _fetcher(client, symbols, interval, limit, max_concurrency, end_time)
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fetch, symbol): symbol for symbol in symbols}
+        for future in as_completed(futures):
+            symbol = futures[future]
+            try:
+                results[symbol] = as_kline_array(future.result())
+            except Exception as e:
+                logger.error(f"获取 {symbol} {interval}K线数据出错: {e}")
+
+    success = sum(1 for v in results.values() if v is not None and len(v) > 0)
+    logger.info(f"并发获取 {interval}K线完成: {success}/{len(symbols)} 个标的, "
+                f"并发数 {workers}, 耗时 {time.time() - start:.2f}s")
+    return results
+
+
+async def fetch_klines_async(client, symbols, interval, limit, max_concurrency=DEFAULT_MAX_CONCURRENCY, end_time=None):
+    """fetch_klines_parallel 的协程版本：请求在运行时的线程池中执行，等待期间事件循环可处理其他策略"""
+    results = {symbol: None for symbol in symbols}
+    if not symbols:
+        return results
+    workers, fetch = _fetcher(client, symbols, interval, limit, max_concurrency, end_time)
+
+    async def fetch_one(symbol):
+        return await to_thread(fetch, symbol)
+
+    start = time.time()
+    for symbol, result in zip(symbols, await map_limited(fetch_one, symbols, workers)):
+        if isinstance(result, Exception):
+            logger.error(f"获取 {symbol} {interval}K线数据出错: {result}")
+            continue
+        results[symbol] = as_kline_array(result)
+
+    success = sum(1 for v in results.values() if v is not None and len(v) > 0)
+    logger.info(f"并发获取 {interval}K线完成: {success}/{len(symbols)} 个标的, "
+                f"并发数 {workers}, 耗时 {time.time() - start:.2f}s（异步）")
+    return results
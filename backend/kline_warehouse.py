@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+"""
+本地历史K线仓库
+按 (symbol, interval) 分目录、按月分区，以列式二进制文件（每个字段一个 .bin）追加写入已收盘的K线，
+读取时通过 np.memmap 映射，不整体加载。index.json 记录每个分区的K线数量和已下载的时间范围（覆盖索引），
+同步时只下载覆盖索引之外的缺失区间，回测、K线缓存初始化等不再重复下载同一段K线。
+
+多个进程（Web 服务、各策略工作进程）共用同一个仓库目录：写入时持有目录下 .lock 文件的排他锁，
+并在锁内重新读取 index.json 再修改，读取时持有共享锁；索引文件被其他进程更新后自动重新加载。
+
+目录结构: data/klines/{interval}/{symbol}/{YYYY-MM}/{field}.bin
+"""
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import numpy as np
+
+from client_registry import ClientRegistry
+from kline_array import KlineArray
+from kline_cache import INTERVAL_MS, FLOAT_FIELDS, INT_FIELDS, REST_MAX_LIMIT, parse_rest_kline
+
+logger = logging.getLogger(__name__)
+
+# 仓库目录
+WAREHOUSE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'klines')
+
+FIELDS = INT_FIELDS + FLOAT_FIELDS
+
+
+def _dtype(field):
+    return np.int64 if field in INT_FIELDS else np.float64
+
+
+def _month(open_time):
+    return datetime.fromtimestamp(open_time / 1000, tz=timezone.utc).strftime('%Y-%m')
+
+
+def _merge_ranges(ranges):
+    """合并重叠或相邻的 [start, end) 区间"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def _missing_ranges(ranges, start, end):
+    """[start, end) 中未被 ranges 覆盖的区间"""
+    missing = []
+    cursor = start
+    for r_start, r_end in ranges:
+        if r_end <= cursor:
+            continue
+        if r_start >= end:
+            break
+        if r_start > cursor:
+            missing.append((cursor, r_start))
+        cursor = max(cursor, r_end)
+    if cursor < end:
+        missing.append((cursor, end))
+    return missing
+
+
+class FileLock:
+    """
+    跨进程文件锁（POSIX 使用 fcntl.flock，Windows 使用 msvcrt.locking，Windows 上共享锁同样为排他锁）
+
+    同一进程内的线程之间不互斥，需要与线程锁配合使用
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    @contextmanager
+    def hold(self, shared=False):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fh = open(self.path, 'a+b')
+        try:
+            self._lock(fh, shared)
+            try:
+                yield
+            finally:
+                self._unlock(fh)
+        finally:
+            fh.close()
+
+    if os.name == 'nt':
+        @staticmethod
+        def _lock(fh, shared):
+            import msvcrt
+            fh.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(fh.fileno(), msvcrt.LK_LOCK, 1)
+                    return
+                except OSError:
+                    # LK_LOCK 重试 10 秒后仍未获得锁，继续等待
+                    continue
+
+        @staticmethod
+        def _unlock(fh):
+            import msvcrt
+            fh.seek(0)
+            msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        @staticmethod
+        def _lock(fh, shared):
+            import fcntl
+            fcntl.flock(fh.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+
+        @staticmethod
+        def _unlock(fh):
+            import fcntl
+            fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+
+
+class KlineWarehouse:
+    """本地K线仓库（线程安全，多进程共用同一目录时通过文件锁协调）"""
+
+    def __init__(self, client=None, root=WAREHOUSE_DIR):
+        self.client = client
+        self.root = root
+        self.index_file = os.path.join(root, 'index.json')
+        self.stats = {'downloaded_bars': 0, 'requests': 0, 'served_bars': 0}
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(os.path.join(root, '.lock'))
+        self._index = {}
+        self._index_mtime = None
+        with self._lock, self._file_lock.hold(shared=True):
+            self._reload_index()
+
+    # ==================== 覆盖索引 ====================
+
+    @contextmanager
+    def _locked(self, shared=False):
+        """持有线程锁和文件锁，并确保内存中的索引与磁盘一致（写入时强制重新读取）"""
+        with self._lock, self._file_lock.hold(shared):
+            self._reload_index(force=not shared)
+            yield
+
+    def _reload_index(self, force=False):
+        """索引文件被其他进程更新过（或 force）时重新读取"""
+        try:
+            mtime = os.stat(self.index_file).st_mtime_ns
+        except FileNotFoundError:
+            self._index, self._index_mtime = {}, None
+            return
+        if not force and mtime == self._index_mtime:
+            return
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                self._index = json.load(f)
+        except Exception as e:
+            logger.error(f"读取K线仓库索引失败，重新建立: {e}")
+            self._index = {}
+        self._index_mtime = mtime
+
+    def _save_index(self):
+        """写入索引（需持有排他锁）"""
+        os.makedirs(self.root, exist_ok=True)
+        tmp_file = f'{self.index_file}.{os.getpid()}.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self._index, f)
+        os.replace(tmp_file, self.index_file)
+        self._index_mtime = os.stat(self.index_file).st_mtime_ns
+
+    def _entry(self, symbol, interval):
+        return self._index.setdefault(f'{interval}/{symbol}', {'ranges': [], 'partitions': {}})
+
+    def coverage(self, symbol=None, interval=None):
+        """
+        已下载的时间范围
+
+        不传参数时返回全部 {'interval/symbol': {'ranges': [[start, end)], 'bars': 数量}}
+        """
+        with self._locked(shared=True):
+            result = {}
+            for key, entry in self._index.items():
+                key_interval, key_symbol = key.split('/', 1)
+                if (symbol and key_symbol != symbol) or (interval and key_interval != interval):
+                    continue
+                result[key] = {'ranges': [list(r) for r in entry['ranges']],
+                               'bars': sum(entry['partitions'].values())}
+            return result
+
+    # ==================== 分区读写 ====================
+
+    def _partition_dir(self, symbol, interval, month):
+        return os.path.join(self.root, interval, symbol, month)
+
+    def _read_partition(self, symbol, interval, month, count):
+        """以只读 memmap 映射分区，只读取索引中记录的数量（忽略写入中断时多出的尾部数据）"""
+        path = self._partition_dir(symbol, interval, month)
+        return {f: np.memmap(os.path.join(path, f'{f}.bin'), dtype=_dtype(f), mode='r', shape=(count,))
+                for f in FIELDS}
+
+    def _write_partition(self, symbol, interval, month, bars):
+        """
+        把同一个月的K线写入分区：全部晚于已有数据时直接追加，否则合并后重写该分区（需持有排他锁，
+        追加前按索引中的数量截断，丢弃写入中断时多出的尾部数据）
+        """
+        entry = self._entry(symbol, interval)
+        count = entry['partitions'].get(month, 0)
+        path = self._partition_dir(symbol, interval, month)
+        os.makedirs(path, exist_ok=True)
+        columns = {f: np.array([b[f] for b in bars], dtype=_dtype(f)) for f in FIELDS}
+        if count:
+            existing = self._read_partition(symbol, interval, month, count)
+            last = int(existing['open_time'][-1])
+        if not count or columns['open_time'][0] > last:
+            for f in FIELDS:
+                file_path = os.path.join(path, f'{f}.bin')
+                with open(file_path, 'ab') as fh:
+                    fh.truncate(count * 8)
+                    fh.write(columns[f].tobytes())
+            entry['partitions'][month] = count + len(bars)
+            return
+        # 新数据在前，相同开盘时间保留新下载的数据（np.unique 返回首次出现的位置，结果按开盘时间排序）
+        merged = {f: np.concatenate([columns[f], np.asarray(existing[f])]) for f in FIELDS}
+        _, keep = np.unique(merged['open_time'], return_index=True)
+        del existing
+        tmp_path = path + '.tmp'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for f in FIELDS:
+            merged[f][keep].tofile(os.path.join(tmp_path, f'{f}.bin'))
+        shutil.rmtree(path)
+        os.replace(tmp_path, path)
+        entry['partitions'][month] = len(keep)
+
+    def write(self, symbol, interval, bars, covered=None):
+        """
+        写入已收盘的K线（字典列表，按开盘时间升序），covered 为本次下载确认过的时间范围 (start, end)
+        """
+        with self._locked():
+            groups = {}
+            for bar in bars:
+                groups.setdefault(_month(bar['open_time']), []).append(bar)
+            for month, month_bars in sorted(groups.items()):
+                self._write_partition(symbol, interval, month, month_bars)
+            if covered:
+                entry = self._entry(symbol, interval)
+                entry['ranges'] = _merge_ranges(entry['ranges'] + [list(covered)])
+            self._save_index()
+
+    def read(self, symbol, interval, start_time=None, end_time=None):
+        """
+        读取 [start_time, end_time) 内的K线，返回 KlineArray（跨分区时拼接，单个分区时为 memmap 视图）；无数据时返回 None
+        """
+        with self._locked(shared=True):
+            entry = self._index.get(f'{interval}/{symbol}')
+            if not entry:
+                return None
+            first_month = _month(start_time) if start_time is not None else ''
+            last_month = _month(end_time - 1) if end_time is not None else '9999'
+            parts = []
+            for month in sorted(entry['partitions']):
+                count = entry['partitions'][month]
+                if not count or month < first_month or month > last_month:
+                    continue
+                columns = self._read_partition(symbol, interval, month, count)
+                open_time = columns['open_time']
+                lo = np.searchsorted(open_time, start_time) if start_time is not None else 0
+                hi = np.searchsorted(open_time, end_time) if end_time is not None else count
+                if hi > lo:
+                    parts.append({f: values[lo:hi] for f, values in columns.items()})
+        if not parts:
+            return None
+        if len(parts) == 1:
+            columns = parts[0]
+        else:
+            columns = {f: np.concatenate([p[f] for p in parts]) for f in FIELDS}
+        klines = KlineArray(columns)
+        self.stats['served_bars'] += len(klines)
+        return klines
+
+    # ==================== 增量同步 ====================
+
+    def sync(self, symbol, interval, start_time, end_time=None):
+        """下载 [start_time, end_time) 中尚未覆盖的区间（只保存已收盘的K线），返回新下载的K线数量"""
+        step = INTERVAL_MS[interval]
+        # 只同步已收盘的K线
+        last_closed = (int(time.time() * 1000) // step) * step
+        end_time = min(end_time if end_time is not None else last_closed, last_closed)
+        start_time = (start_time // step) * step
+        if start_time >= end_time:
+            return 0
+        with self._locked(shared=True):
+            entry = self._index.get(f'{interval}/{symbol}') or {'ranges': []}
+            ranges = [tuple(r) for r in entry['ranges']]
+        downloaded = 0
+        for gap_start, gap_end in _missing_ranges(ranges, start_time, end_time):
+            cursor = gap_start
+            while cursor < gap_end:
+                rows = self.client.client.klines(symbol, interval, startTime=cursor, endTime=gap_end - 1,
+                                                 limit=REST_MAX_LIMIT)
+                self.stats['requests'] += 1
+                bars = [b for b in (parse_rest_kline(r) for r in rows) if b['open_time'] < gap_end]
+                covered_end = gap_end if len(rows) < REST_MAX_LIMIT else bars[-1]['open_time'] + step
+                self.write(symbol, interval, bars, covered=(cursor, covered_end))
+                downloaded += len(bars)
+                cursor = covered_end
+        if downloaded:
+            self.stats['downloaded_bars'] += downloaded
+            logger.info(f"K线仓库同步: {symbol} {interval} 新下载 {downloaded} 根")
+        return downloaded
+
+    def load(self, symbol, interval, start_time, end_time=None):
+        """同步缺失区间后读取 [start_time, end_time) 的已收盘K线"""
+        self.sync(symbol, interval, start_time, end_time)
+        return self.read(symbol, interval, start_time, end_time)
+
+    def get_klines(self, symbol, interval, limit=500):
+        """最近 limit 根已收盘的K线（与 get_klines 相比不含当前未收盘的K线）"""
+        step = INTERVAL_MS[interval]
+        end_time = (int(time.time() * 1000) // step) * step
+        return self.load(symbol, interval, end_time - limit * step, end_time)
+
+
+_warehouses = ClientRegistry('K线仓库')
+
+
+def get_kline_warehouse(client, **kwargs):
+    """获取与 client 绑定的K线仓库"""
+    return _warehouses.get(client, lambda: KlineWarehouse(client, **kwargs))
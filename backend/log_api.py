@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+日志接口
+/api/logs 从日志管道的内存缓冲区读取，支持 after 游标增量读取（不传 after 且缓冲区不足时从日志文件补足）；
+原有的逐条 log 事件改由日志管道推送，socket 事件 log_subscribe {after} 改为订阅分批推送的 log_batch 事件
+（每批需确认，见 log_pipeline）。接口和订阅都需要登录
+"""
+from flask import jsonify, request
+
+from api_extensions import guard_route, login_checker, login_required, override_route
+from log_pipeline import DEFAULT_CAPACITY, format_entry, get_log_pipeline
+
+# 未传 after 时返回的最近日志条数（与页面保留的条数一致）
+DEFAULT_TAIL = 1000
+
+# 单次返回的最大条数（与缓冲区容量一致）
+MAX_LIMIT = DEFAULT_CAPACITY
+
+
+def get_logs():
+    """
+    日志
+
+    不传 after 时返回最近的日志行（原有格式，字符串列表）：缓冲区只有本次启动（或清空）之后的日志，
+    不足 limit 条时改为读取日志文件 data/logs/app.log（含轮转的旧文件）末尾；
+    传 after=<cursor> 时返回之后的日志记录 {id, timestamp, level, name, message}、新游标和被覆盖的条数
+    """
+    pipeline = get_log_pipeline()
+    ring = pipeline.ring
+    try:
+        limit = int(request.args.get('limit', DEFAULT_TAIL))
+        after = request.args.get('after')
+        after = int(after) if after not in (None, '') else None
+    except ValueError:
+        return jsonify({'success': False, 'error': 'after / limit 必须为整数'}), 400
+    limit = max(1, min(limit, MAX_LIMIT))
+    if after is None:
+        cursor = ring.last_id
+        logs = [format_entry(e) for e in ring.tail(limit)]
+        if len(logs) < limit:
+            lines = pipeline.tail_file(limit)
+            if len(lines) > len(logs):
+                logs = lines
+        return jsonify({'success': True, 'logs': logs, 'cursor': cursor})
+    entries, cursor, dropped = ring.after(after, limit)
+    return jsonify({'success': True, 'logs': entries, 'cursor': cursor, 'dropped': dropped})
+
+
+def clear_logs():
+    """清空内存中的日志，之后继续交给原接口清空日志文件"""
+    get_log_pipeline().ring.clear()
+    return None
+
+
+def register_log_routes(app, socketio=None):
+    pipeline = get_log_pipeline()
+    # 替换处理函数后原接口的登录校验不再执行；清空缓冲区也要在登录校验之后
+    auth = login_required(app)
+    override_route(app, '/api/logs', ['GET'], auth(get_logs))
+    guard_route(app, '/api/logs', ['DELETE'], auth(clear_logs))
+    if socketio is None:
+        return
+    pipeline.attach(socketio)
+    authenticated = login_checker(app)
+
+    def on_subscribe(data=None):
+        if not authenticated():
+            socketio.emit('log_batch', {'success': False, 'error': '未登录'}, to=request.sid)
+            return
+        try:
+            after = (data or {}).get('after')
+            after = int(after) if after not in (None, '') else None
+        except (AttributeError, TypeError, ValueError):
+            after = None
+        pipeline.subscribe(request.sid, after)
+
+    def on_unsubscribe(data=None):
+        pipeline.unsubscribe(request.sid)
+
+    socketio.on_event('log_subscribe', on_subscribe)
+    socketio.on_event('log_unsubscribe', on_unsubscribe)
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""
+日志管道
+所有日志先写入定长的内存环形缓冲区（写入只在锁内追加一条记录，不做任何 I/O，策略线程不会被前端拖慢），
+之后由后台线程统一处理:
+- 按轮转文件写入 data/logs/app.log（单个文件上限和保留个数可配置）
+- 接管原有的 log 事件（见 attach）：原应用逐条 emit('log') 的调用被忽略，改由后台线程按顺序逐条推送，
+  只监听 log 事件的页面每条日志仍收到一条消息，但推送不再发生在写日志的线程中
+- 每 100ms 把新日志合并为一条 log_batch 消息推送给通过 log_subscribe 订阅的客户端（这些客户端不再收到逐条的 log）；
+  每个客户端确认上一批后才发送下一批，慢客户端只会落后（超出缓冲区的部分计入 dropped），不会阻塞其他客户端
+- /api/logs?after=<cursor> 按游标增量读取，不再整体读取日志文件；不传 after 且缓冲区不足时从日志文件末尾补足
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from logging.handlers import RotatingFileHandler
+
+logger = logging.getLogger(__name__)
+
+LOG_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'logs')
+LOG_FILE = os.path.join(LOG_DIR, 'app.log')
+
+# 与前端解析格式一致: "2025-11-19 15:37:50 - INFO - 消息"
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# 内存中保留的日志条数
+DEFAULT_CAPACITY = 5000
+
+# 推送间隔（秒）和单批最多条数
+DEFAULT_FLUSH_INTERVAL = 0.1
+DEFAULT_BATCH_SIZE = 500
+
+# 客户端超过该时间未确认时取消订阅（已断开）
+DEFAULT_ACK_TIMEOUT = 30
+
+# 轮转文件大小和保留个数
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_BACKUP_COUNT = 5
+
+
+# 从文件末尾向前读取的块大小
+TAIL_BLOCK_SIZE = 64 * 1024
+
+
+def tail_lines(path, count, block_size=TAIL_BLOCK_SIZE):
+    """文件最后 count 行（从末尾按块向前读取，不读取整个文件），文件不存在时返回空列表"""
+    if count <= 0:
+        return []
+    try:
+        with open(path, 'rb') as f:
+            pos = f.seek(0, os.SEEK_END)
+            data = b''
+            while pos > 0 and data.count(b'\n') <= count:
+                step = min(block_size, pos)
+                pos -= step
+                f.seek(pos)
+                data = f.read(step) + data
+    except OSError:
+        return []
+    return data.decode('utf-8', errors='replace').splitlines()[-count:]
+
+
+class LogRing:
+    """
+    带游标的日志环形缓冲区
+
+    每条日志有递增的 id，after(cursor) 返回 id 大于 cursor 的日志；被覆盖的日志条数计入 dropped
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self._entries = deque(maxlen=capacity)
+        self._next_id = 1
+        self._lock = threading.Lock()
+        self.new_entries = threading.Event()
+
+    @property
+    def last_id(self):
+        return self._next_id - 1
+
+    def append(self, entry):
+        with self._lock:
+            entry['id'] = self._next_id
+            self._next_id += 1
+            self._entries.append(entry)
+        self.new_entries.set()
+
+    def after(self, cursor=0, limit=None):
+        """返回 (日志列表, 新游标, 被覆盖而丢失的条数)"""
+        with self._lock:
+            if not self._entries:
+                return [], max(cursor, self.last_id), 0
+            first_id = self._entries[0]['id']
+            start = max(0, cursor + 1 - first_id)
+            dropped = max(0, first_id - cursor - 1)
+            end = len(self._entries) if limit is None else min(len(self._entries), start + limit)
+            entries = [self._entries[i] for i in range(start, end)]
+        return entries, (entries[-1]['id'] if entries else max(cursor, first_id - 1)), dropped
+
+    def tail(self, limit):
+        with self._lock:
+            return list(self._entries)[-limit:] if limit else list(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RingLogHandler(logging.Handler):
+    """写入环形缓冲区的日志处理器（只做格式化和追加）"""
+
+    def __init__(self, ring):
+        super().__init__()
+        self.ring = ring
+        self.setFormatter(logging.Formatter(LOG_FORMAT, DATE_FORMAT))
+
+    def emit(self, record):
+        try:
+            message = record.getMessage()
+            if record.exc_info:
+                message += '\n' + self.formatter.formatException(record.exc_info)
+            self.ring.append({
+                'timestamp': self.formatter.formatTime(record, DATE_FORMAT),
+                'level': record.levelname,
+                'name': record.name,
+                'message': message,
+            })
+        except Exception:
+            self.handleError(record)
+
+
+def format_entry(entry):
+    """转换为日志文件中的一行（/api/logs 原有返回格式）"""
+    return f"{entry['timestamp']} - {entry['level']} - {entry['message']}"
+
+
+class LogPipeline:
+    """环形缓冲区 + 后台写文件 + 分批推送"""
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, log_file=LOG_FILE, max_bytes=DEFAULT_MAX_BYTES,
+                 backup_count=DEFAULT_BACKUP_COUNT, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 batch_size=DEFAULT_BATCH_SIZE, ack_timeout=DEFAULT_ACK_TIMEOUT):
+        self.ring = LogRing(capacity)
+        self.handler = RingLogHandler(self.ring)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.ack_timeout = ack_timeout
+        self.socketio = None
+        self._emit = None
+        self._broadcast_cursor = 0
+        self.stats = {'batches': 0, 'entries_sent': 0, 'dropped': 0, 'broadcast': 0}
+        self._file_handler = None
+        if log_file:
+            os.makedirs(os.path.dirname(log_file), exist_ok=True)
+            self._file_handler = RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count,
+                                                     encoding='utf-8', delay=True)
+            self._file_handler.setFormatter(logging.Formatter('%(message)s'))
+        self._file_cursor = 0
+        self._file_lock = threading.Lock()
+        self._clients = {}   # {sid: {'cursor', 'sent_at'（未确认批次的发送时间）}}
+        self._clients_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # ==================== 启停 ====================
+
+    def install(self, root=None):
+        """把处理器挂到根日志上"""
+        root = root or logging.getLogger()
+        if self.handler not in root.handlers:
+            root.addHandler(self.handler)
+        if root.level > logging.INFO or root.level == logging.NOTSET:
+            root.setLevel(logging.INFO)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._file_cursor = self.ring.last_id
+        self._thread = threading.Thread(target=self._run, name='log-pipeline', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self.ring.new_entries.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self._flush_file()
+
+    def attach(self, socketio):
+        """
+        接管 socketio 的 log 事件
+
+        之后其他地方（原应用的日志处理器）对 log 事件的 emit 直接忽略：同一条日志已由 RingLogHandler 写入缓冲区，
+        由后台线程逐条推送给未订阅 log_subscribe 的客户端
+        """
+        self.socketio = socketio
+        self._broadcast_cursor = self.ring.last_id
+        emit = getattr(socketio.emit, '_log_pipeline_emit', socketio.emit)
+        self._emit = emit
+
+        def guarded_emit(event, *args, **kwargs):
+            if event == 'log':
+                return None
+            return emit(event, *args, **kwargs)
+
+        guarded_emit._log_pipeline_emit = emit
+        socketio.emit = guarded_emit
+
+    # ==================== 订阅 ====================
+
+    def subscribe(self, sid, after=None):
+        """客户端订阅（after 为已收到的最后一条日志 id，默认只推送之后的新日志）"""
+        with self._clients_lock:
+            self._clients[sid] = {'cursor': self.ring.last_id if after is None else int(after), 'sent_at': None}
+
+    def unsubscribe(self, sid):
+        with self._clients_lock:
+            self._clients.pop(sid, None)
+
+    def _ack(self, sid, cursor):
+        with self._clients_lock:
+            client = self._clients.get(sid)
+            if client is not None:
+                client['cursor'] = max(client['cursor'], cursor)
+                client['sent_at'] = None
+        self.ring.new_entries.set()
+
+    # ==================== 后台处理 ====================
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.ring.new_entries.wait(1)
+            self.ring.new_entries.clear()
+            try:
+                self._flush_file()
+                self._flush_clients()
+            except Exception as e:
+                # 不能用 logger 记录，避免循环
+                sys.stderr.write(f"日志管道处理出错: {e}\n")
+            self._stop.wait(self.flush_interval)
+
+    def _flush_file(self):
+        if self._file_handler is None:
+            return
+        with self._file_lock:
+            entries, self._file_cursor, dropped = self.ring.after(self._file_cursor)
+            if not entries and not dropped:
+                return
+            lines = [f"... 日志写入过慢，跳过 {dropped} 条"] if dropped else []
+            lines.extend(format_entry(entry) for entry in entries)
+            for line in lines:
+                # 由 RotatingFileHandler 负责按大小轮转
+                self._file_handler.handle(logging.makeLogRecord({'msg': line, 'levelno': logging.INFO}))
+
+    def tail_file(self, limit):
+        """
+        日志文件最后 limit 行（app.log 不足时继续读取轮转的 app.log.1、app.log.2 ...）
+
+        先把缓冲区中尚未写入的日志写入文件，返回结果包含缓冲区中的日志
+        """
+        if self._file_handler is None:
+            return []
+        self._flush_file()
+        base = self._file_handler.baseFilename
+        lines = []
+        for i in range(self._file_handler.backupCount + 1):
+            if len(lines) >= limit:
+                break
+            lines = tail_lines(f'{base}.{i}' if i else base, limit - len(lines)) + lines
+        return lines
+
+    def _flush_clients(self):
+        if self.socketio is None:
+            return
+        now = time.time()
+        with self._clients_lock:
+            clients = list(self._clients.items())
+        self._flush_broadcast([sid for sid, _ in clients])
+        for sid, client in clients:
+            if client['sent_at'] is not None:
+                # 上一批尚未确认：慢客户端只会落后，不会阻塞；长时间未确认视为已断开
+                if now - client['sent_at'] > self.ack_timeout:
+                    self.unsubscribe(sid)
+                continue
+            entries, cursor, dropped = self.ring.after(client['cursor'], self.batch_size)
+            if not entries and not dropped:
+                continue
+            with self._clients_lock:
+                client['sent_at'] = now
+            payload = {'entries': entries, 'cursor': cursor, 'dropped': dropped}
+            self._emit('log_batch', payload, to=sid, callback=lambda *args, _sid=sid, _c=cursor: self._ack(_sid, _c))
+            self.stats['batches'] += 1
+            self.stats['entries_sent'] += len(entries)
+            self.stats['dropped'] += dropped
+
+    def _flush_broadcast(self, subscribed):
+        """按顺序逐条推送 log 事件（原有格式），已订阅分批推送的客户端除外"""
+        entries, self._broadcast_cursor, dropped = self.ring.after(self._broadcast_cursor, self.batch_size)
+        if dropped:
+            entries = [{'id': None, 'timestamp': time.strftime(DATE_FORMAT), 'level': 'WARNING',
+                        'message': f"... 日志推送过慢，跳过 {dropped} 条"}] + entries
+        for entry in entries:
+            self._emit('log', {'id': entry['id'], 'timestamp': entry['timestamp'], 'level': entry['level'],
+                               'message': entry['message']}, skip_sid=subscribed or None)
+        self.stats['broadcast'] += len(entries)
+        if len(entries) >= self.batch_size:
+            # 还有未推送的日志，不等待新日志继续处理
+            self.ring.new_entries.set()
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def get_log_pipeline(**kwargs):
+    """全局日志管道（首次调用时创建、挂到根日志并启动）"""
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = LogPipeline(**kwargs)
+            _pipeline.install()
+            _pipeline.start()
+        return _pipeline
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+公开行情客户端
+只访问无需签名的行情接口（K线、ticker、exchangeInfo），用于回测、参数优化等不依赖交易账户的场景；
+与 BinanceClient 一样通过 .client 调用 UMFutures，可直接传给K线仓库等模块
+"""
+import threading
+
+from binance.um_futures import UMFutures
+
+
+class MarketDataClient:
+    """无需 API Key 的合约行情客户端"""
+
+    def __init__(self, base_url=None, timeout=10):
+        kwargs = {'timeout': timeout}
+        if base_url:
+            kwargs['base_url'] = base_url
+        self.client = UMFutures(**kwargs)
+
+    def top_symbols(self, limit=100, quote_asset='USDT'):
+        """按 24h 成交额排序的永续合约交易对"""
+        tickers = [t for t in self.client.ticker_24hr_price_change() if t['symbol'].endswith(quote_asset)]
+        tickers.sort(key=lambda t: float(t.get('quoteVolume', 0)), reverse=True)
+        return [t['symbol'] for t in tickers[:limit]]
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_market_client():
+    """全局公开行情客户端"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = MarketDataClient()
+        return _client
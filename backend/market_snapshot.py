@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+全市场行情快照
+一次请求拉取所有交易对的最新价和买一卖一价，或通过 !miniTicker@arr / !bookTicker 推送实时更新，
+下单时直接读取快照，不再逐个标的调用 ticker_price
+"""
+import logging
+import threading
+import time
+
+from client_registry import ClientRegistry
+from ws_stream import StreamConnection, FUTURES_STREAM_URL
+
+logger = logging.getLogger(__name__)
+
+# 快照默认有效期（秒）
+DEFAULT_MAX_AGE = 5
+
+
+class MarketSnapshot:
+    """全市场最新价 / 盘口快照"""
+
+    def __init__(self, client, max_age=DEFAULT_MAX_AGE, stream_url=FUTURES_STREAM_URL, book_stream=False):
+        self.client = client
+        self.max_age = max_age
+        self.book_stream = book_stream
+        self.stats = {'hits': 0, 'refreshes': 0}
+        self._prices = {}   # {symbol: (price, 更新时间)}
+        self._books = {}    # {symbol: (bid, ask, 更新时间)}
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._refreshed_at = 0
+        self._connection = StreamConnection(stream_url, on_message=self._on_message, name='ticker')
+
+    def start(self):
+        """开启推送（全市场精简 ticker，可选全市场最优挂单）"""
+        streams = ['!miniTicker@arr']
+        if self.book_stream:
+            streams.append('!bookTicker')
+        self._connection.subscribe(streams)
+        self._connection.start()
+
+    def stop(self):
+        self._connection.stop()
+
+    def refresh(self, min_age=0):
+        """
+        一次性拉取全市场最新价和最优挂单（各一次请求）
+
+        min_age 大于 0 时，等待刷新锁期间已被其他线程刷新过（距今不足 min_age 秒）则不再请求，
+        多个策略同时发现快照过期时只刷新一次
+        """
+        with self._refresh_lock:
+            now = time.time()
+            if min_age and now - self._refreshed_at < min_age:
+                return
+            prices = self.client.client.ticker_price()
+            books = self.client.client.book_ticker()
+            with self._lock:
+                for item in prices:
+                    self._prices[item['symbol']] = (float(item['price']), now)
+                for item in books:
+                    bid, ask = float(item['bidPrice']), float(item['askPrice'])
+                    self._books[item['symbol']] = (bid, ask, now)
+            self.stats['refreshes'] += 1
+            self._refreshed_at = now
+            logger.info(f"刷新行情快照: {len(prices)} 个交易对, 耗时 {time.time() - now:.2f}s")
+
+    def update_from_tickers(self, tickers):
+        """用已获取的 24h ticker 数据更新最新价（如涨幅榜数据），无需额外请求"""
+        now = time.time()
+        with self._lock:
+            for item in tickers:
+                price = item.get('lastPrice', item.get('price'))
+                if price is not None:
+                    self._prices[item['symbol']] = (float(price), now)
+
+    def price(self, symbol):
+        """最新价，快照过期或缺失时整体刷新一次"""
+        with self._lock:
+            item = self._prices.get(symbol)
+        if item is None or time.time() - item[1] > self.max_age:
+            self.refresh(min_age=self.max_age)
+            with self._lock:
+                item = self._prices.get(symbol)
+            if item is None:
+                raise KeyError(f"行情快照中没有 {symbol}")
+        else:
+            self.stats['hits'] += 1
+        return item[0]
+
+    def book(self, symbol):
+        """买一卖一价 (bid, ask)，快照过期或缺失时整体刷新一次"""
+        with self._lock:
+            item = self._books.get(symbol)
+        if item is None or time.time() - item[2] > self.max_age:
+            self.refresh(min_age=self.max_age)
+            with self._lock:
+                item = self._books.get(symbol)
+            if item is None:
+                raise KeyError(f"行情快照中没有 {symbol}")
+        return item[0], item[1]
+
+    def _on_message(self, stream, data):
+        now = time.time()
+        if isinstance(data, list):
+            # !miniTicker@arr
+            with self._lock:
+                for item in data:
+                    self._prices[item['s']] = (float(item['c']), now)
+        elif isinstance(data, dict) and data.get('e') == 'bookTicker':
+            with self._lock:
+                self._books[data['s']] = (float(data['b']), float(data['a']), now)
+
+
+_snapshots = ClientRegistry('行情快照')
+
+
+def get_market_snapshot(client, **kwargs):
+    """获取（必要时创建并启动推送）与 client 绑定的行情快照"""
+    def create():
+        snapshot = MarketSnapshot(client, **kwargs)
+        snapshot.start()
+        return snapshot
+
+    return _snapshots.get(client, create)
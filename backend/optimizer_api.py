@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+参数优化接口
+POST   /api/optimize            提交参数优化任务（后台执行）
+GET    /api/optimize/<job_id>   查询任务状态和排序后的结果
+DELETE /api/optimize/<job_id>   取消任务
+
+接口需要登录；每个任务会启动与 CPU 核数相同的回测进程，同一时间只运行一个任务，
+已有任务未结束时提交新任务返回 409。进度通过 socketio 事件 optimize_progress 推送
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from flask import jsonify, request
+
+from api_extensions import login_required
+from backtest_engine import history_requirements, load_history
+from market_client import get_market_client
+from param_optimizer import ParameterOptimizer
+
+logger = logging.getLogger(__name__)
+
+STRATEGY_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'current_strategy.json')
+
+# 默认回测标的数量（按 24h 成交额）
+DEFAULT_UNIVERSE_SIZE = 100
+
+# 未结束的任务状态（取消后仍需等待回测进程退出）
+ACTIVE_STATUSES = ('loading', 'running')
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+_socketio = None
+
+
+def _parse_time(value):
+    """'2025-01-01' / '2025-01-01T08:00' / 毫秒时间戳 -> 毫秒时间戳"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    return int(datetime.fromisoformat(value).timestamp() * 1000)
+
+
+class OptimizeJob:
+    """一个后台参数优化任务"""
+
+    def __init__(self, params):
+        self.id = uuid.uuid4().hex[:12]
+        self.params = params
+        self.status = 'loading'
+        self.done = 0
+        self.total = 0
+        self.results = []
+        self.error = None
+        self.created_at = time.time()
+        self.optimizer = None
+        self._cancelled = False
+
+    def to_dict(self, limit=50):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'done': self.done,
+            'total': self.total,
+            'error': self.error,
+            'results': self.results[:limit],
+        }
+
+    def cancel(self):
+        self._cancelled = True
+        if self.optimizer:
+            self.optimizer.cancel()
+
+    def run(self):
+        try:
+            params = self.params
+            modules = params.get('modules')
+            if modules is None:
+                with open(STRATEGY_FILE, 'r', encoding='utf-8') as f:
+                    modules = json.load(f)['modules']
+            start_time, end_time = _parse_time(params.get('start')), _parse_time(params.get('end'))
+            if start_time is None:
+                raise ValueError("缺少回测开始时间 start")
+            end_time = end_time or int(time.time() * 1000)
+
+            # 按模块配置确定需要加载的周期和标的
+            base_interval, custom_klines = history_requirements(modules)
+            client = get_market_client()
+            symbols = params.get('symbols') or client.top_symbols(int(params.get('universe_size', DEFAULT_UNIVERSE_SIZE)))
+            history = {base_interval: load_history(client, symbols, base_interval, start_time, end_time)}
+            for symbol, interval in custom_klines:
+                history.setdefault(interval, {}).update(load_history(client, [symbol], interval, start_time, end_time))
+            if self._cancelled:
+                self.status = 'cancelled'
+                return
+
+            self.optimizer = ParameterOptimizer(
+                modules, history, params.get('space', {}), mode=params.get('mode', 'grid'),
+                samples=int(params.get('samples', 50)), seed=params.get('seed'),
+                sort_by=params.get('sort_by', 'sharpe'), max_workers=params.get('max_workers'),
+                initial_balance=float(params.get('initial_balance', 1000)),
+            )
+            self.total = self.optimizer.total
+            self.status = 'running'
+            self.results = self.optimizer.run(progress=self._on_progress)
+            self.status = 'cancelled' if self._cancelled else 'finished'
+        except Exception as e:
+            logger.error(f"参数优化任务 {self.id} 失败: {e}", exc_info=True)
+            self.status = 'failed'
+            self.error = str(e)
+        self._emit(None)
+
+    def _on_progress(self, done, total, result):
+        self.done = done
+        self.results = self.optimizer.rank()
+        self._emit(result)
+
+    def _emit(self, result):
+        if _socketio is None:
+            return
+        _socketio.emit('optimize_progress', {
+            'job_id': self.id,
+            'status': self.status,
+            'done': self.done,
+            'total': self.total,
+            'result': result,
+            'best': self.results[0] if self.results else None,
+            'error': self.error,
+        })
+
+
+def start_optimize():
+    """提交参数优化任务"""
+    params = request.get_json(silent=True) or {}
+    if not params.get('space'):
+        return jsonify({'success': False, 'error': '缺少参数空间 space'}), 400
+    job = OptimizeJob(params)
+    with _jobs_lock:
+        active = next((j for j in _jobs.values() if j.status in ACTIVE_STATUSES), None)
+        if active is not None:
+            return jsonify({'success': False, 'error': f'已有参数优化任务 {active.id} 正在运行',
+                            'job_id': active.id}), 409
+        _jobs[job.id] = job
+    threading.Thread(target=job.run, name=f'optimize-{job.id}', daemon=True).start()
+    return jsonify({'success': True, 'job_id': job.id})
+
+
+def get_optimize(job_id):
+    """查询参数优化任务"""
+    job = _jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': '任务不存在'}), 404
+    limit = request.args.get('limit', 50, type=int)
+    return jsonify({'success': True, **job.to_dict(limit)})
+
+
+def cancel_optimize(job_id):
+    """取消参数优化任务"""
+    job = _jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': '任务不存在'}), 404
+    job.cancel()
+    return jsonify({'success': True})
+
+
+def register_optimizer_routes(app, socketio=None):
+    global _socketio
+    _socketio = socketio
+    auth = login_required(app)
+    app.add_url_rule('/api/optimize', endpoint='ext_start_optimize', view_func=auth(start_optimize), methods=['POST'])
+    app.add_url_rule('/api/optimize/<job_id>', endpoint='ext_get_optimize', view_func=auth(get_optimize),
+                     methods=['GET'])
+    app.add_url_rule('/api/optimize/<job_id>', endpoint='ext_cancel_optimize', view_func=auth(cancel_optimize),
+                     methods=['DELETE'])
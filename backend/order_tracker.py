@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+订单生命周期跟踪
+订阅合约用户数据流（ORDER_TRADE_UPDATE / ACCOUNT_UPDATE），记录订单状态和持仓变化，
+下单流程中用 wait_for_orders / wait_for_positions 代替固定的 time.sleep：成交确认后立即继续，超时作为兜底。
+用户数据流未连接时回退为 REST 轮询
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from client_registry import ClientRegistry
+from ws_stream import StreamConnection, FUTURES_STREAM_URL
+
+logger = logging.getLogger(__name__)
+
+# listenKey 有效期 60 分钟，每 30 分钟续期一次
+KEEPALIVE_INTERVAL = 1800
+
+# 订单终态
+FINAL_STATUSES = ('FILLED', 'CANCELED', 'EXPIRED', 'REJECTED', 'EXPIRED_IN_MATCH')
+
+# REST 轮询间隔（秒）
+POLL_INTERVAL = 0.5
+
+# 保留的订单状态：终态订单保留 10 分钟（足够下单流程确认），总数超过上限时丢弃最早的
+ORDER_RETENTION = 600
+MAX_ORDERS = 5000
+
+
+def parse_order_update(o):
+    """解析 ORDER_TRADE_UPDATE 中的订单字段"""
+    return {
+        'symbol': o['s'],
+        'order_id': o['i'],
+        'client_order_id': o.get('c', ''),
+        'side': o.get('S'),
+        'position_side': o.get('ps', 'BOTH'),
+        'type': o.get('o'),
+        'status': o['X'],
+        'avg_price': float(o.get('ap', 0) or 0),
+        'filled_qty': float(o.get('z', 0) or 0),
+        'orig_qty': float(o.get('q', 0) or 0),
+    }
+
+
+def parse_rest_order(o):
+    """解析 REST 查询订单返回的字段"""
+    return {
+        'symbol': o['symbol'],
+        'order_id': o['orderId'],
+        'client_order_id': o.get('clientOrderId', ''),
+        'side': o.get('side'),
+        'position_side': o.get('positionSide', 'BOTH'),
+        'type': o.get('type'),
+        'status': o['status'],
+        'avg_price': float(o.get('avgPrice', 0) or 0),
+        'filled_qty': float(o.get('executedQty', 0) or 0),
+        'orig_qty': float(o.get('origQty', 0) or 0),
+    }
+
+
+class OrderTracker:
+    """基于用户数据流的订单 / 持仓状态跟踪"""
+
+    def __init__(self, client, stream_url=FUTURES_STREAM_URL, keepalive_interval=KEEPALIVE_INTERVAL,
+                 order_retention=ORDER_RETENTION, max_orders=MAX_ORDERS):
+        self.client = client
+        self.stream_url = stream_url
+        self.keepalive_interval = keepalive_interval
+        self.order_retention = order_retention
+        self.max_orders = max_orders
+        self.orders = OrderedDict()   # {order_id: 订单状态}，按最近更新排序
+        self.positions = {}   # {(symbol, position_side): {'amount', 'entry_price', 'time'}}
+        self.listen_key = None
+        self._connection = None
+        self._cond = threading.Condition()
+        self._timer = None
+        self._listeners = []
+
+    @property
+    def connected(self):
+        return self._connection is not None and self._connection.connected
+
+    def add_listener(self, callback):
+        """注册事件回调 callback(event_type, data)，用于推送持仓变化等"""
+        self._listeners.append(callback)
+
+    def start(self):
+        """创建 listenKey 并连接用户数据流"""
+        self.listen_key = self.client.client.new_listen_key()['listenKey']
+        self._connection = StreamConnection(self.stream_url, path=f'/ws/{self.listen_key}',
+                                            on_message=self._on_message, name='user-data')
+        self._connection.start()
+        self._schedule_keepalive()
+
+    def stop(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        if self._connection:
+            self._connection.stop()
+            self._connection = None
+
+    def _schedule_keepalive(self):
+        self._timer = threading.Timer(self.keepalive_interval, self._keepalive)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _keepalive(self):
+        try:
+            self.client.client.renew_listen_key(self.listen_key)
+        except Exception as e:
+            logger.warning(f"listenKey 续期失败，重新创建: {e}")
+            self._restart()
+            return
+        self._schedule_keepalive()
+
+    def _restart(self):
+        self.stop()
+        try:
+            self.start()
+        except Exception as e:
+            logger.error(f"重新连接用户数据流失败: {e}")
+
+    def _on_message(self, stream, data):
+        event = data.get('e') if isinstance(data, dict) else None
+        if event == 'ORDER_TRADE_UPDATE':
+            order = parse_order_update(data['o'])
+            order['time'] = time.time()
+            with self._cond:
+                self.orders[order['order_id']] = order
+                self.orders.move_to_end(order['order_id'])
+                self._prune_orders(order['time'])
+                self._cond.notify_all()
+        elif event == 'ACCOUNT_UPDATE':
+            now = time.time()
+            with self._cond:
+                for p in data.get('a', {}).get('P', []):
+                    self.positions[(p['s'], p.get('ps', 'BOTH'))] = {
+                        'amount': float(p['pa']),
+                        'entry_price': float(p.get('ep', 0) or 0),
+                        'time': now,
+                    }
+                self._cond.notify_all()
+        elif event == 'listenKeyExpired':
+            logger.warning("listenKey 已过期，重新连接用户数据流")
+            threading.Thread(target=self._restart, daemon=True).start()
+            return
+        else:
+            return
+        for callback in self._listeners:
+            try:
+                callback(event, data)
+            except Exception as e:
+                logger.error(f"用户数据流事件回调出错: {e}")
+
+    def _prune_orders(self, now):
+        """丢弃超过保留时间的终态订单，总数超过上限时丢弃最早更新的订单（需持有 self._cond）"""
+        while self.orders:
+            order_id, order = next(iter(self.orders.items()))
+            expired = order['status'] in FINAL_STATUSES and now - order['time'] > self.order_retention
+            if not expired and len(self.orders) <= self.max_orders:
+                break
+            del self.orders[order_id]
+
+    def wait_for_orders(self, orders, timeout=5, statuses=('FILLED',)):
+        """
+        等待订单进入指定状态（或终态），orders 为下单返回的订单列表（需包含 symbol、orderId）
+
+        返回 {orderId: 最新订单状态}，超时未确认的订单不在结果中
+        """
+        pending = {o['orderId']: o['symbol'] for o in orders if 'orderId' in o}
+        targets = set(statuses) | set(FINAL_STATUSES)
+        result = {}
+        deadline = time.time() + timeout
+        start = time.time()
+        while pending:
+            if self.connected:
+                with self._cond:
+                    for order_id in list(pending):
+                        state = self.orders.get(order_id)
+                        if state and state['status'] in targets:
+                            result[order_id] = state
+                            del pending[order_id]
+                    remaining = deadline - time.time()
+                    if not pending or remaining <= 0:
+                        break
+                    self._cond.wait(min(remaining, POLL_INTERVAL))
+            else:
+                for order_id, symbol in list(pending.items()):
+                    try:
+                        state = parse_rest_order(self.client.client.query_order(symbol=symbol, orderId=order_id))
+                    except Exception as e:
+                        logger.warning(f"查询订单 {symbol} {order_id} 失败: {e}")
+                        continue
+                    if state['status'] in targets:
+                        result[order_id] = state
+                        del pending[order_id]
+                remaining = deadline - time.time()
+                if not pending or remaining <= 0:
+                    break
+                time.sleep(min(remaining, POLL_INTERVAL))
+        if pending:
+            logger.warning(f"等待订单确认超时 ({timeout}s): {list(pending)}")
+        else:
+            logger.info(f"订单已确认: {len(result)} 个, 等待 {time.time() - start:.2f}s")
+        return result
+
+    def wait_for_positions(self, symbol_sides, timeout=10, since=None):
+        """
+        等待持仓出现（ACCOUNT_UPDATE 推送的持仓数量不为 0），symbol_sides 为 [(symbol, position_side)]
+
+        返回是否全部确认；用户数据流未连接时轮询持仓接口
+        """
+        pending = set(symbol_sides)
+        since = since if since is not None else 0
+        deadline = time.time() + timeout
+        start = time.time()
+        while pending:
+            if self.connected:
+                with self._cond:
+                    for key in list(pending):
+                        p = self.positions.get(key)
+                        if p and p['amount'] != 0 and p['time'] >= since:
+                            pending.discard(key)
+                    remaining = deadline - time.time()
+                    if not pending or remaining <= 0:
+                        break
+                    self._cond.wait(min(remaining, POLL_INTERVAL))
+            else:
+                try:
+                    for p in self.client.client.get_position_risk():
+                        key = (p['symbol'], p.get('positionSide', 'BOTH'))
+                        if key in pending and float(p.get('positionAmt', 0)) != 0:
+                            pending.discard(key)
+                except Exception as e:
+                    logger.warning(f"查询持仓失败: {e}")
+                remaining = deadline - time.time()
+                if not pending or remaining <= 0:
+                    break
+                time.sleep(min(remaining, POLL_INTERVAL * 2))
+        if pending:
+            logger.warning(f"等待持仓确认超时 ({timeout}s): {sorted(pending)}")
+            return False
+        logger.info(f"持仓已确认: {len(symbol_sides)} 个, 等待 {time.time() - start:.2f}s")
+        return True
+
+
+_trackers = ClientRegistry('订单跟踪')
+
+
+def get_order_tracker(client, **kwargs):
+    """获取（必要时创建并连接）与 client 绑定的订单跟踪器；连接失败时仍返回跟踪器，等待时回退为轮询"""
+    def create():
+        tracker = OrderTracker(client, **kwargs)
+        try:
+            tracker.start()
+        except Exception as e:
+            logger.error(f"连接用户数据流失败，订单确认将使用轮询: {e}")
+        return tracker
+
+    return _trackers.get(client, create)
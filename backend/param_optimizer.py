@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+参数优化
+对 indicator / trade 等模块的参数做网格或随机搜索：每组参数在独立进程中回测（ProcessPoolExecutor，默认每核一个进程），
+历史K线只在主进程加载一次，按字段打包到共享内存，各进程以只读视图映射，不复制数据。
+结果按夏普比率 / 盈亏 / 最大回撤排序。
+
+参数空间写法: {'indicator.period': [10, 20, 30], 'trade.take_profit_ratio': [3, 5, 8]}
+（'模块类型.参数名'，同类型模块都会被设置）
+"""
+import copy
+import itertools
+import logging
+import multiprocessing
+import os
+import random
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from backtest_engine import BacktestEngine
+from kline_array import KlineArray
+
+logger = logging.getLogger(__name__)
+
+# 可排序的指标：True 表示越大越好
+SORT_KEYS = {'sharpe': True, 'pnl': True, 'win_rate': True, 'max_drawdown': False, 'max_drawdown_percent': False}
+
+
+def build_param_sets(space, mode='grid', samples=50, seed=None):
+    """由参数空间生成参数组合列表；random 模式从网格中不重复地抽取 samples 组"""
+    keys = list(space)
+    grid = [dict(zip(keys, values)) for values in itertools.product(*(space[k] for k in keys))]
+    if mode == 'random' and samples < len(grid):
+        grid = random.Random(seed).sample(grid, samples)
+    return grid
+
+
+def apply_params(modules, params):
+    """返回设置了参数的模块配置副本"""
+    modules = copy.deepcopy(modules)
+    for key, value in params.items():
+        module_type, name = key.split('.', 1)
+        matched = False
+        for module in modules:
+            if module.get('type') == module_type:
+                module.setdefault('config', {})[name] = value
+                matched = True
+        if not matched:
+            raise ValueError(f"策略中没有 {module_type} 模块: {key}")
+    return modules
+
+
+# ==================== 共享内存 ====================
+
+class SharedHistory:
+    """
+    把 {interval: {symbol: KlineArray}} 按 (interval, 字段) 拼接后放入共享内存
+
+    layout 可传给子进程，由 attach_history 还原为共享内存上的 KlineArray 视图
+    """
+
+    def __init__(self, history):
+        self._blocks = []
+        self.layout = {}
+        for interval, items in history.items():
+            symbols = sorted(items)
+            offsets, cursor = [], 0
+            for symbol in symbols:
+                offsets.append((symbol, cursor, len(items[symbol])))
+                cursor += len(items[symbol])
+            fields = {}
+            for field in items[symbols[0]].columns if symbols else ():
+                dtype = items[symbols[0]].columns[field].dtype
+                block = shared_memory.SharedMemory(create=True, size=max(cursor * dtype.itemsize, 1))
+                self._blocks.append(block)
+                target = np.ndarray((cursor,), dtype=dtype, buffer=block.buf)
+                for symbol, offset, length in offsets:
+                    target[offset:offset + length] = items[symbol].columns[field]
+                fields[field] = (block.name, dtype.str, cursor)
+            self.layout[interval] = {'symbols': offsets, 'fields': fields}
+
+    @property
+    def size(self):
+        return sum(b.size for b in self._blocks)
+
+    def close(self):
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+
+def attach_history(layout):
+    """在子进程中映射共享内存，返回 ({interval: {symbol: KlineArray}}, 共享内存句柄列表)"""
+    blocks, history = [], {}
+    for interval, item in layout.items():
+        arrays = {}
+        for field, (name, dtype, count) in item['fields'].items():
+            # 子进程与主进程共用 resource_tracker，由主进程负责 unlink
+            block = shared_memory.SharedMemory(name=name)
+            blocks.append(block)
+            arrays[field] = np.ndarray((count,), dtype=np.dtype(dtype), buffer=block.buf)
+            arrays[field].flags.writeable = False
+        history[interval] = {
+            symbol: KlineArray({f: values[offset:offset + length] for f, values in arrays.items()})
+            for symbol, offset, length in item['symbols']
+        }
+    return history, blocks
+
+
+# ==================== 子进程 ====================
+
+_worker = {}
+
+
+def _init_worker(layout, modules, engine_kwargs):
+    logging.getLogger('backtest_engine').setLevel(logging.WARNING)
+    history, blocks = attach_history(layout)
+    _worker.update(history=history, blocks=blocks, modules=modules, engine_kwargs=engine_kwargs)
+
+
+def _run_params(params):
+    start = time.time()
+    try:
+        modules = apply_params(_worker['modules'], params)
+        result = BacktestEngine(modules, _worker['history'], **_worker['engine_kwargs']).run()
+        return {'params': params, 'summary': result['summary'], 'elapsed': round(time.time() - start, 2)}
+    except Exception as e:
+        return {'params': params, 'error': str(e), 'elapsed': round(time.time() - start, 2)}
+
+
+# ==================== 优化器 ====================
+
+class ParameterOptimizer:
+    """并行参数搜索"""
+
+    def __init__(self, modules, history, space, mode='grid', samples=50, seed=None, sort_by='sharpe',
+                 max_workers=None, **engine_kwargs):
+        if sort_by not in SORT_KEYS:
+            raise ValueError(f"不支持的排序指标: {sort_by}，可选 {list(SORT_KEYS)}")
+        self.modules = modules
+        self.history = history
+        self.param_sets = build_param_sets(space, mode, samples, seed)
+        if not self.param_sets:
+            raise ValueError("参数空间为空")
+        # 提前校验参数名，避免进程池启动后才报错
+        apply_params(modules, self.param_sets[0])
+        self.sort_by = sort_by
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.engine_kwargs = engine_kwargs
+        self.results = []
+        self._cancelled = threading.Event()
+
+    @property
+    def total(self):
+        return len(self.param_sets)
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def rank(self, results=None):
+        """按排序指标排序（出错的组合排在最后）"""
+        results = self.results if results is None else results
+        descending = SORT_KEYS[self.sort_by]
+        ok = [r for r in results if 'summary' in r]
+        ok.sort(key=lambda r: r['summary'][self.sort_by], reverse=descending)
+        return ok + [r for r in results if 'summary' not in r]
+
+    def run(self, progress=None):
+        """
+        执行搜索，progress(完成数, 总数, 本组结果) 在每组参数完成时回调；返回排序后的结果
+        """
+        start = time.time()
+        shared = SharedHistory(self.history)
+        logger.info(f"参数优化开始: {self.total} 组参数, {self.max_workers} 个进程, "
+                    f"共享内存 {shared.size / 1024 / 1024:.1f}MB")
+        try:
+            # 使用 spawn：主进程中有 Flask / WebSocket 等线程，fork 可能继承到被占用的锁
+            with ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=_init_worker,
+                                     initargs=(shared.layout, self.modules, self.engine_kwargs)) as executor:
+                futures = [executor.submit(_run_params, params) for params in self.param_sets]
+                for future in as_completed(futures):
+                    if self._cancelled.is_set():
+                        for f in futures:
+                            f.cancel()
+                        break
+                    result = future.result()
+                    self.results.append(result)
+                    if progress:
+                        try:
+                            progress(len(self.results), self.total, result)
+                        except Exception as e:
+                            logger.error(f"参数优化进度回调出错: {e}")
+        finally:
+            shared.close()
+        logger.info(f"参数优化{'已取消' if self._cancelled.is_set() else '完成'}: "
+                    f"{len(self.results)}/{self.total} 组, 耗时 {time.time() - start:.1f}s")
+        return self.rank()
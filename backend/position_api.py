@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+仓位接口
+/api/positions、/api/positions/history、/api/positions/stats 由仓位存储（SQLite）提供数据，
+/api/positions 只附带最近的历史仓位，完整历史通过 /api/positions/history 分页读取；
+/api/account、/api/strategy/positions 由账户状态缓存（见 account_state）提供，不再每次请求交易所，
+缓存不可用（如未配置 API Key）时仍交给原接口处理。
+
+/api/account/state?since=<version> 和 socket 事件 account_subscribe {version} 用于按版本号重新同步，
+之后的变化通过 account_state 事件推送增量；持仓增减时仍推送 positions_updated（附带版本号和持仓增量）
+"""
+import logging
+import threading
+import weakref
+
+from flask import jsonify, request
+from flask_socketio import join_room, leave_room
+
+from account_state import get_account_state
+from api_extensions import guard_route, login_checker, login_required, override_route
+from position_store import get_position_store
+
+logger = logging.getLogger(__name__)
+
+# 账户状态订阅者所在的 socket 房间
+ACCOUNT_ROOM = 'account'
+
+# /api/positions 返回的历史仓位条数（默认 / 最大）
+DEFAULT_HISTORY_LIMIT = 500
+MAX_HISTORY_LIMIT = 5000
+
+_socketio = None
+_subscribers = set()
+_subscribers_lock = threading.Lock()
+_listening = weakref.WeakSet()
+
+
+def get_positions():
+    """
+    当前持仓和最近的历史仓位
+
+    history 只包含最近 history_limit 条（默认 DEFAULT_HISTORY_LIMIT，按平仓时间升序），更早的记录通过
+    /api/positions/history 分页读取；history_total 为历史总数，history_base_pnl 为未返回的记录的盈亏合计
+    （绘制累计盈亏曲线时作为起点）
+    """
+    store = get_position_store()
+    store.sync_from_json()
+    try:
+        limit = max(0, min(int(request.args.get('history_limit', DEFAULT_HISTORY_LIMIT)), MAX_HISTORY_LIMIT))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'history_limit 必须为整数'}), 400
+    history = store.load_history(limit)
+    total = store.history_count()
+    base_pnl = 0
+    if total > len(history):
+        base_pnl = round(store.summary()['pnl'] - sum(float(r.get('pnl', 0) or 0) for r in history), 8)
+    return jsonify({'success': True, 'current': store.load_current(), 'history': history,
+                    'history_total': total, 'history_base_pnl': base_pnl})
+
+
+def get_positions_history():
+    """
+    历史仓位（分页）
+
+    参数: page, page_size, symbol, start, end（平仓时间范围，如 2025-11-17 或 2025-11-17T11）
+    """
+    store = get_position_store()
+    store.sync_from_json()
+    args = request.args
+    try:
+        page = int(args.get('page', 1))
+        page_size = int(args.get('page_size', 100))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'page / page_size 必须为整数'}), 400
+    records, total = store.query_history(page, page_size, symbol=args.get('symbol'),
+                                         start=args.get('start'), end=args.get('end'))
+    return jsonify({'success': True, 'history': records, 'total': total, 'page': page, 'page_size': page_size})
+
+
+def get_positions_stats():
+    """
+    盈亏统计：汇总、按日 / 小时的盈亏序列、按标的汇总
+
+    参数: bucket（day / hour）, start, end
+    """
+    store = get_position_store()
+    store.sync_from_json()
+    args = request.args
+    bucket = 'hour' if args.get('bucket') == 'hour' else 'day'
+    return jsonify({
+        'success': True,
+        'summary': store.summary(),
+        'bucket': bucket,
+        'series': store.pnl_series(bucket, start=args.get('start'), end=args.get('end')),
+        'symbols': store.symbol_stats(),
+    })
+
+
+def clear_positions_history():
+    """清除历史仓位"""
+    get_position_store().clear_history()
+    return jsonify({'success': True})
+
+
+def _account_state():
+    """Web 服务进程中的账户状态缓存（使用多策略运行时的客户端）；不可用时返回 None"""
+    from strategy_host import get_strategy_host
+    try:
+        state = get_account_state(get_strategy_host().client)
+    except Exception as e:
+        logger.warning(f"账户状态缓存不可用: {e}")
+        return None
+    if state not in _listening:
+        _listening.add(state)
+        state.add_listener(_on_delta)
+    state.touch()
+    return state if state.updated_at else None
+
+
+def _since_arg(value):
+    return int(value) if value not in (None, '') else None
+
+
+def get_account():
+    """账户余额（缓存）"""
+    state = _account_state()
+    if state is None:
+        return None
+    snapshot = state.snapshot()
+    return jsonify(dict(snapshot['account'], success=True, version=snapshot['version'],
+                        positions=snapshot['positions']))
+
+
+def get_strategy_positions():
+    """策略当前持仓，未实现盈亏取自账户状态缓存"""
+    state = _account_state()
+    if state is None:
+        return None
+    store = get_position_store()
+    store.sync_from_json()
+    positions = []
+    for p in store.load_current():
+        p = dict(p)
+        p['unrealized_pnl'] = state.unrealized_pnl(p['symbol'], p.get('positionSide', 'LONG'), p.get('quantity'))
+        positions.append(p)
+    return jsonify({'success': True, 'positions': positions, 'version': state.version})
+
+
+def get_account_sync():
+    """按版本号重新同步：since 仍在保留的增量范围内时返回增量，否则返回完整快照"""
+    try:
+        since = _since_arg(request.args.get('since'))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'since 必须为整数'}), 400
+    state = _account_state()
+    if state is None:
+        return jsonify({'success': False, 'error': '账户状态不可用'}), 503
+    return jsonify(dict(state.sync(since), success=True))
+
+
+def _update_subscribers(state):
+    """去掉已断开的订阅者（断开时不一定收到 account_unsubscribe）"""
+    with _subscribers_lock:
+        if _socketio is not None:
+            manager = _socketio.server.manager
+            _subscribers.difference_update([sid for sid in _subscribers if not manager.is_connected(sid, '/')])
+        state.subscribers = len(_subscribers)
+
+
+def _on_delta(delta):
+    if _socketio is None:
+        return
+    _socketio.emit('account_state', delta, to=ACCOUNT_ROOM)
+    resized = delta.get('resized')
+    if resized:
+        # 兼容只监听 positions_updated 的页面：仅在持仓数量变化时通知（未实现盈亏的变化只走 account_state）
+        _socketio.emit('positions_updated', {'message': f"持仓已更新: {', '.join(resized)}",
+                                             'version': delta['version'], 'prev_version': delta['prev_version'],
+                                             'positions': {k: delta['positions'][k] for k in resized}})
+
+
+def register_position_routes(app, socketio=None):
+    global _socketio
+    _socketio = socketio
+    # 替换处理函数后原接口的登录校验不再执行，需要在新处理函数上重新校验；
+    # 缓存的账户数据也要在登录校验之后才返回
+    auth = login_required(app)
+    guard_route(app, '/api/account', ['GET'], auth(get_account))
+    guard_route(app, '/api/strategy/positions', ['GET'], auth(get_strategy_positions))
+    override_route(app, '/api/account/state', ['GET'], auth(get_account_sync))
+    override_route(app, '/api/positions', ['GET'], auth(get_positions))
+    override_route(app, '/api/positions/history', ['GET'], auth(get_positions_history))
+    override_route(app, '/api/positions/history', ['DELETE'], auth(clear_positions_history))
+    override_route(app, '/api/positions/stats', ['GET'], auth(get_positions_stats))
+    if socketio is None:
+        return
+
+    authenticated = login_checker(app)
+
+    def on_subscribe(data=None):
+        """订阅账户状态增量，先推送从客户端已有版本开始的同步数据；未登录的连接不能订阅"""
+        if not authenticated():
+            socketio.emit('account_state', {'success': False, 'error': '未登录'}, to=request.sid)
+            return
+        state = _account_state()
+        if state is None:
+            socketio.emit('account_state', {'success': False, 'error': '账户状态不可用'}, to=request.sid)
+            return
+        join_room(ACCOUNT_ROOM)
+        with _subscribers_lock:
+            _subscribers.add(request.sid)
+        _update_subscribers(state)
+        try:
+            since = _since_arg((data or {}).get('version'))
+        except (TypeError, ValueError):
+            since = None
+        socketio.emit('account_state', dict(state.sync(since), success=True), to=request.sid)
+
+    def on_unsubscribe(data=None):
+        leave_room(ACCOUNT_ROOM)
+        with _subscribers_lock:
+            _subscribers.discard(request.sid)
+        state = _account_state()
+        if state is not None:
+            _update_subscribers(state)
+
+    socketio.on_event('account_subscribe', on_subscribe)
+    socketio.on_event('account_unsubscribe', on_unsubscribe)
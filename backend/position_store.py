@@ -0,0 +1,382 @@
+# -*- coding: utf-8 -*-
+"""
+仓位存储
+基于 SQLite（WAL 模式）保存当前持仓和历史仓位，每次变更只写入变化的记录并在事务中原子提交，
+不再整体重写 positions.json；首次启动时自动导入原有的 positions.json。
+
+data/positions.json 仍保留为只含当前持仓的兼容镜像（原子写入），供仍直接读取该文件的旧接口使用；
+外部对镜像文件的修改（如手动平仓）会在下次加载时同步回数据库
+"""
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+DB_FILE = os.path.join(DATA_DIR, 'positions.db')
+JSON_FILE = os.path.join(DATA_DIR, 'positions.json')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS current_positions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    symbol TEXT NOT NULL,
+    position_side TEXT,
+    client_order_id TEXT,
+    entry_time TEXT,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS position_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    symbol TEXT NOT NULL,
+    position_side TEXT,
+    client_order_id TEXT,
+    entry_time TEXT,
+    exit_time TEXT,
+    exit_reason TEXT,
+    pnl REAL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_history_exit_time ON position_history (exit_time);
+CREATE INDEX IF NOT EXISTS idx_history_symbol ON position_history (symbol, exit_time);
+CREATE TABLE IF NOT EXISTS pnl_daily (
+    bucket TEXT PRIMARY KEY,
+    trades INTEGER NOT NULL DEFAULT 0,
+    wins INTEGER NOT NULL DEFAULT 0,
+    pnl REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS pnl_hourly (
+    bucket TEXT PRIMARY KEY,
+    trades INTEGER NOT NULL DEFAULT 0,
+    wins INTEGER NOT NULL DEFAULT 0,
+    pnl REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS pnl_symbol (
+    bucket TEXT PRIMARY KEY,
+    trades INTEGER NOT NULL DEFAULT 0,
+    wins INTEGER NOT NULL DEFAULT 0,
+    pnl REAL NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# 统计表及对应的分桶方式（按平仓时间的日 / 小时、按标的）
+STATS_TABLES = {
+    'pnl_daily': lambda r: (r.get('exit_time') or '')[:10],
+    'pnl_hourly': lambda r: (r.get('exit_time') or '')[:13],
+    'pnl_symbol': lambda r: r.get('symbol', ''),
+}
+
+# 统计表版本，分桶规则变化时递增以触发重建
+STATS_VERSION = 1
+
+
+def _history_key(record):
+    return record.get('client_order_id', ''), record.get('exit_time', '')
+
+
+class PositionStore:
+    """SQLite 仓位存储（线程安全）"""
+
+    def __init__(self, db_file=DB_FILE, json_file=JSON_FILE):
+        self.db_file = db_file
+        self.json_file = json_file
+        self._lock = threading.RLock()
+        self._listeners = []
+        os.makedirs(os.path.dirname(db_file), exist_ok=True)
+        self._conn = sqlite3.connect(db_file, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SCHEMA)
+        self.migrate_from_json()
+        self._ensure_stats()
+
+    def add_listener(self, callback):
+        """注册历史仓位写入回调 callback(records)，用于增量更新统计等"""
+        self._listeners.append(callback)
+
+    def _transaction(self):
+        return _Transaction(self._conn, self._lock)
+
+    def _get_meta(self, key, default=None):
+        row = self._conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row['value'] if row else default
+
+    def _set_meta(self, key, value):
+        self._conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, str(value)))
+
+    # ==================== 迁移与兼容镜像 ====================
+
+    def migrate_from_json(self):
+        """首次启动时导入 positions.json（原文件备份为 positions.json.migrated.bak）"""
+        with self._lock:
+            if self._get_meta('json_migrated') or not os.path.exists(self.json_file):
+                return
+            try:
+                with open(self.json_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except Exception as e:
+                logger.error(f"读取 {self.json_file} 失败，跳过迁移: {e}")
+                return
+            shutil.copy2(self.json_file, self.json_file + '.migrated.bak')
+            with self._transaction():
+                self._replace_current(data.get('current', []))
+                self._insert_history(data.get('history', []))
+                self._set_meta('json_migrated', 1)
+            logger.info(f"已从 positions.json 导入 {len(data.get('current', []))} 个当前持仓, "
+                        f"{len(data.get('history', []))} 条历史记录")
+            self.export_json()
+
+    def export_json(self):
+        """把当前持仓原子写入兼容镜像文件"""
+        with self._lock:
+            data = {'current': self.load_current(), 'history': []}
+            tmp_file = self.json_file + '.tmp'
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_file, self.json_file)
+            with self._transaction():
+                self._set_meta('json_mtime', os.stat(self.json_file).st_mtime_ns)
+
+    def sync_from_json(self):
+        """镜像文件被外部修改时（如接口手动平仓），把当前持仓和新增的历史记录同步回数据库"""
+        with self._lock:
+            if not os.path.exists(self.json_file):
+                self.export_json()
+                return
+            mtime = os.stat(self.json_file).st_mtime_ns
+            if str(mtime) == self._get_meta('json_mtime'):
+                return
+            try:
+                with open(self.json_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except Exception as e:
+                logger.error(f"读取 {self.json_file} 失败: {e}")
+                return
+            history = data.get('history', [])
+            with self._transaction():
+                self._replace_current(data.get('current', []))
+                added = self._insert_history(history, skip_existing=True)
+            logger.info(f"positions.json 已被外部修改，同步当前持仓 {len(data.get('current', []))} 个, "
+                        f"新增历史记录 {len(added)} 条")
+            self.export_json()
+        self._notify(added)
+
+    # ==================== 当前持仓 ====================
+
+    def load_current(self):
+        with self._lock:
+            rows = self._conn.execute('SELECT data FROM current_positions ORDER BY id').fetchall()
+        return [json.loads(r['data']) for r in rows]
+
+    def save_current(self, positions):
+        """保存当前持仓（只涉及当前持仓表，数量很少）"""
+        with self._lock:
+            with self._transaction():
+                self._replace_current(positions)
+            self.export_json()
+
+    def close_position(self, position, current):
+        """平仓：写入历史并更新当前持仓，在同一事务中完成"""
+        with self._lock:
+            with self._transaction():
+                self._insert_history([position])
+                self._replace_current(current)
+            self.export_json()
+        self._notify([position])
+
+    def _replace_current(self, positions):
+        self._conn.execute('DELETE FROM current_positions')
+        self._conn.executemany(
+            'INSERT INTO current_positions (symbol, position_side, client_order_id, entry_time, data) '
+            'VALUES (?, ?, ?, ?, ?)',
+            [(p.get('symbol', ''), p.get('positionSide', 'LONG'), p.get('client_order_id', ''),
+              p.get('entry_time', ''), json.dumps(p, ensure_ascii=False)) for p in positions]
+        )
+
+    # ==================== 历史仓位 ====================
+
+    def _insert_history(self, records, skip_existing=False):
+        if skip_existing and records:
+            existing = {(r['client_order_id'], r['exit_time']) for r in self._conn.execute(
+                'SELECT client_order_id, exit_time FROM position_history')}
+            records = [r for r in records if _history_key(r) not in existing]
+        self._conn.executemany(
+            'INSERT INTO position_history '
+            '(symbol, position_side, client_order_id, entry_time, exit_time, exit_reason, pnl, data) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            [(r.get('symbol', ''), r.get('positionSide', 'LONG'), r.get('client_order_id', ''),
+              r.get('entry_time', ''), r.get('exit_time', ''), r.get('exit_reason', ''),
+              float(r.get('pnl', 0) or 0), json.dumps(r, ensure_ascii=False)) for r in records]
+        )
+        self._aggregate(records)
+        return records
+
+    def query_history(self, page=1, page_size=100, symbol=None, start=None, end=None):
+        """
+        分页查询历史记录（按平仓时间倒序），start / end 为平仓时间范围（ISO 格式字符串前缀，如 2025-11-17）
+
+        返回 (记录列表, 总数)
+        """
+        where, params = self._history_filter(symbol, start, end)
+        page = max(int(page), 1)
+        page_size = max(1, min(int(page_size), 1000))
+        with self._lock:
+            total = self._conn.execute(f'SELECT COUNT(*) FROM position_history {where}', params).fetchone()[0]
+            rows = self._conn.execute(
+                f'SELECT data FROM position_history {where} ORDER BY exit_time DESC, id DESC LIMIT ? OFFSET ?',
+                params + [page_size, (page - 1) * page_size]
+            ).fetchall()
+        return [json.loads(r['data']) for r in rows], total
+
+    @staticmethod
+    def _history_filter(symbol, start, end):
+        clauses, params = [], []
+        if symbol:
+            clauses.append('symbol = ?')
+            params.append(symbol)
+        if start:
+            clauses.append('exit_time >= ?')
+            params.append(start)
+        if end:
+            # end 只给到日期时包含当天
+            clauses.append('exit_time < ?')
+            params.append(end + '\uffff' if len(end) <= 13 else end)
+        return ('WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    # ==================== 盈亏统计（随平仓增量更新） ====================
+
+    def _aggregate(self, records):
+        for table, bucket_of in STATS_TABLES.items():
+            self._conn.executemany(
+                f'INSERT INTO {table} (bucket, trades, wins, pnl) VALUES (?, 1, ?, ?) '
+                f'ON CONFLICT(bucket) DO UPDATE SET trades = trades + 1, wins = wins + excluded.wins, '
+                f'pnl = pnl + excluded.pnl',
+                [(bucket_of(r), 1 if float(r.get('pnl', 0) or 0) > 0 else 0, float(r.get('pnl', 0) or 0))
+                 for r in records]
+            )
+
+    def _ensure_stats(self):
+        """统计表版本不一致时（首次升级）从历史记录重建"""
+        with self._lock:
+            if self._get_meta('stats_version') == str(STATS_VERSION):
+                return
+            with self._transaction():
+                for table in STATS_TABLES:
+                    self._conn.execute(f'DELETE FROM {table}')
+                rows = self._conn.execute('SELECT data FROM position_history').fetchall()
+                self._aggregate([json.loads(r['data']) for r in rows])
+                self._set_meta('stats_version', STATS_VERSION)
+            logger.info(f"已重建盈亏统计: {len(rows)} 条历史记录")
+
+    def pnl_series(self, bucket='day', start=None, end=None):
+        """按日 / 小时分桶的盈亏序列，附累计盈亏"""
+        table = 'pnl_hourly' if bucket == 'hour' else 'pnl_daily'
+        clauses, params = [], []
+        if start:
+            clauses.append('bucket >= ?')
+            params.append(start[:13 if bucket == 'hour' else 10])
+        if end:
+            clauses.append('bucket <= ?')
+            params.append(end[:13 if bucket == 'hour' else 10])
+        where = ('WHERE ' + ' AND '.join(clauses)) if clauses else ''
+        with self._lock:
+            rows = self._conn.execute(f'SELECT bucket, trades, wins, pnl FROM {table} {where} ORDER BY bucket',
+                                      params).fetchall()
+        series = []
+        cumulative = 0.0
+        for r in rows:
+            cumulative += r['pnl']
+            series.append({'time': r['bucket'], 'trades': r['trades'], 'wins': r['wins'],
+                           'pnl': round(r['pnl'], 8), 'cumulative_pnl': round(cumulative, 8)})
+        return series
+
+    def symbol_stats(self):
+        """按标的汇总的交易次数、胜率、盈亏"""
+        with self._lock:
+            rows = self._conn.execute('SELECT bucket, trades, wins, pnl FROM pnl_symbol ORDER BY pnl DESC').fetchall()
+        return [{'symbol': r['bucket'], 'trades': r['trades'], 'wins': r['wins'],
+                 'win_rate': round(r['wins'] / r['trades'], 4) if r['trades'] else 0,
+                 'pnl': round(r['pnl'], 8)} for r in rows]
+
+    def summary(self):
+        """总交易次数、胜率、总盈亏"""
+        with self._lock:
+            row = self._conn.execute('SELECT COALESCE(SUM(trades), 0) AS trades, COALESCE(SUM(wins), 0) AS wins, '
+                                     'COALESCE(SUM(pnl), 0) AS pnl FROM pnl_symbol').fetchone()
+        trades, wins = row['trades'], row['wins']
+        return {'trades': trades, 'wins': wins, 'win_rate': round(wins / trades, 4) if trades else 0,
+                'pnl': round(row['pnl'], 8)}
+
+    def load_history(self, limit=None):
+        """历史记录（按平仓时间升序），limit 不为空时只返回最近的 limit 条"""
+        with self._lock:
+            if limit is None:
+                rows = self._conn.execute('SELECT data FROM position_history ORDER BY exit_time, id').fetchall()
+            else:
+                rows = self._conn.execute('SELECT data FROM position_history ORDER BY exit_time DESC, id DESC LIMIT ?',
+                                          (max(0, int(limit)),)).fetchall()[::-1]
+        return [json.loads(r['data']) for r in rows]
+
+    def history_count(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM position_history').fetchone()[0]
+
+    def clear_history(self):
+        with self._lock:
+            with self._transaction():
+                self._conn.execute('DELETE FROM position_history')
+                for table in STATS_TABLES:
+                    self._conn.execute(f'DELETE FROM {table}')
+
+    def _notify(self, records):
+        if not records:
+            return
+        for callback in self._listeners:
+            try:
+                callback(records)
+            except Exception as e:
+                logger.error(f"仓位记录回调出错: {e}")
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT，异常时回滚"""
+
+    def __init__(self, conn, lock):
+        self.conn = conn
+        self.lock = lock
+
+    def __enter__(self):
+        self.lock.acquire()
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+        finally:
+            self.lock.release()
+        return False
+
+
+_stores = {}
+_store_lock = threading.Lock()
+
+
+def get_position_store(db_file=None, json_file=None):
+    """获取仓位存储（默认为全局的 data/positions.db，多策略运行时每个策略使用各自的文件）"""
+    db_file = db_file or DB_FILE
+    json_file = json_file or (JSON_FILE if db_file == DB_FILE else os.path.splitext(db_file)[0] + '.json')
+    with _store_lock:
+        store = _stores.get(db_file)
+        if store is None:
+            store = PositionStore(db_file, json_file)
+            _stores[db_file] = store
+        return store
@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+"""
+REST 请求权重限流
+所有合约 REST 请求（BinanceClient 内部的 UMFutures）经过同一个调度器:
+- 按响应头 X-MBX-USED-WEIGHT-1M / X-MBX-ORDER-COUNT-1M 记录当前分钟已用权重和下单次数，
+  响应返回前按接口的预估权重计入（并发请求不会一起越过上限）
+- 按优先级分配额度：下单 / 撤单可用满额度，账户查询和行情数据分别预留余量；
+  有高优先级请求在等待时低优先级请求让行，额度不足时等到下一分钟
+- 相同参数的并发 GET 请求只发送一次（多个策略同时请求同一组K线共享结果）
+- 429 按 Retry-After（没有时指数退避）暂停请求，418（IP 被封禁）暂停到解封时间；GET 请求等待后自动重试
+
+权重限制按 IP 计算，响应头中的已用权重包含同一 IP 上其他进程的请求，多进程运行时各自的调度器也能看到整体用量
+
+用法:
+    install_rate_limiter(binance_client)   # 同一个客户端重复调用不会重复安装
+"""
+import logging
+import threading
+import time
+
+from binance.error import ClientError
+from binance.lib.utils import get_timestamp
+
+logger = logging.getLogger(__name__)
+
+# 合约默认限制（exchangeInfo.rateLimits，可通过 configure 更新）
+DEFAULT_WEIGHT_LIMIT = 2400
+DEFAULT_ORDER_LIMIT = 1200
+
+# 优先级（数值越小越优先）
+PRIORITY_ORDER = 0
+PRIORITY_ACCOUNT = 1
+PRIORITY_DATA = 2
+
+# 各优先级可使用的权重比例（为下单预留余量）
+PRIORITY_SHARE = {PRIORITY_ORDER: 1.0, PRIORITY_ACCOUNT: 0.9, PRIORITY_DATA: 0.8}
+
+# 429 没有 Retry-After 时的退避时间（秒），连续触发时逐级增加
+BACKOFF = (1, 2, 5, 10, 30, 60)
+
+# GET 请求遇到 429 / 418 时的最多重试次数
+MAX_RETRIES = 3
+
+# 单次等待额度的最长时间（秒），超过后仍发送请求（由交易所判定）
+MAX_WAIT = 65
+
+# 不参与合并的参数（每次请求都不同）
+VOLATILE_PARAMS = ('timestamp', 'signature')
+
+ORDER_PATHS = ('/fapi/v1/order', '/fapi/v1/batchOrders', '/fapi/v1/allOpenOrders', '/fapi/v1/countdownCancelAll',
+               '/fapi/v1/listenKey')
+ACCOUNT_PATHS = ('/fapi/v2/account', '/fapi/v3/account', '/fapi/v2/balance', '/fapi/v3/balance',
+                 '/fapi/v2/positionRisk', '/fapi/v3/positionRisk', '/fapi/v1/openOrders', '/fapi/v1/userTrades',
+                 '/fapi/v1/income', '/fapi/v1/allOrders')
+
+
+def _limit_weight(limit, steps):
+    """按 limit 参数分档的权重，steps 为 [(limit 上界, 权重)]"""
+    limit = int(limit or 500)
+    for bound, weight in steps:
+        if limit < bound:
+            return weight
+    return steps[-1][1]
+
+
+def request_weight(method, path, params):
+    """接口的预估权重（币安文档中的权重规则，未列出的按 1 计）"""
+    path = path.split('?', 1)[0]
+    has_symbol = bool(params.get('symbol'))
+    if path in ('/fapi/v1/klines', '/fapi/v1/continuousKlines', '/fapi/v1/indexPriceKlines',
+                '/fapi/v1/markPriceKlines'):
+        return _limit_weight(params.get('limit'), [(100, 1), (500, 2), (1001, 5), (10 ** 9, 10)])
+    if path == '/fapi/v1/depth':
+        return _limit_weight(params.get('limit'), [(51, 2), (101, 5), (501, 10), (10 ** 9, 20)])
+    if path == '/fapi/v1/ticker/24hr':
+        return 1 if has_symbol else 40
+    if path in ('/fapi/v1/ticker/price', '/fapi/v2/ticker/price'):
+        return 1 if has_symbol else 2
+    if path == '/fapi/v1/ticker/bookTicker':
+        return 2 if has_symbol else 5
+    if path == '/fapi/v1/openOrders':
+        return 1 if has_symbol else 40
+    if path == '/fapi/v1/allOrders':
+        return 5
+    if path in ('/fapi/v2/account', '/fapi/v3/account', '/fapi/v2/balance', '/fapi/v3/balance',
+                '/fapi/v2/positionRisk', '/fapi/v3/positionRisk', '/fapi/v1/userTrades', '/fapi/v1/batchOrders'):
+        return 5
+    if path == '/fapi/v1/income':
+        return 30
+    return 1
+
+
+def request_priority(method, path):
+    path = path.split('?', 1)[0]
+    if path in ORDER_PATHS or (method != 'GET' and path not in ACCOUNT_PATHS):
+        return PRIORITY_ORDER
+    if path in ACCOUNT_PATHS:
+        return PRIORITY_ACCOUNT
+    return PRIORITY_DATA
+
+
+def _header(headers, name):
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+class RateLimiter:
+    """按分钟窗口统计请求权重，按优先级发放额度（进程内共享，线程安全）"""
+
+    def __init__(self, weight_limit=DEFAULT_WEIGHT_LIMIT, order_limit=DEFAULT_ORDER_LIMIT, share=None,
+                 max_wait=MAX_WAIT):
+        self.weight_limit = weight_limit
+        self.order_limit = order_limit
+        self.share = dict(PRIORITY_SHARE)
+        self.share.update(share or {})
+        self.max_wait = max_wait
+        self.used_weight = 0        # 当前分钟已确认的权重（响应头或本地累计）
+        self.order_count = 0
+        self.blocked_until = 0      # 429 / 418 后暂停到该时间
+        self.stats = {'requests': 0, 'weight': 0, 'coalesced': 0, 'waits': 0, 'wait_seconds': 0.0,
+                      'rate_limited': 0, 'banned': 0, 'retries': 0}
+        self._window = self._current_window()
+        self._in_flight = 0         # 已发出但未返回的请求的预估权重
+        self._waiting = {}          # {优先级: 等待中的请求数}
+        self._strikes = 0           # 连续 429 次数
+        self._cond = threading.Condition()
+
+    @staticmethod
+    def _current_window():
+        return int(time.time() // 60)
+
+    def configure(self, exchange_info):
+        """按 exchangeInfo.rateLimits 更新限制"""
+        for item in exchange_info.get('rateLimits', []):
+            if item.get('interval') != 'MINUTE' or item.get('intervalNum', 1) != 1:
+                continue
+            if item.get('rateLimitType') == 'REQUEST_WEIGHT':
+                self.weight_limit = int(item['limit'])
+            elif item.get('rateLimitType') == 'ORDERS':
+                self.order_limit = int(item['limit'])
+
+    def _roll(self):
+        window = self._current_window()
+        if window != self._window:
+            self._window = window
+            self.used_weight = 0
+            self.order_count = 0
+
+    def _allowed(self, weight, priority, is_order):
+        if time.time() < self.blocked_until:
+            return False
+        if any(count for p, count in self._waiting.items() if p < priority):
+            return False
+        if is_order and self.order_count >= self.order_limit:
+            return False
+        cap = self.weight_limit * self.share.get(priority, 1.0)
+        # 单个请求超过额度时只要当前窗口空闲即可发送
+        return self.used_weight + self._in_flight + weight <= cap or (self.used_weight + self._in_flight == 0)
+
+    def acquire(self, weight, priority=PRIORITY_DATA, is_order=False):
+        """等待额度并计入在途权重"""
+        start = time.time()
+        with self._cond:
+            self._roll()
+            if not self._allowed(weight, priority, is_order):
+                self.stats['waits'] += 1
+                self._waiting[priority] = self._waiting.get(priority, 0) + 1
+                try:
+                    while True:
+                        self._roll()
+                        if self._allowed(weight, priority, is_order):
+                            break
+                        now = time.time()
+                        if now - start > self.max_wait:
+                            logger.warning(f"等待请求额度超过 {self.max_wait}s，直接发送 (权重 {weight})")
+                            break
+                        # 到下一分钟或解除暂停时重新检查，期间有请求返回也会唤醒
+                        wake = max(self.blocked_until, (self._window + 1) * 60) - now
+                        self._cond.wait(min(max(wake, 0.05), 1))
+                finally:
+                    self._waiting[priority] -= 1
+                    self._cond.notify_all()
+                self.stats['wait_seconds'] += time.time() - start
+            self._in_flight += weight
+            self.stats['requests'] += 1
+            self.stats['weight'] += weight
+
+    def release(self, weight, headers=None, status=None, is_order=False):
+        """请求返回：以响应头为准更新已用权重，处理 429 / 418"""
+        with self._cond:
+            self._in_flight = max(0, self._in_flight - weight)
+            self._roll()
+            used = _header(headers, 'x-mbx-used-weight-1m') if headers else None
+            if used is not None:
+                self.used_weight = max(self.used_weight, int(used)) if status in (429, 418) else int(used)
+            elif status is not None:
+                self.used_weight += weight
+            orders = _header(headers, 'x-mbx-order-count-1m') if headers else None
+            if orders is not None:
+                self.order_count = int(orders)
+            elif is_order and status is not None:
+                self.order_count += 1
+            if status in (429, 418):
+                retry_after = _header(headers, 'retry-after') if headers else None
+                if retry_after is not None:
+                    delay = float(retry_after)
+                else:
+                    delay = BACKOFF[min(self._strikes, len(BACKOFF) - 1)]
+                self._strikes += 1
+                self.blocked_until = max(self.blocked_until, time.time() + delay)
+                if status == 418:
+                    self.stats['banned'] += 1
+                    logger.error(f"IP 因请求过多被封禁，暂停请求 {delay:.0f}s")
+                else:
+                    self.stats['rate_limited'] += 1
+                    logger.warning(f"请求超过频率限制 (429)，暂停 {delay:.0f}s (已用权重 {self.used_weight})")
+            elif status is not None and status < 400:
+                self._strikes = 0
+            self._cond.notify_all()
+
+    def status(self):
+        with self._cond:
+            self._roll()
+            return {
+                'used_weight': self.used_weight,
+                'in_flight': self._in_flight,
+                'weight_limit': self.weight_limit,
+                'order_count': self.order_count,
+                'order_limit': self.order_limit,
+                'blocked_for': round(max(0, self.blocked_until - time.time()), 1),
+                'waiting': {p: c for p, c in self._waiting.items() if c},
+                'stats': dict(self.stats),
+            }
+
+
+class _Call:
+    """进行中的 GET 请求，供相同请求共享结果"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class RateLimitedSender:
+    """
+    替换 UMFutures.send_request：按权重和优先级等待额度、合并相同的并发 GET 请求、429 / 418 后等待重试
+
+    响应头通过 requests 会话的 response 钩子读取（在抛出 ClientError 之前）
+    """
+
+    def __init__(self, api, limiter, max_retries=MAX_RETRIES):
+        self.api = api
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self._send = api.send_request
+        self._local = threading.local()
+        self._calls = {}
+        self._lock = threading.Lock()
+        api.session.hooks.setdefault('response', []).append(self._on_response)
+
+    def _on_response(self, response, *args, **kwargs):
+        self._local.response = response
+        return response
+
+    def __call__(self, http_method, url_path, payload=None, special=False):
+        params = payload or {}
+        if http_method != 'GET':
+            return self._request(http_method, url_path, payload, special)
+        key = (url_path, tuple(sorted((k, str(v)) for k, v in params.items() if k not in VOLATILE_PARAMS)))
+        with self._lock:
+            call = self._calls.get(key)
+            owner = call is None
+            if owner:
+                call = self._calls[key] = _Call()
+        if not owner:
+            self.limiter.stats['coalesced'] += 1
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = self._request(http_method, url_path, payload, special)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def _request(self, http_method, url_path, payload, special):
+        params = payload or {}
+        weight = request_weight(http_method, url_path, params)
+        priority = request_priority(http_method, url_path)
+        is_order = priority == PRIORITY_ORDER and http_method in ('POST', 'PUT')
+        attempt = 0
+        while True:
+            self.limiter.acquire(weight, priority, is_order)
+            self._local.response = None
+            status = None
+            try:
+                result = self._send(http_method, url_path, payload, special)
+                status = 200
+                return result
+            except ClientError as e:
+                status = e.status_code
+                # 只重试 GET；签名放在路径中的请求无法重新签名
+                if (status not in (429, 418) or http_method != 'GET' or attempt >= self.max_retries
+                        or 'signature=' in url_path):
+                    raise
+            finally:
+                response = self._local.response
+                self.limiter.release(weight, response.headers if response is not None else None,
+                                     response.status_code if response is not None else status, is_order)
+            attempt += 1
+            self.limiter.stats['retries'] += 1
+            if 'signature' in params:
+                # 签名请求重新生成时间戳和签名（与 sign_request 相同的顺序）
+                params = {k: v for k, v in params.items() if k not in VOLATILE_PARAMS}
+                params['timestamp'] = get_timestamp()
+                params['signature'] = self.api._get_sign(self.api._prepare_params(params, special))
+                payload = params
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """进程内共享的限流器（权重按 IP 计算，所有客户端共用一份额度）"""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter()
+        return _limiter
+
+
+def install_rate_limiter(client, limiter=None):
+    """为 BinanceClient（或 UMFutures）安装限流，返回使用的限流器"""
+    api = getattr(client, 'client', client)
+    sender = api.__dict__.get('send_request')
+    if isinstance(sender, RateLimitedSender):
+        return sender.limiter
+    limiter = limiter or get_rate_limiter()
+    api.send_request = RateLimitedSender(api, limiter)
+    return limiter
@@ -73,6 +73,8 @@ if __name__ == '__main__':
     # 启动Flask应用
     try:
         from app import app, socketio
+        from api_extensions import register_extensions
+        register_extensions(app, socketio)
         socketio.run(app, host='0.0.0.0', port=5000, debug=False, allow_unsafe_werkzeug=True)
     except KeyboardInterrupt:
         print("\n服务器已停止")
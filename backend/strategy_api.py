@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+策略配置接口扩展
+POST /api/strategy 保存前先编译校验 custom_strategy 代码，有语法错误时不保存并返回错误位置
+GET /api/strategy/timer 返回运行中策略定时器的状态（服务器时间偏差、触发延迟、触发到下单延迟）
+GET /api/strategy/rate_limit 返回请求限流的状态（当前分钟已用权重、等待中的请求、429 / 418 次数）
+GET /api/strategy/transport 返回共享连接池的状态（新建连接数、按接口的延迟直方图）
+/api/strategy/instances 管理多策略运行时中的策略实例（新增、删除、启动、停止、状态、各自的持仓），需要登录
+"""
+from flask import jsonify, request
+
+from api_extensions import guard_route, login_required, override_route
+from http_transport import get_http_transport
+from rate_limiter import get_rate_limiter
+from strategy_code_cache import validate_modules
+from strategy_host import get_strategy_host
+from strategy_worker import set_socketio
+from strategy_timer import timer_status
+
+
+def validate_strategy():
+    """保存策略前校验自定义策略代码，校验通过返回 None（继续保存）"""
+    data = request.get_json(silent=True) or {}
+    errors = validate_modules(data.get('modules', []))
+    if not errors:
+        return None
+    message = '; '.join(f"{e['name'] or '自定义策略'}(模块 {e['index'] + 1}) 第 {e['line']} 行: {e['error']}"
+                        for e in errors)
+    return jsonify({'success': False, 'message': f'自定义策略代码有语法错误: {message}', 'errors': errors}), 400
+
+
+def get_strategy_timer():
+    """运行中策略定时器的状态"""
+    return jsonify({'success': True, 'timers': timer_status()})
+
+
+def get_rate_limit():
+    """请求限流状态"""
+    return jsonify({'success': True, 'rate_limit': get_rate_limiter().status()})
+
+
+def get_transport():
+    """共享连接池状态和按接口的延迟分布"""
+    return jsonify({'success': True, 'transport': get_http_transport().status()})
+
+
+def list_instances():
+    """所有策略实例及运行状态"""
+    return jsonify({'success': True, 'instances': get_strategy_host().status()})
+
+
+def add_instance():
+    """新增策略实例 {id, file（strategies/ 下的策略文件名）, strategy_file（data/ 下的策略配置，可选）, name}"""
+    data = request.get_json(silent=True) or {}
+    if not data.get('id') or not data.get('file'):
+        return jsonify({'success': False, 'error': '缺少 id 或 file'}), 400
+    try:
+        slot = get_strategy_host().add(data['id'], data['file'], data.get('strategy_file'), data.get('name'))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True, 'instance': get_strategy_host().status(slot.id)[0]})
+
+
+def _instance_action(instance_id, action):
+    host = get_strategy_host()
+    try:
+        result = getattr(host, action)(instance_id)
+    except KeyError:
+        return jsonify({'success': False, 'error': f'策略实例 {instance_id} 不存在'}), 404
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+    if result is None:
+        return jsonify({'success': True})
+    return jsonify({'success': True, 'instance': host.status(instance_id)[0]})
+
+
+def get_instance(instance_id):
+    return _instance_action(instance_id, 'get')
+
+
+def delete_instance(instance_id):
+    return _instance_action(instance_id, 'remove')
+
+
+def start_instance(instance_id):
+    return _instance_action(instance_id, 'start')
+
+
+def stop_instance(instance_id):
+    return _instance_action(instance_id, 'stop')
+
+
+def get_instance_positions(instance_id):
+    """策略实例各自的当前持仓和最近的历史仓位"""
+    try:
+        store = get_strategy_host().get(instance_id).position_store
+    except KeyError:
+        return jsonify({'success': False, 'error': f'策略实例 {instance_id} 不存在'}), 404
+    history, total = store.query_history(page=1, page_size=request.args.get('limit', 50, type=int))
+    return jsonify({'success': True, 'current': store.load_current(), 'history': history, 'total': total})
+
+
+def register_strategy_routes(app, socketio=None):
+    set_socketio(socketio)
+    guard_route(app, '/api/strategy', ['POST'], validate_strategy)
+    override_route(app, '/api/strategy/timer', ['GET'], get_strategy_timer)
+    override_route(app, '/api/strategy/rate_limit', ['GET'], get_rate_limit)
+    override_route(app, '/api/strategy/transport', ['GET'], get_transport)
+    # 策略实例接口可以加载和启停策略，与原接口一样需要登录
+    auth = login_required(app)
+    app.add_url_rule('/api/strategy/instances', endpoint='ext_list_instances', view_func=auth(list_instances),
+                     methods=['GET'])
+    app.add_url_rule('/api/strategy/instances', endpoint='ext_add_instance', view_func=auth(add_instance),
+                     methods=['POST'])
+    app.add_url_rule('/api/strategy/instances/<instance_id>', endpoint='ext_get_instance',
+                     view_func=auth(get_instance), methods=['GET'])
+    app.add_url_rule('/api/strategy/instances/<instance_id>', endpoint='ext_delete_instance',
+                     view_func=auth(delete_instance), methods=['DELETE'])
+    app.add_url_rule('/api/strategy/instances/<instance_id>/start', endpoint='ext_start_instance',
+                     view_func=auth(start_instance), methods=['POST'])
+    app.add_url_rule('/api/strategy/instances/<instance_id>/stop', endpoint='ext_stop_instance',
+                     view_func=auth(stop_instance), methods=['POST'])
+    app.add_url_rule('/api/strategy/instances/<instance_id>/positions', endpoint='ext_get_instance_positions',
+                     view_func=auth(get_instance_positions), methods=['GET'])
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+自定义策略代码预编译
+custom_strategy 模块的代码用 compile() 编译为函数，编译结果按模块配置的哈希缓存；
+策略运行时每根K线检查 current_strategy.json，只替换代码有变化的函数，保存策略后下一根K线即生效，无需停止再启动。
+保存策略时先编译校验，语法错误直接返回给前端
+
+注册表按策略标识区分：生成的策略文件中保存 STRATEGY_ID、模块结构指纹 STRATEGY_FINGERPRINT 和生成时各自定义策略
+代码的哈希 CUSTOM_STRATEGY_HASHES。配置文件的模块结构与指纹不一致时（属于其他策略）不替换任何函数；
+策略启动时配置中已经与策略文件不同的代码也不使用（生成之后未重新生成），只有运行期间保存的修改才会替换，
+已替换的代码记录在 data/custom_strategies/<STRATEGY_ID>.json，工作进程重启后继续使用
+"""
+import hashlib
+import json
+import logging
+import math
+import os
+import textwrap
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+STRATEGY_FILE = os.path.join(DATA_DIR, 'current_strategy.json')
+# 运行期间已热更新的代码哈希（按策略标识）
+HOT_RELOAD_DIR = os.path.join(DATA_DIR, 'custom_strategies')
+
+# 自定义策略代码可用的全局变量（与生成的策略文件导入一致）
+STRATEGY_GLOBALS = {
+    'pd': pd, 'np': np, 'datetime': datetime, 'timedelta': timedelta, 'logging': logging,
+    'json': json, 'os': os, 'time': time, 'math': math, 'logger': logger,
+}
+
+# 运行期间读取（不生成到策略文件中）的模块配置项，修改后不需要重新生成策略
+RUNTIME_CONFIG_KEYS = {
+    'trade': ('fill_timeout_seconds', 'confirm_timeout_seconds'),
+}
+
+_code_cache = {}   # {哈希: code object}
+_code_cache_lock = threading.Lock()
+
+
+def config_hash(config, params):
+    """模块配置 + 函数参数的哈希"""
+    text = json.dumps({'config': config, 'params': list(params)}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def code_hash(code):
+    """自定义策略代码的哈希（忽略首尾空白）"""
+    return hashlib.sha256((code or '').strip().encode('utf-8')).hexdigest()[:16]
+
+
+def structure_fingerprint(modules):
+    """模块结构指纹：模块类型、顺序和除 custom_strategy 代码（code / mode）、RUNTIME_CONFIG_KEYS 以外的所有配置"""
+    items = []
+    for module in modules:
+        config = dict(module.get('config', {}))
+        if module.get('type') == 'custom_strategy':
+            config.pop('code', None)
+            config.pop('mode', None)
+        for key in RUNTIME_CONFIG_KEYS.get(module.get('type'), ()):
+            config.pop(key, None)
+        items.append({'type': module.get('type'), 'config': config})
+    text = json.dumps(items, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+
+def _source(code, params, name):
+    body = textwrap.indent(code.strip() or 'return None', '    ')
+    return f"def {name}({', '.join(params)}):\n{body}\n"
+
+
+def compile_code(code, params, name='custom_strategy'):
+    """编译为 code object（按哈希缓存），语法错误时抛出 SyntaxError（行号为用户代码中的行号）"""
+    key = config_hash({'code': code, 'name': name}, params)
+    with _code_cache_lock:
+        compiled = _code_cache.get(key)
+    if compiled is None:
+        try:
+            compiled = compile(_source(code, params, name), f'<{name}>', 'exec')
+        except SyntaxError as e:
+            # 去掉函数头占用的一行
+            if e.lineno:
+                e.lineno -= 1
+            raise
+        with _code_cache_lock:
+            _code_cache[key] = compiled
+    return compiled
+
+
+def compile_custom_strategy(code, params, name='custom_strategy'):
+    """把 custom_strategy 模块的代码编译为函数 name(*params)"""
+    namespace = dict(STRATEGY_GLOBALS)
+    exec(compile_code(code, params, name), namespace)
+    return namespace[name]
+
+
+def custom_strategy_params(modules):
+    """
+    每个 custom_strategy 模块的函数参数 {模块下标: [参数名]}（与生成的策略方法签名一致）
+
+    标的选择之前为全局策略: (klines_{标的}_{周期}..., indicators)；之后再加上 klines_{周期}
+    """
+    global_klines, symbol_klines, per_symbol = [], [], False
+    result = {}
+    for index, module in enumerate(modules):
+        module_type, config = module.get('type'), module.get('config', {})
+        if module_type == 'kline':
+            interval = config.get('interval', '5m')
+            if config.get('source_type') == 'custom_symbol' and config.get('custom_symbol'):
+                global_klines.append(f"klines_{config['custom_symbol']}_{interval}")
+            else:
+                symbol_klines.append(f'klines_{interval}')
+        elif module_type == 'symbol':
+            per_symbol = True
+        elif module_type == 'custom_strategy':
+            result[index] = global_klines + (symbol_klines if per_symbol else []) + ['indicators']
+    return result
+
+
+def validate_modules(modules):
+    """编译校验所有 custom_strategy 模块，返回错误列表 [{'index', 'name', 'line', 'error'}]"""
+    errors = []
+    for index, params in custom_strategy_params(modules).items():
+        module = modules[index]
+        try:
+            compile_code(module.get('config', {}).get('code', ''), params, f'custom_strategy_{index}')
+        except SyntaxError as e:
+            errors.append({'index': index, 'name': module.get('name', ''), 'line': e.lineno, 'error': e.msg})
+    return errors
+
+
+class CustomStrategyRegistry:
+    """
+    某个策略的自定义策略函数：按配置文件维护已编译的函数，文件变化时只替换有变化的函数
+
+    fingerprint / baked 为策略文件中的 STRATEGY_FINGERPRINT / CUSTOM_STRATEGY_HASHES；
+    get 返回 None 时使用策略文件中生成的方法
+    """
+
+    def __init__(self, strategy_id, fingerprint, baked, strategy_file=STRATEGY_FILE, state_dir=HOT_RELOAD_DIR):
+        self.strategy_id = strategy_id
+        self.fingerprint = fingerprint
+        self.baked = {int(k): v for k, v in (baked or {}).items()}
+        self.strategy_file = strategy_file
+        self.state_file = os.path.join(state_dir, f'{strategy_id}.json')
+        self._functions = {}   # {模块下标: (哈希, 参数, 函数, 模式)}
+        self._module_configs = {}   # {模块类型: 配置}，运行期间可调整的参数（如交易模块的等待时间）
+        self._initial = None   # 启动时配置中的代码哈希 {模块下标: 哈希}
+        self._accepted = self._load_accepted()   # 运行期间保存过的代码哈希 {模块下标: 哈希}
+        self._mtime = None
+        self._mismatch_logged = False
+        self._lock = threading.Lock()
+        self.reload_if_changed()
+
+    def _load_accepted(self):
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                data = json.load(f).get(self.strategy_file, {})
+            return {int(k): v for k, v in data.items()}
+        except (OSError, ValueError, AttributeError):
+            return {}
+
+    def _save_accepted(self):
+        try:
+            try:
+                with open(self.state_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                data = {}
+            data[self.strategy_file] = {str(k): v for k, v in self._accepted.items()}
+            os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+            tmp_file = f'{self.state_file}.{os.getpid()}.tmp'
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_file, self.state_file)
+        except Exception as e:
+            logger.error(f"保存自定义策略热更新记录失败: {e}")
+
+    def _should_swap(self, index, code_key):
+        """配置中的代码是否应替换策略文件中的方法"""
+        if code_key == self.baked.get(index):
+            return False
+        # 运行期间保存的修改，或之前运行时已接受的修改
+        return code_key != self._initial.get(index) or code_key == self._accepted.get(index)
+
+    def reload_if_changed(self):
+        """策略文件有变化时重新加载，返回被替换的模块下标列表"""
+        try:
+            mtime = os.stat(self.strategy_file).st_mtime_ns
+        except OSError:
+            return []
+        if mtime == self._mtime:
+            return []
+        try:
+            with open(self.strategy_file, 'r', encoding='utf-8') as f:
+                modules = json.load(f).get('modules', [])
+        except Exception as e:
+            logger.error(f"读取策略配置失败，继续使用当前自定义策略: {e}")
+            return []
+        swapped = []
+        with self._lock:
+            first_load = self._mtime is None
+            self._mtime = mtime
+            if structure_fingerprint(modules) != self.fingerprint:
+                # 配置属于其他策略（或模块结构已修改，需要重新生成策略文件），全部使用策略文件中的方法
+                if not self._mismatch_logged:
+                    logger.warning(f"策略配置 {os.path.basename(self.strategy_file)} 的模块结构与策略 "
+                                   f"{self.strategy_id} 不一致，不热更新自定义策略（重新生成策略后生效）")
+                    self._mismatch_logged = True
+                if self._initial is None:
+                    # 之后切换回本策略的配置视为运行期间的保存
+                    self._initial = {}
+                self._functions = {}
+                self._module_configs = {}
+                return []
+            self._mismatch_logged = False
+            configs = {}
+            for module in modules:
+                configs.setdefault(module.get('type'), module.get('config', {}))
+            self._module_configs = configs
+            params_map = custom_strategy_params(modules)
+            codes = {i: code_hash(modules[i].get('config', {}).get('code', '')) for i in params_map}
+            if self._initial is None:
+                self._initial = codes
+                pending = [i for i, key in codes.items() if key != self.baked.get(i) and not self._should_swap(i, key)]
+                if pending:
+                    logger.warning(f"策略配置中 {[f'custom_strategy_{i}' for i in pending]} 的代码与策略 "
+                                   f"{self.strategy_id} 生成时不同，使用策略文件中的代码（运行期间再次保存后生效）")
+            functions = {}
+            accepted = dict(self._accepted)
+            for index, params in params_map.items():
+                config = modules[index].get('config', {})
+                if not self._should_swap(index, codes[index]):
+                    accepted.pop(index, None)
+                    continue
+                key = config_hash(config, params)
+                current = self._functions.get(index)
+                if current and current[0] == key:
+                    functions[index] = current
+                    continue
+                try:
+                    func = compile_custom_strategy(config.get('code', ''), params, f'custom_strategy_{index}')
+                except SyntaxError as e:
+                    logger.error(f"custom_strategy_{index} 第 {e.lineno} 行语法错误，继续使用原代码: {e.msg}")
+                    if current:
+                        functions[index] = current
+                    continue
+                functions[index] = (key, params, func, config.get('mode', 'row'))
+                accepted[index] = codes[index]
+                swapped.append(index)
+            self._functions = functions
+            changed = accepted != self._accepted
+            self._accepted = accepted
+        if changed:
+            self._save_accepted()
+        if swapped and not first_load:
+            logger.info(f"自定义策略已热更新: {[f'custom_strategy_{i}' for i in swapped]}")
+        return swapped
+
+    def get(self, index, params):
+        """模块下标对应的函数；未替换或参数与生成的方法签名不一致（模块结构已改变）时返回 None"""
+        with self._lock:
+            item = self._functions.get(index)
+        if item is None or list(item[1]) != list(params):
+            return None
+        return item[2]
+
+    def module_config(self, module_type):
+        """配置中第一个 module_type 模块的配置（配置属于其他策略时为空字典），用于读取运行期间可调整的参数"""
+        with self._lock:
+            return dict(self._module_configs.get(module_type, {}))
+
+    def mode(self, index):
+        """模块的调用模式：row（逐个标的调用）或 vector（所有标的一次调用），未替换时为 row"""
+        with self._lock:
+            item = self._functions.get(index)
+        return item[3] if item else 'row'
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_custom_strategies(strategy_id, fingerprint, baked, strategy_file=None):
+    """
+    获取（必要时创建）策略 strategy_id 的自定义策略注册表
+
+    fingerprint / baked 为策略文件中的 STRATEGY_FINGERPRINT / CUSTOM_STRATEGY_HASHES，
+    strategy_file 为策略配置文件（默认为 data/current_strategy.json）
+    """
+    strategy_file = strategy_file or STRATEGY_FILE
+    key = (strategy_id, fingerprint, strategy_file)
+    with _registries_lock:
+        registry = _registries.get(key)
+        if registry is None:
+            registry = CustomStrategyRegistry(strategy_id, fingerprint, baked, strategy_file)
+            _registries[key] = registry
+        return registry
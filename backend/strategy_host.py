@@ -0,0 +1,559 @@
+# -*- coding: utf-8 -*-
+"""
+多策略运行时
+在同一进程中运行多个生成的策略（strategies/ 下的策略文件）:
+- 所有策略共用一个行情客户端 SharedMarketClient：K线缓存、行情快照、交易对精度等按客户端共享的数据只初始化一次，
+  涨幅榜、K线等只读接口在同一根K线内相同参数只请求一次，结果分发给所有策略；
+  策略通过 get_kline_cache(client) 得到的是共享代理 SharedKlineCache，K线缓存的读取同样按K线共享
+- 定时周期和触发模式相同的策略共用一个定时器，定时器运行在进程内共享的事件循环上（不占用线程），触发后并发执行：
+  异步模式（EXECUTION_MODE = 'async'）的策略在循环上交错执行，同步模式的策略各占线程池的一个线程（见 async_runtime）
+- 每个策略有独立的仓位存储 data/strategies/<id>/positions.db 和策略配置（自定义策略热更新）
+- 默认 isolation 为 thread；data/config.json 中 strategy_isolation 为 process 时每个策略在独立的工作进程中运行
+  （见 strategy_worker），由监督线程负责预算、重启和停止，此时行情数据只在各进程内共享
+
+策略实例保存在 data/strategy_instances.json，通过 /api/strategy/instances 接口增删和启停；
+实例的策略配置只能是 data/current_strategy.json 或 data/strategy_configs/ 中的 .json 文件
+"""
+import asyncio
+import importlib.util
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from async_runtime import ASYNC_MODE, SYNC_MODE, execution_mode
+from client_registry import close_client
+from http_transport import warm_up
+from position_store import get_position_store
+from strategy_timer import BEFORE_CLOSE, StrategyTimer, get_server_clock
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(BASE_DIR, 'data')
+STRATEGIES_DIR = os.path.join(BASE_DIR, 'strategies')
+INSTANCES_FILE = os.path.join(DATA_DIR, 'strategy_instances.json')
+CONFIG_FILE = os.path.join(DATA_DIR, 'config.json')
+
+# 策略配置：默认的 current_strategy.json，其余配置放在 strategy_configs/ 中
+DEFAULT_STRATEGY_CONFIG = 'current_strategy.json'
+STRATEGY_CONFIGS_DIR = os.path.join(DATA_DIR, 'strategy_configs')
+
+# 同一根K线内共享结果的只读行情接口
+SHARED_METHODS = ('get_top_gainers', 'get_klines')
+
+# 共享结果的有效期（秒），没有定时器触发时（如手动运行）按时间失效
+DEFAULT_SHARED_TTL = 30
+
+# 运行方式：thread 为同一进程内共享行情，process 为每个策略一个工作进程
+THREAD_ISOLATION = 'thread'
+PROCESS_ISOLATION = 'process'
+
+# 策略未定义 TIMER_CONFIG 且配置中没有定时模块时的默认定时
+DEFAULT_TIMER = {'interval': '5m', 'offset_seconds': 5, 'mode': BEFORE_CLOSE, 'trigger_symbol': 'BTCUSDT'}
+
+
+class SharedMarketClient:
+    """
+    多个策略共用的客户端代理
+
+    SHARED_METHODS 中的只读接口按 (方法, 参数) 缓存到下一次 new_bar（或超过有效期），
+    并发的相同请求只发送一次；其余属性和方法（下单、撤单、.client 等）直接转发给原客户端
+    """
+
+    def __init__(self, client, ttl=DEFAULT_SHARED_TTL):
+        self._target = client
+        self._ttl = ttl
+        self._results = {}   # {键: (结果, 时间)}
+        self._pending = {}   # {键: Event}
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'shared': 0}
+
+    def new_bar(self):
+        """新的K线开始，清空共享结果"""
+        with self._lock:
+            self._results.clear()
+
+    def _call(self, name, args, kwargs, func=None):
+        """按 (名称, 参数) 共享 func（默认为原客户端的同名方法）的结果"""
+        key = (name, args, tuple(sorted(kwargs.items())))
+        while True:
+            with self._lock:
+                item = self._results.get(key)
+                if item is not None and time.time() - item[1] < self._ttl:
+                    self.stats['shared'] += 1
+                    return item[0]
+                event = self._pending.get(key)
+                if event is None:
+                    event = self._pending[key] = threading.Event()
+                    break
+            # 其他策略正在请求，等待结果（请求失败时由本线程重试）
+            event.wait()
+        try:
+            result = (func or getattr(self._target, name))(*args, **kwargs)
+            with self._lock:
+                self._results[key] = (result, time.time())
+                self.stats['requests'] += 1
+            return result
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+            event.set()
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        attr = getattr(self._target, name)
+        if name in SHARED_METHODS and callable(attr):
+            return lambda *args, **kwargs: self._call(name, args, kwargs)
+        return attr
+
+
+class SharedKlineCache:
+    """
+    多个策略共用的K线缓存代理
+
+    get_klines 与 SharedMarketClient 的只读接口共用结果：同一根K线内相同参数只读取一次，
+    缓存断线或过期需要通过 REST 重新初始化时，多个策略读取同一标的也只请求一次；其余方法直接转发给K线缓存
+    """
+
+    def __init__(self, cache, shared):
+        self._cache = cache
+        self._shared = shared
+
+    def get_klines(self, symbol, interval, limit=500, end_time=None):
+        return self._shared._call('kline_cache.get_klines', (symbol, interval, limit), {'end_time': end_time},
+                                  self._cache.get_klines)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self._cache, name)
+
+
+def resolve_strategy_file(file):
+    """
+    strategies/ 下的策略文件名 -> 绝对路径
+
+    只接受不含目录的 .py 文件名，且解析链接后仍位于 strategies/ 中（拒绝绝对路径、.. 和指向外部的链接），
+    防止通过接口加载执行任意文件
+    """
+    name = str(file or '')
+    if not name.endswith('.py') or os.path.basename(name) != name or '\\' in name or name.startswith('.'):
+        raise ValueError(f"策略文件不合法（只能是 strategies/ 下的文件名）: {file}")
+    root = os.path.realpath(STRATEGIES_DIR)
+    path = os.path.realpath(os.path.join(root, name))
+    if not path.startswith(root + os.sep):
+        raise ValueError(f"策略文件不在 strategies/ 目录中: {file}")
+    return path
+
+
+def resolve_config_file(file):
+    """
+    策略配置文件 -> 绝对路径
+
+    只接受 data/current_strategy.json 和 data/strategy_configs/ 中的 .json 文件（文件名按 strategy_configs/ 解析），
+    data/ 下的 config.json（API Key）、仓位、策略实例等文件不能作为策略配置
+    """
+    if not file:
+        return None
+    name = str(file)
+    default = os.path.join(os.path.realpath(DATA_DIR), DEFAULT_STRATEGY_CONFIG)
+    if name == DEFAULT_STRATEGY_CONFIG:
+        return default
+    root = os.path.realpath(STRATEGY_CONFIGS_DIR)
+    path = os.path.realpath(os.path.join(root, name))
+    if path != default and not (path.endswith('.json') and path.startswith(root + os.sep)):
+        raise ValueError(f"策略配置文件只能是 data/{DEFAULT_STRATEGY_CONFIG} 或 data/strategy_configs/ 中的 .json 文件: {file}")
+    return path
+
+
+def load_strategy_module(path, name):
+    """按文件路径加载生成的策略模块"""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _timer_config(module, strategy_file):
+    """定时配置：优先使用策略文件中的 TIMER_CONFIG，其次为策略配置中的定时模块"""
+    config = dict(DEFAULT_TIMER)
+    timer = getattr(module, 'TIMER_CONFIG', None)
+    if timer is None and strategy_file and os.path.exists(strategy_file):
+        try:
+            with open(strategy_file, 'r', encoding='utf-8') as f:
+                modules = json.load(f).get('modules', [])
+            timer = next((m.get('config', {}) for m in modules if m.get('type') == 'timer'), None)
+        except Exception as e:
+            logger.warning(f"读取 {strategy_file} 定时配置失败，使用默认定时: {e}")
+    if timer:
+        config.update({k: v for k, v in timer.items() if k in config})
+        if timer.get('trigger_mode'):
+            config['mode'] = timer['trigger_mode']
+    return config
+
+
+class StrategySlot:
+    """
+    一个策略实例（同时作为生成策略的 runner 和 timer）
+
+    生成的策略通过 runner.position_store / runner.strategy_file 使用独立的仓位存储和配置，
+    通过 timer.bar_close_time / timer.record_order 获取触发的K线和记录下单延迟
+    """
+
+    def __init__(self, instance_id, file, strategy_file=None, name=None, data_dir=None, history_size=100):
+        self.id = instance_id
+        self.name = name or instance_id
+        resolve_strategy_file(file)
+        self.file = file
+        self.strategy_file = resolve_config_file(strategy_file)
+        self.data_dir = data_dir or os.path.join(DATA_DIR, 'strategies', instance_id)
+        self.position_store = get_position_store(os.path.join(self.data_dir, 'positions.db'))
+        self.running = False
+        self.strategy_instance = None
+        self.module = None
+        self.timer_config = None
+        self.execution = SYNC_MODE
+        self.bar_close_time = None
+        self.runs = deque(maxlen=history_size)
+        self.stats = {'runs': 0, 'errors': 0}
+        self.started_at = None
+        self.stop_event = threading.Event()   # 停止信号（代替轮询 running 标志）
+        self.run_listeners = []   # [callback(event, record)]，event 为 start / end
+        self._current = None
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        return resolve_strategy_file(self.file)
+
+    def load(self, client, config):
+        """加载策略文件并创建策略实例"""
+        self.module = load_strategy_module(self.path, f'strategy_instance_{self.id}')
+        self.timer_config = _timer_config(self.module, self.strategy_file)
+        self.execution = execution_mode(self.module)
+        self.strategy_instance = self.module.Strategy(client, config, self)
+        self.strategy_instance.timer = self
+        self.strategy_instance.scheduler = None
+
+    def _begin(self, bar_close_time, triggered_at):
+        record = {'bar_close_time': bar_close_time, 'started_ms': round((time.time() - triggered_at) * 1000, 1),
+                  'first_order_ms': None, 'order_latency_ms': None, 'orders': 0, 'run_seconds': None, 'error': None}
+        with self._lock:
+            self.bar_close_time = bar_close_time
+            self._current = (record, triggered_at)
+        self._notify('start', record)
+        return record
+
+    def _end(self, record, start, error=None):
+        if error is not None:
+            record['error'] = str(error)
+            logger.error(f"策略 {self.id} 运行出错: {error}")
+        with self._lock:
+            self._current = None
+        record['run_seconds'] = round(time.time() - start, 3)
+        self.add_run(record)
+        self._notify('end', record)
+
+    def run(self, bar_close_time, triggered_at):
+        """执行一次策略（triggered_at 为定时器触发时的 time.time()）"""
+        start = time.time()
+        record = self._begin(bar_close_time, triggered_at)
+        error = None
+        try:
+            self.strategy_instance.run()
+        except Exception as e:
+            error = e
+        finally:
+            self._end(record, start, error)
+
+    async def arun(self, bar_close_time, triggered_at):
+        """异步模式：在共享事件循环上执行一次 run_async"""
+        start = time.time()
+        record = self._begin(bar_close_time, triggered_at)
+        error = None
+        try:
+            await self.strategy_instance.run_async()
+        except Exception as e:
+            error = e
+        finally:
+            self._end(record, start, error)
+
+    def add_run(self, record):
+        """记录一次运行结果（进程隔离时由监督进程根据子进程上报的记录调用）"""
+        self.stats['runs'] += 1
+        if record.get('error'):
+            self.stats['errors'] += 1
+        self.runs.append(record)
+
+    def _notify(self, event, record):
+        for callback in self.run_listeners:
+            try:
+                callback(event, record)
+            except Exception as e:
+                logger.error(f"策略运行回调出错: {e}")
+
+    def record_order(self, sent_at, count=1):
+        """记录下单（与 StrategyTimer.record_order 一致，延迟从共用定时器触发时算起）"""
+        with self._lock:
+            if self._current is None:
+                return
+            record, triggered_at = self._current
+            if record['first_order_ms'] is None:
+                record['first_order_ms'] = round((sent_at - triggered_at) * 1000, 1)
+            record['order_latency_ms'] = round((time.time() - triggered_at) * 1000, 1)
+            record['orders'] += count
+
+    def to_dict(self):
+        return {'id': self.id, 'name': self.name, 'file': self.file, 'strategy_file': self.strategy_file}
+
+    def status(self):
+        return dict(self.to_dict(), running=self.running, started_at=self.started_at,
+                    timer=self.timer_config, execution=self.execution, stats=dict(self.stats),
+                    current_positions=len(self.position_store.load_current()), runs=list(self.runs)[-20:])
+
+
+class _TimerGroup:
+    """定时配置相同的一组策略，共用一个定时器"""
+
+    def __init__(self, host, key, config):
+        self.host = host
+        self.key = key
+        self.slots = {}
+        self.timer = StrategyTimer(self._run, interval=config['interval'], offset_seconds=config['offset_seconds'],
+                                   mode=config['mode'], clock=host.clock, kline_cache=host.kline_cache,
+                                   trigger_symbol=config['trigger_symbol'], name='/'.join(str(k) for k in key),
+                                   warmup=lambda: warm_up(host.client))
+
+    async def _run(self):
+        """定时器在共享事件循环上触发：异步模式的策略在循环上交错执行，同步模式的策略各占一个线程"""
+        triggered_at = time.time()
+        bar_close_time = self.timer.bar_close_time
+        slots = list(self.slots.values())
+        if not slots:
+            return
+        self.host.client.new_bar()
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(slot.arun(bar_close_time, triggered_at) if slot.execution == ASYNC_MODE
+                               else loop.run_in_executor(self.host.executor, slot.run, bar_close_time, triggered_at)
+                               for slot in slots))
+        logger.info(f"定时器 {self.timer.name}: {len(slots)} 个策略执行完成, 耗时 {time.time() - triggered_at:.2f}s, "
+                    f"共享请求 {self.host.client.stats}")
+
+
+class StrategyHost:
+    """
+    多策略运行时
+
+    client 为空时由 client_factory() -> (client, config) 在首次需要时创建；
+    进程隔离模式下 client_factory 会传给子进程（需可序列化），worker_options 为 StrategyWorker 的预算等参数
+    """
+
+    def __init__(self, client=None, config=None, instances_file=INSTANCES_FILE, max_workers=16,
+                 isolation=THREAD_ISOLATION, client_factory=None, worker_options=None):
+        if isolation not in (THREAD_ISOLATION, PROCESS_ISOLATION):
+            raise ValueError(f"不支持的运行方式: {isolation}")
+        self._client = client
+        self.client_factory = client_factory or _default_client
+        self.config = config
+        self.instances_file = instances_file
+        self.isolation = isolation
+        self.worker_options = worker_options or {}
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='strategy')
+        self.slots = {}
+        self.groups = {}   # {定时配置: _TimerGroup}
+        self.workers = {}  # {实例ID: StrategyWorker}
+        self._kline_cache = None
+        self._clock = None
+        self._lock = threading.RLock()
+        self._load_instances()
+
+    # 共享服务（与单策略运行时一样按客户端获取，所有策略共用）
+
+    @property
+    def client(self):
+        if not isinstance(self._client, SharedMarketClient):
+            if self._client is None:
+                self._client, config = self.client_factory()
+                if self.config is None:
+                    self.config = config
+            self._client = SharedMarketClient(self._client)
+        return self._client
+
+    @property
+    def kline_cache(self):
+        if self._kline_cache is None:
+            from kline_cache import create_kline_cache, get_kline_cache
+            client = self.client
+            self._kline_cache = get_kline_cache(client, lambda: SharedKlineCache(create_kline_cache(client), client))
+        return self._kline_cache
+
+    @property
+    def clock(self):
+        if self._clock is None:
+            self._clock = get_server_clock(self.client)
+        return self._clock
+
+    # ==================== 实例管理 ====================
+
+    def _load_instances(self):
+        if not self.instances_file or not os.path.exists(self.instances_file):
+            return
+        try:
+            with open(self.instances_file, 'r', encoding='utf-8') as f:
+                items = json.load(f)
+        except Exception as e:
+            logger.error(f"读取策略实例失败: {e}")
+            return
+        for item in items:
+            try:
+                self.slots[item['id']] = StrategySlot(item['id'], item['file'], item.get('strategy_file'),
+                                                      item.get('name'))
+            except ValueError as e:
+                logger.error(f"跳过策略实例 {item.get('id')}: {e}")
+
+    def _save_instances(self):
+        if not self.instances_file:
+            return
+        os.makedirs(os.path.dirname(self.instances_file), exist_ok=True)
+        tmp = self.instances_file + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump([s.to_dict() for s in self.slots.values()], f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.instances_file)
+
+    def add(self, instance_id, file, strategy_file=None, name=None):
+        with self._lock:
+            if not isinstance(instance_id, str) or not instance_id:
+                raise ValueError(f"策略实例 ID 必须为非空字符串: {instance_id!r}")
+            if instance_id in self.slots:
+                raise ValueError(f"策略实例 {instance_id} 已存在")
+            if '/' in instance_id or '\\' in instance_id or instance_id.startswith('.'):
+                raise ValueError(f"策略实例 ID 不合法: {instance_id}")
+            slot = StrategySlot(instance_id, file, strategy_file, name)
+            if not os.path.exists(slot.path):
+                raise ValueError(f"策略文件不存在: {file}")
+            self.slots[instance_id] = slot
+            self._save_instances()
+            return slot
+
+    def remove(self, instance_id):
+        with self._lock:
+            self.stop(instance_id)
+            self.slots.pop(instance_id)
+            self._save_instances()
+
+    def get(self, instance_id):
+        slot = self.slots.get(instance_id)
+        if slot is None:
+            raise KeyError(f"策略实例 {instance_id} 不存在")
+        return slot
+
+    # ==================== 启停 ====================
+
+    def start(self, instance_id):
+        with self._lock:
+            slot = self.get(instance_id)
+            if slot.running:
+                return slot
+            slot.stop_event.clear()
+            if self.isolation == PROCESS_ISOLATION:
+                from strategy_worker import StrategyWorker
+                worker = StrategyWorker(slot, self.config, self.client_factory, **self.worker_options)
+                self.workers[instance_id] = worker
+                worker.start()
+                slot.running = True
+                slot.started_at = time.time()
+                logger.info(f"策略实例 {instance_id} 已在工作进程中启动（{slot.file}）")
+                return slot
+            # 先注册共享K线缓存，策略中的 get_kline_cache(client) 才会得到同一个代理
+            self.kline_cache
+            slot.load(self.client, self.config or {})
+            config = slot.timer_config
+            key = (config['interval'], config['mode'], float(config['offset_seconds']), config['trigger_symbol'])
+            group = self.groups.get(key)
+            if group is None:
+                group = _TimerGroup(self, key, config)
+                self.groups[key] = group
+                group.timer.start()
+            group.slots[instance_id] = slot
+            slot.running = True
+            slot.started_at = time.time()
+            logger.info(f"策略实例 {instance_id} 已启动（{slot.file}, 定时 {key}）")
+            return slot
+
+    def stop(self, instance_id):
+        with self._lock:
+            slot = self.get(instance_id)
+            if not slot.running:
+                return slot
+            slot.running = False
+            slot.stop_event.set()
+            worker = self.workers.pop(instance_id, None)
+            if worker is not None:
+                worker.stop()
+            for key, group in list(self.groups.items()):
+                if group.slots.pop(instance_id, None) is not None and not group.slots:
+                    group.timer.stop()
+                    del self.groups[key]
+            logger.info(f"策略实例 {instance_id} 已停止")
+            return slot
+
+    def stop_all(self):
+        for instance_id in list(self.slots):
+            self.stop(instance_id)
+
+    def close(self, wait=True):
+        """停止所有实例，等待进行中的运行结束，并释放共享客户端的行情服务（K线缓存、行情快照、订单跟踪等）"""
+        self.stop_all()
+        self.executor.shutdown(wait=wait)
+        if isinstance(self._client, SharedMarketClient):
+            close_client(self._client)
+        self._kline_cache = None
+        self._clock = None
+
+    def status(self, instance_id=None):
+        """所有实例（或指定实例）的状态，进程隔离时包含工作进程状态"""
+        slots = [self.get(instance_id)] if instance_id else self.slots.values()
+        result = []
+        for slot in slots:
+            item = slot.status()
+            worker = self.workers.get(slot.id)
+            item['isolation'] = self.isolation
+            item['worker'] = worker.status() if worker else None
+            result.append(item)
+        return result
+
+
+def _default_client():
+    """使用 data/config.json 中的 API Key 创建交易客户端（共享连接池、请求限流）"""
+    from binance_client import BinanceClient
+    from http_transport import install_transport
+    from rate_limiter import install_rate_limiter
+    with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    client = BinanceClient(config.get('binance_api_key'), config.get('binance_api_secret'))
+    install_transport(client)
+    install_rate_limiter(client)
+    return client, config
+
+
+_host = None
+_host_lock = threading.Lock()
+
+
+def get_strategy_host():
+    """全局多策略运行时（默认在 Web 服务进程内运行，data/config.json 中 strategy_isolation 为 process 时每个策略一个工作进程）"""
+    global _host
+    with _host_lock:
+        if _host is None:
+            try:
+                with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+                    isolation = json.load(f).get('strategy_isolation', THREAD_ISOLATION)
+            except Exception:
+                isolation = THREAD_ISOLATION
+            _host = StrategyHost(isolation=isolation)
+        return _host
@@ -0,0 +1,480 @@
+# -*- coding: utf-8 -*-
+"""
+策略定时器
+按币安服务器时间触发策略（通过 /fapi/v1/time 测量本地时钟偏差，定期重新同步），支持两种触发模式:
+- before_close: K线收盘前 offset_seconds 秒触发（原 cron 定时的行为，但不受本地时钟偏差影响）
+- kline_close:  收到触发标的K线收盘推送（x 为 true）后立即触发，超过 close_timeout_seconds 仍未收到时按时间兜底触发
+
+每次运行记录触发延迟（相对计划时间）、触发到下单的延迟和运行耗时，可通过 GET /api/strategy/timer 查看；
+设置 warmup 时在计划触发前 warmup_seconds 秒调用（如预热 HTTP 连接，见 http_transport）；
+job 为协程函数（异步模式策略的 run_async）时定时器和 job 都在共享事件循环上运行，不占用定时器线程（见 async_runtime）
+
+用法（生成的策略代码中）:
+    timer = StrategyTimer(strategy.run, interval='5m', offset_seconds=5, mode='kline_close',
+                          clock=get_server_clock(binance_client), kline_cache=strategy.kline_cache)
+    strategy.timer = timer
+    timer.start()
+    ...
+    timer.record_order(sent_at, len(orders))   # 下单后记录
+"""
+import asyncio
+import inspect
+import logging
+import threading
+import time
+import weakref
+from collections import deque
+
+from async_runtime import get_async_runtime, to_thread
+from client_registry import ClientRegistry
+from kline_cache import INTERVAL_MS
+
+logger = logging.getLogger(__name__)
+
+# 触发模式
+BEFORE_CLOSE = 'before_close'
+KLINE_CLOSE = 'kline_close'
+TRIGGER_MODES = (BEFORE_CLOSE, KLINE_CLOSE)
+
+# 服务器时间重新同步的间隔（秒）
+DEFAULT_SYNC_INTERVAL = 300
+
+# kline_close 模式下等待收盘推送的最长时间（秒），超过后按时间触发
+DEFAULT_CLOSE_TIMEOUT = 3
+
+# 在计划触发前多少秒调用 warmup
+DEFAULT_WARMUP_SECONDS = 3
+
+# 周线从周一 00:00 (UTC) 开始，1970-01-01 为周四
+_WEEK_ORIGIN_MS = 4 * 86400000
+
+
+class ServerClock:
+    """
+    服务器时钟
+
+    多次请求 /fapi/v1/time，取往返时间最短的一次估算偏差: offset = serverTime - (发送时间 + 接收时间) / 2
+    """
+
+    def __init__(self, client, sync_interval=DEFAULT_SYNC_INTERVAL, samples=3):
+        self.client = client
+        self.sync_interval = sync_interval
+        self.samples = samples
+        self.offset_ms = 0
+        self.rtt_ms = None
+        self.synced_at = 0
+        self._lock = threading.Lock()
+
+    def sync(self):
+        """测量本地时钟偏差，失败时保留上一次的结果"""
+        best = None
+        for _ in range(self.samples):
+            try:
+                sent = time.time()
+                server_time = int(self.client.client.time()['serverTime'])
+                received = time.time()
+            except Exception as e:
+                logger.warning(f"获取服务器时间失败: {e}")
+                continue
+            rtt = (received - sent) * 1000
+            if best is None or rtt < best[0]:
+                best = (rtt, server_time - (sent + received) / 2 * 1000)
+        if best is None:
+            return False
+        with self._lock:
+            self.rtt_ms, self.offset_ms = round(best[0], 1), round(best[1], 1)
+            self.synced_at = time.time()
+        logger.info(f"服务器时间已同步: 本地时钟偏差 {self.offset_ms:+.1f}ms, 往返 {self.rtt_ms:.1f}ms")
+        return True
+
+    def sync_if_due(self):
+        if time.time() - self.synced_at >= self.sync_interval:
+            self.sync()
+
+    def now_ms(self):
+        """当前服务器时间（毫秒）"""
+        return time.time() * 1000 + self.offset_ms
+
+    def to_local(self, server_ms):
+        """服务器时间（毫秒）对应的本地时间戳（秒）"""
+        return (server_ms - self.offset_ms) / 1000
+
+
+def next_close_time(now_ms, interval):
+    """now_ms 之后（不含）最近的K线收盘边界（毫秒，即下一根K线的开盘时间）"""
+    step = INTERVAL_MS[interval]
+    origin = _WEEK_ORIGIN_MS if interval == '1w' else 0
+    return ((int(now_ms) - origin) // step + 1) * step + origin
+
+
+class StrategyTimer:
+    """
+    按K线周期触发 job 的定时器
+
+    同步 job 在定时器的后台线程中执行；job 为协程函数时定时器作为任务运行在共享事件循环上，不占用线程
+    （时钟同步和预热放到运行时的线程池）。上一次尚未结束时错过的触发会被跳过（与原调度器 max_instances=1 一致）；
+    bar_close_time 为本次触发对应的K线收盘边界（毫秒），可传给 get_klines(end_time=...)
+    """
+
+    def __init__(self, job, interval='5m', offset_seconds=5, mode=BEFORE_CLOSE, clock=None, kline_cache=None,
+                 trigger_symbol='BTCUSDT', close_timeout=DEFAULT_CLOSE_TIMEOUT, name='strategy', history_size=100,
+                 warmup=None, warmup_seconds=DEFAULT_WARMUP_SECONDS):
+        if interval not in INTERVAL_MS:
+            raise ValueError(f"不支持的定时周期: {interval}")
+        if mode not in TRIGGER_MODES:
+            raise ValueError(f"不支持的触发模式: {mode}")
+        if mode == KLINE_CLOSE and kline_cache is None:
+            raise ValueError("kline_close 模式需要K线缓存")
+        self.job = job
+        self.interval = interval
+        self.offset_ms = int(float(offset_seconds or 0) * 1000)
+        self.mode = mode
+        self.clock = clock
+        self.kline_cache = kline_cache
+        self.trigger_symbol = trigger_symbol
+        self.close_timeout = close_timeout
+        self.name = name
+        self.warmup = warmup
+        self.warmup_ms = int(float(warmup_seconds or 0) * 1000)
+        self.bar_close_time = None
+        self.runs = deque(maxlen=history_size)
+        self.stats = {'runs': 0, 'skipped': 0, 'fallbacks': 0, 'errors': 0, 'warmups': 0}
+        self._current = None
+        self._last_close = None
+        self._closed = {}   # {收盘边界: 收到推送的本地时间}
+        self._closed_event = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._task = None     # 异步 job 时定时器在共享事件循环上运行的任务
+        self._wakeup = None   # 事件循环上等待用的 asyncio.Event
+        self._lock = threading.Lock()
+
+    # ==================== 时间 ====================
+
+    def _now_ms(self):
+        return self.clock.now_ms() if self.clock else time.time() * 1000
+
+    def _to_local(self, server_ms):
+        return self.clock.to_local(server_ms) if self.clock else server_ms / 1000
+
+    def _sleep_until(self, server_ms):
+        """等待到服务器时间 server_ms，返回是否被停止"""
+        return self._stop.wait(max(0, self._to_local(server_ms) - time.time()))
+
+    # ==================== 启停 ====================
+
+    @property
+    def is_async(self):
+        """job 为协程函数时定时器本身也在共享事件循环上运行，不占用线程"""
+        return inspect.iscoroutinefunction(self.job)
+
+    def start(self):
+        if self._thread is not None or self._task is not None:
+            return
+        if self.clock:
+            self.clock.sync()
+        if self.mode == KLINE_CLOSE:
+            self.kline_cache.add_close_listener(self._on_close)
+            self.kline_cache.subscribe(self.trigger_symbol, self.interval)
+        self._stop.clear()
+        if self.is_async:
+            self._task = get_async_runtime().submit(self._aloop())
+        else:
+            self._thread = threading.Thread(target=self._loop, name=f'timer-{self.name}', daemon=True)
+            self._thread.start()
+        _register(self)
+        if self.mode == KLINE_CLOSE:
+            logger.info(f"定时器已启动: {self.interval} K线收盘触发（{self.trigger_symbol} 收盘推送，"
+                        f"{self.close_timeout}s 未收到时按时间触发）")
+        else:
+            logger.info(f"定时器已启动: {self.interval} K线收盘前 {self.offset_ms / 1000:g}s 触发（服务器时间）")
+
+    def stop(self):
+        started = self._thread is not None or self._task is not None
+        self._stop.set()
+        self._closed_event.set()
+        self._wake()
+        if self.mode == KLINE_CLOSE:
+            self.kline_cache.remove_close_listener(self._on_close)
+            if started:
+                self.kline_cache.release(self.trigger_symbol, self.interval)
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+        if self._task is not None and not get_async_runtime().in_loop:
+            try:
+                self._task.result(timeout=5)
+            except Exception as e:
+                logger.warning(f"定时器 {self.name} 停止时出错: {e}")
+        self._thread = None
+        self._task = None
+
+    def shutdown(self, wait=True):
+        """兼容原 BackgroundScheduler 的接口"""
+        self.stop()
+
+    @property
+    def running(self):
+        return (self._thread is not None or self._task is not None) and not self._stop.is_set()
+
+    # ==================== 触发 ====================
+
+    def _on_close(self, symbol, interval, bar):
+        if symbol != self.trigger_symbol or interval != self.interval:
+            return
+        with self._lock:
+            self._closed[bar['close_time'] + 1] = time.time()
+        self._closed_event.set()
+        self._wake()
+
+    def _wake(self):
+        """唤醒事件循环上等待中的定时器（停止或收到收盘推送）"""
+        wakeup = self._wakeup
+        if wakeup is not None:
+            get_async_runtime().loop.call_soon_threadsafe(wakeup.set)
+
+    def _next_trigger(self):
+        """下一次触发 (收盘边界, 计划触发的服务器时间)"""
+        now = self._now_ms()
+        offset = self.offset_ms if self.mode == BEFORE_CLOSE else 0
+        close_time = next_close_time(now + offset, self.interval)
+        if self._last_close is not None and close_time <= self._last_close:
+            # 提前醒来或时钟重新同步后，避免同一根K线触发两次
+            close_time = self._last_close + INTERVAL_MS[self.interval]
+        return close_time, close_time - offset
+
+    def _take_close(self, close_time):
+        """是否已收到 close_time 的收盘推送（收到时只保留之后的边界）"""
+        with self._lock:
+            if close_time not in self._closed:
+                return False
+            self._closed = {k: v for k, v in self._closed.items() if k > close_time}
+            return True
+
+    def _wait_close(self, close_time):
+        """等待收盘推送，返回触发来源 close_event / fallback，停止时返回 None"""
+        deadline = self._to_local(close_time + self.close_timeout * 1000)
+        while True:
+            # 先清除再检查，检查之后到达的推送会唤醒下面的等待
+            self._closed_event.clear()
+            if self._stop.is_set():
+                return None
+            if self._take_close(close_time):
+                return 'close_event'
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return 'fallback'
+            self._closed_event.wait(remaining)
+
+    def _fallback(self):
+        self.stats['fallbacks'] += 1
+        logger.warning(f"{self.close_timeout}s 内未收到 {self.trigger_symbol} {self.interval} 收盘推送，按时间触发")
+
+    def _skip_missed(self, close_time):
+        """运行超过一个周期时，错过的触发直接跳过"""
+        missed = (next_close_time(self._now_ms(), self.interval) - close_time) // INTERVAL_MS[self.interval] - 1
+        if missed > 0:
+            self.stats['skipped'] += missed
+            logger.warning(f"策略运行超过定时周期，跳过 {missed} 次触发")
+
+    def _loop(self):
+        while not self._stop.is_set():
+            if self.clock:
+                self.clock.sync_if_due()
+            close_time, scheduled = self._next_trigger()
+            if self.warmup is not None and self._warm_up(scheduled):
+                break
+            if self._sleep_until(scheduled):
+                break
+            source = 'timer'
+            if self.mode == KLINE_CLOSE:
+                source = self._wait_close(close_time)
+                if source is None:
+                    break
+                if source == 'fallback':
+                    self._fallback()
+            self._run(close_time, scheduled, source)
+            self._skip_missed(close_time)
+
+    def _warm_up(self, scheduled):
+        """在计划触发前 warmup_seconds 秒调用 warmup，返回是否被停止"""
+        if self._now_ms() > scheduled - self.warmup_ms:
+            return False
+        if self._sleep_until(scheduled - self.warmup_ms):
+            return True
+        try:
+            self.warmup()
+            self.stats['warmups'] += 1
+        except Exception as e:
+            logger.warning(f"定时器 {self.name} 预热失败: {e}")
+        return False
+
+    def _begin_run(self, close_time, scheduled, source):
+        triggered = self._now_ms()
+        record = {
+            'bar_close_time': close_time,
+            'source': source,
+            'scheduled_at': scheduled,
+            'triggered_at': int(triggered),
+            'trigger_lag_ms': round(triggered - scheduled, 1),
+            'first_order_ms': None,
+            'order_latency_ms': None,
+            'orders': 0,
+            'run_seconds': None,
+            'error': None,
+        }
+        start = time.time()
+        with self._lock:
+            self.bar_close_time = close_time
+            self._last_close = close_time
+            self._current = (record, start)
+        return record, start
+
+    def _end_run(self, record, start, error=None):
+        if error is not None:
+            record['error'] = str(error)
+            self.stats['errors'] += 1
+            logger.error(f"策略运行出错: {error}")
+        with self._lock:
+            self._current = None
+        record['run_seconds'] = round(time.time() - start, 3)
+        self.stats['runs'] += 1
+        self.runs.append(record)
+        if record['first_order_ms'] is not None:
+            logger.info(f"触发延迟 {record['trigger_lag_ms']:.0f}ms, 触发到下单 {record['first_order_ms']:.0f}ms, "
+                        f"下单完成 {record['order_latency_ms']:.0f}ms")
+
+    def _run(self, close_time, scheduled, source):
+        record, start = self._begin_run(close_time, scheduled, source)
+        error = None
+        try:
+            self.job()
+        except Exception as e:
+            error = e
+        self._end_run(record, start, error)
+
+    # ==================== 事件循环上的定时（异步 job） ====================
+
+    async def _await_wakeup(self, timeout):
+        """在事件循环上等待最多 timeout 秒，停止或收到收盘推送时提前返回"""
+        self._wakeup.clear()
+        if self._stop.is_set() or timeout <= 0:
+            return
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _asleep_until(self, server_ms):
+        """等待到服务器时间 server_ms，返回是否被停止"""
+        while not self._stop.is_set():
+            remaining = self._to_local(server_ms) - time.time()
+            if remaining <= 0:
+                return False
+            await self._await_wakeup(remaining)
+        return True
+
+    async def _await_close(self, close_time):
+        """与 _wait_close 相同，在事件循环上等待"""
+        deadline = self._to_local(close_time + self.close_timeout * 1000)
+        while not self._stop.is_set():
+            if self._take_close(close_time):
+                return 'close_event'
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return 'fallback'
+            await self._await_wakeup(remaining)
+        return None
+
+    async def _aloop(self):
+        self._wakeup = asyncio.Event()
+        try:
+            while not self._stop.is_set():
+                if self.clock:
+                    await to_thread(self.clock.sync_if_due)
+                close_time, scheduled = self._next_trigger()
+                if self.warmup is not None and self._now_ms() <= scheduled - self.warmup_ms:
+                    if await self._asleep_until(scheduled - self.warmup_ms):
+                        break
+                    try:
+                        await to_thread(self.warmup)
+                        self.stats['warmups'] += 1
+                    except Exception as e:
+                        logger.warning(f"定时器 {self.name} 预热失败: {e}")
+                if await self._asleep_until(scheduled):
+                    break
+                source = 'timer'
+                if self.mode == KLINE_CLOSE:
+                    source = await self._await_close(close_time)
+                    if source is None:
+                        break
+                    if source == 'fallback':
+                        self._fallback()
+                record, start = self._begin_run(close_time, scheduled, source)
+                error = None
+                try:
+                    await self.job()
+                except Exception as e:
+                    error = e
+                self._end_run(record, start, error)
+                self._skip_missed(close_time)
+        finally:
+            self._wakeup = None
+
+    def record_order(self, sent_at, count=1):
+        """
+        记录本次运行中的下单（sent_at 为发送请求前的 time.time()）
+
+        first_order_ms 为触发到第一笔订单发出的时间，order_latency_ms 为触发到最后一笔下单返回的时间
+        """
+        with self._lock:
+            if self._current is None:
+                return
+            record, start = self._current
+            if record['first_order_ms'] is None:
+                record['first_order_ms'] = round((sent_at - start) * 1000, 1)
+            record['order_latency_ms'] = round((time.time() - start) * 1000, 1)
+            record['orders'] += count
+
+    # ==================== 状态 ====================
+
+    def status(self):
+        runs = list(self.runs)
+        lags = [r['trigger_lag_ms'] for r in runs]
+        orders = [r['first_order_ms'] for r in runs if r['first_order_ms'] is not None]
+        return {
+            'name': self.name,
+            'interval': self.interval,
+            'mode': self.mode,
+            'offset_seconds': self.offset_ms / 1000,
+            'trigger_symbol': self.trigger_symbol if self.mode == KLINE_CLOSE else None,
+            'running': self.running,
+            'clock_offset_ms': self.clock.offset_ms if self.clock else None,
+            'clock_rtt_ms': self.clock.rtt_ms if self.clock else None,
+            'next_trigger': self._next_trigger()[1] if self.running else None,
+            'stats': dict(self.stats),
+            'avg_trigger_lag_ms': round(sum(lags) / len(lags), 1) if lags else None,
+            'avg_first_order_ms': round(sum(orders) / len(orders), 1) if orders else None,
+            'runs': runs[-20:],
+        }
+
+
+_clocks = ClientRegistry('服务器时钟')
+_timers = weakref.WeakSet()
+_registry_lock = threading.Lock()
+
+
+def get_server_clock(client, **kwargs):
+    """获取与 client 绑定的服务器时钟"""
+    return _clocks.get(client, lambda: ServerClock(client, **kwargs))
+
+
+def _register(timer):
+    with _registry_lock:
+        _timers.add(timer)
+
+
+def timer_status():
+    """所有运行中定时器的状态"""
+    with _registry_lock:
+        timers = list(_timers)
+    return [t.status() for t in timers if t.running]
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""
+策略工作进程
+多策略运行时的进程隔离模式：每个策略实例在独立的子进程（spawn）中运行，AI 筛选、大量计算或自定义代码卡死
+都不会占用 Web 服务进程的 GIL。监督线程负责:
+- 通过队列接收子进程的日志（重新写入本进程的日志系统，沿用原有的 log 推送）、运行记录和持仓变化（推送 positions_updated）
+- 单次运行的时间 / CPU 预算（默认不限制），超出时结束子进程并重启
+- 子进程异常退出时按退避时间重启，时间窗口内重启次数过多则停止
+- 停止时先发送停止信号，等待当前运行结束，超时后再强制结束（代替每秒轮询 runner.running）
+"""
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import traceback
+
+import psutil
+
+logger = logging.getLogger(__name__)
+
+# 单次运行默认预算（秒），为 None 时不限制。
+# 超出预算时子进程可能正处于下单 / 等待成交阶段，被结束后交易所上的订单和本地持仓记录可能不一致，
+# 因此默认不限制，只在确认策略不会卡在下单阶段时通过 worker_options 开启
+DEFAULT_MAX_RUN_SECONDS = None
+DEFAULT_MAX_CPU_SECONDS = None
+
+# 停止时等待当前运行结束的时间（秒）
+DEFAULT_GRACE_SECONDS = 30
+
+# 重启退避（秒）和时间窗口内的最大重启次数
+RESTART_BACKOFF = (1, 2, 5, 10, 30, 60)
+DEFAULT_MAX_RESTARTS = 5
+DEFAULT_RESTART_WINDOW = 600
+
+_socketio = None
+
+
+def set_socketio(socketio):
+    """设置用于推送 positions_updated 的 socketio 实例"""
+    global _socketio
+    _socketio = socketio
+
+
+# ==================== 子进程 ====================
+
+class _QueueLogHandler(logging.Handler):
+    """把子进程的日志记录发送给监督进程"""
+
+    def __init__(self, events):
+        super().__init__()
+        self.events = events
+
+    def emit(self, record):
+        try:
+            message = record.getMessage()
+            if record.exc_info:
+                message += '\n' + ''.join(traceback.format_exception(*record.exc_info))
+            self.events.put(('log', {'name': record.name, 'levelno': record.levelno, 'levelname': record.levelname,
+                                     'msg': message, 'created': record.created}))
+        except Exception:
+            self.handleError(record)
+
+
+def _positions_key(store):
+    return sorted((p.get('symbol'), p.get('positionSide'), p.get('client_order_id')) for p in store.load_current())
+
+
+def _worker_main(info, config, client_factory, events, stop_event):
+    """子进程入口：创建只含一个策略的运行时，直到收到停止信号"""
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_QueueLogHandler(events))
+    root.setLevel(logging.INFO)
+
+    from strategy_host import StrategyHost, StrategySlot
+
+    try:
+        client, default_config = client_factory()
+        host = StrategyHost(client, config if config is not None else default_config, instances_file=None)
+        slot = StrategySlot(**info)
+        host.slots[slot.id] = slot
+        state = {'cpu': 0, 'positions': _positions_key(slot.position_store)}
+
+        def on_run(event, record):
+            if event == 'start':
+                state['cpu'] = time.process_time()
+                events.put(('run_start', record))
+                return
+            record = dict(record, cpu_seconds=round(time.process_time() - state['cpu'], 3))
+            events.put(('run_end', record))
+            positions = _positions_key(slot.position_store)
+            if positions != state['positions']:
+                state['positions'] = positions
+                events.put(('positions', {'current': len(positions)}))
+
+        slot.run_listeners.append(on_run)
+        slot.position_store.add_listener(lambda records: events.put(('positions', {'closed': len(records)})))
+        host.start(slot.id)
+        events.put(('started', {'pid': os.getpid()}))
+    except Exception as e:
+        logging.getLogger(__name__).error(f"策略工作进程启动失败: {e}", exc_info=True)
+        events.put(('failed', {'error': str(e)}))
+        return
+
+    stop_event.wait()
+    # 等待进行中的运行结束（超过监督进程的等待时间会被强制结束）
+    host.close()
+    events.put(('stopped', {}))
+
+
+# ==================== 监督 ====================
+
+class StrategyWorker:
+    """监督一个策略实例的工作进程"""
+
+    def __init__(self, slot, config, client_factory, max_run_seconds=DEFAULT_MAX_RUN_SECONDS,
+                 max_cpu_seconds=DEFAULT_MAX_CPU_SECONDS, grace_seconds=DEFAULT_GRACE_SECONDS,
+                 max_restarts=DEFAULT_MAX_RESTARTS, restart_window=DEFAULT_RESTART_WINDOW):
+        self.slot = slot
+        self.config = config
+        self.client_factory = client_factory
+        self.max_run_seconds = max_run_seconds
+        self.max_cpu_seconds = max_cpu_seconds
+        self.grace_seconds = grace_seconds
+        self.max_restarts = max_restarts
+        self.restart_window = restart_window
+        self.state = 'stopped'   # starting / running / restarting / stopping / stopped / failed
+        self.pid = None
+        self.restarts = []       # 重启时间
+        self.last_error = None
+        self._process = None
+        self._events = None
+        self._stop_event = None
+        self._run = None         # (开始时间, 开始时的 CPU 时间, 运行记录)
+        self._stopping = threading.Event()
+        self._monitor_thread = None
+        self._log = logging.getLogger(f'strategy.{slot.id}')
+
+    def start(self):
+        self._stopping.clear()
+        self._spawn()
+        self._monitor_thread = threading.Thread(target=self._monitor, name=f'supervisor-{self.slot.id}', daemon=True)
+        self._monitor_thread.start()
+
+    def _spawn(self):
+        # 使用 spawn：主进程中有 Flask / WebSocket 等线程，fork 可能继承到被占用的锁
+        ctx = multiprocessing.get_context('spawn')
+        self._events = ctx.Queue()
+        self._stop_event = ctx.Event()
+        info = {'instance_id': self.slot.id, 'file': self.slot.file, 'strategy_file': self.slot.strategy_file,
+                'name': self.slot.name, 'data_dir': self.slot.data_dir}
+        self._process = ctx.Process(target=_worker_main, name=f'strategy-{self.slot.id}', daemon=True,
+                                    args=(info, self.config, self.client_factory, self._events, self._stop_event))
+        self.state = 'starting'
+        self._run = None
+        self._process.start()
+        self.pid = self._process.pid
+        logger.info(f"策略 {self.slot.id} 工作进程已启动 (pid {self.pid})")
+
+    def stop(self, grace_seconds=None):
+        """发送停止信号，等待当前运行结束，超时后强制结束"""
+        grace = self.grace_seconds if grace_seconds is None else grace_seconds
+        self._stopping.set()
+        self.state = 'stopping'
+        process = self._process
+        if process is not None and process.is_alive():
+            self._stop_event.set()
+            process.join(grace)
+            if process.is_alive():
+                logger.warning(f"策略 {self.slot.id} 在 {grace}s 内未停止，强制结束")
+                self._terminate(process)
+        if self._monitor_thread is not None and self._monitor_thread is not threading.current_thread():
+            self._monitor_thread.join(timeout=5)
+        self._drain()
+        self.state = 'stopped'
+        logger.info(f"策略 {self.slot.id} 工作进程已停止")
+
+    @staticmethod
+    def _terminate(process):
+        process.terminate()
+        process.join(5)
+        if process.is_alive():
+            process.kill()
+            process.join(5)
+
+    # ==================== 事件 ====================
+
+    def _drain(self):
+        while True:
+            try:
+                self._handle(*self._events.get_nowait())
+            except (queue.Empty, OSError, ValueError):
+                return
+
+    def _handle(self, event, data):
+        if event == 'log':
+            record = logging.makeLogRecord({
+                'name': self._log.name, 'levelno': data['levelno'], 'levelname': data['levelname'],
+                'msg': f"[{self.slot.name}] {data['msg']}", 'created': data['created'],
+            })
+            if self._log.isEnabledFor(record.levelno):
+                self._log.handle(record)
+        elif event == 'run_start':
+            try:
+                cpu = psutil.Process(self.pid).cpu_times()
+                cpu = cpu.user + cpu.system
+            except psutil.Error:
+                cpu = None
+            self._run = (time.time(), cpu, data)
+        elif event == 'run_end':
+            self._run = None
+            self.slot.add_run(data)
+        elif event == 'positions':
+            if _socketio is not None:
+                _socketio.emit('positions_updated', {'message': f'策略 {self.slot.name} 持仓已更新',
+                                                     'instance': self.slot.id})
+        elif event == 'started':
+            self.state = 'running'
+        elif event == 'failed':
+            self.last_error = data['error']
+
+    # ==================== 监控 ====================
+
+    def _over_budget(self):
+        """当前运行超出预算时返回原因"""
+        if self._run is None:
+            return None
+        started, cpu_start, _ = self._run
+        if self.max_run_seconds and time.time() - started > self.max_run_seconds:
+            return f'单次运行超过 {self.max_run_seconds}s'
+        if self.max_cpu_seconds and cpu_start is not None:
+            try:
+                cpu = psutil.Process(self.pid).cpu_times()
+            except psutil.Error:
+                return None
+            if cpu.user + cpu.system - cpu_start > self.max_cpu_seconds:
+                return f'单次运行 CPU 时间超过 {self.max_cpu_seconds}s'
+        return None
+
+    def _monitor(self):
+        while not self._stopping.is_set():
+            try:
+                self._handle(*self._events.get(timeout=0.5))
+                continue
+            except queue.Empty:
+                pass
+            except (OSError, ValueError, EOFError):
+                # 子进程被结束时队列可能损坏
+                pass
+            if self._stopping.is_set():
+                break
+            reason = self._over_budget()
+            if reason is not None:
+                record = dict(self._run[2], error=reason, run_seconds=round(time.time() - self._run[0], 3))
+                self.slot.add_run(record)
+                logger.error(f"策略 {self.slot.id} {reason}，结束工作进程")
+                self._terminate(self._process)
+            if not self._process.is_alive():
+                self._restart()
+
+    def _restart(self):
+        exitcode = self._process.exitcode
+        self._drain()
+        now = time.time()
+        self.restarts = [t for t in self.restarts if now - t < self.restart_window]
+        if len(self.restarts) >= self.max_restarts:
+            self.state = 'failed'
+            self.slot.running = False
+            logger.error(f"策略 {self.slot.id} 工作进程 {self.restart_window}s 内重启 {len(self.restarts)} 次，不再重启"
+                         f"{f': {self.last_error}' if self.last_error else ''}")
+            self._stopping.set()
+            return
+        delay = RESTART_BACKOFF[min(len(self.restarts), len(RESTART_BACKOFF) - 1)]
+        self.state = 'restarting'
+        logger.warning(f"策略 {self.slot.id} 工作进程已退出 (exitcode {exitcode})，{delay}s 后重启")
+        if self._stopping.wait(delay):
+            return
+        self.restarts.append(time.time())
+        self._spawn()
+
+    def status(self):
+        return {
+            'state': self.state,
+            'pid': self.pid,
+            'restarts': len(self.restarts),
+            'last_error': self.last_error,
+            'running_for': round(time.time() - self._run[0], 1) if self._run else None,
+            'max_run_seconds': self.max_run_seconds,
+            'max_cpu_seconds': self.max_cpu_seconds,
+        }
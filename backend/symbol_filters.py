@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+交易对精度过滤器缓存
+从 exchangeInfo 中提取 LOT_SIZE / PRICE_FILTER / MIN_NOTIONAL，按交易对建立索引并预先生成 Decimal 量化器，
+下单时格式化数量和价格、检查最小名义价值都不再查询 exchangeInfo。缓存定时刷新并保存到 data/ 目录，重启后可立即使用；
+下单路径上遇到缓存缺失或过期时只在后台刷新，本次使用已有的规则
+"""
+import json
+import logging
+import os
+import threading
+import time
+from decimal import Decimal, ROUND_DOWN, ROUND_HALF_UP
+
+from client_registry import ClientRegistry
+from rate_limiter import get_rate_limiter
+
+logger = logging.getLogger(__name__)
+
+# 缓存文件
+CACHE_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'exchange_filters.json')
+
+# 默认刷新间隔（秒）
+DEFAULT_TTL = 3600
+
+# 下单路径触发的后台刷新（缓存缺失或过期）最短间隔（秒）
+BACKGROUND_REFRESH_INTERVAL = 60
+
+
+def _quantizer(step):
+    """步长对应的小数位量化器，如 0.0010 -> Decimal('0.001')，5 -> Decimal('1')"""
+    exponent = step.normalize().as_tuple().exponent
+    return Decimal(1).scaleb(min(exponent, 0))
+
+
+class SymbolFilter:
+    """单个交易对的精度规则"""
+
+    __slots__ = ('symbol', 'step_size', 'tick_size', 'min_qty', 'min_notional', 'qty_quantizer', 'price_quantizer')
+
+    def __init__(self, symbol, step_size, tick_size, min_qty='0', min_notional='0'):
+        self.symbol = symbol
+        self.step_size = Decimal(str(step_size))
+        self.tick_size = Decimal(str(tick_size))
+        self.min_qty = Decimal(str(min_qty))
+        self.min_notional = Decimal(str(min_notional))
+        self.qty_quantizer = _quantizer(self.step_size)
+        self.price_quantizer = _quantizer(self.tick_size)
+
+    def format_quantity(self, quantity):
+        """数量按步长向下取整"""
+        value = Decimal(str(quantity))
+        if self.step_size > 0:
+            value = (value / self.step_size).to_integral_value(ROUND_DOWN) * self.step_size
+        return format(value.quantize(self.qty_quantizer, rounding=ROUND_DOWN), 'f')
+
+    def format_price(self, price):
+        """价格按最小变动价位四舍五入"""
+        value = Decimal(str(price))
+        if self.tick_size > 0:
+            value = (value / self.tick_size).to_integral_value(ROUND_HALF_UP) * self.tick_size
+        return format(value.quantize(self.price_quantizer, rounding=ROUND_HALF_UP), 'f')
+
+    def meets_notional(self, quantity, price):
+        """名义价值（数量 × 价格）是否不低于 MIN_NOTIONAL"""
+        return Decimal(str(quantity)) * Decimal(str(price)) >= self.min_notional
+
+    def to_dict(self):
+        return {
+            'step_size': str(self.step_size),
+            'tick_size': str(self.tick_size),
+            'min_qty': str(self.min_qty),
+            'min_notional': str(self.min_notional),
+        }
+
+
+def parse_exchange_info(exchange_info):
+    """从 exchangeInfo 解析出 {symbol: SymbolFilter}"""
+    filters = {}
+    for item in exchange_info.get('symbols', []):
+        values = {'step_size': '0', 'tick_size': '0', 'min_qty': '0', 'min_notional': '0'}
+        for f in item.get('filters', []):
+            filter_type = f.get('filterType')
+            if filter_type == 'LOT_SIZE':
+                values['step_size'] = f.get('stepSize', '0')
+                values['min_qty'] = f.get('minQty', '0')
+            elif filter_type == 'PRICE_FILTER':
+                values['tick_size'] = f.get('tickSize', '0')
+            elif filter_type == 'MIN_NOTIONAL':
+                values['min_notional'] = f.get('notional', f.get('minNotional', '0'))
+        filters[item['symbol']] = SymbolFilter(item['symbol'], **values)
+    return filters
+
+
+class SymbolFilterCache:
+    """exchangeInfo 精度过滤器缓存"""
+
+    def __init__(self, client, cache_file=CACHE_FILE, ttl=DEFAULT_TTL):
+        self.client = client
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.updated_at = 0
+        self._filters = {}
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._timer = None
+        self._refreshing = False
+        self._last_background_refresh = 0
+
+    def load(self):
+        """从缓存文件加载，返回是否加载成功"""
+        if not os.path.exists(self.cache_file):
+            return False
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            filters = {s: SymbolFilter(s, **v) for s, v in data.get('symbols', {}).items()}
+        except Exception as e:
+            logger.warning(f"读取交易对精度缓存失败: {e}")
+            return False
+        with self._lock:
+            self._filters = filters
+            self.updated_at = data.get('updated_at', 0)
+        logger.info(f"加载交易对精度缓存: {len(filters)} 个交易对")
+        return True
+
+    def save(self):
+        """原子写入缓存文件"""
+        with self._lock:
+            data = {
+                'updated_at': self.updated_at,
+                'symbols': {s: f.to_dict() for s, f in self._filters.items()},
+            }
+        os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+        tmp_file = self.cache_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_file, self.cache_file)
+
+    def refresh(self):
+        """重新下载 exchangeInfo 并更新缓存"""
+        with self._refresh_lock:
+            start = time.time()
+            exchange_info = self.client.client.exchange_info()
+            filters = parse_exchange_info(exchange_info)
+            # 顺带按 rateLimits 更新请求限流的额度
+            get_rate_limiter().configure(exchange_info)
+            with self._lock:
+                self._filters = filters
+                self.updated_at = time.time()
+            try:
+                self.save()
+            except Exception as e:
+                logger.warning(f"保存交易对精度缓存失败: {e}")
+            logger.info(f"刷新交易对精度缓存: {len(filters)} 个交易对, 耗时 {time.time() - start:.2f}s")
+
+    @property
+    def expired(self):
+        return time.time() - self.updated_at > self.ttl
+
+    def warm(self):
+        """
+        启动时预热：优先使用本地缓存，过期时在后台刷新；本地没有缓存时同步下载
+        """
+        if not self.load():
+            self.refresh()
+        elif self.expired:
+            self.refresh_in_background()
+
+    def start_auto_refresh(self):
+        """按 ttl 定时刷新"""
+        self.stop_auto_refresh()
+        self._timer = threading.Timer(self.ttl, self._auto_refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def stop_auto_refresh(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+    def stop(self):
+        """停止定时刷新（客户端释放时由 close_client 调用）"""
+        self.stop_auto_refresh()
+
+    def _auto_refresh(self):
+        self._safe_refresh()
+        self.start_auto_refresh()
+
+    def _safe_refresh(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.error(f"刷新交易对精度缓存失败: {e}")
+
+    def refresh_in_background(self):
+        """在后台线程刷新，已有后台刷新进行中时不重复启动；返回是否启动了刷新"""
+        with self._lock:
+            if self._refreshing:
+                return False
+            self._refreshing = True
+            self._last_background_refresh = time.time()
+
+        def run():
+            try:
+                self._safe_refresh()
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=run, name='symbol-filters-refresh', daemon=True).start()
+        return True
+
+    def get(self, symbol):
+        """
+        获取交易对精度规则（不在调用线程中请求 exchangeInfo）
+
+        缓存中没有（如新上线交易对）或缓存已过期时在后台刷新（最多每分钟一次），本次返回已有的规则，没有时返回 None
+        """
+        with self._lock:
+            item = self._filters.get(symbol)
+            due = time.time() - self._last_background_refresh > BACKGROUND_REFRESH_INTERVAL
+        if due and (item is None or self.expired):
+            self.refresh_in_background()
+        return item
+
+    def format_quantity(self, symbol, quantity):
+        item = self.get(symbol)
+        if item is None:
+            return self.client.format_quantity(symbol, quantity)
+        return item.format_quantity(quantity)
+
+    def format_price(self, symbol, price):
+        item = self.get(symbol)
+        if item is None:
+            return self.client.format_price(symbol, price)
+        return item.format_price(price)
+
+    def check_notional(self, symbol, quantity, price):
+        """订单名义价值是否满足 MIN_NOTIONAL，没有该交易对的规则时返回 True（交给交易所校验）"""
+        item = self.get(symbol)
+        return item is None or item.meets_notional(quantity, price)
+
+
+_caches = ClientRegistry('交易对精度缓存')
+
+
+def get_symbol_filters(client, **kwargs):
+    """获取（必要时创建、预热并开启定时刷新）与 client 绑定的精度缓存"""
+    def create():
+        cache = SymbolFilterCache(client, **kwargs)
+        try:
+            cache.warm()
+        except Exception as e:
+            logger.error(f"预热交易对精度缓存失败: {e}")
+        cache.start_auto_refresh()
+        return cache
+
+    return _caches.get(client, create)
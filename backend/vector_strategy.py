@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+向量化自定义策略
+custom_strategy 模块配置 "mode": "vector" 时，所有候选标的只调用一次自定义策略：
+按标的的K线参数（如 klines_5m）传入 KlineMatrix，klines_5m.close 等为 (标的数 × K线数) 的二维数组，
+indicators 中按标的计算的指标同样为二维数组（全局K线和全局指标保持不变）。
+代码返回与标的一一对应的方向数组，如:
+
+    long = (klines_5m.close[:, -1] > indicators['ema_5m'][:, -1]) & (klines_5m.close[:, -1] > klines_5m.open[:, -1])
+    short = (klines_5m.close[:, -1] < indicators['ema_5m'][:, -1]) & (klines_5m.close[:, -1] < klines_5m.open[:, -1])
+    return np.where(long, 1, np.where(short, -1, 0))
+
+方向可以是 "LONG" / "SHORT" / None，也可以是数值（> 0 做多，< 0 做空，0 或 NaN 跳过）
+"""
+import numpy as np
+
+from kline_array import as_kline_array
+
+# 自定义策略模式
+ROW_MODE = 'row'
+VECTOR_MODE = 'vector'
+
+
+def _stack(arrays, length=None):
+    """按右对齐堆叠为 float64 二维数组，左侧以 NaN 填充"""
+    arrays = [np.asarray(a, dtype=np.float64) for a in arrays]
+    if length is None:
+        length = max((len(a) for a in arrays), default=0)
+    values = np.full((len(arrays), length), np.nan)
+    for i, a in enumerate(arrays):
+        n = min(len(a), length)
+        if n:
+            values[i, length - n:] = a[len(a) - n:]
+    return values
+
+
+class KlineMatrix:
+    """
+    多个标的的K线矩阵
+
+    open / high / low / close / volume 等属性为 (标的数 × K线数) 的二维数组（右对齐，按需堆叠），
+    symbols 为对应的标的列表
+    """
+
+    def __init__(self, klines_list, symbols=None):
+        self.symbols = list(symbols) if symbols is not None else []
+        self._klines = [as_kline_array(k) for k in klines_list]
+        self.length = max((len(k) for k in self._klines), default=0)
+        self._columns = {}
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        columns = self.__dict__['_columns']
+        if name not in columns:
+            klines = self.__dict__['_klines']
+            if klines and name not in klines[0].columns:
+                raise AttributeError(name)
+            columns[name] = _stack([k.columns[name] for k in klines], self.length)
+        return columns[name]
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+    def __len__(self):
+        return len(self._klines)
+
+    @property
+    def shape(self):
+        return len(self._klines), self.length
+
+    def __repr__(self):
+        return f"KlineMatrix(symbols={len(self._klines)}, bars={self.length})"
+
+
+def stack_indicators(indicators_list):
+    """把每个标的的 {指标名: 序列} 堆叠为 {指标名: 二维数组}"""
+    names = {}
+    for indicators in indicators_list:
+        for name in indicators:
+            names.setdefault(name, None)
+    return {name: _stack([ind.get(name, ()) for ind in indicators_list]) for name in names}
+
+
+def normalize_directions(result, count):
+    """把向量策略的返回值转换为 ['LONG' / 'SHORT' / None] 列表"""
+    if result is None:
+        return [None] * count
+    values = list(np.asarray(result, dtype=object).reshape(-1)) if not isinstance(result, list) else result
+    if len(values) != count:
+        raise ValueError(f"向量策略返回 {len(values)} 个方向，与标的数量 {count} 不一致")
+    directions = []
+    for value in values:
+        if isinstance(value, str):
+            directions.append(value if value in ('LONG', 'SHORT') else None)
+        elif value is None:
+            directions.append(None)
+        else:
+            try:
+                number = float(value)
+            except (TypeError, ValueError):
+                directions.append(None)
+                continue
+            directions.append('LONG' if number > 0 else ('SHORT' if number < 0 else None))
+    return directions
+
+
+def evaluate_vector(func, global_args, klines_lists, indicators_list, symbols, global_indicators=None):
+    """
+    对所有候选标的调用一次向量策略
+
+    global_args 为全局K线参数，klines_lists 为每个按标的K线参数的 [各标的K线]，
+    indicators_list 为各标的的指标；返回与 symbols 对应的方向列表
+    """
+    matrices = [KlineMatrix(klines, symbols) for klines in klines_lists]
+    indicators = stack_indicators(indicators_list)
+    if global_indicators:
+        for name, values in global_indicators.items():
+            indicators.setdefault(name, values)
+    return normalize_directions(func(*global_args, *matrices, indicators), len(symbols))
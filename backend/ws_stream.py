@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+币安合约 WebSocket 行情连接
+负责连接、断线重连、订阅管理，消息通过回调交给上层（K线缓存、用户数据流等）
+"""
+import json
+import logging
+import threading
+import time
+
+import websocket
+
+logger = logging.getLogger(__name__)
+
+# U本位合约行情推送地址
+FUTURES_STREAM_URL = 'wss://fstream.binance.com'
+
+
+class StreamConnection:
+    """
+    单个 WebSocket 连接
+
+    path 为 '/stream' 时使用组合流格式 {"stream": ..., "data": ...}，回调参数为 (stream, data)；
+    path 为 '/ws/<name>' 时为原始流，回调参数为 (None, data)
+    """
+
+    def __init__(self, base_url=FUTURES_STREAM_URL, path='/stream', on_message=None, on_open=None,
+                 name='market', reconnect_delay=1, max_reconnect_delay=30):
+        self.url = base_url.rstrip('/') + path
+        self.name = name
+        self.on_message = on_message
+        self.on_open = on_open
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+
+        self.streams = set()
+        self.connected = False
+        self.connect_count = 0
+        self.last_message_time = 0
+
+        self._ws = None
+        self._running = False
+        self._thread = None
+        self._lock = threading.Lock()
+        self._request_id = 0
+
+    def start(self):
+        """启动后台连接线程"""
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run_forever, name=f'ws-{self.name}', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """关闭连接并停止重连"""
+        self._running = False
+        ws = self._ws
+        if ws:
+            try:
+                ws.close()
+            except Exception:
+                pass
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+        self.connected = False
+
+    def wait_connected(self, timeout=10):
+        """等待连接建立"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.connected:
+                return True
+            time.sleep(0.05)
+        return self.connected
+
+    def subscribe(self, streams):
+        """订阅流，已连接时立即发送订阅请求，未连接时在连接建立后自动订阅"""
+        with self._lock:
+            new_streams = [s for s in streams if s not in self.streams]
+            self.streams.update(new_streams)
+        if new_streams and self.connected:
+            self._send_method('SUBSCRIBE', new_streams)
+
+    def unsubscribe(self, streams):
+        """取消订阅"""
+        with self._lock:
+            removed = [s for s in streams if s in self.streams]
+            self.streams.difference_update(removed)
+        if removed and self.connected:
+            self._send_method('UNSUBSCRIBE', removed)
+
+    def _send_method(self, method, params):
+        with self._lock:
+            self._request_id += 1
+            request_id = self._request_id
+        try:
+            self._ws.send(json.dumps({'method': method, 'params': list(params), 'id': request_id}))
+        except Exception as e:
+            logger.warning(f"[{self.name}] 发送 {method} 失败: {e}")
+
+    def _run_forever(self):
+        delay = self.reconnect_delay
+        while self._running:
+            self._ws = websocket.WebSocketApp(
+                self.url,
+                on_open=self._handle_open,
+                on_message=self._handle_message,
+                on_error=self._handle_error,
+                on_close=self._handle_close,
+            )
+            started = time.time()
+            try:
+                self._ws.run_forever(ping_interval=60, ping_timeout=20)
+            except Exception as e:
+                logger.error(f"[{self.name}] WebSocket 运行出错: {e}")
+            self.connected = False
+            if not self._running:
+                break
+            # 连接维持超过一分钟视为正常断开，重连间隔复位
+            if time.time() - started > 60:
+                delay = self.reconnect_delay
+            logger.warning(f"[{self.name}] WebSocket 已断开，{delay} 秒后重连")
+            time.sleep(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    def _handle_open(self, ws):
+        self.connected = True
+        self.connect_count += 1
+        reconnected = self.connect_count > 1
+        logger.info(f"[{self.name}] WebSocket 已{'重新' if reconnected else ''}连接: {self.url}")
+        with self._lock:
+            streams = list(self.streams)
+        if streams:
+            self._send_method('SUBSCRIBE', streams)
+        if self.on_open:
+            try:
+                self.on_open(reconnected)
+            except Exception as e:
+                logger.error(f"[{self.name}] 连接回调出错: {e}", exc_info=True)
+
+    def _handle_message(self, ws, message):
+        self.last_message_time = time.time()
+        try:
+            msg = json.loads(message)
+        except ValueError:
+            logger.warning(f"[{self.name}] 无法解析的消息: {message[:200]}")
+            return
+        # 订阅请求的应答
+        if isinstance(msg, dict) and 'id' in msg and 'result' in msg:
+            return
+        if not self.on_message:
+            return
+        try:
+            if isinstance(msg, dict) and 'stream' in msg and 'data' in msg:
+                self.on_message(msg['stream'], msg['data'])
+            else:
+                self.on_message(None, msg)
+        except Exception as e:
+            logger.error(f"[{self.name}] 处理推送消息出错: {e}", exc_info=True)
+
+    def _handle_error(self, ws, error):
+        logger.warning(f"[{self.name}] WebSocket 错误: {error}")
+
+    def _handle_close(self, ws, status_code, reason):
+        self.connected = False
@@ -7,7 +7,6 @@
 
 # ==================== 导入库 ====================
 # 数据处理
-import pandas as pd
 import numpy as np
 
 # 时间处理
@@ -15,62 +14,87 @@ from datetime import datetime, timedelta
 
 # 系统库
 import logging
-import json
-import os
 import time
 import math
+import asyncio
 
 # 并发处理
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
-# HTTP请求
-import requests
-
 # AI相关
 from openai import OpenAI
 
-# 定时任务
-from apscheduler.schedulers.background import BackgroundScheduler
+# 定时任务（按服务器时间触发）
+from strategy_timer import StrategyTimer, get_server_clock
 
-# 技术分析库
-import talib
+# 平台运行时
+from kline_fetcher import fetch_klines_parallel, fetch_klines_async
+from async_runtime import ASYNC_MODE, to_thread
+from kline_cache import get_kline_cache
+from client_registry import close_client
+from kline_array import as_kline_array
+from indicator_engine import IndicatorEngine
+from symbol_filters import get_symbol_filters
+from market_snapshot import get_market_snapshot
+from order_tracker import get_order_tracker
+from rate_limiter import install_rate_limiter
+from http_transport import install_transport, get_http_session, warm_up
+from position_store import get_position_store
+from strategy_code_cache import get_custom_strategies
+from vector_strategy import VECTOR_MODE, evaluate_vector
 
 # 日志
 logger = logging.getLogger(__name__)
 
+# 定时配置（多策略运行时按相同配置共用定时器）
+TIMER_CONFIG = {'interval': '5m', 'offset_seconds': 5, 'mode': 'before_close', 'trigger_symbol': 'BTCUSDT'}
+
+# 策略标识：模块结构指纹和生成时各自定义策略代码的哈希（自定义策略只热更新属于本策略的配置，见 strategy_code_cache）
+STRATEGY_ID = 'top_gainers_ema_1119_1537'
+STRATEGY_FINGERPRINT = 'c556ff9bdba00243'
+CUSTOM_STRATEGY_HASHES = {1: '39ce972bce73ac47', 5: 'f05967517a8855c0'}
+
+# 执行模式：async 时定时器和 run_async 都在共享事件循环上运行（多个策略共用一个循环）；sync 为原同步流程 run
+EXECUTION_MODE = 'async'
+
 class Strategy:
     def __init__(self, binance_client, config, runner=None):
         self.client = binance_client
         self.config = config
+        self.transport = install_transport(binance_client)  # 共享 HTTP 连接池（keep-alive、按接口统计延迟）
+        self.rate_limiter = install_rate_limiter(binance_client)  # 请求权重限流（下单优先、合并相同请求、429 退避）
+        self.kline_cache = get_kline_cache(binance_client)  # K线内存缓存（WebSocket 推送实时更新）
+        self.indicator_engine = IndicatorEngine()  # 增量指标引擎（按标的保存指标状态）
+        self.symbol_filters = get_symbol_filters(binance_client)  # 交易对精度缓存（数量/价格格式化）
+        self.market_snapshot = get_market_snapshot(binance_client)  # 全市场行情快照（下单取价）
+        self.order_tracker = get_order_tracker(binance_client)  # 订单跟踪（用户数据流确认成交）
+        self.custom_strategies = get_custom_strategies(STRATEGY_ID, STRATEGY_FINGERPRINT, CUSTOM_STRATEGY_HASHES,
+                                                       getattr(runner, 'strategy_file', None))  # 预编译的自定义策略（运行期间保存后热更新）
         self.runner = runner  # 保存 runner 引用，用于检查停止状态
         self.scheduler = None  # 保存调度器引用
-        self.positions = {'current': [], 'history': []}
+        self.timer = None  # 策略定时器（记录触发到下单的延迟）
+        self.positions = {'current': [], 'history': []}  # 历史记录保存在仓位存储中，不再整体加载
         self.symbol_cooldown = {}  # 标的冷却时间记录 {symbol: last_buy_time}
-        # 使用根目录的 data/positions.json
-        self.positions_file = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'positions.json')
+        # 仓位存储 data/positions.db（data/positions.json 为当前持仓的兼容镜像），多策略运行时使用各自的仓位存储
+        self.position_store = getattr(runner, 'position_store', None) or get_position_store()
         self.load_positions()
     
     def load_positions(self):
-        """加载仓位数据"""
-        # 确保目录存在
-        os.makedirs(os.path.dirname(self.positions_file), exist_ok=True)
-        
-        if os.path.exists(self.positions_file):
-            with open(self.positions_file, 'r', encoding='utf-8') as f:
-                self.positions = json.load(f)
-                logger.info(f"加载仓位数据: {len(self.positions.get('current', []))} 个当前持仓, {len(self.positions.get('history', []))} 个历史记录")
-        else:
-            # 如果文件不存在，创建初始文件
-            logger.info("仓位文件不存在，创建新文件")
-            self.save_positions()
+        """加载当前持仓（同步外部对 positions.json 的修改，如手动平仓）"""
+        self.position_store.sync_from_json()
+        self.positions['current'] = self.position_store.load_current()
+        logger.info(f"加载仓位数据: {len(self.positions['current'])} 个当前持仓")
     
     def save_positions(self):
-        """保存仓位数据"""
-        # 确保目录存在
-        os.makedirs(os.path.dirname(self.positions_file), exist_ok=True)
-        
-        with open(self.positions_file, 'w', encoding='utf-8') as f:
-            json.dump(self.positions, f, ensure_ascii=False, indent=2)
+        """保存当前持仓（事务写入，历史记录不受影响）"""
+        self.position_store.save_current(self.positions['current'])
+    
+    def trade_timeout(self, key, default):
+        """交易模块中的等待时间（fill_timeout_seconds / confirm_timeout_seconds），保存配置后下一根K线生效"""
+        try:
+            return float(self.custom_strategies.module_config('trade').get(key, default))
+        except (TypeError, ValueError):
+            return default
 
     
     def run(self):
@@ -79,18 +103,25 @@ class Strategy:
         logger.info(f"策略 {'top_gainers_ema_1119_1537'} 开始执行")
         logger.info("=" * 60)
         
+        run_start_time = time.time()
+        # 本次触发对应的K线收盘边界，只使用开盘时间早于它的K线（按收盘触发时排除已开始的下一根K线）
+        bar_end_time = self.timer.bar_close_time if self.timer else None
+        
         try:
             # 步骤1: 重新加载仓位数据（同步手动平仓等操作）
             logger.info("\n步骤1: 重新加载仓位数据...")
             self.load_positions()
             
+            # 热更新自定义策略代码（保存策略后下一根K线生效，无需重启）
+            self.custom_strategies.reload_if_changed()
+            
             # 步骤2: 清理到期仓位（检查持仓时间）
             logger.info("\n步骤2: 清理到期仓位...")
             self.clear_expired_positions()
             
             # 步骤3: 获取BTCUSDT的5m行情数据（自定义标的）
             logger.info("\n步骤3: 获取BTCUSDT的5m行情数据...")
-            klines_BTCUSDT_5m = self.client.get_klines("BTCUSDT", "5m", 60)
+            klines_BTCUSDT_5m = self.kline_cache.get_klines("BTCUSDT", "5m", 60, end_time=bar_end_time)
             if klines_BTCUSDT_5m is None or len(klines_BTCUSDT_5m) == 0:
                 logger.warning(f"未获取到BTCUSDT的5mK线数据")
                 return
@@ -98,25 +129,8 @@ class Strategy:
 
             # 步骤4: 自定义策略判断（全局）
             logger.info("\n步骤4: 自定义策略判断...")
-            
-            try:
-                # 计算全局指标
-                global_indicators = self.calculate_indicators(klines_BTCUSDT_5m)
-                
-                signal = self.custom_strategy_1(klines_BTCUSDT_5m, global_indicators)
-                
-                # 全局策略：返回 "LONG" 或 "SHORT" 决定后续开单方向
-                if signal == "LONG":
-                    global_direction = "LONG"
-                    logger.info(f"  自定义策略通过 ✓ (全局方向: LONG)")
-                elif signal == "SHORT":
-                    global_direction = "SHORT"
-                    logger.info(f"  自定义策略通过 ✓ (全局方向: SHORT)")
-                else:
-                    logger.info(f"  自定义策略未通过（返回值: {signal}），策略结束")
-                    return
-            except Exception as e:
-                logger.error(f"自定义策略判断出错: {e}")
+            global_direction, global_indicators = self.judge_global(klines_BTCUSDT_5m)
+            if global_direction is None:
                 return
 
             # 步骤5: 获取交易标的
@@ -130,127 +144,35 @@ class Strategy:
 
             # 步骤6: 获取5m行情数据
             logger.info("\n步骤6: 获取5m行情数据...")
-            passed_symbols = []
-            
-            for symbol in symbols:
-                try:
-                    # 检查是否已持仓
-                    if any(p['symbol'] == symbol for p in self.positions['current']):
-                        logger.info(f"  {symbol} 已在持仓中，跳过")
-                        continue
-                    
-                    # 检查冷却时间
-                    if 0 > 0 and symbol in self.symbol_cooldown:
-                        last_buy_time = self.symbol_cooldown[symbol]
-                        time_passed = (datetime.now() - last_buy_time).total_seconds() / 60
-                        if time_passed < 0:
-                            remaining = 0 - time_passed
-                            logger.info(f"  {symbol} 冷却中，剩余 {remaining:.1f} 分钟，跳过")
-                            continue
-                    
-                    klines_5m = self.client.get_klines(symbol, "5m", 60)
-                    if klines_5m is None or len(klines_5m) == 0:
-                        logger.warning(f"  {symbol} 未获取到5mK线数据")
-                        continue
-                    
-                    # 保存数据供后续使用
-                    data = {
-                        'symbol': symbol,
-                        'klines_5m': klines_5m
-                    }
-                    
-                    # 如果有全局方向，添加到数据中
-                    if 'global_direction' in locals():
-                        data['direction'] = global_direction
-                    
-                    passed_symbols.append(data)
-                    
-                except Exception as e:
-                    logger.error(f"获取 {symbol} 5mK线数据出错: {e}")
-                    continue
-            
-            logger.info(f"成功获取 {len(passed_symbols)} 个标的的5mK线数据")
+            fetch_symbols = self.select_fetch_symbols(symbols)
             
+            # 并发获取K线（最大并发数: 5）
+            klines_map = fetch_klines_parallel(self.kline_cache, fetch_symbols, "5m", 60, max_concurrency=5,
+                                               end_time=bar_end_time)
+            passed_symbols = self.collect_klines(fetch_symbols, klines_map, global_direction)
             if not passed_symbols:
-                logger.warning("未获取到任何K线数据，策略结束")
                 return
 
             # 步骤7: 批量计算技术指标
             logger.info("\n步骤7: 批量计算技术指标...")
-            
-            for data in passed_symbols:
-                try:
-                    # 合并全局K线数据
-                    data['klines_BTCUSDT_5m'] = klines_BTCUSDT_5m
-                    klines_BTCUSDT_5m = data.get('klines_BTCUSDT_5m', [])
-                    klines_5m = data.get('klines_5m', [])
-                    indicators = self.calculate_indicators(klines_BTCUSDT_5m, klines_5m)
-                    # 合并全局指标
-                    if 'global_indicators' in locals():
-                        indicators.update(global_indicators)
-                    data['indicators'] = indicators
-                except Exception as e:
-                    logger.error(f"计算 {data['symbol']} 指标出错: {e}")
-                    data['indicators'] = {}
-            
-            logger.info(f"完成 {len(passed_symbols)} 个标的的指标计算")
+            self.apply_indicators(passed_symbols, klines_BTCUSDT_5m, global_indicators)
 
             # 步骤8: 自定义策略判断
             logger.info("\n步骤8: 自定义策略判断...")
-            
-            new_passed = []
-            for data in passed_symbols:
-                try:
-                    symbol = data['symbol']
-                    klines_5m = data.get('klines_5m', [])
-                    indicators = data.get('indicators', {})
-                    
-                    signal = self.custom_strategy_5(klines_BTCUSDT_5m, klines_5m, indicators)
-                    
-                    # 处理返回值：只识别 "LONG" 和 "SHORT"，其他都跳过
-                    if signal == "LONG":
-                        direction = "LONG"
-                    elif signal == "SHORT":
-                        direction = "SHORT"
-                    else:
-                        logger.info(f"  {symbol} 自定义策略未通过（返回值: {signal}）")
-                        continue
-                    
-                    # 检查方向一致性
-                    if 'direction' in data:
-                        if data['direction'] != direction:
-                            logger.info(f"  {symbol} 方向不一致（已有{data['direction']}，策略返回{direction}），跳过")
-                            continue
-                    else:
-                        data['direction'] = direction
-                    
-                    logger.info(f"  {symbol} 自定义策略通过 ✓ (方向: {direction})")
-                    new_passed.append(data)
-                except Exception as e:
-                    logger.error(f"判断 {data['symbol']} 自定义策略出错: {e}")
-            
-            passed_symbols = new_passed
-            logger.info(f"自定义策略通过: {len(passed_symbols)} 个标的")
-            
+            passed_symbols = self.judge_symbols(passed_symbols, klines_BTCUSDT_5m)
             if not passed_symbols:
-                logger.info("没有标的通过自定义策略，策略结束")
                 return
 
             # 步骤9: 执行买入
-            if passed_symbols:
-                logger.info(f"\n步骤9: 执行买入，共{len(passed_symbols)}个标的")
-                # 传递带方向的数据
-                symbols_with_direction = [{
-                    'symbol': d['symbol'],
-                    'direction': d.get('direction', 'LONG')
-                } for d in passed_symbols]
-                self.execute_batch_buy(symbols_with_direction)
-            else:
-                logger.info("\n没有符合条件的标的")
+            opened_orders = self.open_positions(passed_symbols)
 
             
-            # 最后总是执行：检查账户数据、止损单、挂单等
-            time.sleep(10)
+            # 最后总是执行：检查账户数据、止损单、挂单等（有开仓时先等待持仓确认，最多 confirm_timeout_seconds 秒）
+            if opened_orders:
+                self.order_tracker.wait_for_positions(
+                    [(o['symbol'], o.get('positionSide', 'LONG')) for o in opened_orders],
+                    timeout=self.trade_timeout('confirm_timeout_seconds', 10), since=run_start_time
+                )
             logger.info("\n最后检查: 验证账户数据、止损单、挂单...")
             self.check_positions_after_buy()
             
@@ -262,6 +184,238 @@ class Strategy:
             logger.error(f"策略执行出错: {e}", exc_info=True)
 
     
+    async def run_async(self):
+        """
+        执行策略主流程（异步模式）
+
+        与 run 的步骤相同：全局K线和涨幅榜同时获取，标的K线在共享事件循环上并发获取，
+        指标计算、自定义策略、热更新检查和下单等同步步骤都放到运行时的线程池执行，不在事件循环线程上运行，
+        等待期间其他策略可继续运行
+        """
+        logger.info("=" * 60)
+        logger.info(f"策略 {'top_gainers_ema_1119_1537'} 开始执行（异步）")
+        logger.info("=" * 60)
+        
+        run_start_time = time.time()
+        bar_end_time = self.timer.bar_close_time if self.timer else None
+        
+        try:
+            # 步骤1-2: 重新加载仓位数据、清理到期仓位
+            await to_thread(self.load_positions)
+            await to_thread(self.custom_strategies.reload_if_changed)
+            await to_thread(self.clear_expired_positions)
+            
+            # 步骤3 / 步骤5: 全局K线和交易标的同时获取（涨幅榜在同一根K线内为共享请求）
+            klines_BTCUSDT_5m, symbols = await asyncio.gather(
+                to_thread(self.kline_cache.get_klines, "BTCUSDT", "5m", 60, end_time=bar_end_time),
+                to_thread(self.get_symbols),
+            )
+            if klines_BTCUSDT_5m is None or len(klines_BTCUSDT_5m) == 0:
+                logger.warning(f"未获取到BTCUSDT的5mK线数据")
+                return
+            logger.info(f"获取到 {len(klines_BTCUSDT_5m)} 根BTCUSDT的5mK线, {len(symbols)} 个标的: {symbols}")
+            
+            # 步骤4: 自定义策略判断（全局）
+            global_direction, global_indicators = await to_thread(self.judge_global, klines_BTCUSDT_5m)
+            if global_direction is None:
+                return
+            if not symbols:
+                logger.warning("未获取到任何标的，策略结束")
+                return
+            
+            # 步骤6: 获取5m行情数据（最大并发数: 5）
+            fetch_symbols = await to_thread(self.select_fetch_symbols, symbols)
+            klines_map = await fetch_klines_async(self.kline_cache, fetch_symbols, "5m", 60, max_concurrency=5,
+                                                  end_time=bar_end_time)
+            passed_symbols = await to_thread(self.collect_klines, fetch_symbols, klines_map, global_direction)
+            if not passed_symbols:
+                return
+            
+            # 步骤7-8: 指标计算和自定义策略（同步计算放到线程池）
+            await to_thread(self.apply_indicators, passed_symbols, klines_BTCUSDT_5m, global_indicators)
+            passed_symbols = await to_thread(self.judge_symbols, passed_symbols, klines_BTCUSDT_5m)
+            if not passed_symbols:
+                return
+            
+            # 步骤9: 执行买入
+            opened_orders = await to_thread(self.open_positions, passed_symbols)
+            
+            # 最后检查：等待持仓确认（最多 confirm_timeout_seconds 秒），验证账户数据、止损单、挂单
+            if opened_orders:
+                await to_thread(
+                    self.order_tracker.wait_for_positions,
+                    [(o['symbol'], o.get('positionSide', 'LONG')) for o in opened_orders],
+                    timeout=self.trade_timeout('confirm_timeout_seconds', 10), since=run_start_time
+                )
+            logger.info("\n最后检查: 验证账户数据、止损单、挂单...")
+            await to_thread(self.check_positions_after_buy)
+            
+            logger.info("=" * 60)
+            logger.info("策略执行完成")
+            logger.info("=" * 60)
+            
+        except Exception as e:
+            logger.error(f"策略执行出错: {e}", exc_info=True)
+
+    
+    def judge_global(self, klines_BTCUSDT_5m):
+        """全局自定义策略判断，返回 (全局方向, 全局指标)，未通过时方向为 None"""
+        try:
+            # 计算全局指标
+            global_indicators = self.calculate_indicators(klines_BTCUSDT_5m)
+            
+            signal = self.custom_strategy_1(klines_BTCUSDT_5m, global_indicators)
+            
+            # 全局策略：返回 "LONG" 或 "SHORT" 决定后续开单方向
+            if signal in ("LONG", "SHORT"):
+                logger.info(f"  自定义策略通过 ✓ (全局方向: {signal})")
+                return signal, global_indicators
+            logger.info(f"  自定义策略未通过（返回值: {signal}），策略结束")
+        except Exception as e:
+            logger.error(f"自定义策略判断出错: {e}")
+        return None, {}
+
+    
+    def select_fetch_symbols(self, symbols):
+        """过滤已持仓和冷却中的标的，返回需要获取K线的标的"""
+        fetch_symbols = []
+        for symbol in symbols:
+            # 检查是否已持仓
+            if any(p['symbol'] == symbol for p in self.positions['current']):
+                logger.info(f"  {symbol} 已在持仓中，跳过")
+                continue
+            
+            # 检查冷却时间
+            if 0 > 0 and symbol in self.symbol_cooldown:
+                last_buy_time = self.symbol_cooldown[symbol]
+                time_passed = (datetime.now() - last_buy_time).total_seconds() / 60
+                if time_passed < 0:
+                    remaining = 0 - time_passed
+                    logger.info(f"  {symbol} 冷却中，剩余 {remaining:.1f} 分钟，跳过")
+                    continue
+            
+            fetch_symbols.append(symbol)
+        return fetch_symbols
+
+    
+    def collect_klines(self, fetch_symbols, klines_map, global_direction=None):
+        """整理获取到的K线，返回 [{symbol, klines_5m, direction}]"""
+        passed_symbols = []
+        for symbol in fetch_symbols:
+            klines_5m = klines_map.get(symbol)
+            if klines_5m is None or len(klines_5m) == 0:
+                logger.warning(f"  {symbol} 未获取到5mK线数据")
+                continue
+            
+            # 保存数据供后续使用
+            data = {
+                'symbol': symbol,
+                'klines_5m': klines_5m
+            }
+            
+            # 如果有全局方向，添加到数据中
+            if global_direction is not None:
+                data['direction'] = global_direction
+            
+            passed_symbols.append(data)
+        
+        logger.info(f"成功获取 {len(passed_symbols)} 个标的的5mK线数据")
+        if not passed_symbols:
+            logger.warning("未获取到任何K线数据，策略结束")
+        return passed_symbols
+
+    
+    def apply_indicators(self, passed_symbols, klines_BTCUSDT_5m, global_indicators=None):
+        """
+        计算技术指标并写入每个标的的 indicators
+
+        按标的增量计算（IndicatorEngine 保存每个标的的指标状态，每根K线只处理新收盘的K线），
+        新出现的标的首次按整个K线窗口初始化状态；批量向量化计算（indicator_batch）只用于回测和参数优化
+        """
+        for data in passed_symbols:
+            try:
+                # 合并全局K线数据
+                data['klines_BTCUSDT_5m'] = klines_BTCUSDT_5m
+                klines_5m = data.get('klines_5m', [])
+                indicators = self.calculate_indicators(klines_BTCUSDT_5m, klines_5m, symbol=data['symbol'])
+                # 合并全局指标
+                if global_indicators:
+                    indicators.update(global_indicators)
+                data['indicators'] = indicators
+            except Exception as e:
+                logger.error(f"计算 {data['symbol']} 指标出错: {e}")
+                data['indicators'] = {}
+        
+        logger.info(f"完成 {len(passed_symbols)} 个标的的指标计算")
+
+    
+    def judge_symbols(self, passed_symbols, klines_BTCUSDT_5m):
+        """逐个标的（或向量模式一次）执行自定义策略，返回通过且方向一致的标的"""
+        new_passed = []
+        
+        # 向量模式：所有标的一次调用（klines_5m 为 KlineMatrix，指标为二维数组）
+        signals = None
+        if self.custom_strategies.mode(5) == VECTOR_MODE:
+            func = self.custom_strategies.get(5, ('klines_BTCUSDT_5m', 'klines_5m', 'indicators'))
+            try:
+                signals = evaluate_vector(
+                    func, [klines_BTCUSDT_5m], [[d['klines_5m'] for d in passed_symbols]],
+                    [d.get('indicators', {}) for d in passed_symbols], [d['symbol'] for d in passed_symbols]
+                )
+            except Exception as e:
+                logger.error(f"向量自定义策略执行出错: {e}")
+                signals = [None] * len(passed_symbols)
+        
+        for i, data in enumerate(passed_symbols):
+            try:
+                symbol = data['symbol']
+                klines_5m = data.get('klines_5m', [])
+                indicators = data.get('indicators', {})
+                
+                if signals is not None:
+                    signal = signals[i]
+                else:
+                    signal = self.custom_strategy_5(klines_BTCUSDT_5m, klines_5m, indicators)
+                
+                # 处理返回值：只识别 "LONG" 和 "SHORT"，其他都跳过
+                if signal == "LONG":
+                    direction = "LONG"
+                elif signal == "SHORT":
+                    direction = "SHORT"
+                else:
+                    logger.info(f"  {symbol} 自定义策略未通过（返回值: {signal}）")
+                    continue
+                
+                # 检查方向一致性
+                if 'direction' in data:
+                    if data['direction'] != direction:
+                        logger.info(f"  {symbol} 方向不一致（已有{data['direction']}，策略返回{direction}），跳过")
+                        continue
+                else:
+                    data['direction'] = direction
+                
+                logger.info(f"  {symbol} 自定义策略通过 ✓ (方向: {direction})")
+                new_passed.append(data)
+            except Exception as e:
+                logger.error(f"判断 {data['symbol']} 自定义策略出错: {e}")
+        
+        logger.info(f"自定义策略通过: {len(new_passed)} 个标的")
+        if not new_passed:
+            logger.info("没有标的通过自定义策略，策略结束")
+        return new_passed
+
+    
+    def open_positions(self, passed_symbols):
+        """执行买入，返回成交的订单"""
+        logger.info(f"\n步骤9: 执行买入，共{len(passed_symbols)}个标的")
+        # 传递带方向的数据
+        symbols_with_direction = [{
+            'symbol': d['symbol'],
+            'direction': d.get('direction', 'LONG')
+        } for d in passed_symbols]
+        return self.execute_batch_buy(symbols_with_direction) or []
+
+    
     def get_symbols(self):
         """获取交易标的"""
         # 使用 get_top_gainers 获取涨幅榜数据
@@ -269,6 +423,9 @@ class Strategy:
         
         logger.info(f"获取涨幅榜原始数据: {len(gainers)} 个标的")
         
+        # 涨幅榜数据中已包含最新价，直接更新行情快照
+        self.market_snapshot.update_from_tickers(gainers)
+        
         # 过滤黑名单
         if []:
             gainers = [g for g in gainers if g['symbol'] not in []]
@@ -287,24 +444,29 @@ class Strategy:
         return symbols
 
     
-    def calculate_indicators(self, klines_BTCUSDT_5m, klines_5m=None):
-        """计算技术指标"""
+    def calculate_indicators(self, klines_BTCUSDT_5m, klines_5m=None, symbol=None):
+        """计算技术指标（传入 symbol 时增量计算，只处理新收盘的K线）"""
         indicators = {}
         
         # 从 klines_5m 计算指标
         if klines_5m is not None:
-            df_5m = pd.DataFrame(klines_5m)
-            close_5m = df_5m["close"].astype(float).values
-            high_5m = df_5m["high"].astype(float).values
-            low_5m = df_5m["low"].astype(float).values
-            volume_5m = df_5m["volume"].astype(float).values
-            ema = talib.EMA(close_5m, timeperiod=20)
+            klines_5m = as_kline_array(klines_5m)
+            ema = self.indicator_engine.compute(symbol, "5m", klines_5m, "EMA", period=20)['ema']
             indicators['ema_5m'] = ema.tolist()
         return indicators
 
     
     def custom_strategy_1(self, klines_BTCUSDT_5m, indicators):
         """自定义策略 - 自定义策略"""
+        # 运行期间保存过的新代码优先（预编译，见 strategy_code_cache）
+        func = self.custom_strategies.get(1, ('klines_BTCUSDT_5m', 'indicators'))
+        if func is not None:
+            try:
+                return func(klines_BTCUSDT_5m, indicators)
+            except Exception as e:
+                logger.error(f"自定义策略执行出错: {e}")
+                return None
+        
         # 自定义策略逻辑
         # 可用变量: klines_BTCUSDT_5m, indicators
         # 可用库: pandas as pd, numpy as np, datetime, timedelta, logging, json, os, time, math
@@ -328,6 +490,15 @@ class Strategy:
     
     def custom_strategy_5(self, klines_BTCUSDT_5m, klines_5m, indicators):
         """自定义策略 - 自定义策略"""
+        # 运行期间保存过的新代码优先（预编译，见 strategy_code_cache）
+        func = self.custom_strategies.get(5, ('klines_BTCUSDT_5m', 'klines_5m', 'indicators'))
+        if func is not None:
+            try:
+                return func(klines_BTCUSDT_5m, klines_5m, indicators)
+            except Exception as e:
+                logger.error(f"自定义策略执行出错: {e}")
+                return None
+        
         # 自定义策略逻辑
         # 可用变量: klines_BTCUSDT_5m, klines_5m, indicators
         # 可用库: pandas as pd, numpy as np, datetime, timedelta, logging, json, os, time, math
@@ -405,15 +576,14 @@ class Strategy:
                 if symbols_with_direction:
                     direction = symbols_with_direction[i].get('direction', 'LONG')
                 
-                # 获取当前价格
-                ticker = self.client.client.ticker_price(symbol=symbol)
-                current_price = float(ticker['price'])
+                # 获取当前价格（从行情快照读取）
+                current_price = self.market_snapshot.price(symbol)
                 
                 # 计算数量
                 quantity = 6 / current_price
                 
                 # 格式化数量精度
-                quantity_str = self.client.format_quantity(symbol, quantity)
+                quantity_str = self.symbol_filters.format_quantity(symbol, quantity)
                 
                 # 跳过数量为0的订单
                 if float(quantity_str) == 0:
@@ -435,7 +605,12 @@ class Strategy:
                     logger.warning(f"{symbol} 未知方向: {direction}，跳过")
                     continue
                 
-                limit_price_str = self.client.format_price(symbol, limit_price)
+                limit_price_str = self.symbol_filters.format_price(symbol, limit_price)
+                
+                # 名义价值低于 MIN_NOTIONAL 的订单会被交易所拒绝，下单前跳过
+                if not self.symbol_filters.check_notional(symbol, quantity_str, limit_price_str):
+                    logger.warning(f"{symbol} 订单名义价值 {quantity_str} × {limit_price_str} 低于最小名义价值，跳过")
+                    continue
                 
                 # 生成自定义订单号
                 client_order_id = f"QUANT_{symbol}_{int(time.time() * 1000)}"
@@ -472,7 +647,10 @@ class Strategy:
             try:
                 logger.info(f"执行第 {index + 1} 批订单，共 {len(batch_orders)} 个")
                 logger.info(f"订单详情: {batch_orders}")
+                sent_at = time.time()
                 results = self.client.client.new_batch_order(batch_orders)
+                if self.timer:
+                    self.timer.record_order(sent_at, len(batch_orders))
                 logger.info(f"下单结果: {results}")
                 
                 # 过滤成功的订单
@@ -540,7 +718,22 @@ class Strategy:
             
             # 下止盈止损单
             if True and all_success_orders:
-                time.sleep(1)
+                # 等待开仓单成交确认（用户数据流推送，最多 fill_timeout_seconds 秒），用实际成交均价计算止盈止损
+                fill_timeout = self.trade_timeout('fill_timeout_seconds', 1)
+                filled_states = self.order_tracker.wait_for_orders(all_success_orders, timeout=fill_timeout)
+                filled = False
+                for order in all_success_orders:
+                    state = filled_states.get(order['orderId'])
+                    if state and state['avg_price'] > 0:
+                        order['avgPrice'] = state['avg_price']
+                        order['status'] = state['status']
+                        for pos in self.positions['current']:
+                            if pos['order_id'] == order['orderId']:
+                                pos['entry_price'] = state['avg_price']
+                                filled = True
+                # 成交均价立即保存（不等止损单下单后再保存，止损单失败时也不会丢失）
+                if filled:
+                    self.save_positions()
                 
                 # 第一步：先下止损单
                 all_stop_loss_orders = []
@@ -572,8 +765,8 @@ class Strategy:
                         else:
                             continue
                         
-                        stop_loss_price_str = self.client.format_price(symbol, stop_loss_price)
-                        quantity_str = self.client.format_quantity(symbol, quantity)
+                        stop_loss_price_str = self.symbol_filters.format_price(symbol, stop_loss_price)
+                        quantity_str = self.symbol_filters.format_quantity(symbol, quantity)
                         all_stop_loss_orders.append({
                             'symbol': symbol,
                             'side': side,
@@ -585,12 +778,14 @@ class Strategy:
                         logger.info(f"  准备止损单 {symbol} ({position_side}): {stop_loss_price_str} ({price_change})")
                 
                 # 分批下止损单
+                placed_stop_loss_orders = []
                 if all_stop_loss_orders:
                     for index in range(math.ceil(len(all_stop_loss_orders) / batch_size)):
                         batch_sl = all_stop_loss_orders[index * batch_size : (index + 1) * batch_size]
                         try:
                             sl_results = self.client.client.new_batch_order(batch_sl)
                             logger.info(f"✓ 第 {index + 1} 批止损单设置成功: {len(sl_results)} 个订单")
+                            placed_stop_loss_orders.extend(r for r in sl_results if 'orderId' in r)
                             
                             for sl_result in sl_results:
                                 if 'orderId' in sl_result:
@@ -605,8 +800,9 @@ class Strategy:
                         except Exception as e:
                             logger.error(f"✗ 第 {index + 1} 批止损单设置失败: {e}")
                 
-                # 第二步：再下止盈单
-                time.sleep(1)
+                # 第二步：再下止盈单（止损单被交易所接受后立即下，最多等待 fill_timeout_seconds 秒）
+                if placed_stop_loss_orders:
+                    self.order_tracker.wait_for_orders(placed_stop_loss_orders, timeout=fill_timeout, statuses=('NEW',))
                 all_take_profit_orders = []
                 for idx, order in enumerate(all_success_orders):
                     symbol = order['symbol']
@@ -636,8 +832,8 @@ class Strategy:
                         else:
                             continue
                         
-                        take_profit_price_str = self.client.format_price(symbol, take_profit_price)
-                        quantity_str = self.client.format_quantity(symbol, quantity)
+                        take_profit_price_str = self.symbol_filters.format_price(symbol, take_profit_price)
+                        quantity_str = self.symbol_filters.format_quantity(symbol, quantity)
                         all_take_profit_orders.append({
                             'symbol': symbol,
                             'side': side,
@@ -692,7 +888,7 @@ class Strategy:
                     timestamp = datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d %H:%M:%S')
                     webhook = ""
                     if webhook:
-                        requests.post(
+                        get_http_session().post(
                             webhook,
                             json={"msg_type": "text", "content": {"text": f"开仓通知: {symbols_str} --- {timestamp}"} },
                             timeout=5
@@ -704,6 +900,8 @@ class Strategy:
                 logger.error(f"发送通知失败: {e}")
         except Exception as e:
             logger.error(f"批量下单失败: {e}")
+        
+        return all_success_orders
 
     
     def clear_expired_positions(self):
@@ -718,6 +916,7 @@ class Strategy:
         
         # 收集所有需要平仓的信息
         closed_positions = []
+        hold_bars_updated = False
         
         for position in self.positions['current'][:]:
             try:
@@ -735,12 +934,16 @@ class Strategy:
                         closed_positions.append(result)
                 else:
                     position['hold_bars'] = hold_bars + 1
-                    self.save_positions()
+                    hold_bars_updated = True
                     logger.info(f"  {symbol} 继续持仓 ({hold_bars + 1}/{max_hold_bars})")
                     
             except Exception as e:
                 logger.error(f"检查仓位 {position.get('symbol', 'unknown')} 出错: {e}")
         
+        # 统一保存持仓K线计数
+        if hold_bars_updated:
+            self.save_positions()
+        
         # 统一发送平仓通知
         if closed_positions:
             self.send_close_notification(closed_positions)
@@ -835,8 +1038,7 @@ class Strategy:
                 position['pnl'] = round(pnl, 2)
                 
                 self.positions['current'].remove(position)
-                self.positions['history'].append(position)
-                self.save_positions()
+                self.position_store.close_position(position, self.positions['current'])
                 
                 logger.info(f"✓ 平仓成功 ({reason}): {symbol}")
                 logger.info(f"  开仓价: {entry_price}, 平仓价: {exit_price}, 盈亏: {pnl:.2f} USDT")
@@ -902,7 +1104,7 @@ class Strategy:
                 
                 message = f"平仓通知: {', '.join(symbols_info)} | 总盈亏: {total_pnl:.2f}U --- {timestamp}"
                 
-                requests.post(
+                get_http_session().post(
                     webhook,
                     json={"msg_type": "text", "content": {"text": message}},
                     timeout=5
@@ -924,30 +1126,33 @@ def run_strategy(binance_client, config, runner=None):
     # 使用定时器启动
     logger.info("=" * 60)
     logger.info("策略启动：top_gainers_ema_1119_1537")
-    logger.info("定时周期：5m（K线收盘前5秒执行）")
-    logger.info("执行时间：04:55, 09:55, 14:55, 19:55, 24:55, 29:55, 34:55, 39:55, 44:55, 49:55, 54:55, 59:55")
+    logger.info("定时周期：5m（K线收盘前5秒执行，按服务器时间）")
     logger.info("=" * 60)
     
-    # 创建后台调度器
-    scheduler = BackgroundScheduler()
-    strategy.scheduler = scheduler
-    
-    # 添加定时任务
-    scheduler.add_job(
-        strategy.run,
-        'cron',
-        minute='4,9,14,19,24,29,34,39,44,49,54,59', second='55',
-        misfire_grace_time=5,
-        coalesce=False
+    # 创建策略定时器（before_close: 收盘前 offset_seconds 秒触发；kline_close: 收到收盘推送后触发）
+    timer = StrategyTimer(
+        strategy.run_async if EXECUTION_MODE == ASYNC_MODE else strategy.run,
+        clock=get_server_clock(binance_client),
+        kline_cache=strategy.kline_cache,
+        name='top_gainers_ema_1119_1537',
+        warmup=lambda: warm_up(binance_client),  # 触发前预热连接，第一笔下单不等待 TLS 握手
+        **TIMER_CONFIG
     )
+    strategy.timer = timer
+    strategy.scheduler = timer
     
-    # 启动调度器（非阻塞）
-    scheduler.start()
+    # 启动定时器（非阻塞）
+    timer.start()
     logger.info("定时任务已配置，等待下次执行...")
     
-    # 保持运行状态，同时检查 runner 的停止信号
+    # 保持运行状态，直到收到停止信号（runner 提供 stop_event 时直接等待，否则每秒检查 running 标志）
+    stop_event = getattr(runner, 'stop_event', None)
     try:
         while True:
+            if stop_event is not None:
+                stop_event.wait()
+                logger.info("收到停止信号，正在关闭...")
+                break
             if runner and hasattr(runner, 'running') and not runner.running:
                 logger.info("收到停止信号，正在关闭...")
                 break
@@ -956,6 +1161,7 @@ def run_strategy(binance_client, config, runner=None):
         logger.info("收到中断信号")
     finally:
         logger.info("正在停止定时器...")
-        scheduler.shutdown(wait=False)
+        timer.stop()
         logger.info("定时器已停止")
-
+        # 释放该客户端的K线缓存、行情快照、订单跟踪等（推送连接和后台线程）
+        close_client(binance_client)
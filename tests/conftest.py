@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+"""
+测试配置
+后端模块以 backend/ 为工作目录运行（模块之间直接 import），测试时把 backend/ 和 strategies/ 加入搜索路径
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (os.path.join(ROOT, 'backend'), os.path.join(ROOT, 'strategies')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
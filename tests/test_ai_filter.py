@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+AI 筛选测试
+通过本地模拟的 OpenAI 兼容接口（FakeOpenAIServer）驱动 AIFilter：并发请求、截止时间、回复缓存和同轮去重
+"""
+import time
+
+import pytest
+
+from ai_filter import AIFilter, parse_reply
+from fake_openai_server import FakeOpenAIServer
+
+CONFIG = {
+    'prompt': '标的指标 {indicators.value}，请给出信号',
+    'system_prompt': '只回复 JSON',
+    'long_required_signal': ['BUY'],
+    'long_required_confidence': ['HIGH'],
+    'short_required_signal': ['SELL'],
+    'short_required_confidence': [],
+}
+
+
+@pytest.fixture
+def server():
+    server = FakeOpenAIServer().start()
+    yield server
+    server.stop()
+
+
+def _items(*values, direction='LONG'):
+    return [{'symbol': f'S{value}', 'direction': direction, 'indicators': {'value': [value]}} for value in values]
+
+
+def _filter(server, **kwargs):
+    return AIFilter(base_url=server.url, api_key='test', model='stub', **kwargs)
+
+
+def test_results_follow_required_signals(server):
+    server.reply = lambda prompt: {'signal': 'BUY', 'confidence': 'HIGH', 'reason': 'ok'}
+    ai = _filter(server)
+    results = ai.filter(_items(1) + _items(2, direction='SHORT'), CONFIG)
+    assert [r['symbol'] for r in results] == ['S1', 'S2']
+    assert [r['passed'] for r in results] == [True, False]
+    assert results[0]['signal'] == 'BUY' and results[0]['reason'] == 'ok'
+    assert not results[0]['cached'] and not results[0]['timed_out']
+    assert results[0]['prompt_tokens'] > 0 and results[0]['prompt_chars'] > 0
+    # 请求包含系统提示词、模型和渲染后的提示词
+    request = server.requests[0]
+    assert request['model'] == 'stub'
+    assert request['messages'][0] == {'role': 'system', 'content': '只回复 JSON'}
+    assert '{indicators.value}' not in request['messages'][1]['content']
+
+
+def test_requests_run_concurrently(server):
+    server.delay = 0.3
+    ai = _filter(server, concurrency=8)
+    start = time.time()
+    results = ai.filter(_items(*range(6)), CONFIG)
+    assert time.time() - start < 0.3 * 3
+    assert len(server.requests) == 6
+    assert all(r['passed'] for r in results)
+    assert ai.stats['calls'] == 6
+
+
+def test_concurrency_limit_from_config(server):
+    server.delay = 0.2
+    ai = _filter(server, concurrency=8)
+    start = time.time()
+    ai.filter(_items(*range(4)), dict(CONFIG, concurrency=1))
+    assert time.time() - start >= 0.2 * 4
+
+
+def test_deadline_marks_slow_items_hold(server):
+    server.delay = lambda prompt: 3 if '99' in prompt else 0.1
+    ai = _filter(server, deadline=10)
+    start = time.time()
+    results = ai.filter(_items(1, 99, 2), dict(CONFIG, deadline_seconds=0.8))
+    assert time.time() - start < 2
+    slow = results[1]
+    assert slow['timed_out'] and not slow['passed']
+    assert slow['signal'] == 'HOLD' and slow['latency'] == 0.8
+    assert [r['passed'] for r in (results[0], results[2])] == [True, True]
+    assert ai.stats['timeouts'] == 1
+
+    # 超时的提示词不缓存，下一轮重新请求
+    server.delay = 0
+    results = ai.filter(_items(1, 99), CONFIG, deadline=2)
+    assert [r['cached'] for r in results] == [True, False]
+    assert results[1]['passed']
+
+
+def test_cached_replies_skip_requests(server):
+    ai = _filter(server)
+    ai.filter(_items(1, 2), CONFIG)
+    assert len(server.requests) == 2
+    results = ai.filter(_items(2, 1, 3), CONFIG)
+    assert [r['cached'] for r in results] == [True, True, False]
+    assert len(server.requests) == 3
+    assert ai.stats['cache_hits'] == 2
+    # 缓存按方向重新判断是否通过
+    results = ai.filter(_items(1, direction='SHORT'), CONFIG)
+    assert results[0]['cached'] and not results[0]['passed']
+
+
+def test_cache_key_includes_system_prompt(server):
+    ai = _filter(server)
+    ai.filter(_items(1), CONFIG)
+    ai.filter(_items(1), dict(CONFIG, system_prompt='另一个系统提示词'))
+    assert len(server.requests) == 2
+
+
+def test_duplicate_prompts_requested_once_per_round(server):
+    server.delay = 0.1
+    ai = _filter(server)
+    items = _items(1, 1, 2)
+    items[1]['symbol'] = 'OTHER'
+    results = ai.filter(items, CONFIG)
+    assert len(server.requests) == 2
+    assert [r['symbol'] for r in results] == ['S1', 'OTHER', 'S2']
+    assert all(r['passed'] and not r['cached'] for r in results)
+
+
+def test_cache_ttl_expires(server):
+    ai = _filter(server, cache_ttl=0.2)
+    ai.filter(_items(1), CONFIG)
+    assert ai.filter(_items(1), CONFIG)[0]['cached']
+    time.sleep(0.3)
+    assert not ai.filter(_items(1), CONFIG)[0]['cached']
+    assert len(server.requests) == 2
+
+
+def test_cache_size_evicts_oldest(server):
+    ai = _filter(server, cache_size=2)
+    for value in (1, 2, 3):
+        ai.filter(_items(value), CONFIG)
+    results = ai.filter(_items(3, 2, 1), CONFIG)
+    assert [r['cached'] for r in results] == [True, True, False]
+
+
+def test_failed_requests_hold(server):
+    server.stop()
+    ai = _filter(server)
+    results = ai.filter(_items(1), CONFIG, deadline=2)
+    assert results[0]['signal'] == 'HOLD'
+    assert not results[0]['passed'] and not results[0]['timed_out']
+    assert ai.stats['errors'] == 1
+
+
+def test_parse_reply():
+    assert parse_reply('结果: {"signal": "sell", "confidence": "medium", "reason": "x"}') == \
+        {'signal': 'SELL', 'confidence': 'MEDIUM', 'reason': 'x'}
+    assert parse_reply('无法判断')['signal'] == 'HOLD'
+    assert parse_reply(None)['signal'] == 'HOLD'
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+回测引擎模拟撮合测试
+三个标的在同一根K线发出信号：多单按开盘价成交后止盈，空单按限价成交后同一根K线同时触及止盈止损按止损，
+另一张多单限价未触及不成交；盈亏、手续费和权益与手算结果一致
+"""
+import numpy as np
+import pytest
+
+from backtest_engine import run_backtest
+from kline_array import KlineArray
+
+STEP = 300000
+
+# 每根K线 (open, high, low, close)
+BARS = {
+    # 第 2 根开盘 100.5 低于限价 101，按开盘价成交；第 3 根最高 111 触及止盈 110.55
+    'AAAUSDT': [(100, 100, 100, 100), (100, 100, 100, 100), (100.5, 101, 100, 100.8), (105, 111, 105, 108),
+                (108, 108, 108, 108)],
+    # 空单限价 49.5，第 2 根开盘 49 低于限价、最高 49.8 触及，按限价成交；第 3 根同时触及止损 51.975 和止盈 44.55
+    'BBBUSDT': [(50, 50, 50, 50), (50, 50, 50, 50), (49, 49.8, 48.9, 49.2), (49, 52, 44, 50), (50, 50, 50, 50)],
+    # 限价 202，第 2 根最低 205 未触及
+    'CCCUSDT': [(200, 200, 200, 200), (200, 200, 200, 200), (210, 215, 205, 212), (212, 212, 212, 212),
+                (212, 212, 212, 212)],
+}
+
+# 只在第 1 根K线收盘时发出信号：收盘价 >= 100 做多，否则做空
+CODE = """if klines_5m[-1]['open_time'] != 300000:
+    return None
+return "LONG" if klines_5m[-1]['close'] >= 100 else "SHORT"
+"""
+
+MODULES = [
+    {'type': 'symbol', 'config': {'mode': 'fixed', 'symbols': list(BARS), 'top_n': 3}},
+    {'type': 'kline', 'config': {'interval': '5m', 'limit': 2}},
+    {'type': 'custom_strategy', 'config': {'code': CODE}},
+    {'type': 'trade', 'config': {'max_positions': 3, 'hold_bars': 10, 'position_size': 100,
+                                 'take_profit_ratio': 10, 'stop_loss_ratio': 5}},
+    {'type': 'timer', 'config': {'interval': '5m'}},
+]
+
+
+def _klines(bars):
+    o, h, l, c = (np.array(column, dtype=np.float64) for column in zip(*bars))
+    return KlineArray.from_columns({'open_time': np.arange(len(bars)) * STEP, 'open': o, 'high': h, 'low': l,
+                                    'close': c, 'volume': np.ones(len(bars))})
+
+
+@pytest.fixture(scope='module')
+def result():
+    history = {'5m': {symbol: _klines(bars) for symbol, bars in BARS.items()}}
+    return run_backtest(MODULES, history, initial_balance=1000, fee_rate=0.001, limit_spread=0.01)
+
+
+def test_fills_and_exits_match_hand_computed(result):
+    trades = {t['symbol']: t for t in result['trades']}
+    assert set(trades) == {'AAAUSDT', 'BBBUSDT'}
+
+    long = trades['AAAUSDT']
+    assert long['positionSide'] == 'LONG' and long['exit_reason'] == '止盈'
+    assert long['entry_price'] == pytest.approx(100.5)
+    assert long['exit_price'] == pytest.approx(110.55)
+    assert long['quantity'] == pytest.approx(1.0)
+    assert long['fee'] == pytest.approx((100.5 + 110.55) * 0.001)
+    assert long['pnl'] == pytest.approx(10.05 - 0.21105)
+
+    short = trades['BBBUSDT']
+    assert short['positionSide'] == 'SHORT' and short['exit_reason'] == '止损'
+    assert short['entry_price'] == pytest.approx(49.5)
+    assert short['exit_price'] == pytest.approx(51.975)
+    assert short['quantity'] == pytest.approx(2.0)
+    assert short['fee'] == pytest.approx((49.5 + 51.975) * 2 * 0.001)
+    assert short['pnl'] == pytest.approx(-(51.975 - 49.5) * 2 - 0.20295)
+
+
+def test_summary_and_equity(result):
+    summary = result['summary']
+    pnl = (10.05 - 0.21105) + (-4.95 - 0.20295)
+    assert summary['orders'] == 3 and summary['unfilled_orders'] == 1
+    assert summary['trades'] == 2 and summary['wins'] == 1
+    assert summary['pnl'] == pytest.approx(pnl)
+    assert summary['fees'] == pytest.approx(0.21105 + 0.20295)
+    assert summary['final_equity'] == pytest.approx(1000 + pnl)
+    assert summary['strategy_errors'] == 0
+
+    # 成交那根K线收盘时的浮动盈亏: 多单 (100.8 - 100.5) * 1，空单 (49.5 - 49.2) * 2
+    equity = result['equity']['equity']
+    assert equity[:2] == [1000, 1000]
+    assert equity[2] == pytest.approx(1000 + 0.3 + 0.6)
+    assert equity[3] == equity[4] == pytest.approx(1000 + pnl)
+    assert summary['max_drawdown'] == 0
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+共享 HTTP 传输层测试
+通过本地模拟的 REST 服务（FakeRestServer，HTTP/1.1 保持连接）检查：多个连接器的会话共用一个连接池，
+顺序请求复用同一个连接，预热建立的连接被之后的并发请求复用，按接口记录延迟
+"""
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+import requests
+from binance.um_futures import UMFutures
+
+import http_transport
+from fake_rest_server import FakeRestServer
+from http_transport import HttpTransport, LatencyHistogram, install_transport
+
+
+@pytest.fixture
+def server():
+    server = FakeRestServer(delay=0.05).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def transport(monkeypatch):
+    transport = HttpTransport(pool_size=8)
+    monkeypatch.setattr(http_transport, '_transport', transport)
+    return transport
+
+
+def _pool(transport, server):
+    pools = transport.pools()
+    assert list(pools) == [server.url]
+    return pools[server.url]
+
+
+def test_sequential_requests_reuse_one_connection(server, transport):
+    for _ in range(5):
+        assert transport.session.get(server.url + '/fapi/v1/ping', timeout=5).json() == {}
+    pool = _pool(transport, server)
+    assert pool['connections_opened'] == 1
+    assert pool['requests'] == 5
+    assert pool['idle'] == 1
+
+
+def test_client_sessions_share_pool(server, transport):
+    futures, spot = UMFutures(base_url=server.url), UMFutures(base_url=server.url)
+    client = SimpleNamespace(client=futures, spot_client=spot, other=requests.Session())
+    assert install_transport(client) is transport
+    assert transport.stats['sessions'] == 3
+    # 重复安装不会重复挂载
+    install_transport(client)
+    assert transport.stats['sessions'] == 3
+
+    futures.time()
+    spot.ping()
+    transport.session.get(server.url + '/fapi/v1/ping', timeout=5)
+    pool = _pool(transport, server)
+    assert pool['connections_opened'] == 1 and pool['requests'] == 3
+
+
+def test_warm_up_connections_are_reused(server, transport):
+    assert transport.warm_up(server.url, connections=4) == 4
+    assert _pool(transport, server)['connections_opened'] == 4
+    assert transport.stats['warmups'] == 1 and transport.stats['warmup_ms'] > 0
+
+    session = transport.session
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(lambda _: session.get(server.url + '/fapi/v1/time', timeout=5).close(), range(8)))
+    pool = _pool(transport, server)
+    assert pool['connections_opened'] == 4
+    assert pool['requests'] == 12
+
+
+def test_latency_recorded_per_path(server, transport):
+    transport.session.get(server.url + '/fapi/v1/ping?x=1', timeout=5)
+    transport.session.get(server.url + '/fapi/v1/time', timeout=5)
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    # 端口已关闭，连接被拒绝
+    with pytest.raises(requests.RequestException):
+        transport.session.get(f'http://127.0.0.1:{port}/fapi/v1/time', timeout=1)
+    latency = transport.status()['latency']
+    assert set(latency) == {'GET /fapi/v1/ping', 'GET /fapi/v1/time'}
+    assert latency['GET /fapi/v1/ping']['count'] == 1
+    assert latency['GET /fapi/v1/ping']['avg_ms'] >= 50
+    assert latency['GET /fapi/v1/time']['errors'] == 1
+
+
+def test_histogram_percentiles():
+    histogram = LatencyHistogram(buckets=(10, 100))
+    for ms in (1, 2, 3, 50, 500):
+        histogram.add(ms)
+    assert histogram.counts == [3, 1, 1]
+    assert histogram.percentile(0.5) == 10
+    assert histogram.percentile(0.8) == 100
+    assert histogram.percentile(1) == 500
+    assert LatencyHistogram().percentile(0.5) is None
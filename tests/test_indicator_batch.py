@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+跨标的向量化指标与逐个标的调用 TA-Lib 的一致性
+标的K线数量各不相同（含短于预热期的标的），以及回测长历史上布林带的精度
+"""
+import numpy as np
+import pytest
+
+talib = pytest.importorskip('talib')
+
+import indicator_batch
+from indicator_batch import compute_batch, unstack
+from indicator_engine import INDICATOR_OUTPUTS
+from kline_array import KlineArray
+
+STEP = 300000
+LENGTHS = [120, 10, 61, 0, 35, 90, 26, 1, 100]
+
+CASES = [
+    ('EMA', {'period': 20}, lambda c: [talib.EMA(c, 20)]),
+    ('RSI', {'period': 14}, lambda c: [talib.RSI(c, 14)]),
+    ('MACD', {'fast_period': 12, 'slow_period': 26, 'signal_period': 9}, lambda c: list(talib.MACD(c, 12, 26, 9))),
+    ('MACD', {'fast_period': 10, 'slow_period': 5, 'signal_period': 4}, lambda c: list(talib.MACD(c, 5, 10, 4))),
+    ('BOLL', {'period': 20, 'std_dev': 2}, lambda c: list(talib.BBANDS(c, 20, 2, 2, 0))),
+    ('BOLL', {'period': 10, 'std_dev': 1.5}, lambda c: list(talib.BBANDS(c, 10, 1.5, 1.5, 0))),
+]
+IDS = [f"{t}-{'-'.join(str(v) for v in p.values())}" for t, p, _ in CASES]
+
+
+def _series(seed, n, base=100.0):
+    rng = np.random.default_rng(seed)
+    return base + np.cumsum(rng.normal(0, 1, n))
+
+
+def _klines(close):
+    times = np.arange(len(close)) * STEP
+    return KlineArray.from_columns({'open_time': times, 'open': close, 'high': close, 'low': close,
+                                    'close': close, 'volume': np.ones(len(close))})
+
+
+def _assert_matches(actual, expected, rtol=1e-9, atol=1e-9):
+    """NaN 位置（预热期）完全一致，其余数值一致"""
+    actual = np.asarray(actual, dtype=np.float64)
+    np.testing.assert_array_equal(np.isnan(actual), np.isnan(expected))
+    mask = ~np.isnan(expected)
+    np.testing.assert_allclose(actual[mask], expected[mask], rtol=rtol, atol=atol)
+
+
+@pytest.mark.parametrize('indicator_type,params,reference', CASES, ids=IDS)
+def test_ragged_batch_matches_talib(indicator_type, params, reference):
+    closes = [_series(seed, n) for seed, n in enumerate(LENGTHS)]
+    result = compute_batch([_klines(c) for c in closes], indicator_type, **params)
+    for name, expected_all in zip(INDICATOR_OUTPUTS[indicator_type], zip(*(reference(c) for c in closes))):
+        assert result[name].shape == (len(LENGTHS), max(LENGTHS))
+        for close, actual, expected in zip(closes, unstack(result[name], LENGTHS), expected_all):
+            assert len(actual) == len(close)
+            _assert_matches(actual, expected)
+
+
+def test_empty_pool():
+    result = compute_batch([], 'BOLL', period=20, std_dev=2)
+    assert [v.shape for v in result.values()] == [(0, 0)] * 3
+
+
+def test_boll_long_history_has_no_drift(monkeypatch):
+    """回测对整段历史计算布林带：十万根高价位K线上仍与 TA-Lib 一致，分块边界不影响结果"""
+    monkeypatch.setattr(indicator_batch, 'BOLL_CHUNK_ELEMENTS', 20 * 3 * 7001)
+    closes = [_series(11, 105000, base=60000.0), _series(12, 90000, base=30000.0), _series(13, 40, base=1.0)]
+    lengths = [len(c) for c in closes]
+    result = compute_batch([_klines(c) for c in closes], 'BOLL', period=20, std_dev=2)
+    for i, close in enumerate(closes):
+        expected = talib.BBANDS(close, 20, 2, 2, 0)
+        for name, reference in zip(INDICATOR_OUTPUTS['BOLL'], expected):
+            actual = unstack(result[name], lengths)[i]
+            _assert_matches(actual, reference, rtol=1e-10, atol=1e-6)
+        # 带宽（上轨 - 中轨）等于 2 倍总体标准差，不受价位抵消误差影响
+        middle = np.asarray(unstack(result['boll_middle'], lengths)[i])
+        upper = np.asarray(unstack(result['boll_upper'], lengths)[i])
+        windows = np.lib.stride_tricks.sliding_window_view(close, 20)
+        np.testing.assert_allclose((upper - middle)[19:], 2 * windows.std(axis=1), rtol=0, atol=1e-8)
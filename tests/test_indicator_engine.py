@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""增量指标引擎与 TA-Lib 全量计算的一致性（EMA / RSI / MACD / BOLL）"""
+import numpy as np
+import pytest
+
+talib = pytest.importorskip('talib')
+
+from indicator_engine import INDICATOR_OUTPUTS, IndicatorEngine, create_state
+from kline_array import KlineArray
+
+STEP = 300000
+WINDOW = 60
+
+CASES = [
+    ('EMA', {'period': 20}, lambda c: [talib.EMA(c, 20)]),
+    ('EMA', {'period': 5}, lambda c: [talib.EMA(c, 5)]),
+    ('RSI', {'period': 14}, lambda c: [talib.RSI(c, 14)]),
+    ('RSI', {'period': 6}, lambda c: [talib.RSI(c, 6)]),
+    ('MACD', {'fast_period': 12, 'slow_period': 26, 'signal_period': 9}, lambda c: list(talib.MACD(c, 12, 26, 9))),
+    ('MACD', {'fast_period': 5, 'slow_period': 10, 'signal_period': 4}, lambda c: list(talib.MACD(c, 5, 10, 4))),
+    ('BOLL', {'period': 20, 'std_dev': 2}, lambda c: list(talib.BBANDS(c, 20, 2, 2, 0))),
+    ('BOLL', {'period': 10, 'std_dev': 1.5}, lambda c: list(talib.BBANDS(c, 10, 1.5, 1.5, 0))),
+]
+IDS = [f"{t}-{'-'.join(str(v) for v in p.values())}" for t, p, _ in CASES]
+
+
+def _series(seed, n=400):
+    rng = np.random.default_rng(seed)
+    return 100 + np.cumsum(rng.normal(0, 1, n))
+
+
+def _klines(close, start=0):
+    times = (np.arange(len(close)) + start) * STEP
+    return KlineArray.from_columns({'open_time': times, 'open': close, 'high': close, 'low': close,
+                                    'close': close, 'volume': np.ones(len(close))})
+
+
+def _assert_matches(actual, expected):
+    """NaN 位置（预热期）完全一致，其余数值一致"""
+    np.testing.assert_array_equal(np.isnan(actual), np.isnan(expected))
+    mask = ~np.isnan(expected)
+    np.testing.assert_allclose(actual[mask], expected[mask], rtol=1e-9, atol=1e-9)
+
+
+def _outputs(indicator_type, result):
+    return [result[name] for name in INDICATOR_OUTPUTS[indicator_type]]
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+@pytest.mark.parametrize('indicator_type,params,reference', CASES, ids=IDS)
+def test_state_update_matches_talib(indicator_type, params, reference, seed):
+    close = _series(seed)
+    state = create_state(indicator_type, params)
+    values = np.array([state.update(float(x)) for x in close], dtype=np.float64).reshape(len(close), -1)
+    for column, expected in zip(values.T, reference(close)):
+        _assert_matches(column, expected)
+
+
+@pytest.mark.parametrize('indicator_type,params,reference', CASES, ids=IDS)
+def test_peek_does_not_change_state(indicator_type, params, reference):
+    close = _series(4, 80)
+    state = create_state(indicator_type, params)
+    for x in close:
+        peeked = state.peek(float(x))
+        state.peek(float(x) * 2)
+        np.testing.assert_array_equal(np.asarray(peeked, dtype=float), np.asarray(state.update(float(x)), dtype=float))
+
+
+@pytest.mark.parametrize('indicator_type,params,reference', CASES, ids=IDS)
+def test_stateless_compute_matches_talib(indicator_type, params, reference):
+    close = _series(5, WINDOW)
+    result = IndicatorEngine().compute(None, '5m', _klines(close), indicator_type, **params)
+    for actual, expected in zip(_outputs(indicator_type, result), reference(close)):
+        _assert_matches(actual, expected)
+
+
+@pytest.mark.parametrize('indicator_type,params,reference', CASES, ids=IDS)
+def test_incremental_windows_match_talib(indicator_type, params, reference):
+    """滑动窗口逐根更新：每个窗口的结果等于从第一根K线起全量计算的对应部分（最后一根为未收盘K线试算）"""
+    close = _series(6, 300)
+    klines = _klines(close)
+    engine = IndicatorEngine()
+    for end in range(WINDOW, len(close) + 1):
+        result = engine.compute('BTCUSDT', '5m', klines[end - WINDOW:end], indicator_type, **params)
+        if end % 20 and end != len(close):
+            continue
+        for actual, expected in zip(_outputs(indicator_type, result), reference(close[:end])):
+            _assert_matches(actual, expected[-WINDOW:])
+
+
+@pytest.mark.parametrize('indicator_type,params,reference', CASES, ids=IDS)
+def test_repeated_compute_on_same_bar(indicator_type, params, reference):
+    """同一根未收盘K线多次计算（价格变化）不会重复写入状态"""
+    live = _series(7, WINDOW)
+    engine = IndicatorEngine()
+    engine.compute('BTCUSDT', '5m', _klines(live), indicator_type, **params)
+    for price in (live[-1] * 1.01, live[-1] * 0.98, live[-1]):
+        live[-1] = price
+        result = engine.compute('BTCUSDT', '5m', _klines(live), indicator_type, **params)
+        for actual, expected in zip(_outputs(indicator_type, result), reference(live)):
+            _assert_matches(actual[-1:], expected[-1:])
+
+
+@pytest.mark.parametrize('indicator_type,params,reference', CASES, ids=IDS)
+def test_reseed_after_gap(indicator_type, params, reference):
+    """窗口与已处理的K线不连续（策略停运后恢复）时重建状态，结果等于对新窗口全量计算"""
+    close = _series(8, 400)
+    klines = _klines(close)
+    engine = IndicatorEngine()
+    for end in range(WINDOW, 120):
+        engine.compute('BTCUSDT', '5m', klines[end - WINDOW:end], indicator_type, **params)
+    window = klines[300:300 + WINDOW]
+    result = engine.compute('BTCUSDT', '5m', window, indicator_type, **params)
+    for actual, expected in zip(_outputs(indicator_type, result), reference(close[300:300 + WINDOW])):
+        _assert_matches(actual, expected)
+    # 重建后继续增量更新
+    result = engine.compute('BTCUSDT', '5m', klines[301:301 + WINDOW], indicator_type, **params)
+    for actual, expected in zip(_outputs(indicator_type, result), reference(close[300:301 + WINDOW])):
+        _assert_matches(actual, expected[-WINDOW:])
+
+
+def test_symbols_and_params_are_isolated():
+    close_a, close_b = _series(9, WINDOW), _series(10, WINDOW)
+    engine = IndicatorEngine()
+    engine.compute('AAA', '5m', _klines(close_a), 'EMA', period=20)
+    ema_b = engine.compute('BBB', '5m', _klines(close_b), 'EMA', period=20)['ema']
+    ema_a10 = engine.compute('AAA', '5m', _klines(close_a), 'EMA', period=10)['ema']
+    _assert_matches(ema_b, talib.EMA(close_b, 20))
+    _assert_matches(ema_a10, talib.EMA(close_a, 10))
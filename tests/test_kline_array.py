@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""KlineArray 的复制 / 序列化（传给工作进程、参数优化进程和用户代码中的 copy）"""
+import copy
+import pickle
+
+import numpy as np
+import pytest
+
+from kline_array import KlineArray
+
+
+@pytest.fixture
+def klines():
+    return KlineArray.from_rows([
+        {'open_time': 1000 + i, 'open': i, 'high': i + 2, 'low': i - 1, 'close': i + 1, 'volume': 10 * i,
+         'quote_volume': 5.0 * i, 'trades': i}
+        for i in range(20)
+    ])
+
+
+def _assert_same(a, b):
+    assert list(a.columns) == list(b.columns)
+    for name in a.columns:
+        np.testing.assert_array_equal(a.columns[name], b.columns[name])
+        assert a.columns[name].dtype == b.columns[name].dtype
+
+
+@pytest.mark.parametrize('protocol', range(pickle.HIGHEST_PROTOCOL + 1))
+def test_pickle_round_trip(klines, protocol):
+    restored = pickle.loads(pickle.dumps(klines, protocol))
+    _assert_same(klines, restored)
+    assert restored[-1]['close'] == 20.0
+
+
+def test_copy_and_deepcopy(klines):
+    shallow = copy.copy(klines)
+    deep = copy.deepcopy(klines)
+    _assert_same(klines, shallow)
+    _assert_same(klines, deep)
+    deep.close[0] = -1
+    assert klines.close[0] == 1.0
+
+
+def test_slice_round_trip(klines):
+    part = pickle.loads(pickle.dumps(klines[5:10]))
+    assert len(part) == 5
+    assert part.open_time.tolist() == list(range(1005, 1010))
+
+
+def test_unknown_attribute_raises(klines):
+    with pytest.raises(AttributeError):
+        klines.missing
+    assert not hasattr(KlineArray.__new__(KlineArray), 'close')
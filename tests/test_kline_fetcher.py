@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+K线并发获取测试
+结果按传入顺序返回，单个标的出错或无数据不影响其他标的，并发数受 max_concurrency 限制
+"""
+import threading
+import time
+
+from async_runtime import get_async_runtime
+from kline_array import KlineArray
+from kline_fetcher import fetch_klines_async, fetch_klines_parallel
+
+SYMBOLS = ['BTCUSDT', 'ETHUSDT', 'BADUSDT', 'EMPTYUSDT', 'SOLUSDT', 'XRPUSDT']
+
+
+class _FakeClient:
+    """按标的返回K线，BADUSDT 抛出异常，EMPTYUSDT 返回空列表；记录调用参数和最大并发数"""
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.calls = []
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def get_klines(self, symbol, interval, limit, end_time=None):
+        with self._lock:
+            self.calls.append((symbol, interval, limit, end_time))
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            # 越靠前的标的返回越慢，检查结果不按完成顺序排列
+            time.sleep(self.delay * (len(SYMBOLS) - SYMBOLS.index(symbol)) / len(SYMBOLS))
+            if symbol == 'BADUSDT':
+                raise RuntimeError('Invalid symbol')
+            if symbol == 'EMPTYUSDT':
+                return []
+            base = SYMBOLS.index(symbol)
+            return [{'open_time': i * 60000, 'open': base, 'high': base + 1, 'low': base - 1, 'close': base,
+                     'volume': 1} for i in range(limit)]
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+def _check(results, client, max_concurrency):
+    assert list(results) == SYMBOLS
+    assert results['BADUSDT'] is None
+    assert len(results['EMPTYUSDT']) == 0
+    for symbol in ('BTCUSDT', 'ETHUSDT', 'SOLUSDT', 'XRPUSDT'):
+        assert isinstance(results[symbol], KlineArray)
+        assert len(results[symbol]) == 3
+        assert results[symbol].close[-1] == SYMBOLS.index(symbol)
+    assert sorted(c[0] for c in client.calls) == sorted(SYMBOLS)
+    assert 1 < client.max_active <= max_concurrency
+
+
+def test_fetch_parallel_isolates_failures_and_keeps_order():
+    client = _FakeClient()
+    results = fetch_klines_parallel(client, SYMBOLS, '5m', 3, max_concurrency=3)
+    _check(results, client, 3)
+    assert all(c[1:] == ('5m', 3, None) for c in client.calls)
+
+
+def test_fetch_parallel_passes_end_time():
+    client = _FakeClient(delay=0)
+    fetch_klines_parallel(client, ['BTCUSDT', 'ETHUSDT'], '1h', 3, end_time=123)
+    assert {c[3] for c in client.calls} == {123}
+
+
+def test_fetch_parallel_empty():
+    assert fetch_klines_parallel(_FakeClient(), [], '5m', 3) == {}
+
+
+def test_fetch_async_isolates_failures_and_keeps_order():
+    client = _FakeClient()
+    results = get_async_runtime().run(fetch_klines_async(client, SYMBOLS, '5m', 3, max_concurrency=2, end_time=7))
+    _check(results, client, 2)
+    assert {c[3] for c in client.calls} == {7}
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""K线仓库：多个进程同时写入同一目录时索引和分区保持一致"""
+import multiprocessing
+
+import numpy as np
+
+from kline_warehouse import KlineWarehouse
+
+STEP = 300000
+T0 = 1_700_000_000_000 // STEP * STEP
+
+
+def _bar(t):
+    return {'open_time': t, 'open': 1.0, 'high': 2.0, 'low': 0.5, 'close': t / 1e12, 'volume': 1.0,
+            'quote_volume': 1.0, 'close_time': t + STEP - 1, 'trades': 1}
+
+
+def _writer(root, worker_id, workers, rounds):
+    warehouse = KlineWarehouse(None, root)
+    for i in range(rounds):
+        t = T0 + (i * workers + worker_id) * STEP
+        # 相邻进程写入的区间互相重叠，既有追加也有合并重写
+        warehouse.write('BTCUSDT', '5m', [_bar(t), _bar(t + STEP)], covered=(t, t + 2 * STEP))
+
+
+def test_concurrent_writers(tmp_path):
+    workers, rounds = 3, 40
+    ctx = multiprocessing.get_context('spawn')
+    processes = [ctx.Process(target=_writer, args=(str(tmp_path), i, workers, rounds)) for i in range(workers)]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join(120)
+        assert p.exitcode == 0
+
+    warehouse = KlineWarehouse(None, str(tmp_path))
+    klines = warehouse.read('BTCUSDT', '5m')
+    expected = np.arange(T0, T0 + (rounds * workers + 1) * STEP, STEP)
+    np.testing.assert_array_equal(klines.open_time, expected)
+    np.testing.assert_allclose(klines.close, expected / 1e12)
+    coverage = warehouse.coverage('BTCUSDT', '5m')['5m/BTCUSDT']
+    assert coverage['ranges'] == [[int(T0), int(expected[-1] + STEP)]]
+    assert coverage['bars'] == len(expected)
+
+
+def test_reader_sees_other_process_writes(tmp_path):
+    reader = KlineWarehouse(None, str(tmp_path))
+    assert reader.read('BTCUSDT', '5m') is None
+    ctx = multiprocessing.get_context('spawn')
+    p = ctx.Process(target=_writer, args=(str(tmp_path), 0, 1, 5))
+    p.start()
+    p.join(60)
+    assert len(reader.read('BTCUSDT', '5m')) == 6
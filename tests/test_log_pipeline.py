@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+日志管道测试
+环形缓冲区游标、写文件，GET /api/logs 在缓冲区不足时从日志文件（含轮转的旧文件）补足，
+原有 log 事件改由管道逐条推送，以及接口和订阅的登录校验
+"""
+import logging
+
+import pytest
+from flask import Flask, jsonify
+from flask_socketio import SocketIO
+
+import log_api
+from log_pipeline import LogPipeline, LogRing, tail_lines
+
+
+def _record(message, name='test'):
+    return logging.makeLogRecord({'msg': message, 'levelno': logging.INFO, 'levelname': 'INFO', 'name': name})
+
+
+@pytest.fixture
+def pipeline(tmp_path):
+    pipeline = LogPipeline(log_file=str(tmp_path / 'logs' / 'app.log'), max_bytes=800, backup_count=3)
+    yield pipeline
+    pipeline.stop()
+
+
+@pytest.fixture
+def app(pipeline, monkeypatch):
+    monkeypatch.setattr(log_api, 'get_log_pipeline', lambda: pipeline)
+    app = Flask(__name__)
+    app.state = {'authenticated': True}
+    app.add_url_rule('/api/auth/status', 'auth_status', lambda: jsonify(app.state))
+    app.add_url_rule('/api/logs', 'logs', lambda: jsonify({'success': True}), methods=['GET', 'DELETE'])
+    app.socketio = SocketIO(app)
+    log_api.register_log_routes(app, app.socketio)
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+class _FakeSocketIO:
+    def __init__(self):
+        self.emitted = []
+
+    def emit(self, event, data, **kwargs):
+        self.emitted.append((event, data, kwargs))
+
+
+def test_ring_after_reports_dropped():
+    ring = LogRing(capacity=3)
+    for i in range(5):
+        ring.append({'message': str(i)})
+    entries, cursor, dropped = ring.after(0)
+    assert [e['message'] for e in entries] == ['2', '3', '4']
+    assert cursor == 5 and dropped == 2
+    assert ring.after(cursor) == ([], 5, 0)
+
+
+def test_tail_lines(tmp_path):
+    path = tmp_path / 'a.log'
+    path.write_text(''.join(f'line {i}\n' for i in range(1000)), encoding='utf-8')
+    assert tail_lines(str(path), 3, block_size=16) == ['line 997', 'line 998', 'line 999']
+    assert len(tail_lines(str(path), 5000, block_size=100)) == 1000
+    assert tail_lines(str(path), 0) == []
+    assert tail_lines(str(tmp_path / 'missing.log'), 3) == []
+
+
+def test_tail_file_reads_rotated_files(pipeline):
+    for i in range(100):
+        pipeline.handler.handle(_record(f'消息 {i:03d}'))
+    lines = pipeline.tail_file(60)
+    assert len(lines) == 60
+    assert lines[0].endswith('消息 040') and lines[-1].endswith('消息 099')
+    assert len(pipeline.tail_file(1000)) < 100   # 超出保留个数的旧文件已删除
+
+
+def test_get_logs_falls_back_to_log_file(pipeline, client, tmp_path):
+    # 之前运行写入的日志（不在当前缓冲区中）
+    (tmp_path / 'logs' / 'app.log').write_text('2025-01-01 00:00:00 - INFO - 上次运行\n', encoding='utf-8')
+    pipeline.handler.handle(_record('本次运行'))
+    data = client.get('/api/logs?limit=10').get_json()
+    assert data['logs'][0] == '2025-01-01 00:00:00 - INFO - 上次运行'
+    assert data['logs'][1].endswith('本次运行')
+    assert len(data['logs']) == 2
+    assert data['cursor'] == 1
+
+    # 缓冲区足够时直接返回缓冲区中的日志
+    data = client.get('/api/logs?limit=1').get_json()
+    assert len(data['logs']) == 1 and data['logs'][0].endswith('本次运行')
+
+
+def test_get_logs_after_cursor(pipeline, client):
+    for i in range(3):
+        pipeline.handler.handle(_record(f'消息 {i}'))
+    data = client.get('/api/logs?after=1').get_json()
+    assert [e['message'] for e in data['logs']] == ['消息 1', '消息 2']
+    assert data['cursor'] == 3 and data['dropped'] == 0
+    assert client.get('/api/logs?after=x').status_code == 400
+
+
+def test_drain_errors_go_to_stderr(pipeline, capsys, monkeypatch):
+    def fail():
+        raise RuntimeError('磁盘已满')
+    monkeypatch.setattr(pipeline, '_flush_file', fail)
+    pipeline.flush_interval = 0.01
+    pipeline.start()
+    pipeline.handler.handle(_record('x'))
+    pipeline._stop.wait(0.2)
+    pipeline._stop.set()
+    pipeline._thread.join(2)
+    captured = capsys.readouterr()
+    assert '日志管道处理出错: 磁盘已满' in captured.err
+    assert captured.out == ''
+
+
+def test_get_logs_clamps_limit(pipeline, client):
+    for i in range(3):
+        pipeline.handler.handle(_record(f'消息 {i}'))
+    for limit in (0, -5):
+        logs = client.get(f'/api/logs?limit={limit}').get_json()['logs']
+        assert len(logs) == 1 and logs[0].endswith('消息 2')
+    assert len(client.get('/api/logs?after=0&limit=0').get_json()['logs']) == 1
+
+
+def test_log_routes_require_login(app, pipeline, client):
+    pipeline.handler.handle(_record('x'))
+    app.state['authenticated'] = False
+    assert client.get('/api/logs').status_code == 401
+    assert client.delete('/api/logs').status_code == 401
+    assert len(pipeline.ring.tail(10)) == 1
+
+    app.state['authenticated'] = True
+    assert client.delete('/api/logs').get_json() == {'success': True}
+    assert pipeline.ring.tail(10) == []
+
+
+def test_log_subscribe_requires_login(app, pipeline):
+    app.state['authenticated'] = False
+    socket = app.socketio.test_client(app)
+    socket.emit('log_subscribe', {'after': 0})
+    assert [r['args'][0] for r in socket.get_received()] == [{'success': False, 'error': '未登录'}]
+    assert pipeline._clients == {}
+
+    app.state['authenticated'] = True
+    socket.emit('log_subscribe', {'after': 0})
+    assert list(pipeline._clients.values()) == [{'cursor': 0, 'sent_at': None}]
+
+
+def test_log_events_go_through_pipeline(pipeline):
+    socketio = _FakeSocketIO()
+    pipeline.attach(socketio)
+    pipeline.subscribe('batched', 0)
+    # 原应用逐条推送的 log 事件被忽略，其他事件照常发送
+    socketio.emit('log', {'message': 'direct'})
+    socketio.emit('other', {'x': 1})
+    assert socketio.emitted == [('other', {'x': 1}, {})]
+    socketio.emitted.clear()
+
+    for i in range(3):
+        pipeline.handler.handle(_record(f'消息 {i}'))
+    pipeline._flush_clients()
+    single = [(data, kwargs) for event, data, kwargs in socketio.emitted if event == 'log']
+    # 只监听 log 的页面每条日志收到一条消息，按顺序，不发给已订阅分批推送的客户端
+    assert [data['message'] for data, _ in single] == ['消息 0', '消息 1', '消息 2']
+    assert all(kwargs == {'skip_sid': ['batched']} for _, kwargs in single)
+    batches = [(data, kwargs) for event, data, kwargs in socketio.emitted if event == 'log_batch']
+    assert len(batches) == 1
+    data, kwargs = batches[0]
+    assert [e['message'] for e in data['entries']] == ['消息 0', '消息 1', '消息 2']
+    assert data['cursor'] == 3 and kwargs['to'] == 'batched'
+
+    # 再次接管同一个 socketio 不会重复包装
+    pipeline.attach(socketio)
+    socketio.emitted.clear()
+    pipeline.handler.handle(_record('消息 3'))
+    pipeline._flush_clients()
+    assert [(e[1]['id'], e[1]['message']) for e in socketio.emitted if e[0] == 'log'] == [(4, '消息 3')]
+
+
+def test_broadcast_reports_dropped(pipeline):
+    pipeline.ring = LogRing(capacity=2)
+    pipeline.handler.ring = pipeline.ring
+    socketio = _FakeSocketIO()
+    pipeline.attach(socketio)
+    for i in range(5):
+        pipeline.handler.handle(_record(f'消息 {i}'))
+    pipeline._flush_clients()
+    messages = [data['message'] for event, data, _ in socketio.emitted]
+    assert messages == ['... 日志推送过慢，跳过 3 条', '消息 3', '消息 4']
+    assert all(kwargs == {'skip_sid': None} for _, _, kwargs in socketio.emitted)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+行情快照测试
+整体刷新和 24h ticker 数据写入快照，过期后读取时整体刷新一次，推送消息更新快照（不连接推送）
+"""
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import market_snapshot
+from market_snapshot import MarketSnapshot
+
+
+class _FakeFutures:
+    """ticker_price / book_ticker 返回当前的全市场价格，记录请求次数"""
+
+    def __init__(self, prices, delay=0):
+        self.prices = prices
+        self.delay = delay
+        self.calls = {'ticker_price': 0, 'book_ticker': 0}
+
+    def ticker_price(self):
+        self.calls['ticker_price'] += 1
+        if self.delay:
+            threading.Event().wait(self.delay)
+        return [{'symbol': s, 'price': str(p)} for s, p in self.prices.items()]
+
+    def book_ticker(self):
+        self.calls['book_ticker'] += 1
+        return [{'symbol': s, 'bidPrice': str(p - 1), 'askPrice': str(p + 1)} for s, p in self.prices.items()]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(market_snapshot, 'time', SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+def _snapshot(prices, **kwargs):
+    futures = _FakeFutures(prices, **kwargs)
+    return MarketSnapshot(SimpleNamespace(client=futures), max_age=5), futures
+
+
+def test_first_read_seeds_whole_market(clock):
+    snapshot, futures = _snapshot({'BTCUSDT': 100.0, 'ETHUSDT': 10.0})
+    assert snapshot.price('BTCUSDT') == 100.0
+    assert snapshot.price('ETHUSDT') == 10.0
+    assert snapshot.book('ETHUSDT') == (9.0, 11.0)
+    assert futures.calls == {'ticker_price': 1, 'book_ticker': 1}
+    assert snapshot.stats == {'hits': 1, 'refreshes': 1}
+
+
+def test_stale_snapshot_refreshes_once(clock):
+    snapshot, futures = _snapshot({'BTCUSDT': 100.0})
+    snapshot.refresh()
+    futures.prices['BTCUSDT'] = 105.0
+    clock[0] += 5
+    assert snapshot.price('BTCUSDT') == 100.0   # 未超过 max_age
+    clock[0] += 0.1
+    assert snapshot.price('BTCUSDT') == 105.0
+    assert snapshot.book('BTCUSDT') == (104.0, 106.0)
+    assert futures.calls['ticker_price'] == 2
+
+
+def test_missing_symbol_raises_after_refresh(clock):
+    snapshot, futures = _snapshot({'BTCUSDT': 100.0})
+    with pytest.raises(KeyError):
+        snapshot.price('NOPEUSDT')
+    # 刚刷新过（不足 max_age）时不再重复请求
+    with pytest.raises(KeyError):
+        snapshot.book('NOPEUSDT')
+    assert futures.calls['ticker_price'] == 1
+
+
+def test_ticker_data_and_pushes_update_without_requests(clock):
+    snapshot, futures = _snapshot({'BTCUSDT': 100.0})
+    snapshot.update_from_tickers([{'symbol': 'BTCUSDT', 'lastPrice': '101.5'}, {'symbol': 'SOLUSDT', 'price': '20'},
+                                  {'symbol': 'XRPUSDT'}])
+    assert snapshot.price('BTCUSDT') == 101.5
+    assert snapshot.price('SOLUSDT') == 20.0
+    clock[0] += 4
+    snapshot._on_message('!miniTicker@arr', [{'s': 'BTCUSDT', 'c': '102'}])
+    snapshot._on_message('!bookTicker', {'e': 'bookTicker', 's': 'BTCUSDT', 'b': '101.9', 'a': '102.1'})
+    clock[0] += 4
+    # 推送更新的数据重新计算有效期，未推送的标的过期
+    assert snapshot.price('BTCUSDT') == 102.0
+    assert snapshot.book('BTCUSDT') == (101.9, 102.1)
+    assert futures.calls['ticker_price'] == 0
+    assert snapshot.price('SOLUSDT') == 20.0   # 过期后整体刷新一次（刷新结果中没有时保留原值）
+    assert futures.calls['ticker_price'] == 1
+
+
+def test_concurrent_stale_reads_share_one_refresh():
+    snapshot, futures = _snapshot({'BTCUSDT': 100.0}, delay=0.2)
+    threads = [threading.Thread(target=snapshot.price, args=('BTCUSDT',)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert futures.calls['ticker_price'] == 1
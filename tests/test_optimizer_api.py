@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+参数优化接口测试
+接口需要登录，已有任务未结束时拒绝提交新任务
+"""
+import threading
+
+import pytest
+from flask import Flask, jsonify
+
+import optimizer_api
+from optimizer_api import OptimizeJob
+
+
+@pytest.fixture
+def app(monkeypatch):
+    release = threading.Event()
+
+    def run(job):
+        job.status = 'running'
+        release.wait(5)
+        job.status = 'finished'
+    monkeypatch.setattr(OptimizeJob, 'run', run)
+    monkeypatch.setattr(optimizer_api, '_jobs', {})
+    app = Flask(__name__)
+    app.state = {'authenticated': False}
+    app.release = release
+    app.add_url_rule('/api/auth/status', 'auth_status', lambda: jsonify(app.state))
+    optimizer_api.register_optimizer_routes(app)
+    yield app
+    release.set()
+
+
+def test_optimize_routes_require_login(app):
+    client = app.test_client()
+    assert client.post('/api/optimize', json={'space': {'x': [1]}}).status_code == 401
+    assert client.get('/api/optimize/x').status_code == 401
+    assert client.delete('/api/optimize/x').status_code == 401
+    assert optimizer_api._jobs == {}
+
+
+def test_rejects_concurrent_jobs(app):
+    app.state['authenticated'] = True
+    client = app.test_client()
+    first = client.post('/api/optimize', json={'space': {'x': [1]}}).get_json()['job_id']
+    response = client.post('/api/optimize', json={'space': {'x': [2]}})
+    assert response.status_code == 409
+    assert response.get_json()['job_id'] == first
+    assert list(optimizer_api._jobs) == [first]
+
+    # 上一个任务结束后可以提交新任务
+    app.release.set()
+    optimizer_api._jobs[first].status = 'finished'
+    assert client.post('/api/optimize', json={'space': {'x': [2]}}).status_code == 200
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+订单跟踪测试
+用户数据流推送到达后立即结束等待，超时只返回已确认的订单；未连接时回退为 REST 轮询
+"""
+import threading
+import time
+
+from order_tracker import OrderTracker, parse_order_update, parse_rest_order
+
+
+class _Connected:
+    connected = True
+
+
+class _FakeRest:
+    """query_order 前几次返回 NEW，之后返回 FILLED；get_position_risk 返回设置的持仓"""
+
+    def __init__(self, fill_after=2):
+        self.fill_after = fill_after
+        self.queries = 0
+        self.positions = []
+        self.client = self
+
+    def query_order(self, symbol, orderId):
+        self.queries += 1
+        status = 'FILLED' if self.queries > self.fill_after else 'NEW'
+        return {'symbol': symbol, 'orderId': orderId, 'clientOrderId': 'c', 'side': 'BUY', 'positionSide': 'LONG',
+                'type': 'LIMIT', 'status': status, 'avgPrice': '101.5' if status == 'FILLED' else '0',
+                'executedQty': '0.01', 'origQty': '0.01'}
+
+    def get_position_risk(self):
+        return self.positions
+
+
+def _order_update(order_id, status, avg_price='0', symbol='BTCUSDT'):
+    return {'e': 'ORDER_TRADE_UPDATE', 'o': {'s': symbol, 'i': order_id, 'c': f'QUANT_{order_id}', 'S': 'BUY',
+                                             'ps': 'LONG', 'o': 'LIMIT', 'X': status, 'ap': avg_price,
+                                             'z': '0.01', 'q': '0.01'}}
+
+
+def _tracker(client=None, connected=True, **kwargs):
+    tracker = OrderTracker(client or _FakeRest(), **kwargs)
+    if connected:
+        tracker._connection = _Connected()
+    return tracker
+
+
+def _push_later(tracker, messages, delay=0.1):
+    def push():
+        time.sleep(delay)
+        for message in messages:
+            tracker._on_message('user-data', message)
+    threading.Thread(target=push, daemon=True).start()
+
+
+def test_parse_order_fields():
+    order = parse_order_update(_order_update(7, 'FILLED', '101.5')['o'])
+    assert order == {'symbol': 'BTCUSDT', 'order_id': 7, 'client_order_id': 'QUANT_7', 'side': 'BUY',
+                     'position_side': 'LONG', 'type': 'LIMIT', 'status': 'FILLED', 'avg_price': 101.5,
+                     'filled_qty': 0.01, 'orig_qty': 0.01}
+    rest = parse_rest_order(_FakeRest(fill_after=0).query_order('BTCUSDT', 7))
+    assert rest['status'] == 'FILLED' and rest['avg_price'] == 101.5 and rest['client_order_id'] == 'c'
+
+
+def test_wait_returns_on_push():
+    tracker = _tracker()
+    events = []
+    tracker.add_listener(lambda event, data: events.append(event))
+    _push_later(tracker, [_order_update(1, 'NEW'), _order_update(1, 'FILLED', '100.2'), _order_update(2, 'FILLED', '5')])
+    start = time.time()
+    result = tracker.wait_for_orders([{'symbol': 'BTCUSDT', 'orderId': 1}, {'symbol': 'BTCUSDT', 'orderId': 2}],
+                                     timeout=3)
+    assert time.time() - start < 1
+    assert result[1]['status'] == 'FILLED' and result[1]['avg_price'] == 100.2
+    assert set(result) == {1, 2}
+    assert events == ['ORDER_TRADE_UPDATE'] * 3
+
+
+def test_wait_timeout_returns_confirmed_only():
+    tracker = _tracker()
+    _push_later(tracker, [_order_update(1, 'FILLED', '100'), _order_update(2, 'NEW')], delay=0)
+    start = time.time()
+    result = tracker.wait_for_orders([{'symbol': 'BTCUSDT', 'orderId': 1}, {'symbol': 'BTCUSDT', 'orderId': 2},
+                                      {'symbol': 'BTCUSDT', 'code': -2019}], timeout=0.4)
+    assert 0.4 <= time.time() - start < 1
+    assert list(result) == [1]
+
+
+def test_wait_for_new_status_and_final_statuses():
+    tracker = _tracker()
+    tracker._on_message('user-data', _order_update(1, 'NEW'))
+    tracker._on_message('user-data', _order_update(2, 'REJECTED'))
+    result = tracker.wait_for_orders([{'symbol': 'BTCUSDT', 'orderId': 1}, {'symbol': 'BTCUSDT', 'orderId': 2}],
+                                     timeout=0.2, statuses=('NEW',))
+    assert {k: v['status'] for k, v in result.items()} == {1: 'NEW', 2: 'REJECTED'}
+
+
+def test_wait_polls_rest_when_disconnected():
+    client = _FakeRest(fill_after=2)
+    tracker = _tracker(client, connected=False)
+    result = tracker.wait_for_orders([{'symbol': 'BTCUSDT', 'orderId': 1}], timeout=3)
+    assert result[1]['status'] == 'FILLED'
+    assert client.queries == 3
+
+
+def test_wait_for_positions():
+    tracker = _tracker()
+    since = time.time()
+    _push_later(tracker, [{'e': 'ACCOUNT_UPDATE', 'a': {'P': [{'s': 'BTCUSDT', 'ps': 'LONG', 'pa': '0.01',
+                                                                 'ep': '100'}]}}])
+    assert tracker.wait_for_positions([('BTCUSDT', 'LONG')], timeout=3, since=since)
+    assert tracker.positions[('BTCUSDT', 'LONG')]['entry_price'] == 100
+    assert not tracker.wait_for_positions([('ETHUSDT', 'LONG')], timeout=0.2)
+
+    client = _FakeRest()
+    client.positions = [{'symbol': 'ETHUSDT', 'positionSide': 'SHORT', 'positionAmt': '-1'}]
+    assert _tracker(client, connected=False).wait_for_positions([('ETHUSDT', 'SHORT')], timeout=2)
+
+
+def test_prune_orders():
+    tracker = _tracker(order_retention=0, max_orders=2)
+    tracker._on_message('user-data', _order_update(1, 'FILLED', '1'))
+    tracker._on_message('user-data', _order_update(2, 'NEW'))
+    time.sleep(0.01)
+    tracker._on_message('user-data', _order_update(3, 'NEW'))
+    tracker._on_message('user-data', _order_update(4, 'NEW'))
+    # 终态订单超过保留时间被丢弃，总数不超过上限
+    assert list(tracker.orders) == [3, 4]
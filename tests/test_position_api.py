@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+仓位接口测试
+替换处理函数后的仓位接口需要登录：未登录时返回 401 且不修改仓位存储；
+账户状态缓存在登录校验之后才返回，未登录的 socket 连接不能订阅账户状态
+"""
+import pytest
+from flask import Flask, jsonify
+from flask_socketio import SocketIO
+
+import position_api
+from position_store import PositionStore
+
+RECORD = {'symbol': 'BTCUSDT', 'positionSide': 'LONG', 'client_order_id': 'a', 'entry_time': '2025-11-17 10:00:00',
+          'exit_time': '2025-11-17 11:00:00', 'exit_reason': 'TP', 'pnl': 1.5}
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = PositionStore(db_file=str(tmp_path / 'positions.db'), json_file=str(tmp_path / 'positions.json'))
+    store.close_position(RECORD, [])
+    return store
+
+
+@pytest.fixture
+def app(store, monkeypatch):
+    monkeypatch.setattr(position_api, 'get_position_store', lambda: store)
+    app = Flask(__name__)
+    app.state = {'authenticated': False}
+    app.add_url_rule('/api/auth/status', 'auth_status', lambda: jsonify(app.state))
+    app.add_url_rule('/api/positions', 'positions', lambda: 'original')
+    app.add_url_rule('/api/positions/history', 'positions_history', lambda: 'original', methods=['GET', 'DELETE'])
+    app.add_url_rule('/api/account', 'account', lambda: jsonify({'source': 'original'}))
+    app.socketio = SocketIO(app)
+    position_api.register_position_routes(app, app.socketio)
+    return app
+
+
+class _FakeAccountState:
+    version = 3
+
+    def __init__(self):
+        self.calls = 0
+
+    def snapshot(self):
+        self.calls += 1
+        return {'account': {'balance': 100}, 'version': self.version, 'positions': {}}
+
+    def sync(self, since):
+        self.calls += 1
+        return {'version': self.version, 'full': True}
+
+
+@pytest.fixture
+def account(monkeypatch):
+    state = _FakeAccountState()
+    monkeypatch.setattr(position_api, '_account_state', lambda: state)
+    monkeypatch.setattr(position_api, '_update_subscribers', lambda state: None)
+    return state
+
+
+def test_position_routes_require_login(app, store):
+    client = app.test_client()
+    for rule in ('/api/positions', '/api/positions/history', '/api/positions/stats'):
+        assert client.get(rule).status_code == 401
+    assert client.delete('/api/positions/history').status_code == 401
+    assert store.history_count() == 1
+
+    app.state['authenticated'] = True
+    data = client.get('/api/positions').get_json()
+    assert data['history'][0]['client_order_id'] == 'a'
+    assert client.delete('/api/positions/history').get_json() == {'success': True}
+    assert store.history_count() == 0
+
+
+def test_account_cache_requires_login(app, account):
+    client = app.test_client()
+    assert client.get('/api/account').status_code == 401
+    assert client.get('/api/account/state').status_code == 401
+    assert account.calls == 0
+
+    app.state['authenticated'] = True
+    assert client.get('/api/account').get_json()['balance'] == 100
+    assert client.get('/api/account/state?since=1').get_json()['version'] == 3
+
+
+def test_account_subscribe_requires_login(app, account):
+    socket = app.socketio.test_client(app)
+    socket.emit('account_subscribe', {'version': 1})
+    received = socket.get_received()
+    assert [r['args'][0] for r in received] == [{'success': False, 'error': '未登录'}]
+    assert account.calls == 0
+
+    app.state['authenticated'] = True
+    socket.emit('account_subscribe', {'version': 1})
+    received = socket.get_received()
+    assert received[0]['args'][0] == {'version': 3, 'full': True, 'success': True}
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+提示词序列化测试
+紧凑 CSV 解析回来后与原K线在有效数字内一致（截取最近 N 根、降采样后与手动合并一致），
+指标序列与K线按相同方式对齐，json 格式与原来的输出一致
+"""
+import json
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from kline_array import KlineArray
+from prompt_serializer import FIELD_LABELS, PromptSerializer, downsample_klines, estimate_tokens, make_serializer
+
+STEP = 300000
+
+
+def _klines(n=60, seed=1):
+    rng = np.random.default_rng(seed)
+    close = 30000 + np.cumsum(rng.normal(0, 50, n))
+    open_ = close + rng.normal(0, 20, n)
+    return KlineArray.from_columns({'open_time': 1700000000000 + np.arange(n) * STEP, 'open': open_,
+                                    'high': np.maximum(open_, close) + rng.uniform(0, 30, n),
+                                    'low': np.minimum(open_, close) - rng.uniform(0, 30, n), 'close': close,
+                                    'volume': rng.uniform(100, 1000, n)})
+
+
+def _parse(text):
+    """紧凑 CSV -> (表头, 行列表)"""
+    header, *rows = text.split('\n')
+    return header.split(','), [row.split(',') for row in rows]
+
+
+def _assert_rows(rows, klines, fields, precision, time_format='%m-%d %H:%M'):
+    assert len(rows) == len(klines)
+    for row, expected in zip(rows, klines):
+        for field, text in zip(fields, row):
+            if field == 'time':
+                assert text == datetime.fromtimestamp(expected['open_time'] / 1000).strftime(time_format)
+            else:
+                assert float(text) == pytest.approx(expected[field], rel=10 ** (1 - precision))
+
+
+def test_klines_round_trip():
+    klines = _klines()
+    serializer = PromptSerializer(precision=7)
+    header, rows = _parse(serializer(klines))
+    assert header == ['t', 'o', 'h', 'l', 'c', 'v']
+    _assert_rows(rows, klines, serializer.fields, 7)
+    # 字典列表与 KlineArray 输出相同
+    assert serializer(klines.to_rows()) == serializer(klines)
+
+
+def test_last_n_and_downsample_round_trip():
+    klines = _klines(61)
+    serializer = PromptSerializer(fields=('time', 'open', 'high', 'low', 'close', 'volume'), last_n=5, downsample=3)
+    header, rows = _parse(serializer(klines))
+    assert len(rows) == 5
+    # 手动从最新一根往前每 3 根合并
+    expected = []
+    for end in range(61, 61 - 15, -3):
+        group = klines[end - 3:end]
+        expected.insert(0, {'open_time': group.open_time[0], 'open': group.open[0], 'high': group.high.max(),
+                            'low': group.low.min(), 'close': group.close[-1], 'volume': group.volume.sum()})
+    fields = [{label: f for f, label in FIELD_LABELS.items()}[h] for h in header]
+    _assert_rows(rows, expected, fields, serializer.precision)
+    assert len(downsample_klines(klines, 3)) == 20
+
+
+def test_series_aligns_with_klines():
+    klines = _klines(61)
+    serializer = PromptSerializer(fields=('close',), last_n=4, downsample=3, precision=8)
+    closes = [float(row[0]) for row in _parse(serializer(klines))[1]]
+    # 收盘价序列按同样方式截取后，与K线的收盘价逐个对应
+    assert [float(v) for v in serializer.series(klines.close).split(',')] == closes
+    assert PromptSerializer().series([1.0, np.nan, 2.5]) == '1,,2.5'
+    assert PromptSerializer()(3.14159265) == '3.1416'
+
+
+def test_json_format_unchanged():
+    klines = _klines(3)
+    serialize = make_serializer({'format': 'json'})
+    assert json.loads(serialize(klines)) == klines.to_rows()
+    assert json.loads(serialize(np.array([1.5, 2.0]))) == [1.5, 2.0]
+    assert isinstance(make_serializer(), PromptSerializer)
+
+
+def test_compact_is_shorter_than_json():
+    klines = _klines()
+    compact = make_serializer()(klines)
+    assert estimate_tokens(compact) * 3 < estimate_tokens(make_serializer({'format': 'json'})(klines))
+    assert estimate_tokens('中文') == 2
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+REST 限流测试
+通过本地模拟的合约 REST 服务（FakeRestServer）驱动 RateLimitedSender：响应头权重、429 / Retry-After 重试
+（签名请求重新签名）、相同 GET 请求合并
+"""
+import hashlib
+import hmac
+import threading
+import time
+from urllib.parse import urlencode
+
+import pytest
+from binance.error import ClientError
+from binance.um_futures import UMFutures
+
+from fake_rest_server import FakeRestServer
+from rate_limiter import PRIORITY_DATA, PRIORITY_ORDER, RateLimiter, install_rate_limiter, request_weight
+
+SECRET = 'test-secret'
+
+
+@pytest.fixture
+def server():
+    server = FakeRestServer().start()
+    yield server
+    server.stop()
+
+
+def _client(server, limiter):
+    api = UMFutures(key='test-key', secret=SECRET, base_url=server.url)
+    assert install_rate_limiter(api, limiter) is limiter
+    return api
+
+
+def _fail_once(status, body, headers):
+    """第一次返回错误，之后返回 body"""
+    calls = []
+
+    def handler(params):
+        calls.append(params)
+        return (status, {'code': -1003, 'msg': 'Too many requests'}, headers) if len(calls) == 1 else body
+    handler.calls = calls
+    return handler
+
+
+def _paths(server, path):
+    return [params for method, p, params in server.requests if p == path]
+
+
+def test_install_is_idempotent(server):
+    limiter = RateLimiter()
+    api = _client(server, limiter)
+    sender = api.send_request
+    assert install_rate_limiter(api) is limiter
+    assert api.send_request is sender
+
+
+def test_used_weight_follows_response_headers(server):
+    server.add_handler('/fapi/v1/klines', lambda params: [],
+                       weight=lambda params: request_weight('GET', '/fapi/v1/klines', params))
+    server.add_handler('/fapi/v1/exchangeInfo', lambda params: {}, weight=1)
+    limiter = RateLimiter()
+    api = _client(server, limiter)
+
+    api.klines('BTCUSDT', '5m', limit=499)
+    assert limiter.used_weight == server.used_weight
+    api.klines('ETHUSDT', '5m', limit=1000)
+    api.exchange_info()
+    assert limiter.used_weight == server.used_weight
+    assert limiter.stats['requests'] == 3
+    assert limiter.stats['weight'] == 2 + 5 + 1
+    assert limiter.status()['in_flight'] == 0
+
+    # 响应头包含同一 IP 上其他请求的权重
+    server.used_weight += 100
+    api.exchange_info()
+    assert limiter.used_weight == server.used_weight
+
+
+def test_order_count_follows_response_headers(server):
+    server.add_handler('/fapi/v1/order', lambda params: {'orderId': 1})
+    limiter = RateLimiter()
+    api = _client(server, limiter)
+    api.new_order(symbol='BTCUSDT', side='BUY', type='MARKET', quantity=1)
+    api.new_order(symbol='BTCUSDT', side='SELL', type='MARKET', quantity=1)
+    assert limiter.order_count == server.order_count == 2
+
+
+def test_get_retried_after_retry_after(server):
+    handler = _fail_once(429, {'symbol': 'BTCUSDT', 'price': '1'}, {'Retry-After': 1})
+    for path in ('/fapi/v1/ticker/price', '/fapi/v2/ticker/price'):
+        server.add_handler(path, handler)
+    limiter = RateLimiter()
+    api = _client(server, limiter)
+
+    start = time.time()
+    assert api.ticker_price('BTCUSDT') == {'symbol': 'BTCUSDT', 'price': '1'}
+    assert time.time() - start >= 0.9
+    assert len(handler.calls) == 2
+    assert limiter.stats['rate_limited'] == 1
+    assert limiter.stats['retries'] == 1
+
+
+def test_signed_get_is_resigned_on_retry(server):
+    handler = _fail_once(418, {'assets': []}, {'Retry-After': 1})
+    for path in ('/fapi/v2/account', '/fapi/v3/account'):
+        server.add_handler(path, handler)
+    limiter = RateLimiter()
+    api = _client(server, limiter)
+
+    assert api.account() == {'assets': []}
+    first, second = handler.calls
+    assert limiter.stats['banned'] == 1
+    assert int(second['timestamp']) > int(first['timestamp'])
+    assert second['signature'] != first['signature']
+    # 新签名对应新的时间戳
+    query = urlencode({k: v for k, v in second.items() if k != 'signature'})
+    assert second['signature'] == hmac.new(SECRET.encode(), query.encode(), hashlib.sha256).hexdigest()
+
+
+def test_get_gives_up_after_max_retries(server):
+    server.add_handler('/fapi/v1/exchangeInfo', lambda params: (429, {'code': -1003, 'msg': 'x'}, {'Retry-After': 0}))
+    limiter = RateLimiter()
+    api = _client(server, limiter)
+    api.send_request.max_retries = 2
+    with pytest.raises(ClientError) as e:
+        api.exchange_info()
+    assert e.value.status_code == 429
+    assert len(_paths(server, '/fapi/v1/exchangeInfo')) == 3
+
+
+def test_order_is_not_retried(server):
+    server.add_handler('/fapi/v1/order', lambda params: (429, {'code': -1003, 'msg': 'x'}, {'Retry-After': 2}))
+    limiter = RateLimiter()
+    api = _client(server, limiter)
+    with pytest.raises(ClientError):
+        api.new_order(symbol='BTCUSDT', side='BUY', type='MARKET', quantity=1)
+    assert len(_paths(server, '/fapi/v1/order')) == 1
+    assert limiter.stats['retries'] == 0
+    assert limiter.status()['blocked_for'] > 1
+
+
+def test_concurrent_identical_gets_are_coalesced(server):
+    server.delay = 0.3
+    server.add_handler('/fapi/v1/klines', lambda params: [[1, '1', '1', '1', '1', '1']])
+    limiter = RateLimiter()
+    api = _client(server, limiter)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(api.klines('BTCUSDT', '5m', limit=100)))
+               for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == [[[1, '1', '1', '1', '1', '1']]] * 5
+    assert len(_paths(server, '/fapi/v1/klines')) == 1
+    assert limiter.stats['coalesced'] == 4
+
+    # 参数不同的请求分别发送
+    threads = [threading.Thread(target=api.klines, args=(symbol, '5m')) for symbol in ('BTCUSDT', 'ETHUSDT')]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(_paths(server, '/fapi/v1/klines')) == 3
+
+
+def test_coalesced_callers_share_errors(server):
+    server.delay = 0.3
+    server.add_handler('/fapi/v1/klines', lambda params: (400, {'code': -1121, 'msg': 'Invalid symbol.'}, {}))
+    limiter = RateLimiter()
+    api = _client(server, limiter)
+
+    errors = []
+
+    def fetch():
+        try:
+            api.klines('XXXUSDT', '5m')
+        except ClientError as e:
+            errors.append(e.status_code)
+    threads = [threading.Thread(target=fetch) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == [400] * 3
+    assert len(_paths(server, '/fapi/v1/klines')) == 1
+
+
+def test_data_requests_wait_for_quota():
+    limiter = RateLimiter(weight_limit=10, share={PRIORITY_DATA: 0.5})
+    limiter.acquire(5)
+    released = threading.Event()
+
+    def second():
+        limiter.acquire(1)
+        released.set()
+    threading.Thread(target=second, daemon=True).start()
+    assert not released.wait(0.2)
+    # 下单请求不受行情额度限制
+    limiter.acquire(1, priority=PRIORITY_ORDER)
+    limiter.release(1, {'X-MBX-USED-WEIGHT-1M': '1'}, 200)
+    limiter.release(5, {'X-MBX-USED-WEIGHT-1M': '1'}, 200)
+    assert released.wait(2)
+
+
+def test_fake_server_rejects_over_weight_limit():
+    server = FakeRestServer(weight_limit=3).start()
+    try:
+        server.add_handler('/fapi/v1/exchangeInfo', lambda params: {}, weight=2)
+        api = UMFutures(base_url=server.url)
+        api.exchange_info()
+        with pytest.raises(ClientError) as e:
+            api.exchange_info()
+        assert e.value.status_code == 429
+        assert int(e.value.header['Retry-After']) >= 1
+        assert int(e.value.header['X-MBX-USED-WEIGHT-1M']) == 4
+        assert server.rejected == 1
+    finally:
+        server.stop()
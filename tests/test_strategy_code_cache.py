@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""自定义策略热更新：只替换属于该策略、且在运行期间保存的代码"""
+import json
+import os
+
+import pytest
+
+from strategy_code_cache import (CustomStrategyRegistry, code_hash, structure_fingerprint, validate_modules)
+
+BAKED_CODE = 'return "SHORT"'
+PARAMS = ('klines_BTCUSDT_5m', 'indicators')
+
+
+def _modules(code, interval='5m'):
+    return [
+        {'type': 'kline', 'config': {'source_type': 'custom_symbol', 'custom_symbol': 'BTCUSDT', 'interval': interval}},
+        {'type': 'custom_strategy', 'name': '自定义策略', 'config': {'code': code}},
+    ]
+
+
+class _Config:
+    def __init__(self, path):
+        self.path = str(path)
+        self.version = 0
+
+    def save(self, modules):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump({'modules': modules}, f)
+        # 保证每次保存的修改时间不同
+        self.version += 1
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + self.version * 1000))
+
+
+@pytest.fixture
+def config(tmp_path):
+    return _Config(tmp_path / 'current_strategy.json')
+
+
+def _registry(config, tmp_path, fingerprint=None):
+    fingerprint = fingerprint or structure_fingerprint(_modules(BAKED_CODE))
+    return CustomStrategyRegistry('demo', fingerprint, {1: code_hash(BAKED_CODE)}, config.path,
+                                  state_dir=str(tmp_path / 'state'))
+
+
+def _call(registry):
+    func = registry.get(1, PARAMS)
+    return None if func is None else func([], {})
+
+
+def test_config_changed_before_start_is_not_used(config, tmp_path):
+    config.save(_modules('return "LONG"'))
+    registry = _registry(config, tmp_path)
+    assert _call(registry) is None
+
+
+def test_save_while_running_is_swapped(config, tmp_path):
+    config.save(_modules(BAKED_CODE))
+    registry = _registry(config, tmp_path)
+    assert _call(registry) is None
+    config.save(_modules('return "LONG"'))
+    assert registry.reload_if_changed() == [1]
+    assert _call(registry) == 'LONG'
+    # 改回生成时的代码后使用策略文件中的方法
+    config.save(_modules(BAKED_CODE))
+    registry.reload_if_changed()
+    assert _call(registry) is None
+
+
+def test_edit_before_start_applies_after_next_save(config, tmp_path):
+    config.save(_modules('return "LONG"'))
+    registry = _registry(config, tmp_path)
+    config.save(_modules('return None'))
+    registry.reload_if_changed()
+    assert registry.get(1, PARAMS) is not None
+    assert _call(registry) is None
+
+
+def test_other_strategy_config_is_ignored(config, tmp_path):
+    config.save(_modules(BAKED_CODE))
+    registry = _registry(config, tmp_path)
+    config.save(_modules('return "LONG"', interval='15m'))
+    assert registry.reload_if_changed() == []
+    assert _call(registry) is None
+    # 切换回本策略的配置（运行期间保存）后生效
+    config.save(_modules('return "LONG"'))
+    registry.reload_if_changed()
+    assert _call(registry) == 'LONG'
+
+
+def test_started_with_other_strategy_config(config, tmp_path):
+    config.save(_modules('return "LONG"', interval='1h'))
+    registry = _registry(config, tmp_path)
+    assert _call(registry) is None
+    config.save(_modules('return "LONG"'))
+    registry.reload_if_changed()
+    assert _call(registry) == 'LONG'
+
+
+def test_accepted_code_survives_restart(config, tmp_path):
+    config.save(_modules(BAKED_CODE))
+    registry = _registry(config, tmp_path)
+    config.save(_modules('return "LONG"'))
+    registry.reload_if_changed()
+    restarted = _registry(config, tmp_path)
+    assert _call(restarted) == 'LONG'
+
+
+def test_syntax_error_keeps_previous_function(config, tmp_path):
+    config.save(_modules(BAKED_CODE))
+    registry = _registry(config, tmp_path)
+    config.save(_modules('return "LONG"'))
+    registry.reload_if_changed()
+    config.save(_modules('return ('))
+    registry.reload_if_changed()
+    assert _call(registry) == 'LONG'
+
+
+def test_validate_modules_reports_user_line():
+    errors = validate_modules(_modules('x = 1\nreturn (\n'))
+    assert len(errors) == 1
+    assert errors[0]['index'] == 1
+    assert errors[0]['line'] in (2, 3)
+
+
+def test_module_config_follows_saved_config(config, tmp_path):
+    modules = _modules(BAKED_CODE) + [{'type': 'trade', 'config': {'fill_timeout_seconds': 1}}]
+    config.save(modules)
+    registry = CustomStrategyRegistry('demo', structure_fingerprint(modules), {1: code_hash(BAKED_CODE)}, config.path,
+                                      state_dir=str(tmp_path / 'state'))
+    assert registry.module_config('trade') == {'fill_timeout_seconds': 1}
+    assert registry.module_config('timer') == {}
+    modules[2]['config']['fill_timeout_seconds'] = 3
+    config.save(modules)
+    registry.reload_if_changed()
+    assert registry.module_config('trade') == {'fill_timeout_seconds': 3}
+    # 配置属于其他策略时不使用
+    config.save(_modules(BAKED_CODE, interval='1h'))
+    registry.reload_if_changed()
+    assert registry.module_config('trade') == {}
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+多策略运行时测试
+策略文件只能是 strategies/ 下的文件名，策略配置只能是策略配置文件，策略实例接口需要登录；
+策略通过 get_kline_cache 读取的K线按K线在策略之间共享；共用定时器运行在共享事件循环上
+"""
+import os
+
+import pytest
+from flask import Flask, jsonify
+
+import strategy_api
+import strategy_host
+from api_extensions import login_required
+from async_runtime import ASYNC_MODE, SYNC_MODE, get_async_runtime
+from kline_cache import get_kline_cache
+from strategy_host import (DEFAULT_TIMER, STRATEGIES_DIR, SharedKlineCache, SharedMarketClient, StrategyHost,
+                           _TimerGroup, resolve_config_file, resolve_strategy_file)
+
+STRATEGY = 'top_gainers_ema_1119_1537.py'
+
+
+def test_resolve_strategy_file():
+    assert resolve_strategy_file(STRATEGY) == os.path.join(os.path.realpath(STRATEGIES_DIR), STRATEGY)
+
+
+@pytest.mark.parametrize('file', ['../backend/run.py', os.path.join(STRATEGIES_DIR, STRATEGY), '/tmp/x.py',
+                                  '..\\x.py', '.x.py', 'x.txt', '', None])
+def test_resolve_strategy_file_rejects_paths(file):
+    with pytest.raises(ValueError):
+        resolve_strategy_file(file)
+
+
+def test_resolve_strategy_file_rejects_links_outside(tmp_path, monkeypatch):
+    (tmp_path / 'outside.py').write_text('raise SystemExit\n')
+    root = tmp_path / 'strategies'
+    root.mkdir()
+    (root / 'link.py').symlink_to(tmp_path / 'outside.py')
+    monkeypatch.setattr(strategy_host, 'STRATEGIES_DIR', str(root))
+    with pytest.raises(ValueError):
+        resolve_strategy_file('link.py')
+
+
+def test_resolve_config_file(tmp_path, monkeypatch):
+    configs = tmp_path / 'strategy_configs'
+    configs.mkdir()
+    (configs / 'link.json').symlink_to(tmp_path / 'config.json')
+    monkeypatch.setattr(strategy_host, 'DATA_DIR', str(tmp_path))
+    monkeypatch.setattr(strategy_host, 'STRATEGY_CONFIGS_DIR', str(configs))
+    root = os.path.realpath(tmp_path)
+    assert resolve_config_file(None) is None
+    assert resolve_config_file('current_strategy.json') == os.path.join(root, 'current_strategy.json')
+    assert resolve_config_file(str(tmp_path / 'current_strategy.json')) == os.path.join(root, 'current_strategy.json')
+    assert resolve_config_file('a.json') == os.path.join(root, 'strategy_configs', 'a.json')
+    assert resolve_config_file(str(configs / 'a.json')) == os.path.join(root, 'strategy_configs', 'a.json')
+    for file in ('../config.json', str(tmp_path / 'config.json'), '../positions.json', '../strategy_instances.json',
+                 'link.json', '/etc/passwd', 'a.txt'):
+        with pytest.raises(ValueError):
+            resolve_config_file(file)
+
+
+def test_host_rejects_and_skips_invalid_files(tmp_path):
+    instances = tmp_path / 'instances.json'
+    instances.write_text('[{"id": "bad", "file": "/tmp/x.py"}]')
+    host = StrategyHost(client=object(), config={}, instances_file=str(instances))
+    assert host.slots == {}
+    with pytest.raises(ValueError):
+        host.add('evil', '../backend/run.py')
+    for instance_id in (1, ['x'], None, ''):
+        with pytest.raises(ValueError):
+            host.add(instance_id, STRATEGY)
+    assert host.slots == {}
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.state = {'authenticated': False}
+    app.add_url_rule('/api/auth/status', 'auth_status', lambda: jsonify(app.state))
+    strategy_api.register_strategy_routes(app)
+    return app
+
+
+def test_instance_routes_require_login(app):
+    client = app.test_client()
+    assert client.get('/api/strategy/instances').status_code == 401
+    assert client.post('/api/strategy/instances', json={'id': 'x', 'file': STRATEGY}).status_code == 401
+    assert client.post('/api/strategy/instances/x/start').status_code == 401
+    assert client.delete('/api/strategy/instances/x').status_code == 401
+
+    app.state['authenticated'] = True
+    assert client.post('/api/strategy/instances/x/start').status_code == 404
+    response = client.post('/api/strategy/instances', json={'id': 'x', 'file': '../backend/run.py'})
+    assert response.status_code == 400
+    assert client.post('/api/strategy/instances', json={'id': 5, 'file': STRATEGY}).status_code == 400
+    assert client.post('/api/strategy/instances', json={'id': 'x', 'file': STRATEGY,
+                                                        'strategy_file': '../config.json'}).status_code == 400
+
+
+def test_login_required_without_auth_status_denies():
+    app = Flask(__name__)
+    app.add_url_rule('/x', 'x', login_required(app)(lambda: 'ok'))
+    assert app.test_client().get('/x').status_code == 401
+
+
+@pytest.mark.parametrize('config, isolation', [(None, 'thread'), ('{}', 'thread'),
+                                               ('{"strategy_isolation": "process"}', 'process')])
+def test_global_host_defaults_to_thread_isolation(tmp_path, monkeypatch, config, isolation):
+    config_file = tmp_path / 'config.json'
+    if config is not None:
+        config_file.write_text(config)
+    monkeypatch.setattr(strategy_host, 'CONFIG_FILE', str(config_file))
+    monkeypatch.setattr(strategy_host, '_host', None)
+    assert strategy_host.get_strategy_host().isolation == isolation
+
+
+class _FakeKlineCache:
+    def __init__(self):
+        self.calls = []
+        self.stopped = False
+
+    def get_klines(self, symbol, interval, limit=500, end_time=None):
+        self.calls.append((symbol, interval, limit, end_time))
+        return [symbol, len(self.calls)]
+
+    def stop(self):
+        self.stopped = True
+
+
+def test_kline_cache_reads_shared_between_strategies(tmp_path, monkeypatch):
+    fake = _FakeKlineCache()
+    monkeypatch.setattr('kline_cache.create_kline_cache', lambda client: fake)
+    host = StrategyHost(client=object(), config={}, instances_file=None)
+    cache = host.kline_cache
+    assert isinstance(cache, SharedKlineCache)
+    # 生成的策略通过 get_kline_cache(client) 取得同一个共享代理
+    assert get_kline_cache(host.client) is cache
+
+    first = cache.get_klines('BTCUSDT', '5m', 60, end_time=100)
+    assert get_kline_cache(host.client).get_klines('BTCUSDT', '5m', 60, end_time=100) is first
+    cache.get_klines('ETHUSDT', '5m', 60, end_time=100)
+    assert fake.calls == [('BTCUSDT', '5m', 60, 100), ('ETHUSDT', '5m', 60, 100)]
+    assert host.client.stats == {'requests': 2, 'shared': 1}
+
+    # 新K线开始后重新读取
+    host.client.new_bar()
+    assert cache.get_klines('BTCUSDT', '5m', 60, end_time=100) == ['BTCUSDT', 3]
+
+    host.close()
+    assert fake.stopped
+
+
+def test_shared_market_client_is_proxy():
+    assert isinstance(StrategyHost(client=object(), config={}, instances_file=None).client, SharedMarketClient)
+
+
+class _FakeSlot:
+    def __init__(self, execution):
+        self.execution = execution
+        self.runs = []
+
+    def run(self, bar_close_time, triggered_at):
+        self.runs.append((bar_close_time, get_async_runtime().in_loop))
+
+    async def arun(self, bar_close_time, triggered_at):
+        self.runs.append((bar_close_time, get_async_runtime().in_loop))
+
+
+def test_timer_group_runs_on_shared_loop(monkeypatch):
+    """共用定时器运行在事件循环上：异步策略在循环上执行，同步策略在线程池中执行"""
+    monkeypatch.setattr('kline_cache.create_kline_cache', lambda client: _FakeKlineCache())
+    host = StrategyHost(client=object(), config={}, instances_file=None)
+    group = _TimerGroup(host, ('5m',), DEFAULT_TIMER)
+    assert group.timer.is_async
+    group.slots = {'a': _FakeSlot(ASYNC_MODE), 's': _FakeSlot(SYNC_MODE)}
+    group.timer.bar_close_time = 300000
+    get_async_runtime().run(group._run(), timeout=5)
+    assert group.slots['a'].runs == [(300000, True)]
+    assert group.slots['s'].runs == [(300000, False)]
+    host.close()
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+策略定时器测试
+通过本地模拟的 REST 服务（FakeRestServer）提供有偏差的 /fapi/v1/time：服务器时间设在K线收盘边界前不久，
+定时器应按服务器时间（而不是本地时钟）在边界触发；协程 job 的定时器运行在共享事件循环上
+"""
+import threading
+import time
+from collections import deque
+from types import SimpleNamespace
+
+import pytest
+from binance.um_futures import UMFutures
+
+from async_runtime import get_async_runtime
+from fake_rest_server import FakeRestServer
+from strategy_timer import KLINE_CLOSE, ServerClock, StrategyTimer, next_close_time
+
+STEP = 60000
+
+
+def _skew_to_boundary(lead_ms):
+    """使服务器时间位于下一个 1m 收盘边界前 lead_ms 毫秒的偏差"""
+    now = int(time.time() * 1000)
+    return (now // STEP + 1) * STEP - lead_ms - now
+
+
+@pytest.fixture
+def rest():
+    servers = []
+
+    def start(skew_ms):
+        server = FakeRestServer(skew_ms=skew_ms).start()
+        servers.append(server)
+        return server
+    yield start
+    for server in servers:
+        server.stop()
+
+
+def _clock(server):
+    return ServerClock(SimpleNamespace(client=UMFutures(base_url=server.url)))
+
+
+class _FakeKlineCache:
+    """只实现定时器用到的收盘推送接口"""
+
+    def __init__(self):
+        self.listeners = []
+        self.subscribed = []
+        self.released = []
+
+    def add_close_listener(self, listener):
+        self.listeners.append(listener)
+
+    def remove_close_listener(self, listener):
+        self.listeners.remove(listener)
+
+    def subscribe(self, symbol, interval):
+        self.subscribed.append((symbol, interval))
+
+    def release(self, symbol, interval):
+        self.released.append((symbol, interval))
+
+    def push_close(self, symbol, interval, open_time):
+        for listener in list(self.listeners):
+            listener(symbol, interval, {'open_time': open_time, 'close_time': open_time + STEP - 1})
+
+
+def _run_once(timer, timeout):
+    done = threading.Event()
+    job = timer.job
+
+    def wrapped():
+        job()
+        done.set()
+    timer.job = wrapped
+    timer.start()
+    try:
+        assert done.wait(timeout), '定时器未按服务器时间触发'
+    finally:
+        timer.stop()
+
+
+def test_next_close_time():
+    assert next_close_time(0, '1m') == STEP
+    assert next_close_time(STEP - 1, '1m') == STEP
+    assert next_close_time(STEP, '1m') == 2 * STEP
+    # 周线边界为周一 00:00 (UTC)
+    monday = 4 * 86400000
+    assert next_close_time(monday, '1w') == monday + 7 * 86400000
+    assert next_close_time(monday - 1, '1w') == monday
+
+
+@pytest.mark.parametrize('skew_ms', [1500, -2500])
+def test_server_clock_measures_skew(rest, skew_ms):
+    clock = _clock(rest(skew_ms))
+    assert clock.sync()
+    assert clock.rtt_ms is not None
+    assert abs(clock.offset_ms - skew_ms) <= clock.rtt_ms / 2 + 5
+    assert abs(clock.now_ms() - (time.time() * 1000 + skew_ms)) <= clock.rtt_ms / 2 + 5
+    assert clock.to_local(clock.now_ms()) == pytest.approx(time.time(), abs=0.05)
+
+
+def test_server_clock_keeps_offset_when_sync_fails(rest):
+    server = rest(1000)
+    clock = _clock(server)
+    assert clock.sync()
+    offset = clock.offset_ms
+    server.handlers['/fapi/v1/time'] = lambda params: (500, {'code': -1000, 'msg': 'Internal error'}, {})
+    assert not clock.sync()
+    assert clock.offset_ms == offset
+
+
+def test_before_close_triggers_on_server_time(rest):
+    # 服务器时间距收盘边界 1.5 秒，本地时钟距边界通常还有数十秒
+    server = rest(_skew_to_boundary(1500))
+    runs = []
+    timer = StrategyTimer(lambda: runs.append(server.server_time()), interval='1m', offset_seconds=0.5,
+                          clock=_clock(server), name='test-before-close')
+    start = time.time()
+    _run_once(timer, 3)
+    assert 0.8 <= time.time() - start <= 2
+    record = timer.runs[0]
+    assert record['source'] == 'timer'
+    assert record['bar_close_time'] % STEP == 0
+    assert record['scheduled_at'] == record['bar_close_time'] - 500
+    assert abs(record['trigger_lag_ms']) < 200
+    assert runs[0] == pytest.approx(record['scheduled_at'], abs=200)
+
+
+def test_kline_close_triggers_on_close_push(rest):
+    server = rest(_skew_to_boundary(1000))
+    cache = _FakeKlineCache()
+    boundary = (server.server_time() // STEP + 1) * STEP
+    timer = StrategyTimer(lambda: None, interval='1m', mode=KLINE_CLOSE, clock=_clock(server), kline_cache=cache,
+                          trigger_symbol='ETHUSDT', close_timeout=5, name='test-kline-close')
+
+    def push():
+        time.sleep(1.2)
+        cache.push_close('BTCUSDT', '1m', boundary - STEP)   # 其他标的的推送不触发
+        cache.push_close('ETHUSDT', '1m', boundary - STEP)
+    threading.Thread(target=push, daemon=True).start()
+    start = time.time()
+    _run_once(timer, 4)
+    assert time.time() - start < 2
+    assert cache.subscribed == [('ETHUSDT', '1m')]
+    assert cache.released == [('ETHUSDT', '1m')]
+    assert cache.listeners == []
+    record = timer.runs[0]
+    assert record['source'] == 'close_event'
+    assert record['bar_close_time'] == boundary
+    assert timer.stats['fallbacks'] == 0
+
+
+def test_kline_close_falls_back_without_push(rest):
+    server = rest(_skew_to_boundary(500))
+    timer = StrategyTimer(lambda: None, interval='1m', mode=KLINE_CLOSE, clock=_clock(server),
+                          kline_cache=_FakeKlineCache(), close_timeout=0.5, name='test-fallback')
+    start = time.time()
+    _run_once(timer, 3)
+    assert 0.8 <= time.time() - start <= 2
+    assert timer.runs[0]['source'] == 'fallback'
+    assert timer.stats['fallbacks'] == 1
+
+
+def test_record_order_latency(rest):
+    server = rest(_skew_to_boundary(800))
+    timer = None
+
+    def job():
+        sent = time.time()
+        time.sleep(0.05)
+        timer.record_order(sent, 2)
+    timer = StrategyTimer(job, interval='1m', offset_seconds=0, clock=_clock(server), name='test-orders')
+    _run_once(timer, 3)
+    record = timer.runs[0]
+    assert record['orders'] == 2
+    assert record['first_order_ms'] is not None and record['first_order_ms'] < 50
+    assert record['order_latency_ms'] >= 50
+    # 不在运行中时忽略
+    timer.record_order(time.time())
+    assert timer.runs[0]['orders'] == 2
+
+
+def test_coroutine_job_runs_on_shared_loop(rest):
+    """协程 job 的定时器运行在共享事件循环上，不创建定时器线程"""
+    server = rest(_skew_to_boundary(1000))
+    cache = _FakeKlineCache()
+    boundary = (server.server_time() // STEP + 1) * STEP
+    done = threading.Event()
+    runs = []
+
+    async def job():
+        runs.append((get_async_runtime().in_loop, timer.bar_close_time))
+        done.set()
+    timer = StrategyTimer(job, interval='1m', mode=KLINE_CLOSE, clock=_clock(server), kline_cache=cache,
+                          close_timeout=5, name='test-async')
+    threading.Timer(1.2, cache.push_close, ('BTCUSDT', '1m', boundary - STEP)).start()
+    start = time.time()
+    timer.start()
+    try:
+        assert timer.running and timer._thread is None
+        assert not [t for t in threading.enumerate() if t.name.startswith('timer-')]
+        assert done.wait(4), '定时器未在事件循环上触发'
+    finally:
+        timer.stop()
+    assert time.time() - start < 2
+    assert runs == [(True, boundary)]
+    assert timer.runs[0]['source'] == 'close_event'
+    assert not timer.running and cache.listeners == []
+
+
+def test_coroutine_job_timer_stops_while_waiting(rest):
+    async def job():
+        pass
+    timer = StrategyTimer(job, interval='1m', offset_seconds=0, clock=_clock(rest(0)), name='test-async-stop')
+    timer.start()
+    start = time.time()
+    timer.stop()
+    assert time.time() - start < 1
+    assert not timer.running and timer.runs == deque()
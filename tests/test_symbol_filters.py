@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+交易对精度过滤器测试
+数量按步长向下取整、价格按最小变动价位四舍五入、最小名义价值检查，缓存缺失或过期时只在后台刷新
+"""
+import threading
+import time
+
+import pytest
+
+from symbol_filters import SymbolFilter, SymbolFilterCache, parse_exchange_info
+
+
+def _exchange_info(*symbols):
+    return {'symbols': [{'symbol': symbol, 'filters': [
+        {'filterType': 'PRICE_FILTER', 'tickSize': '0.10'},
+        {'filterType': 'LOT_SIZE', 'stepSize': '0.001', 'minQty': '0.001'},
+        {'filterType': 'MIN_NOTIONAL', 'notional': '5'},
+    ]} for symbol in symbols]}
+
+
+class _FakeClient:
+    """exchange_info 可延迟返回，format_* 为缓存缺失时的回退"""
+
+    def __init__(self, symbols=('BTCUSDT',), delay=0):
+        self.symbols = list(symbols)
+        self.delay = delay
+        self.calls = 0
+        self.client = self
+
+    def exchange_info(self):
+        self.calls += 1
+        time.sleep(self.delay)
+        return _exchange_info(*self.symbols)
+
+    def format_quantity(self, symbol, quantity):
+        return f'fallback {quantity}'
+
+    def format_price(self, symbol, price):
+        return f'fallback {price}'
+
+
+@pytest.mark.parametrize('step, quantity, expected', [
+    ('0.001', 1.23456, '1.234'), ('0.001', 0.0009, '0.000'), ('0.010', 2.999, '2.99'),
+    ('5', 17, '15'), ('1', 3.9999, '3'), ('0.1', 0.30000000000000004, '0.3'),
+])
+def test_format_quantity_rounds_down_to_step(step, quantity, expected):
+    assert SymbolFilter('X', step, '0.01').format_quantity(quantity) == expected
+
+
+@pytest.mark.parametrize('tick, price, expected', [
+    ('0.10', 101.249, '101.2'), ('0.10', 101.25, '101.3'), ('0.0001', 0.123456, '0.1235'),
+    ('0.5', 10.74, '10.5'), ('0.5', 10.75, '11.0'), ('1', 99.5, '100'),
+])
+def test_format_price_rounds_to_tick(tick, price, expected):
+    assert SymbolFilter('X', '0.001', tick).format_price(price) == expected
+
+
+def test_parse_exchange_info_and_notional():
+    item = parse_exchange_info(_exchange_info('BTCUSDT'))['BTCUSDT']
+    assert item.to_dict() == {'step_size': '0.001', 'tick_size': '0.10', 'min_qty': '0.001', 'min_notional': '5'}
+    assert item.meets_notional('0.05', '100.0')
+    assert item.meets_notional('0.050', '100')
+    assert not item.meets_notional('0.049', '100.0')
+
+
+def _cache(tmp_path, client, **kwargs):
+    return SymbolFilterCache(client, cache_file=str(tmp_path / 'filters.json'), **kwargs)
+
+
+def _wait_for(condition, timeout=2):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_check_notional(tmp_path):
+    cache = _cache(tmp_path, _FakeClient())
+    cache.refresh()
+    assert cache.check_notional('BTCUSDT', '0.06', '100.0')
+    assert not cache.check_notional('BTCUSDT', '0.04', '100.0')
+    # 没有规则的交易对交给交易所校验
+    assert cache.check_notional('NEWUSDT', '0.001', '1')
+
+
+def test_miss_refreshes_in_background(tmp_path):
+    client = _FakeClient(symbols=('BTCUSDT', 'NEWUSDT'), delay=0.3)
+    cache = _cache(tmp_path, client)
+    start = time.time()
+    assert cache.get('NEWUSDT') is None
+    assert cache.format_quantity('NEWUSDT', 1.5) == 'fallback 1.5'
+    assert time.time() - start < 0.2
+    assert _wait_for(lambda: cache.get('NEWUSDT') is not None)
+    assert client.calls == 1
+    assert cache.format_quantity('NEWUSDT', 1.23456) == '1.234'
+
+    # 缺失触发的刷新最多每分钟一次
+    assert cache.get('MISSINGUSDT') is None
+    time.sleep(0.05)
+    assert client.calls == 1
+
+
+def test_stale_entry_served_while_refreshing(tmp_path):
+    client = _FakeClient(delay=0.3)
+    cache = _cache(tmp_path, client, ttl=0)
+    cache.refresh()
+    assert client.calls == 1
+    cache._last_background_refresh = 0
+    start = time.time()
+    assert cache.format_price('BTCUSDT', 101.249) == '101.2'
+    assert time.time() - start < 0.2
+    # 刷新进行中不重复启动
+    cache._last_background_refresh = 0
+    assert not cache.refresh_in_background()
+    assert _wait_for(lambda: not cache._refreshing)
+    assert client.calls == 2
+
+
+def test_refresh_failure_keeps_filters(tmp_path, monkeypatch):
+    client = _FakeClient()
+    cache = _cache(tmp_path, client, ttl=0)
+    cache.refresh()
+
+    def fail():
+        raise RuntimeError('timeout')
+    client.exchange_info = fail
+    done = threading.Event()
+    original = cache._safe_refresh
+
+    def safe_refresh():
+        original()
+        done.set()
+    monkeypatch.setattr(cache, '_safe_refresh', safe_refresh)
+    assert cache.refresh_in_background()
+    assert done.wait(2)
+    assert cache.get('BTCUSDT').format_quantity(0.0129) == '0.012'
+    # 重启后从缓存文件加载
+    reloaded = _cache(tmp_path, client)
+    assert reloaded.load() and reloaded.get('BTCUSDT').min_notional == 5
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+向量化自定义策略测试
+同一条规则分别写成逐标的（row）和向量（vector）两种代码，对K线数量各不相同的标的池得到相同的方向，
+回测中两种模式的成交也完全一致
+"""
+import numpy as np
+import pytest
+
+from backtest_engine import run_backtest
+from indicator_batch import compute_batch, unstack
+from kline_array import KlineArray
+from strategy_code_cache import compile_custom_strategy
+from vector_strategy import VECTOR_MODE, evaluate_vector, normalize_directions
+
+STEP = 300000
+PARAMS = ['klines_BTCUSDT_5m', 'klines_5m', 'indicators']
+
+# 全局K线收涨时，收盘价高于 EMA 且阳线做多，低于 EMA 且阴线做空
+ROW_CODE = """if klines_BTCUSDT_5m[-1]['close'] < klines_BTCUSDT_5m[-1]['open']:
+    return None
+if klines_5m[-1]['close'] > indicators['ema_5m'][-1] and klines_5m[-1]['close'] > klines_5m[-1]['open']:
+    return "LONG"
+if klines_5m[-1]['close'] < indicators['ema_5m'][-1] and klines_5m[-1]['close'] < klines_5m[-1]['open']:
+    return "SHORT"
+return None
+"""
+
+VECTOR_CODE = """if klines_BTCUSDT_5m[-1]['close'] < klines_BTCUSDT_5m[-1]['open']:
+    return None
+close, open_, ema = klines_5m.close[:, -1], klines_5m.open[:, -1], indicators['ema_5m'][:, -1]
+long = (close > ema) & (close > open_)
+short = (close < ema) & (close < open_)
+return np.where(long, 1, np.where(short, -1, 0))
+"""
+
+
+def _klines(seed, n, start=0):
+    rng = np.random.default_rng(seed)
+    close = 100 + np.cumsum(rng.normal(0, 1, n))
+    open_ = close + rng.normal(0, 0.5, n)
+    return KlineArray.from_columns({'open_time': (np.arange(n) + start) * STEP, 'open': open_,
+                                    'high': np.maximum(open_, close) + 0.3, 'low': np.minimum(open_, close) - 0.3,
+                                    'close': close, 'volume': np.ones(n)})
+
+
+def test_vector_and_row_signals_match():
+    row = compile_custom_strategy(ROW_CODE, PARAMS, name='row')
+    vector = compile_custom_strategy(VECTOR_CODE, PARAMS, name='vector')
+    symbols = [f'S{i}USDT' for i in range(12)]
+    klines = [_klines(i, n) for i, n in enumerate([60, 25, 60, 40, 60, 33, 60, 21, 60, 59, 45, 60])]
+    ema = unstack(compute_batch(klines, 'EMA', period=20)['ema'], [len(k) for k in klines])
+    indicators = [{'ema_5m': np.asarray(e)} for e in ema]
+    seen = set()
+    for seed in range(100, 110):
+        global_klines = _klines(seed, 60)
+        expected = [row(global_klines, k, ind) for k, ind in zip(klines, indicators)]
+        actual = evaluate_vector(vector, [global_klines], [klines], indicators, symbols)
+        assert actual == expected
+        seen.update(expected)
+    # 覆盖了做多、做空和跳过
+    assert seen == {'LONG', 'SHORT', None}
+
+
+def test_normalize_directions():
+    assert normalize_directions(None, 2) == [None, None]
+    assert normalize_directions(np.array([1, -2.5, 0, np.nan]), 4) == ['LONG', 'SHORT', None, None]
+    assert normalize_directions(['LONG', 'SHORT', 'HOLD', None, 'x'], 5) == ['LONG', 'SHORT', None, None, None]
+    with pytest.raises(ValueError):
+        normalize_directions([1, 0], 3)
+
+
+def _modules(code, mode=None):
+    strategy = {'code': code}
+    if mode:
+        strategy['mode'] = mode
+    return [
+        {'type': 'kline', 'config': {'source_type': 'custom_symbol', 'custom_symbol': 'BTCUSDT', 'interval': '5m',
+                                     'limit': 30}},
+        {'type': 'symbol', 'config': {'mode': 'fixed', 'symbols': [f'S{i}USDT' for i in range(6)], 'top_n': 6}},
+        {'type': 'kline', 'config': {'interval': '5m', 'limit': 30}},
+        {'type': 'indicator', 'config': {'indicator_type': 'EMA', 'period': 20, 'data_source': 'klines_5m'}},
+        {'type': 'custom_strategy', 'config': strategy},
+        {'type': 'trade', 'config': {'max_positions': 3, 'hold_bars': 3, 'position_size': 100,
+                                     'take_profit_ratio': 2, 'stop_loss_ratio': 2}},
+        {'type': 'timer', 'config': {'interval': '5m'}},
+    ]
+
+
+def test_backtest_trades_match_between_modes():
+    # 标的上市时间不同（K线数量不同）
+    history = {'5m': {f'S{i}USDT': _klines(i, 300 - 40 * i, start=40 * i) for i in range(6)}}
+    history['5m']['BTCUSDT'] = _klines(50, 300)
+    row = run_backtest(_modules(ROW_CODE), history)
+    vector = run_backtest(_modules(VECTOR_CODE, VECTOR_MODE), history)
+    assert row['summary']['strategy_errors'] == vector['summary']['strategy_errors'] == 0
+    assert row['summary']['trades'] > 10
+    assert vector['trades'] == row['trades']
+    assert vector['equity'] == row['equity']